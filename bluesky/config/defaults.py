@@ -17,6 +17,29 @@ _VSMOKE_IMAGES_PATH = os.path.join(_REPO_ROOT_DIR,
 _DEFAULTS = {
     "skip_failed_fires": True,
     "skip_failed_sources": False,
+    # if true, all fires are validated once, when loaded, and
+    # active area locations aren't revalidated by the modules
+    "validate_fires": False,
+    "fires_store": {
+        # 'memory' or 'sqlite'; if 'sqlite', fires are kept in an embedded
+        # database on local disk and paged into memory in batches
+        "type": "memory",
+        # directory in which to create the sqlite file; defaults
+        # to the system's temp dir
+        "dir": None,
+        "batch_size": 1000
+    },
+    # pool of workers running the feps_* binaries used by ubc-bsf-feps
+    # emissions and timeprofile and by feps plumerise
+    "feps_workers": {
+        # number of locations to run concurrently; with more than one
+        # worker, and no 'working_dir' configured for the module, each
+        # worker runs in its own reused scratch directory
+        "num_workers": 1,
+        # directory in which to create scratch directories; defaults to
+        # /dev/shm, if writable, else the system's temp dir
+        "scratch_dir": None
+    },
     "statuslogging": {
         "enabled": False,
         "api_endpoint": None,
@@ -69,6 +92,7 @@ _DEFAULTS = {
         #   "location": {"boundary": {
         #     "sw": { "lat":None, "lng": None},
         #     "ne": { "lat":None, "lng": None}}}
+        #   "dispersion_window": {"buffer_hours": 0}
     },
     "fuelbeds": {
         # The following defaults are defined in the fccsmap package,
@@ -94,10 +118,37 @@ _DEFAULTS = {
         "total_pct_threshold": 0.5,
         # Force use of AK fuelbed lookup; useful if all fires
         # are known to be in AK, but none define 'state'
-        "use_alaska": False
+        "use_alaska": False,
+        # Memoize lookups within the run, keyed on exact point coordinates
+        # or perimeter, and, if 'cache_dir' is set, persist them on disk
+        # across runs
+        "cache_lookups": False,
+        "cache_dir": None,
+        # Simplify polygons, with tolerance of half the raster cell size
+        # (in degrees; ~30m), and split those spanning more than
+        # 'polygon_tile_cells' cells into raster aligned tiles, looked
+        # up in parallel
+        "polygon_raster_cell_size": 0.00027,
+        "polygon_simplify": False,
+        "polygon_tile_cells": None,
+        "polygon_tile_workers": 4,
+        # Look up all points in the run at once, reading the FCCS fuelbed
+        # grid ('fccs_fuelload_file') directly; requires 'no_sampling'
+        "raster_point_lookups": False
     },
     "consumption": {
         "fuel_loadings": {},
+        # Run consume once for each group of fuelbeds sharing burn type,
+        # fuel loadings, and location settings, rather than per fuelbed
+        "batch_fuelbeds": False,
+        # Compute per-acre consumption and heat once for each unique set
+        # of consume inputs, and scale by area; if 'cache_dir' is set,
+        # per-acre values are persisted on disk across runs
+        "cache_per_acre": False,
+        "cache_dir": None,
+        # Interpolate per-acre values from table built by bsp-build-tables,
+        # falling back to consume for fuelbeds the table doesn't cover
+        "table_file": None,
         "default_ecoregion": None,
         "ecoregion_lookup_implemenation": "ogr",
         "consume_settings": {
@@ -159,9 +210,25 @@ _DEFAULTS = {
         # Note that 'efs' is deprecated, and so is not listed here
         "model": "prichard-oneill",
         "include_emissions_details": False,
+        # Store emissions details as (species x phase) arrays, indexed by
+        # species and phase lists in the summary, rather than as nested
+        # phase > species dicts
+        "compact_emissions_details": False,
         "species": [],
         "fuel_loadings": {},
+        # Interpolate per-acre emissions from table built by
+        # bsp-build-tables with the same emissions model
+        "table_file": None,
+        # Compute FEPS and Prichard / O'Neill emissions for all fuelbeds
+        # at once, with matrix products (not supported with details)
+        "vectorized": False,
+        # Have consume emissions use the consumption and heat stored on
+        # each fuelbed, rather than recompute them
+        "reuse_consumption": False,
         "ubc-bsf-feps": {
+            # compute emissions for all locations at once, in process,
+            # rather than running feps_emissions for each location
+            "in_process": True,
             "working_dir": None
         }
     },
@@ -193,9 +260,16 @@ _DEFAULTS = {
     "timeprofile": {
         "hourly_fractions": None,
         "model": "default",
+        # drop hours outside of the dispersion window, defined by
+        # 'dispersion' > 'start' and 'num_hours', from time profiles
+        "prune_to_dispersion_window": False,
         "ubc-bsf-feps": {
             "interpolation_type": 1,
             "normalize": True,
+            # compute time profiles for all active areas at once, in
+            # process, rather than running feps_weather and
+            # feps_timeprofile for each one
+            "in_process": True,
             "working_dir": None
         }
     },
@@ -235,6 +309,9 @@ _DEFAULTS = {
             "fire_locations_filename": "fire_locations.csv",
             "fire_events_filename": "fire_events.csv"
 
+        },
+        "sqlitedb": {
+            "filename": "bluesky.sqlite"
         }
     },
     "trajectories": {
@@ -0,0 +1,390 @@
+"""bluesky.consumetables
+
+Precomputed per-acre consumption, heat, and emissions tables, built by
+bsp-build-tables, and used by the consumption and emissions modules in
+place of running consume (and the emissions calculator) for every fuelbed.
+
+Tables are keyed by (fccs_id, ecoregion, season, burn type) and computed
+on a grid of 1000-hr and duff fuel moistures, the consume inputs to which
+consumption is most sensitive. Values are bilinearly interpolated between
+grid points. All other consume settings are held at the defaults in
+effect when the table was built; fuelbeds whose locations specify
+different settings, or moistures outside of the grid, aren't looked up
+in the table, and are instead run through the full model.
+
+Interpolation error is measured when the table is built, by running
+consume at the midpoints of all grid cells, where interpolation error is
+greatest, and comparing against interpolated values. The maximum and
+95th percentile relative errors of total consumption and heat are
+recorded in the table's metadata, under 'error_bounds'.
+
+Tables are stored in numpy .npz files, with the following arrays:
+
+    metadata            -- json string; build settings, consume version,
+                           emissions model, error bounds, etc.
+    keys                -- (n, 4) fccs_id, ecoregion, season, burn type
+    grid_0, grid_1      -- 1000-hr and duff moisture grid values
+    consumption_fields  -- 'category/subcategory/phase' names
+    consumption         -- (n, len(grid_0), len(grid_1), num fields)
+    heat_fields         -- phase names
+    heat                -- (n, len(grid_0), len(grid_1), num phases)
+    emissions_fields    -- 'phase/species' names
+    emissions           -- (n, 2, len(grid_0), len(grid_1), num fields);
+                           second axis is wildfire (0) vs. rx (1)
+
+Values that consume failed to compute are NaN.
+"""
+
+__author__ = "Joel Dubowy"
+
+import itertools
+import json
+import logging
+
+import numpy
+
+from bluesky.consumeutils import (
+    _get_settings, get_default_fuel_loadings, FuelLoadingsManager,
+    CONSUME_VERSION_STR
+)
+
+__all__ = [
+    'build_table',
+    'ConsumeTable'
+]
+
+GRID_FIELDS = ('fuel_moisture_1000hr_pct', 'fuel_moisture_duff_pct')
+DEFAULT_GRID = [
+    [6, 10, 15, 20, 30, 40, 60, 80, 120],
+    [10, 20, 40, 60, 80, 100, 130, 160, 200, 300]
+]
+ECOREGIONS = ['western', 'southern', 'boreal']
+SEASONS = ['spring', 'summer', 'fall', 'winter']
+BURN_TYPES = ['natural', 'activity']
+EMISSIONS_MODELS = ['feps', 'prichard-oneill']
+
+# consumption below this, in tons per acre, is ignored when computing
+# relative interpolation error
+MIN_ERROR_CONSUMPTION = 0.01
+
+
+##
+## Building
+##
+
+def build_table(filename, fccs_ids=None, ecoregions=ECOREGIONS,
+        seasons=SEASONS, burn_types=BURN_TYPES, grid=DEFAULT_GRID,
+        emissions_model=None, validate=True):
+    """Runs consume for every key and moisture grid point, and saves the
+    results in filename (.npz)
+    """
+    if emissions_model and emissions_model not in EMISSIONS_MODELS:
+        raise ValueError("Invalid emissions model for table: {}".format(
+            emissions_model))
+
+    fccs_ids = [str(f) for f in (fccs_ids or
+        sorted(get_default_fuel_loadings(), key=_fccs_id_sort_key))]
+    keys = list(itertools.product(fccs_ids, ecoregions, seasons, burn_types))
+    shape = (len(keys), len(grid[0]), len(grid[1]))
+    consumption = _Array(shape)
+    heat = _Array(shape)
+    emissions = _Array((len(keys), 2) + shape[1:])
+
+    fuel_loadings_manager = FuelLoadingsManager()
+    for burn_type in burn_types:
+        key_idxs = [i for i, k in enumerate(keys) if k[3] == burn_type]
+        for (gi, m0), (gj, m1) in itertools.product(
+                enumerate(grid[0]), enumerate(grid[1])):
+            logging.info("Running consume for %s fuelbeds, %s burns, "
+                "moistures %s, %s", len(key_idxs), burn_type, m0, m1)
+            fbs = _run_consume([keys[i] for i in key_idxs], burn_type,
+                (m0, m1), fuel_loadings_manager)
+            for i, fb in zip(key_idxs, fbs):
+                if not fb:
+                    continue
+                consumption.set((i, gi, gj), _flatten(fb['consumption']))
+                heat.set((i, gi, gj), _flatten(fb['heat']))
+                if emissions_model:
+                    for is_rx in (0, 1):
+                        emissions.set((i, is_rx, gi, gj), _flatten(
+                            _calculate_emissions(emissions_model,
+                                keys[i][0], is_rx, fb['consumption'])))
+
+    metadata = {
+        "consume_version": CONSUME_VERSION_STR,
+        "emissions_model": emissions_model,
+        "grid_fields": GRID_FIELDS,
+        # settings, other than the grid fields, used for all keys
+        "settings": {b: _get_base_settings(_get_settings({}, b))
+            for b in burn_types}
+    }
+    table_data = dict(
+        keys=numpy.array(keys, dtype=str),
+        grid_0=numpy.array(grid[0], dtype=float),
+        grid_1=numpy.array(grid[1], dtype=float),
+        consumption_fields=numpy.array(consumption.fields, dtype=str),
+        consumption=consumption.array,
+        heat_fields=numpy.array(heat.fields, dtype=str),
+        heat=heat.array,
+        emissions_fields=numpy.array(emissions.fields, dtype=str),
+        emissions=emissions.array
+    )
+
+    if validate:
+        table = ConsumeTable(table_data=dict(table_data,
+            metadata=json.dumps(metadata)))
+        metadata['error_bounds'] = _measure_error(table, keys, burn_types,
+            grid, fuel_loadings_manager)
+        logging.info("Interpolation error bounds: %s",
+            metadata['error_bounds'])
+
+    numpy.savez_compressed(filename, metadata=json.dumps(metadata),
+        **table_data)
+    return metadata
+
+def _fccs_id_sort_key(fccs_id):
+    return (0, int(fccs_id), '') if fccs_id.isdigit() else (1, 0, fccs_id)
+
+def _run_consume(keys, burn_type, moistures, fuel_loadings_manager):
+    """Runs consume for all keys (of the same burn type) at the given
+    moistures, returning list of per-acre fuelbed results, with None
+    for those that failed
+    """
+    # imported here to avoid circular import
+    from bluesky.modules import consumption
+
+    rows = []
+    for fccs_id, ecoregion, season, _ in keys:
+        location = dict(zip(GRID_FIELDS, moistures), area=1.0,
+            ecoregion=ecoregion)
+        rows.append((None, {"fccs_id": fccs_id, "pct": 100.0}, location,
+            season))
+    try:
+        consumption._run_fuelbeds(rows, fuel_loadings_manager, "", burn_type)
+    except Exception as e:
+        logging.debug("Failed to run consume on %s fuelbeds (%s). Running "
+            "them individually", len(rows), e)
+        for row in rows:
+            try:
+                consumption._run_fuelbeds([row], fuel_loadings_manager, "",
+                    burn_type)
+            except Exception as e:
+                logging.warning("Failed to run consume on fuelbed %s: %s",
+                    row[1]['fccs_id'], e)
+    return [fb if 'consumption' in fb else None for _, fb, _, _ in rows]
+
+def _get_calculator(emissions_model, fccs_id, is_rx):
+    # imported here so that emissions packages are only required when
+    # building tables with emissions
+    from bluesky.modules import emissions
+    calculators = emissions.EmissionsCalculatorCache()
+    if emissions_model == 'feps':
+        return (calculators.get_feps_calculator(), 1.0)
+    return (calculators.get_prichard_oneill_calculator(fccs_id, is_rx),
+        emissions.PrichardOneill.CONVERSION_FACTOR)
+
+def _calculate_emissions(emissions_model, fccs_id, is_rx, consumption):
+    calculator, factor = _get_calculator(emissions_model,
+        None if emissions_model == 'feps' else fccs_id, is_rx)
+    r = calculator.calculate(consumption)['summary']['total']
+    return {p: {s: [v * factor for v in vals] for s, vals in d.items()}
+        for p, d in r.items()}
+
+def _measure_error(table, keys, burn_types, grid, fuel_loadings_manager):
+    errors = {'consumption': [], 'heat': []}
+    midpoints = [[(a + b) / 2.0 for a, b in zip(g[:-1], g[1:])]
+        for g in grid]
+    for burn_type in burn_types:
+        burn_type_keys = [k for k in keys if k[3] == burn_type]
+        for m in itertools.product(*midpoints):
+            fbs = _run_consume(burn_type_keys, burn_type, m,
+                fuel_loadings_manager)
+            for key, fb in zip(burn_type_keys, fbs):
+                values = fb and table.get_values(
+                    table.get_key_index(*key), m)
+                if not values:
+                    continue
+                for k in errors:
+                    actual = _get_total(fb[k])
+                    if actual > MIN_ERROR_CONSUMPTION:
+                        errors[k].append(
+                            abs(_get_total(values[k]) - actual) / actual)
+
+    return {k: {
+        "max": float(numpy.max(e)) if e else None,
+        "p95": float(numpy.percentile(e, 95)) if e else None,
+        "num_samples": len(e)
+    } for k, e in errors.items()}
+
+def _get_total(values):
+    # consumption has 'summary' > 'total' > 'total'; heat has 'total'
+    values = values.get('summary', {}).get('total', values)
+    return values['total'][0]
+
+
+##
+## Flattening
+##
+
+def _flatten(data, prefix=()):
+    """Flattens nested dict of single element lists into dict keyed by
+    '/' delimited path
+    """
+    flat = {}
+    for k, v in data.items():
+        if isinstance(v, dict):
+            flat.update(_flatten(v, prefix + (k,)))
+        else:
+            flat['/'.join(prefix + (k,))] = v[0]
+    return flat
+
+def _unflatten(fields, values):
+    data = {}
+    for f, v in zip(fields, values):
+        path = f.split('/')
+        d = data
+        for k in path[:-1]:
+            d = d.setdefault(k, {})
+        d[path[-1]] = [float(v)]
+    return data
+
+class _Array(object):
+    """float32 array whose last dimension, of named fields, grows as new
+    fields are encountered
+    """
+
+    def __init__(self, shape):
+        self._shape = shape
+        self.fields = []
+        self._field_idxs = {}
+        self.array = numpy.full(shape + (0,), numpy.nan, dtype=numpy.float32)
+
+    def set(self, idx, values):
+        new_fields = [f for f in values if f not in self._field_idxs]
+        if new_fields:
+            for f in new_fields:
+                self._field_idxs[f] = len(self.fields)
+                self.fields.append(f)
+            self.array = numpy.concatenate([self.array, numpy.full(
+                self._shape + (len(new_fields),), numpy.nan,
+                dtype=numpy.float32)], axis=-1)
+        for f, v in values.items():
+            self.array[idx + (self._field_idxs[f],)] = v
+
+
+##
+## Look-ups
+##
+
+def _get_base_settings(settings):
+    """Returns consume settings, excluding the grid fields, in json
+    compatible form for comparison with table metadata
+    """
+    return json.loads(json.dumps({k: v for k, v in settings.items()
+        if k not in GRID_FIELDS}, default=str))
+
+class ConsumeTable(object):
+
+    def __init__(self, filename=None, table_data=None):
+        if filename:
+            table_data = numpy.load(filename)
+        self.metadata = json.loads(str(table_data['metadata']))
+        self._index = {tuple(k): i
+            for i, k in enumerate(table_data['keys'].tolist())}
+        self._grid = [table_data['grid_0'], table_data['grid_1']]
+        self._consumption_fields = table_data['consumption_fields'].tolist()
+        self._consumption = table_data['consumption']
+        self._heat_fields = table_data['heat_fields'].tolist()
+        self._heat = table_data['heat']
+        self._emissions_fields = table_data['emissions_fields'].tolist()
+        self._emissions = table_data['emissions']
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def get_key_index(self, fccs_id, ecoregion, season, burn_type):
+        return self._index.get((str(fccs_id), ecoregion, season, burn_type))
+
+    def look_up(self, fccs_id, location, season, burn_type, is_rx=False):
+        """Returns per-acre consumption, heat, and emissions for the
+        fuelbed, or None if the table doesn't cover its inputs
+        """
+        values = self._look_up(fccs_id, location, season, burn_type, is_rx)
+        if values:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return values
+
+    def _look_up(self, fccs_id, location, season, burn_type, is_rx):
+        idx = self.get_key_index(fccs_id, location.get('ecoregion'), season,
+            burn_type)
+        if idx is None:
+            return None
+
+        settings = _get_settings(location, burn_type)
+        if (_get_base_settings(settings)
+                != self.metadata['settings'].get(burn_type)):
+            return None
+
+        return self.get_values(idx,
+            [float(settings[f]) for f in GRID_FIELDS], is_rx)
+
+    def get_values(self, idx, moistures, is_rx=False):
+        weights = self._get_weights(moistures)
+        if not weights:
+            return None
+
+        consumption = self._interpolate(self._consumption[idx],
+            self._consumption_fields, weights)
+        heat = self._interpolate(self._heat[idx], self._heat_fields, weights)
+        if consumption is None or heat is None:
+            return None
+
+        values = {
+            "consumption": consumption,
+            "heat": heat
+        }
+        if self._emissions_fields:
+            emissions = self._interpolate(
+                self._emissions[idx][int(bool(is_rx))],
+                self._emissions_fields, weights)
+            if emissions is not None:
+                values["emissions"] = emissions
+        return values
+
+    def _get_weights(self, moistures):
+        """Returns list of ((i, j), weight) for bilinear interpolation,
+        or None if any value is outside of the grid
+        """
+        idxs = []
+        for grid, m in zip(self._grid, moistures):
+            if m < grid[0] or m > grid[-1]:
+                return None
+            i = min(int(numpy.searchsorted(grid, m, side='right')) - 1,
+                len(grid) - 2)
+            idxs.append((i, (m - grid[i]) / (grid[i + 1] - grid[i])))
+        (i, t), (j, u) = idxs
+        return [
+            ((i, j), (1 - t) * (1 - u)),
+            ((i + 1, j), t * (1 - u)),
+            ((i, j + 1), (1 - t) * u),
+            ((i + 1, j + 1), t * u)
+        ]
+
+    def _interpolate(self, array, fields, weights):
+        """Returns nested dict of interpolated values, or None if any are
+        missing. Fields not computed for the key at any grid point (e.g.
+        species without EFs for the fuelbed) are omitted.
+        """
+        present = ~numpy.isnan(array).all(axis=(0, 1))
+        if not present.any():
+            return None
+        values = sum([array[ij][present].astype(float) * w
+            for ij, w in weights])
+        if numpy.isnan(values).any():
+            return None
+        return _unflatten([f for f, p in zip(fields, present) if p], values)
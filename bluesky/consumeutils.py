@@ -6,18 +6,26 @@ TODO: move this (and other top level utility modules?) into nested package ?
 __author__ = "Joel Dubowy"
 
 import copy
+import hashlib
+import json
+import os
+import sqlite3
 import tempfile
 
-#import numpy
 import consume
+import numpy
 
 from bluesky.config import Config
 from bluesky.exceptions import BlueSkyConfigurationError
 
 __all__ = [
     "_apply_settings",
+    "_get_settings",
     "FuelLoadingsManager",
     "FuelConsumptionForEmissions",
+    "StoredFuelConsumptionForEmissions",
+    "PerAcreConsumptionCache",
+    "get_default_fuel_loadings",
     "CONSUME_FIELDS",
     "CONSUME_VERSION_STR"
 ]
@@ -74,6 +82,17 @@ def _apply_settings(fc, location, burn_type):
             raise BlueSkyConfigurationError("Specify {} for {} burns".format(
                 field, burn_type))
 
+class _Settings(object):
+    pass
+
+def _get_settings(location, burn_type):
+    """Returns dict of consume settings that would be applied for the
+    given location and burn type
+    """
+    settings = _Settings()
+    _apply_settings(settings, location, burn_type)
+    return vars(settings)
+
 class FuelLoadingsManager(object):
 
     FUEL_LOADINGS_KEY_MAPPINGS = {
@@ -148,30 +167,36 @@ fuelbed_number,filename,cover_type,ecoregion,overstory_loading,midstory_loading,
         self._all_fuel_loadings = {}
         if all_fuel_loadings:
             for fccs_id, loadings in all_fuel_loadings.items():
-                self._all_fuel_loadings[fccs_id] = {k.lower(): v for k, v in loadings.items()}
+                self._all_fuel_loadings[str(fccs_id)] = {k.lower(): v for k, v in loadings.items()}
 
-        self._default_fuel_loadings = {}
-        self._default_fccsdb_obj = None # lazy instantiate
-        self._custom = {}
+        self._custom_fuel_loadings = None # lazy indexed
 
     ##
     ## Public Interface
     ##
 
     def get_fuel_loadings(self, fccs_id, fccsdb_obj=None):
-        # TODO: make sure this method works both when default fuel loadings
-        # are used and when custom ones are used
-
-        if not fccsdb_obj:
-            if fccs_id not in self._default_fuel_loadings:
-                # instantiate default fccsdb obj if not yet done
-                if not self._default_fccsdb_obj:
-                    self._default_fccsdb_obj = consume.fccs_db.FCCSDB()
-                self._default_fuel_loadings[fccs_id] = self._get_fuel_loadings_from_fccsdb_obj(
-                    fccs_id, self._default_fccsdb_obj)
-            return self._default_fuel_loadings[fccs_id]
-
-        return self._get_fuel_loadings_from_fccsdb_obj(fccs_id, fccsdb_obj)
+        """Returns fuel loadings for fccs_id
+
+        Loadings of built-in fuelbeds are looked up in the process-wide
+        index of consume's fuel loadings, regardless of fccsdb_obj.
+        Loadings of custom fuelbeds are read from fccsdb_obj, which is
+        expected to have been instantiated with the file returned by
+        generate_custom_csv, and indexed on first access.
+        """
+        fccs_id = str(fccs_id)
+        if fccsdb_obj and fccs_id in self._all_fuel_loadings:
+            if self._custom_fuel_loadings is None:
+                self._custom_fuel_loadings = _index_fuel_loadings(
+                    fccsdb_obj.loadings_data_)
+            return self._custom_fuel_loadings.get(fccs_id)
+
+        return get_default_fuel_loadings().get(fccs_id)
+
+    def get_custom_fuel_loadings(self, fccs_id):
+        """Returns custom fuel loadings configured for fccs_id, if any
+        """
+        return self._all_fuel_loadings.get(str(fccs_id))
 
     def generate_custom_csv(self, fccs_id):
         fccs_id = str(fccs_id)  # shouldn't be necessary, but just in case...
@@ -181,30 +206,15 @@ fuelbed_number,filename,cover_type,ecoregion,overstory_loading,midstory_loading,
             # consume.FuelConsumption must be instantiated with fccs_file=""
             return ""
 
-        # TODO: wrap self._generate(fccs_id) in try/except, and return
+        # TODO: wrap self._generate() in try/except, and return
         #   empty string on failure?  (maybe not, since we might not want
         #   to silently use default fuel_loadings when alternate is specified)
-        return self._generate(fccs_id)
+        return self._generate()
 
     ##
     ## Helper Methods
     ##
 
-
-    def _get_fuel_loadings_from_fccsdb_obj(self, fccs_id, fccsdb_obj):
-        # iterate through the rows in the fccsdb_obj.loadings_data_
-        # pandas.DataFrame until you find row with fuel loadings for fccs_id
-        for i in range(len(fccsdb_obj.loadings_data_)):
-            row = fccsdb_obj.loadings_data_.irow(i)
-            if row[0] == str(fccs_id):
-                d = dict(row)
-                for k in d:
-                    if k in self.FUEL_LOADINGS_KEY_MAPPINGS:
-                        d[self.FUEL_LOADINGS_KEY_MAPPINGS[k]] = d.pop(k)
-                d.pop('fccs_id', None)
-                return d
-
-
     def _fill_in_defaults(self, fuel_loadings):
         based_on_fccs_id = fuel_loadings.pop('based_on_fccs_id', None)
         if based_on_fccs_id:
@@ -219,37 +229,150 @@ fuelbed_number,filename,cover_type,ecoregion,overstory_loading,midstory_loading,
                 if k not in fuel_loadings:
                     fuel_loadings[k] = defaults[k]
 
-    def _generate(self, fccs_id):
-        if fccs_id not in self._custom:
-            fuel_loadings = copy.copy(self._all_fuel_loadings[fccs_id])
-
-            f = tempfile.NamedTemporaryFile(mode='w')
-
+    def _generate(self):
+        """Writes all custom fuelbeds to a single csv file, which is
+        shared by all managers in the process with the same custom
+        fuel loadings, so that consume can be instantiated with any
+        custom fuelbed without regenerating files.
+        """
+        key = hashlib.sha1(json.dumps(self._all_fuel_loadings,
+            sort_keys=True, default=str).encode()).hexdigest()
+        if key not in _CUSTOM_CSV_FILES:
+            rows = []
+            for fccs_id in sorted(self._all_fuel_loadings):
+                fuel_loadings = copy.copy(self._all_fuel_loadings[fccs_id])
+                # set fuelbed_id
+                fuel_loadings['fuelbed_number'] = fccs_id
+                # default non-loadings columns to empty string
+                for k in self.NON_LOADINGS_FIELDS:
+                    fuel_loadings[k] = fuel_loadings.get(k, "")
+
+                self._fill_in_defaults(fuel_loadings)
+
+                # Keep the try/except in case based_on_fccs_id isn't defined and defaults
+                # aren't filled in.
+                try:
+                    rows.append(self.FCCS_LOADINGS_CSV_ROW_TEMPLATE.format(
+                        **fuel_loadings))
+                except KeyError as e:
+                    raise BlueSkyConfigurationError(
+                        "Missing fuel loadings field: '{}'".format(str(e)))
+
+            f = tempfile.NamedTemporaryFile(mode='w', suffix='.csv')
             f.write(self.FCCS_LOADINGS_CSV_HEADER)
-            # set fuelbed_id
-            fuel_loadings['fuelbed_number'] = fccs_id
-            # default non-loadings columns to empty string
-            for k in self.NON_LOADINGS_FIELDS:
-                fuel_loadings[k] = fuel_loadings.get(k, "")
-
-            self._fill_in_defaults(fuel_loadings)
-
-            # Keep the try/except in case based_on_fccs_id isn't defined and defaults
-            # aren't filled in.
-            try:
-                row = self.FCCS_LOADINGS_CSV_ROW_TEMPLATE.format(**fuel_loadings)
-            except KeyError as e:
-                raise BlueSkyConfigurationError(
-                    "Missing fuel loadings field: '{}'".format(str(e)))
-
-            f.write(row)
+            f.write(''.join(rows))
             f.flush()
 
-            # return temp file object, not just it's name, since file is
+            # keep temp file object, not just it's name, since file is
             # deleted once obejct goes out of scope
-            self._custom[fccs_id] = f
-
-        return self._custom[fccs_id].name
+            _CUSTOM_CSV_FILES[key] = f
+
+        return _CUSTOM_CSV_FILES[key].name
+
+# Custom fuel loadings csv files, keyed by hash of the loadings
+_CUSTOM_CSV_FILES = {}
+
+# Index of consume's built-in fuel loadings, by fccs_id, built once per
+# process.  Call get_default_fuel_loadings before forking worker
+# processes to have them share it, read-only, rather than each build it.
+_DEFAULT_FUEL_LOADINGS = None
+
+def get_default_fuel_loadings():
+    global _DEFAULT_FUEL_LOADINGS
+    if _DEFAULT_FUEL_LOADINGS is None:
+        _DEFAULT_FUEL_LOADINGS = _index_fuel_loadings(
+            consume.fccs_db.FCCSDB().loadings_data_)
+    return _DEFAULT_FUEL_LOADINGS
+
+def _index_fuel_loadings(loadings_data):
+    """Converts pandas.DataFrame of fuel loadings, with fccs id in the
+    first column, to dict of fuel loadings keyed by fccs id
+    """
+    id_column = loadings_data.columns[0]
+    mappings = FuelLoadingsManager.FUEL_LOADINGS_KEY_MAPPINGS
+    index = {}
+    for row in loadings_data.to_dict('records'):
+        fccs_id = str(row[id_column])
+        d = {mappings.get(k, k): v for k, v in row.items()}
+        d.pop('fccs_id', None)
+        index[fccs_id] = d
+    return index
+
+
+# Process-wide memo of per-acre consumption and heat, shared by all
+# PerAcreConsumptionCache instances
+_PER_ACRE_MEMO = {}
+
+class PerAcreConsumptionCache(object):
+    """Caches consume's per-acre consumption and heat, along with fuel
+    loadings, keyed by fccs_id, custom fuel loadings, ecoregion, season,
+    burn type, and consume settings (moisture, slope, windspeed, etc.).
+
+    Consume output scales linearly with area for fixed inputs, so cached
+    values need only be multiplied by each fuelbed's area. Values are
+    memoized process-wide and, if cache_dir is specified, persisted in a
+    sqlite file across runs.
+    """
+
+    def __init__(self, cache_dir=None):
+        self._hits = 0
+        self._misses = 0
+
+        self._conn = None
+        if cache_dir:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            self._conn = sqlite3.connect(
+                os.path.join(cache_dir, 'consumption-per-acre.sqlite'))
+            self._conn.execute("CREATE TABLE IF NOT EXISTS per_acre "
+                "(key TEXT PRIMARY KEY, value TEXT)")
+
+    def get_key(self, fccs_id, custom_fuel_loadings, ecoregion, season,
+            burn_type, settings):
+        return hashlib.sha1(json.dumps([CONSUME_VERSION_STR, str(fccs_id),
+            custom_fuel_loadings, ecoregion, season, burn_type, settings],
+            sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key):
+        value = _PER_ACRE_MEMO.get(key)
+        if value is None and self._conn:
+            row = self._conn.execute("SELECT value FROM per_acre "
+                "WHERE key = ?", (key,)).fetchone()
+            if row:
+                value = _PER_ACRE_MEMO[key] = json.loads(row[0])
+
+        if value is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return value
+
+    def set(self, key, value):
+        _PER_ACRE_MEMO[key] = value
+        if self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO per_acre VALUES (?, ?)",
+                (key, json.dumps(value, default=_json_default)))
+
+    @property
+    def stats(self):
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": float(self._hits) / total if total else None
+        }
+
+    def close(self):
+        if self._conn:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+def _json_default(val):
+    # numpy arrays and scalars
+    if hasattr(val, 'tolist'):
+        return val.tolist()
+    return str(val)
 
 
 # consume internall stores consumption data in arrays; order matters
@@ -291,14 +414,12 @@ class FuelConsumptionForEmissions(consume.FuelConsumption):
         fccs_file = fccs_file or ""
         super(FuelConsumptionForEmissions, self).__init__(fccs_file=fccs_file)
 
-        # TODO:  figure out how to avoid re-computing consumption and still
-        #  compute emissions correctly; for now, let it recompute, since
+        # Note: consumption is recomputed by consume.Emissions, since
         #  consumption was most likely produced with consume using the same
         #  conifguration as this emissions run (which means this is wasted
-        #  computation, but shouldn't be changing the consumption values)
+        #  computation, but shouldn't be changing the consumption values);
+        #  see StoredFuelConsumptionForEmissions to avoid recomputing
 
-        # self._set_consumption_data(consumption_data)
-        # self._set_heat_data(heat_data)
         self.burn_type = burn_type
         self.fuelbed_fccs_ids = [fccs_id]
         self.fuelbed_area_acres = [area]
@@ -307,34 +428,63 @@ class FuelConsumptionForEmissions(consume.FuelConsumption):
 
         _apply_settings(self, location, burn_type)
 
-    # def _calculate(self):
-    #     """Overrides consume.FuelConsumption._calculate so that it doesn't
-    #     recalculate _cons_data and _heat_data when it's called by
-    #     consume.Emissions._calculate
-
-    #     Note:  We could have _calculate skipped altogether by setting
-    #         consume.Emissions._have_cons_data = len(
-    #             FuelConsumptionForEmissions._cons_data[0][0])
-    #     but we need calcualte to be called in order to set self._cons_data_piles
-    #     """
-    #     loadings = self._get_loadings_for_specified_files(
-    #         self._settings.get('fuelbeds'))
-
-    #     self._cons_data_piles = consume.con_calc_natural.ccon_piles(
-    #         self._settings.get('pile_black_pct'), loadings)
-
-    # def _set_consumption_data(self, consumption_data):
-    #     # This is a reverse of what's done in
-    #     #  consume.FuelConsumption.make_dictionary_of_lists
-    #     cons_data = []
-    #     for c, subc in CONSUME_FUEL_CATEGORIES.items():
-    #         for sc in subc:
-    #             cons_data.append([
-    #                 # TODO: use get's and default missing values to 0
-    #                 consumption_data[c][sc][f] for f in CONSUME_FIELDS
-    #             ])
-    #     self._cons_data = numpy.array(cons_data)
-
-    # def _set_heat_data(self, heat_data):
-    #     # _heat_data is indeed supposed to be an array with a single nested array
-    #     self._heat_data = numpy.array([[heat_data[f] for f in CONSUME_FIELDS]])
+
+class StoredFuelConsumptionForEmissions(FuelConsumptionForEmissions):
+    """Provides consume.Emissions with the consumption and heat already
+    computed by the consumption module, rather than recomputing them
+
+    Stored consumption and heat values have been multiplied by area,
+    while consume's internal arrays are per acre, so they're divided by
+    area here. consume.Emissions then multiplies its results by area,
+    as it does when consumption is recomputed.
+    """
+
+    def __init__(self, consumption_data, heat_data, area, burn_type, fccs_id,
+            season, location, fccs_file=None):
+        super(StoredFuelConsumptionForEmissions, self).__init__(
+            consumption_data, heat_data, area, burn_type, fccs_id,
+            season, location, fccs_file=fccs_file)
+        self._cons_data = get_cons_data(consumption_data, area)
+        self._heat_data = get_heat_data(heat_data, area)
+
+    def _calculate(self):
+        """Overrides consume.FuelConsumption._calculate so that it doesn't
+        recalculate _cons_data and _heat_data when it's called by
+        consume.Emissions._calculate
+
+        Note:  We could have _calculate skipped altogether by setting
+            consume.Emissions._have_cons_data = len(
+                FuelConsumptionForEmissions._cons_data[0][0])
+        but we need calcualte to be called in order to set self._cons_data_piles
+        """
+        loadings = self._get_loadings_for_specified_files(
+            self._settings.get('fuelbeds'))
+
+        self._cons_data_piles = consume.con_calc_natural.ccon_piles(
+            self._settings.get('pile_black_pct'), loadings)
+
+def get_cons_data(consumption_data, area):
+    """Returns per-acre consumption array, as stored internally by
+    consume, from consumption values multiplied by area
+
+    This is a reverse of what's done in
+    consume.FuelConsumption.make_dictionary_of_lists. Missing values
+    are set to 0.
+    """
+    cons_data = []
+    for c, subc in CONSUME_FUEL_CATEGORIES.items():
+        for sc in subc:
+            phases = consumption_data.get(c, {}).get(sc, {})
+            cons_data.append([
+                [v / area for v in phases.get(f, [0.0])]
+                for f in CONSUME_FIELDS
+            ])
+    return numpy.array(cons_data)
+
+def get_heat_data(heat_data, area):
+    """Returns per-acre heat array, as stored internally by consume, from
+    heat values multiplied by area
+    """
+    # _heat_data is indeed supposed to be an array with a single nested array
+    return numpy.array([[[v / area for v in heat_data.get(f, [0.0])]
+        for f in CONSUME_FIELDS]])
@@ -8,6 +8,8 @@ __author__ = "Joel Dubowy"
 
 import itertools
 
+import numpy
+
 from pyairfire.data.utils import (
     deepmerge,
     summarize,
@@ -21,23 +23,231 @@ def summarize_fuelbeds(obj, key):
     locations = [loc for loc in locations if loc.get('fuelbeds')]
     obj[key] = summarize(locations, key, include_details=False)
 
-def summarize_all_levels(fires_manager, key):
-    """Aggregates data over all fuelbeds - per active_area,
+def summarize_all_levels(fires_manager, *keys):
+    """Aggregates data over all fuelbeds - per location, per active_area,
     per activity collection, per fire, and across all fires
 
-    Includes only per-phase totals, not per category > sub-category > phase
+    Each key (e.g. 'consumption', 'heat') is aggregated in the same
+    single pass over the fuelbeds; see FuelbedDataAggregator. Each fire's
+    summaries are set as it's added, so that they're saved by the sqlite
+    fires store, and only the totals across all fires are kept.
+
+    Includes only per-phase totals, not per category > sub-category > phase,
+    except in the summary across all fires
     """
+    aggregator = FuelbedDataAggregator(keys)
     for fire in fires_manager.fires:
         with fires_manager.fire_failure_handler(fire):
-            for ac in fire.get('activity', []):
-                for aa in ac.active_areas:
-                    for loc in aa.locations:
-                        summarize_fuelbeds(loc, key)
-                    summarize_fuelbeds(aa, key)
-                summarize_fuelbeds(ac, key)
-            summarize_fuelbeds(fire, key)
-
-    summarize_over_all_fires(fires_manager, key)
+            aggregator.add_fire(fire)
+            aggregator.set_summaries()
+
+    fires_manager.summarize(**aggregator.get_overall_summaries())
+
+
+class FuelbedDataAggregator(object):
+    """Sums nested fuelbed data at every level in one traversal
+
+    Summing each level's fuelbeds separately, with nested dict merges,
+    walks every fuelbed once per level and per key. Instead, each
+    fuelbed's data are flattened once into (column, value) entries,
+    where a column is a (key, nested path, element index) combination.
+    Each location's leaf totals (e.g. per species or per phase) are
+    then accumulated with numpy, and higher levels' totals are summed
+    from those of their locations, which are contiguous since they're
+    added in traversal order.
+
+    Fires are summarized one at a time: add_fire flattens a fire's data,
+    and set_summaries sets its summaries and adds its totals to those
+    across all fires. Only the totals across all fires, including per
+    column details, are kept from one fire to the next.
+    """
+
+    SKIPPED_KEYS = ('summary', 'total')
+
+    def __init__(self, keys):
+        self._keys = keys
+        # columns of each leaf, per (key, path) of the dicts containing them
+        self._path_columns = {}
+        self._column_info = []
+        self._column_leaf_idxs = []
+        self._leaves = {}
+        self._leaf_info = []
+        # totals across the fires whose summaries have been set: per
+        # column totals and numbers of entries, and per leaf totals and
+        # whether each leaf is defined
+        self._col_totals = numpy.zeros(0)
+        self._col_counts = numpy.zeros(0, dtype=int)
+        self._leaf_totals = numpy.zeros(0)
+        self._leaf_defined = numpy.zeros(0, dtype=bool)
+        # flattened data of the last fire added; see add_fire
+        self._fire_data = None
+
+    def add_fire(self, fire):
+        """Flattens fire's fuelbed data; nothing is recorded for the fire
+        if this fails
+        """
+        # columns and values of all entries, and number of entries per
+        # location, in the order in which locations were added
+        entries = ([], [], [])
+        # (level, object, start location index, end location index)
+        # for each location, active area, activity collection, and fire
+        groups = []
+        l = 0
+        for ac in fire.get('activity', []):
+            ac_start = l
+            for aa in ac.active_areas:
+                aa_start = l
+                for loc in aa.locations:
+                    n = len(entries[0])
+                    for fb in loc.get('fuelbeds') or []:
+                        for key in self._keys:
+                            self._flatten(fb[key], key, (), entries)
+                    entries[2].append(len(entries[0]) - n)
+                    groups.append((0, loc, l, l + 1))
+                    l += 1
+                groups.append((1, aa, aa_start, l))
+            groups.append((2, ac, ac_start, l))
+        groups.append((3, fire, 0, l))
+
+        self._fire_data = (entries, groups)
+
+    def _flatten(self, data, key, path, entries):
+        columns = self._path_columns.get((key, path))
+        if columns is None:
+            columns = self._path_columns[(key, path)] = {}
+        for k, v in data.items():
+            if not path and k in self.SKIPPED_KEYS:
+                continue
+            if isinstance(v, dict):
+                self._flatten(v, key, path + (k,), entries)
+                continue
+
+            leaf_columns = columns.get(k)
+            if leaf_columns is None:
+                leaf_columns = columns[k] = []
+            if not isinstance(v, (list, tuple, numpy.ndarray)):
+                v = [v]
+            while len(leaf_columns) < len(v):
+                leaf_columns.append(self._add_column(key, path + (k,),
+                    len(leaf_columns)))
+            for c, e in zip(leaf_columns, v):
+                if e is not None:
+                    entries[0].append(c)
+                    entries[1].append(e)
+
+    def _add_column(self, key, path, i):
+        self._column_info.append((key, path, i))
+        # leaf values for 'total' are included in the details
+        # but not in the summaries
+        self._column_leaf_idxs.append(-1 if path[-1] == 'total'
+            else self._get_leaf_idx(key, path[-1]))
+        return len(self._column_info) - 1
+
+    def _get_leaf_idx(self, key, leaf):
+        idx = self._leaves.get((key, leaf))
+        if idx is None:
+            idx = self._leaves[(key, leaf)] = len(self._leaf_info)
+            self._leaf_info.append((key, leaf))
+        return idx
+
+    def _location_totals(self, rows, cols, values, num_locations):
+        """Returns (locations x leaves) arrays of totals and of whether
+        each leaf is defined
+        """
+        shape = (num_locations, len(self._leaf_info))
+        totals = numpy.zeros(shape)
+        defined = numpy.zeros(shape, dtype=bool)
+        leaf_idxs = numpy.array(self._column_leaf_idxs, dtype=int)[cols]
+        m = leaf_idxs >= 0
+        rows, leaf_idxs = rows[m], leaf_idxs[m]
+        numpy.add.at(totals, (rows, leaf_idxs), values[m])
+        defined[rows, leaf_idxs] = True
+        return totals, defined
+
+    def set_summaries(self):
+        """Sets the summaries of each of the last added fire's locations,
+        active areas, and activity collections, and of the fire itself,
+        and adds its totals to those across all fires
+        """
+        (cols, values, num_entries), groups = self._fire_data
+        self._fire_data = None
+        rows = numpy.repeat(numpy.arange(len(num_entries)), num_entries)
+        cols = numpy.array(cols, dtype=int)
+        values = numpy.array(values, dtype=float)
+        totals, defined = self._location_totals(rows, cols, values,
+            len(num_entries))
+
+        levels = numpy.array([g[0] for g in groups], dtype=int)
+        starts = numpy.array([g[2] for g in groups], dtype=int)
+        ends = numpy.array([g[3] for g in groups], dtype=int)
+        group_totals = numpy.zeros((len(groups), totals.shape[1]))
+        group_defined = numpy.zeros(group_totals.shape, dtype=bool)
+
+        # reduceat sums from each start to the next start, so groups
+        # are summed separately per level, at which they partition the
+        # locations; empty groups are skipped
+        for level in range(4):
+            idxs = numpy.nonzero((levels == level) & (starts < ends))[0]
+            if len(idxs) and totals.shape[1]:
+                group_totals[idxs] = numpy.add.reduceat(
+                    totals, starts[idxs], axis=0)
+                group_defined[idxs] = numpy.logical_or.reduceat(
+                    defined, starts[idxs], axis=0)
+
+        for (level, obj, start, end), g_totals, g_defined in zip(
+                groups, group_totals, group_defined):
+            for key in self._keys:
+                obj[key] = {'summary': self._summary(key, g_totals, g_defined)}
+
+        num_columns = len(self._column_info)
+        self._col_totals = _pad(self._col_totals, num_columns) + numpy.bincount(
+            cols, weights=values, minlength=num_columns)
+        self._col_counts = _pad(self._col_counts, num_columns) + numpy.bincount(
+            cols, minlength=num_columns)
+        self._leaf_totals = (_pad(self._leaf_totals, totals.shape[1])
+            + totals.sum(axis=0))
+        self._leaf_defined = (_pad(self._leaf_defined, totals.shape[1])
+            | defined.any(axis=0))
+
+    def _summary(self, key, totals, defined):
+        summary = {leaf: float(totals[i])
+            for i, (k, leaf) in enumerate(self._leaf_info)
+            if k == key and defined[i]}
+        summary['total'] = sum(summary.values())
+        return summary
+
+    def get_overall_summaries(self):
+        """Returns each key's summary across all fires, including the
+        per category > sub-category > phase (or per phase > species) details
+        """
+        num_leaves = len(self._leaf_info)
+        col_totals = _pad(self._col_totals, len(self._column_info))
+        col_counts = _pad(self._col_counts, len(self._column_info))
+
+        summaries = {key: {} for key in self._keys}
+        for (key, path, i), v, n in zip(self._column_info, col_totals,
+                col_counts):
+            if n:
+                d = summaries[key]
+                for k in path[:-1]:
+                    d = d.setdefault(k, {})
+                leaf = d.setdefault(path[-1], [])
+                leaf.extend([0.0] * (i + 1 - len(leaf)))
+                leaf[i] = float(v)
+
+        for key in self._keys:
+            summaries[key]['summary'] = self._summary(key,
+                _pad(self._leaf_totals, num_leaves),
+                _pad(self._leaf_defined, num_leaves))
+        return summaries
+
+def _pad(a, n):
+    """Pads 1-d array a with zeros (or False) to length n, for columns
+    and leaves added since it was computed
+    """
+    if len(a) >= n:
+        return a
+    return numpy.concatenate([a, numpy.zeros(n - len(a), dtype=a.dtype)])
 
 def summarize_over_all_fires(fires_manager, key):
     # summarise over all activity objects
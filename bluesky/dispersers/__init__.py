@@ -24,6 +24,7 @@ from bluesky import datautils, locationutils
 from bluesky.config import Config
 from bluesky.datetimeutils import parse_utc_offset
 from bluesky.models.fires import Fire
+from bluesky.hourlyseries import HourlySeries
 from . import firemerge
 
 
@@ -101,7 +102,8 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
         # osutils.create_working_dir will create working dir if necessary
 
         counts = {'fires': len(fires_manager.fires)}
-        self._set_fire_data(fires_manager.fires)
+        self._set_fire_data(fires_manager.fires,
+            hourly_emissions=fires_manager.hourly_emissions)
         counts['locations'] = len(self._fires)
 
         # TODO: only merge fires if hysplit, or make it configurable ???
@@ -159,8 +161,9 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
 
     SPECIES = ('PM2.5', 'CO')
 
-    def _set_fire_data(self, fires):
+    def _set_fire_data(self, fires, hourly_emissions=None):
         self._fires = []
+        self._hourly_emissions = hourly_emissions
 
         # TODO: aggreagating over all fires (if psossible)
         #  use self.model_start and self.model_end
@@ -183,12 +186,16 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
                         "Missing fire activity data required for computing dispersion")
 
                 loc_num = 0
+                # indices of locations in fire.locations
+                loc_idxs = itertools.count()
                 for aa in fire.active_areas:
                     utc_offset = self._get_utc_offset(aa)
                     for loc in aa.locations:
+                        loc_idx = next(loc_idxs)
                         try:
                             self._add_location(fire, aa, loc,
-                                activity_fields, utc_offset, loc_num)
+                                activity_fields, utc_offset, loc_num,
+                                loc_idx=loc_idx)
                             loc_num += 1
 
                         except SkipLocationError:
@@ -205,7 +212,8 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
 
     ## Creating fires out of locations
 
-    def _add_location(self, fire, aa, loc, activity_fields, utc_offset, loc_num):
+    def _add_location(self, fire, aa, loc, activity_fields, utc_offset,
+            loc_num, loc_idx=None):
         if any([not loc.get(f) for f in activity_fields]):
             raise ValueError("Each active area must have {} in "
                 "order to compute {} dispersion".format(
@@ -217,9 +225,12 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
         heat = self._get_heat(fire, aa, loc)
         plumerise, timeprofile = self._get_plumerise_and_timeprofile(
             loc, utc_offset)
-        emissions = self._get_emissions(loc)
-        timeprofiled_emissions = self._get_timeprofiled_emissions(
-            timeprofile, emissions)
+        timeprofiled_emissions = self._get_timeprofiled_emissions_from_hourly(
+            fire, loc_idx, timeprofile)
+        if timeprofiled_emissions is None:
+            emissions = self._get_emissions(loc)
+            timeprofiled_emissions = self._get_timeprofiled_emissions(
+                timeprofile, emissions)
         timeprofiled_area = {dt: e.get('area_fraction') * loc['area'] for dt,e in timeprofile.items()}
 
         # consumption = datautils.sum_nested_data(
@@ -256,16 +267,37 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
         all_timeprofile = loc.get('timeprofile', {})
         plumerise = {}
         timeprofile = {}
-        for i in range(self._num_hours):
-            local_dt = self._model_start + timedelta(hours=(i + utc_offset))
-            # TODO: will all_plumerise and all_timeprofile always
-            #    have string value keys
-            local_dt = local_dt.strftime('%Y-%m-%dT%H:%M:%S')
-            plumerise[local_dt] = all_plumerise.get(local_dt) or self.MISSING_PLUMERISE_HOUR
-            timeprofile[local_dt] = all_timeprofile.get(local_dt) or self.MISSING_TIMEPROFILE_HOUR
+        for local_dt, local_dt_str in self._get_local_hours(utc_offset):
+            plumerise[local_dt_str] = (self._get_hour(all_plumerise,
+                local_dt, local_dt_str) or self.MISSING_PLUMERISE_HOUR)
+            timeprofile[local_dt_str] = (self._get_hour(all_timeprofile,
+                local_dt, local_dt_str) or self.MISSING_TIMEPROFILE_HOUR)
 
         return plumerise, timeprofile
 
+    def _get_local_hours(self, utc_offset):
+        """Returns the model run's hours, as local datetimes and strings,
+        which are the same for all locations with the same utc offset
+        """
+        if not hasattr(self, '_local_hours'):
+            self._local_hours = {}
+        key = (self._model_start, self._num_hours, utc_offset)
+        if key not in self._local_hours:
+            local_dts = [self._model_start + timedelta(hours=(i + utc_offset))
+                for i in range(self._num_hours)]
+            self._local_hours[key] = [(dt, dt.strftime('%Y-%m-%dT%H:%M:%S'))
+                for dt in local_dts]
+        return self._local_hours[key]
+
+    def _get_hour(self, data, local_dt, local_dt_str):
+        # HourlySeries are indexed by datetime, without parsing strings
+        if isinstance(data, HourlySeries):
+            i = data.get_index(local_dt)
+            return data.get_hour(i) if i is not None else None
+        # TODO: will plumerise and timeprofile dicts always
+        #    have string value keys
+        return data.get(local_dt_str)
+
     def _get_emissions(self, loc):
         # sum the emissions across all fuelbeds, but keep them separate by phase
         emissions = {p: {} for p in PHASES}
@@ -288,6 +320,22 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
         return timeprofiled_emissions
 
 
+    def _get_timeprofiled_emissions_from_hourly(self, fire, loc_idx,
+            timeprofile):
+        """Slices location's timeprofiled emissions out of the run's
+        hourly emissions, returning None if they're not available
+        """
+        if self._hourly_emissions is None or loc_idx is None:
+            return None
+        l_idx = self._hourly_emissions.get_location_idx(fire, loc_idx)
+        if l_idx is None:
+            return None
+
+        hours = list(timeprofile)
+        values = self._hourly_emissions.get(l_idx, hours, self.SPECIES).sum(axis=1)
+        return {dt: {e: float(v) for e, v in zip(self.SPECIES, dt_values)}
+            for dt, dt_values in zip(hours, values)}
+
     def _get_heat(self, fire, aa, loc):
         # TDOO: handle case where heat is defined by phase, but not total
         #   (just make sure each phase is defined, and set total to sum)
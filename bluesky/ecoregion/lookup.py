@@ -9,8 +9,11 @@ import os
 
 #import shapefile
 import fiona
+import numpy
 import ogr
+import shapely
 from shapely import geometry
+from shapely.strtree import STRtree
 
 from bluesky.exceptions import (
     BlueSkyGeographyValueError,
@@ -24,30 +27,81 @@ __all__ = ['lookup']
 ECOREGION_SHAPEFILE = os.path.join(os.path.dirname(__file__), 'data', '3ecoregions.shp')
 # ACCEPTED_VALUES = ["western","southern","boreal"]
 
+# shapely >= 2.0 supports querying an STRtree with an array of geometries
+# in one call; older versions return candidate geometries one query at a time
+SHAPELY_VECTORIZED = hasattr(shapely, 'points')
+
+_SHAPELY_INDEX = None
+
+def _load_shapely_index():
+    """Loads ecoregion polygons into an STRtree, once per process
+
+    Returns tuple of the tree, the list of polygons, and the list of
+    their ecoregion names.
+    """
+    global _SHAPELY_INDEX
+    if _SHAPELY_INDEX is None:
+        logging.debug("Loading ecoregion polygons from %s", ECOREGION_SHAPEFILE)
+        with fiona.open(ECOREGION_SHAPEFILE) as shapes:
+            shapes = [s for s in shapes]
+        polygons = [geometry.shape(s['geometry']) for s in shapes]
+        domains = [s['properties']['DOMAIN'] for s in shapes]
+        _SHAPELY_INDEX = (STRtree(polygons), polygons, domains)
+    return _SHAPELY_INDEX
+
 
 class EcoregionLookup(object):
 
-    def __init__(self, implementation='ogr'):
+    # Results are cached by coordinates rounded to this many
+    # decimal places (~10m)
+    DEFAULT_PRECISION = 4
+
+    def __init__(self, implementation='ogr', precision=DEFAULT_PRECISION):
         try:
             self._lookup = getattr(self, '_lookup_ecoregion_{}'.format(
                 implementation))
         except AttributeError:
             raise BlueSkyConfigurationError(
                 "Invalid ecoregion lookup implementation: %s", implementation)
+        # implementations without a batch lookup look up points one at a time
+        self._lookup_many = getattr(self,
+            '_lookup_ecoregions_{}'.format(implementation),
+            lambda points: [self._lookup(lat, lng) for lat, lng in points])
 
+        self._precision = precision
+        self._cache = {}
         self._input = None # instantiate when necessary
 
-    def _validate_lat_lng(self, lat, lng):
+    def validate_lat_lng(self, lat, lng):
         if abs(lat) > 90.0 or abs(lng) > 180.0:
             raise BlueSkyGeographyValueError(
                 "Invalid lat,lng: {},{}".format(lat, lng))
 
     def lookup(self, lat, lng):
         logging.debug("Looking up ecoregion for %s, %s", lat, lng)
-        self._validate_lat_lng(lat, lng)
 
         # TODO: Handle exceptions here or in calling code ?
-        return self._lookup(lat, lng)
+        return self.lookup_many([(lat, lng)])[0]
+
+    def lookup_many(self, points):
+        """Looks up ecoregions for list of (lat, lng) tuples, returning
+        list of ecoregions, with None for points not in any ecoregion
+
+        Results are cached by rounded coordinates, and points not already
+        cached are looked up together, in one call.
+        """
+        keys = []
+        for lat, lng in points:
+            self.validate_lat_lng(lat, lng)
+            keys.append((round(lat, self._precision),
+                round(lng, self._precision)))
+
+        new_keys = [k for k in dict.fromkeys(keys) if k not in self._cache]
+        if new_keys:
+            logging.debug("Looking up ecoregions for %s points", len(new_keys))
+            self._cache.update(zip(new_keys, self._lookup_many(new_keys)))
+
+        return [self._cache[k] for k in keys]
 
     ## Fiona + shapely
 
@@ -57,23 +111,39 @@ class EcoregionLookup(object):
         Note: If a fire's location is defined as a polygon, it's the calling
           code's responsibility to pick a representative lat/lng.
         """
-        self._validate_lat_lng(lat, lng)
+        self.validate_lat_lng(lat, lng)
+        return self._lookup_ecoregions_shapely([(lat, lng)])[0]
 
-        if not self._input:
-            with fiona.open(ECOREGION_SHAPEFILE) as shapes:
-                # need to crate new list out of shapes collection, since
-                # `shapes` becomse invalid once out of this context
-                self._input = [s for s in shapes]
-
-        # sf = shapefile.Reader(ECOREGION_SHAPEFILE)
-        # shapes = sf.shapes()
-        point = geometry.Point(lng, lat) # longitude, latitude
+    def _lookup_ecoregions_shapely(self, points):
+        """Looks up ecoregions for list of (lat, lng) tuples using an
+        STRtree of the ecoregion polygons
 
-        ecoregion = None
-        for sr in self._input:
-            polygon = geometry.asShape(sr['geometry'])
-            if polygon.contains(point):
-                return sr['properties']['DOMAIN']
+        If a point falls in more than one polygon, the first listed in the
+        shapefile is used.
+        """
+        tree, polygons, domains = _load_shapely_index()
+        polygon_indices = [None] * len(points)
+
+        if SHAPELY_VECTORIZED:
+            geoms = shapely.points(numpy.array(
+                [(lng, lat) for lat, lng in points], dtype=float).reshape(-1, 2))
+            point_idx, polygon_idx = tree.query(geoms, predicate='within')
+            for i, j in zip(point_idx, polygon_idx):
+                if polygon_indices[i] is None or j < polygon_indices[i]:
+                    polygon_indices[i] = j
+
+        else:
+            # the tree only matches bounding boxes, so check candidates
+            index = {id(p): j for j, p in enumerate(polygons)}
+            for i, (lat, lng) in enumerate(points):
+                point = geometry.Point(lng, lat) # longitude, latitude
+                matches = [index[id(p)] for p in tree.query(point)
+                    if p.contains(point)]
+                if matches:
+                    polygon_indices[i] = min(matches)
+
+        return [domains[j] if j is not None else None
+            for j in polygon_indices]
 
     ## Ogr
 
@@ -83,7 +153,7 @@ class EcoregionLookup(object):
         Note: If a fire's location is defined as a polygon, it's the calling
           code's responsibility to pick a representative lat/lng.
         """
-        self._validate_lat_lng(lat, lng)
+        self.validate_lat_lng(lat, lng)
 
         if not self._input:
             self._input = ogr.GetDriverByName('ESRI Shapefile').Open(
@@ -0,0 +1,151 @@
+"""bluesky.emissionsdetails
+
+Compact representation of per fuelbed emissions details.
+
+Emissions details are nested dicts - category > sub-category > phase >
+species - with single element lists of values at the leaves, e.g.
+
+    {
+        "summary": {
+            "total": {
+                "flaming": {"CO": [1.2], "PM2.5": [0.3], ...},
+                "smoldering": {...},
+                ...
+            },
+            ...
+        },
+        "canopy": {
+            "overstory": {...},
+            ...
+        },
+        ...
+    }
+
+Repeating phase and species names, and wrapping each value in a list,
+for every sub-category of every fuelbed makes up most of the size of
+the details. In the compact form, each phase > species dict is replaced
+by a (species x phase) list of lists of values, e.g.
+
+    {
+        "summary": {
+            "total": [[1.2, 3.1, 0.5, 4.8], [0.3, 0.9, 0.2, 1.4], ...],
+            ...
+        },
+        ...
+    }
+
+with rows and columns indexed by species and phase lists shared by all
+fuelbeds in the run (see DetailsIndex).
+"""
+
+__author__ = "Joel Dubowy"
+
+__all__ = [
+    'DetailsIndex',
+    'compact',
+    'expand',
+    'pad',
+    'summarize'
+]
+
+PHASES = ["flaming", "smoldering", "residual", "total"]
+
+class DetailsIndex(object):
+    """Species and phases indexing the rows and columns of compact
+    emissions details
+
+    Species are added as they're encountered, so details compacted
+    earlier in the run may have fewer rows; see `pad`.
+    """
+
+    def __init__(self, phases=PHASES):
+        self.phases = list(phases)
+        self.species = []
+        self._species_idx = {}
+
+    def get_species_idx(self, species):
+        idx = self._species_idx.get(species)
+        if idx is None:
+            idx = self._species_idx[species] = len(self.species)
+            self.species.append(species)
+        return idx
+
+    def rename_species(self, rename):
+        """Renames species with function mapping old to new name"""
+        self.species = [rename(s) for s in self.species]
+        self._species_idx = {s: i for i, s in enumerate(self.species)}
+
+    def to_dict(self):
+        return {"species": self.species, "phases": self.phases}
+
+
+def _is_phase_dict(d):
+    # i.e. phase > species > value(s)
+    return bool(d) and all(isinstance(v, dict)
+        and not any(isinstance(sv, dict) for sv in v.values())
+        for v in d.values())
+
+def _value(v):
+    # consume's values may be scalars or arrays of one value
+    try:
+        return float(v[0])
+    except (TypeError, IndexError):
+        return float(v)
+
+def compact(details, index):
+    """Returns compact form of nested emissions details, adding any new
+    species to index
+    """
+    if _is_phase_dict(details):
+        rows = []
+        for p, species_values in details.items():
+            if p not in index.phases:
+                continue
+            p_idx = index.phases.index(p)
+            for s, v in species_values.items():
+                s_idx = index.get_species_idx(s)
+                while len(rows) <= s_idx:
+                    rows.append([0.0] * len(index.phases))
+                rows[s_idx][p_idx] = _value(v)
+        return rows
+
+    return {k: compact(v, index) for k, v in details.items()
+        if isinstance(v, dict)}
+
+def expand(details, index):
+    """Returns nested emissions details from compact form"""
+    if isinstance(details, list):
+        return {p: {s: [row[p_idx]] for s, row in zip(index.species, details)}
+            for p_idx, p in enumerate(index.phases)}
+    return {k: expand(v, index) for k, v in details.items()}
+
+def pad(details, num_species):
+    """Pads compact details, in place, with rows of zeros for species
+    added to the index after they were compacted
+    """
+    for v in details.values():
+        if isinstance(v, list):
+            num_phases = len(v[0]) if v else len(PHASES)
+            v.extend([[0.0] * num_phases for i in range(num_species - len(v))])
+        else:
+            pad(v, num_species)
+
+def summarize(all_details):
+    """Sums list of compact details, which must have been padded to the
+    same number of species
+    """
+    summary = {}
+    for details in all_details:
+        _add(summary, details)
+    return summary
+
+def _add(summary, details):
+    for k, v in details.items():
+        if isinstance(v, list):
+            if k not in summary:
+                summary[k] = [list(row) for row in v]
+            else:
+                summary[k] = [[a + b for a, b in zip(s_row, row)]
+                    for s_row, row in zip(summary[k], v)]
+        else:
+            _add(summary.setdefault(k, {}), v)
@@ -0,0 +1,165 @@
+"""bluesky.emissionsmatrix
+
+Vectorized emissions calculations, computing emissions for many fuelbeds
+at once with matrix products rather than running an emissions calculator
+on each fuelbed's nested consumption dict.
+
+Emissions calculators (e.g. emitcalc's EmissionsCalculator) compute
+emissions as consumption times emission factor, per fuel category,
+subcategory, phase, and species, and sum the results. A calculator's
+output is therefore a linear function of its consumption input. Rather
+than reimplement the calculator's EF lookups, its EFs are derived by
+running it once on unit consumption for each fuel subcategory and
+consumption phase. This yields, for each subcategory, a (phases x
+outputs) block of EFs, where outputs are the (phase, species) values in
+the calculator's 'summary' > 'total' output, along with the set of
+outputs the calculator produces when the subcategory is present.
+Derived EFs are cached per calculator, for the life of the process.
+
+Consumption for all fuelbeds using a calculator is then stacked into a
+(fuelbeds x subcategory phases) array, and emissions are computed with
+a single matrix product against the stacked (subcategory phases x
+outputs) EF array.
+"""
+
+__author__ = "Joel Dubowy"
+
+import logging
+
+import numpy
+
+__all__ = [
+    'calculate'
+]
+
+# Derived EFs, keyed by id of calculator; the calculator is stored along
+# with its EFs so that the id isn't reused
+_LINEAR_MAPS = {}
+
+class LinearEmissionsMap(object):
+    """Emission factors of a calculator, derived by running it on unit
+    consumption, one subcategory phase at a time
+    """
+
+    def __init__(self, calculator):
+        self._calculator = calculator
+        self.outputs = [] # list of (phase, species)
+        self._output_idx = {}
+        # (category, subcategory, phases) -> ({phase: {output idx: EF}},
+        #    set of output indices)
+        self._subcategories = {}
+
+    def get(self, category, sub_category, phases):
+        """Returns EFs, by consumption phase and output index, and the set
+        of output indices, for subcategory with the given phases defined
+        """
+        key = (category, sub_category, phases)
+        if key not in self._subcategories:
+            efs = {}
+            present = set()
+            for phase in phases:
+                consumption = {category: {sub_category: {
+                    p: [1.0 if p == phase else 0.0] for p in phases}}}
+                r = self._calculator.calculate(consumption).get(
+                    'summary', {}).get('total', {})
+                efs[phase] = {}
+                for output_phase, species_values in r.items():
+                    for species, values in species_values.items():
+                        idx = self._get_output_idx((output_phase, species))
+                        present.add(idx)
+                        if values[0]:
+                            efs[phase][idx] = values[0]
+            self._subcategories[key] = (efs, present)
+        return self._subcategories[key]
+
+    def _get_output_idx(self, output):
+        if output not in self._output_idx:
+            self._output_idx[output] = len(self.outputs)
+            self.outputs.append(output)
+        return self._output_idx[output]
+
+def _get_linear_map(calculator):
+    key = id(calculator)
+    if key not in _LINEAR_MAPS:
+        _LINEAR_MAPS[key] = (calculator, LinearEmissionsMap(calculator))
+    return _LINEAR_MAPS[key][1]
+
+def _flatten(consumption):
+    """Returns list of (category, subcategory, phases, values), or None if
+    consumption isn't made up of single valued lists
+    """
+    subcategories = []
+    for c, sub_categories in consumption.items():
+        if not isinstance(sub_categories, dict):
+            return None
+        for sc, phase_values in sub_categories.items():
+            if not isinstance(phase_values, dict):
+                return None
+            phases = tuple(sorted(phase_values))
+            values = []
+            for p in phases:
+                v = phase_values[p]
+                if not isinstance(v, list) or len(v) != 1:
+                    return None
+                values.append(v[0])
+            subcategories.append((c, sc, phases, values))
+    return subcategories
+
+def calculate(calculator, consumptions, factor=1.0):
+    """Computes emissions for list of consumption dicts, all using the
+    same calculator
+
+    Returns list containing, for each consumption dict, what
+    `calculator.calculate(consumption)['summary']['total']` would,
+    with values multiplied by factor, or None for consumption dicts that
+    aren't made up of single valued lists, which must be run through the
+    calculator itself.
+    """
+    linear_map = _get_linear_map(calculator)
+
+    rows = [] # (consumption idx, flattened consumption)
+    columns = {} # (category, subcategory, phases, phase) -> column idx
+    for i, consumption in enumerate(consumptions):
+        flattened = _flatten(consumption)
+        if flattened is None:
+            continue
+        rows.append((i, flattened))
+        for c, sc, phases, values in flattened:
+            for p in phases:
+                columns.setdefault((c, sc, phases, p), len(columns))
+
+    results = [None] * len(consumptions)
+    if not rows:
+        return results
+
+    subcategory_efs = {k[:3]: linear_map.get(*k[:3]) for k in columns}
+    num_outputs = len(linear_map.outputs)
+
+    # (subcategory phases x outputs) EFs
+    efs = numpy.zeros((len(columns), num_outputs))
+    for (c, sc, phases, p), j in columns.items():
+        for idx, ef in subcategory_efs[(c, sc, phases)][0][p].items():
+            efs[j, idx] = ef
+
+    # (fuelbeds x subcategory phases) consumption, and (fuelbeds x outputs)
+    # flags indicating which outputs the calculator would produce
+    consumption = numpy.zeros((len(rows), len(columns)))
+    present = numpy.zeros((len(rows), num_outputs), dtype=bool)
+    for n, (i, flattened) in enumerate(rows):
+        for c, sc, phases, values in flattened:
+            for p, v in zip(phases, values):
+                consumption[n, columns[(c, sc, phases, p)]] = v
+            present[n, list(subcategory_efs[(c, sc, phases)][1])] = True
+
+    emissions = consumption.dot(efs) * factor
+    logging.debug("Computed %s emissions values for %s fuelbeds",
+        num_outputs, len(rows))
+
+    for n, (i, flattened) in enumerate(rows):
+        r = {}
+        for idx in numpy.nonzero(present[n])[0]:
+            phase, species = linear_map.outputs[idx]
+            r.setdefault(phase, {})[species] = [float(emissions[n, idx])]
+        results[i] = r
+
+    return results
@@ -5,6 +5,8 @@ import subprocess
 import logging
 import csv
 
+from bluesky import fepsengine
+
 # required executables
 FEPS_EMISSIONS_BINARY = 'feps_emissions'
 
@@ -38,6 +40,40 @@ class UbcBsfFEPSEmissions(object):
 
         return emissions
 
+    def run_many(self, fireLocs, species=None):
+        """Computes emissions for list of locations in process, with
+        bluesky.fepsengine, rather than running feps_emissions for each one
+
+        Emissions are computed only for `species`, if specified.
+
+        Returns list of emissions, with exceptions in place of the
+        emissions of locations that failed
+        """
+        if species is None:
+            species = fepsengine.EMISSIONS_SPECIES
+        results = [None] * len(fireLocs)
+        valid = []
+        consumption = []
+        for i, fireLoc in enumerate(fireLocs):
+            try:
+                c = fireLoc['consumption']['summary']
+                consumption.append([c["flaming"], c["smoldering"], c["residual"]])
+                valid.append(i)
+            except Exception as e:
+                results[i] = e
+
+        if valid:
+            emissions = fepsengine.emissions(consumption, species=species)
+            for i, loc_emissions in zip(valid, emissions):
+                results[i] = {
+                    phase: {s: [float(e)] for s, e in zip(
+                        species, phase_emissions)}
+                    for phase, phase_emissions in zip(
+                        fepsengine.EMISSIONS_PHASES, loc_emissions)
+                }
+
+        return results
+
     # NOTE: Assumes that consumption is in the UBC team's units of tons/acre
     def _write_consumption(self, consumption, fire_location_info, filename):
         f = open(filename, 'w')
@@ -52,7 +52,8 @@ class ExporterBase(object):
 
         fires_manager.export = fires_manager.export or {}
         fires_manager.export[self.EXPORT_KEY] = r
-        with open(os.path.join(output_dir, json_output_filename), 'w') as f:
+        with io.open_file(os.path.join(output_dir, json_output_filename),
+                'w') as f:
             fires_manager.dumps(output_stream=f)
 
         if create_tarball:
@@ -15,6 +15,7 @@ import os
 
 from bluesky.config import Config
 from bluesky.exceptions import BlueSkyConfigurationError
+from bluesky.hourlyemissions import HourlyEmissions
 
 class EmissionsCsvWriter(object):
 
@@ -24,6 +25,7 @@ class EmissionsCsvWriter(object):
             raise BlueSkyConfigurationError("Specify destination "
                 "('config' > 'extrafiles' > 'emissionscsv' > 'filename')")
         self._filename = os.path.join(dest_dir, self._filename)
+        self._hourly_emissions = None
 
     SPECIES = [
         "PM2.5", "PM10", "CO",  'CO2', 'CH4', 'NOx', 'NH3', 'SO2', 'VOC'
@@ -54,6 +56,7 @@ class EmissionsCsvWriter(object):
             self.emissions_writer = csv.writer(f)
             self.emissions_writer.writerow(self.HEADERS)
 
+            self._hourly_emissions = fires_manager.hourly_emissions
             for fire in fires_manager.fires:
                 with fires_manager.fire_failure_handler(fire):
                     self._write_fire(fire)
@@ -66,8 +69,12 @@ class EmissionsCsvWriter(object):
         if not locations:
             raise ValueError(self.MISSING_LOCATONS_ERROR_MSG)
 
-        for loc in locations:
-            self._write_location(fire, loc)
+        # hourly emissions are computed for just this fire if not
+        # writing all fires with write
+        hourly_emissions = self._hourly_emissions or HourlyEmissions([fire])
+        for loc_idx, loc in enumerate(locations):
+            self._write_location(fire, loc, hourly_emissions,
+                hourly_emissions.get_location_idx(fire, loc_idx))
 
     MISSING_TIMEPROFILE_ERROR_MSG = (
         "activity timeprofile information required to write emissions csv")
@@ -75,7 +82,10 @@ class EmissionsCsvWriter(object):
     MISSING_EMISSIONS_ERROR_MSG = (
         "activity emissions information required to write emissions csv")
 
-    def _write_location(self, fire, loc):
+    INVALID_EMISSIONS_ERROR_MSG = (
+        "Invalid activity timeprofile or emissions information")
+
+    def _write_location(self, fire, loc, hourly_emissions, l_idx):
         if not loc.get('timeprofile'):
             raise ValueError(self.MISSING_TIMEPROFILE_ERROR_MSG)
 
@@ -85,11 +95,19 @@ class EmissionsCsvWriter(object):
         if not loc.get('fuelbeds') or any(
                 [not l.get('emissions') for l in loc['fuelbeds']]):
             raise ValueError(self.MISSING_EMISSIONS_ERROR_MSG)
-
-        for i, ts in enumerate(sorted(list(loc.get('timeprofile').keys()))):
-            self._write_row(fire, loc, i, ts)
-
-    def _write_row(self, fire, loc, i, ts):
+        # hourly emissions aren't computed for locations with invalid
+        # time profile or emissions data
+        if l_idx is None:
+            raise ValueError(self.INVALID_EMISSIONS_ERROR_MSG)
+
+        timestamps = sorted(list(loc.get('timeprofile').keys()))
+        # (hours x phases x species)
+        emissions = hourly_emissions.get(l_idx, timestamps, self.SPECIES,
+            phases=self.PIPELINE_PHASES)
+        for i, ts in enumerate(timestamps):
+            self._write_row(fire, loc, i, ts, emissions[i])
+
+    def _write_row(self, fire, loc, i, ts, emissions):
         tp = loc['timeprofile'][ts]
         utc_offset = loc['utc_offset'] or 'Z'
         row = {
@@ -105,12 +123,10 @@ class EmissionsCsvWriter(object):
 
         # Iterate through SPECIES to compute totals
         # by phase; then write out columns in BSF's order
-        for s in self.SPECIES:
+        for s_idx, s in enumerate(self.SPECIES):
             if s in loc['fuelbeds'][0]['emissions']['total']:
-                for f1, f2 in zip(self.PIPELINE_PHASES, self.EMIS_FILE_PHASES):
-                    row[s + '_' + f2] = sum([
-                        f['emissions'][f1][s][0] for f in loc['fuelbeds']
-                    ]) * tp[f1]
+                for p_idx, f2 in enumerate(self.EMIS_FILE_PHASES):
+                    row[s + '_' + f2] = float(emissions[p_idx][s_idx])
                 row[s + '_emitted'] = sum([row[s + '_' + f2]
                     for f2 in self.EMIS_FILE_PHASES])
 
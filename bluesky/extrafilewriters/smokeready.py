@@ -249,8 +249,9 @@ class SmokeReadyWriter(object):
     skip_bad_fips = 0
     total_skipped = 0
 
+    hourly_emissions = fires_manager.hourly_emissions
     for fire_info in fires_info:
-      for fire_loc in fire_info.locations:
+      for loc_idx, fire_loc in enumerate(fire_info.locations):
        with fires_manager.fire_failure_handler(fire_info):
         if any([k not in fire_loc for k in ('lat', 'lng')]):
           skip_no_lat_lng += 1
@@ -440,6 +441,15 @@ class SmokeReadyWriter(object):
             # collect sorted hour list
             ordered_hours = sorted(fire_loc['plumerise'].keys())
 
+            # (hours x phases) slice of the run's hourly emissions, if
+            # they were computed for this location
+            l_idx = hourly_emissions.get_location_idx(fire_info, loc_idx)
+            if var not in ('PTOP', 'PBOT', 'LAY1F') and l_idx is not None:
+              species_hourly = hourly_emissions.get(l_idx, ordered_hours,
+                [species_key], phases=('flaming', 'smoldering', 'residual'))[:, :, 0]
+            else:
+              species_hourly = None
+
             for day in range(num_days):
                 dt = start_dt + timedelta(days=day)
                 date = dt.strftime('%m/%d/%y')  # Date
@@ -490,7 +500,13 @@ class SmokeReadyWriter(object):
                         else:
                           value == None
                     else:
-                      if fire_phase == "flaming":
+                      if fire_phase in ("flaming", "smoldering") and species_hourly is not None:
+                        if fire_phase == "flaming":
+                          value = float(species_hourly[h][0])
+                        else:
+                          # smoke wants smoldering + residual
+                          value = float(species_hourly[h][1] + species_hourly[h][2])
+                      elif fire_phase == "flaming":
                         flaming_total = self._phase_emissions_for_species(fire_loc, fire_phase, species_key)
                         value = (timeprofile_hour[fire_phase] * flaming_total)
                       elif fire_phase == "smoldering":
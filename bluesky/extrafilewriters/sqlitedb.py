@@ -0,0 +1,318 @@
+"""bluesky.extrafilewriters.sqlitedb
+
+Writes fires, active areas, locations, per-species emissions totals,
+plumerise summaries, and run metadata to an indexed sqlite database,
+so that post-run analysis doesn't need to parse the full output json.
+
+Schema:
+
+    run
+        key TEXT PRIMARY KEY    -- e.g. 'run_id', 'today', 'counts',
+                                --   'processing', 'runtime', 'error',
+                                --   'dispersion_counts'
+        value TEXT              -- json encoded value
+
+    fires
+        pk INTEGER PRIMARY KEY
+        id TEXT                 -- fire id (not necessarily unique)
+        type TEXT               -- 'wildfire' or 'rx'
+        fuel_type TEXT
+        event_id TEXT
+        event_name TEXT
+        area REAL               -- acres, summed over all locations
+        num_locations INTEGER
+        failed INTEGER          -- 1 if fire was in 'failed_fires'
+        error_type TEXT
+        error_message TEXT
+
+    active_areas
+        pk INTEGER PRIMARY KEY
+        fire_pk INTEGER         -- references fires.pk
+        start TEXT
+        end TEXT
+        utc_offset TEXT
+        country TEXT
+        state TEXT
+        county TEXT
+        ecoregion TEXT
+
+    locations
+        pk INTEGER PRIMARY KEY
+        active_area_pk INTEGER  -- references active_areas.pk
+        fire_pk INTEGER         -- references fires.pk
+        lat REAL
+        lng REAL
+        area REAL               -- acres
+        country TEXT
+        state TEXT
+        county TEXT
+        fccs_id TEXT            -- fuelbed making up largest fraction
+        consumption REAL        -- tons
+        heat REAL               -- BTU
+
+    emissions
+        location_pk INTEGER     -- references locations.pk
+        fire_pk INTEGER         -- references fires.pk
+        species TEXT            -- e.g. 'PM2.5', 'CO'
+        total REAL              -- tons
+
+    plumerise
+        location_pk INTEGER     -- references locations.pk
+        fire_pk INTEGER         -- references fires.pk
+        num_hours INTEGER
+        min_plume_bottom REAL   -- meters
+        max_plume_top REAL      -- meters
+        mean_smolder_fraction REAL
+
+Example - total PM2.5 by state:
+
+    SELECT l.state, SUM(e.total) FROM emissions e
+        JOIN locations l ON l.pk = e.location_pk
+        WHERE e.species = 'PM2.5' GROUP BY l.state;
+"""
+
+__author__ = "Joel Dubowy"
+
+import json
+import logging
+import os
+import sqlite3
+
+from bluesky import __version__, locationutils
+from bluesky.config import Config
+from bluesky.models.fires import FireEncoder
+
+__all__ = [
+    'SqliteDbWriter'
+]
+
+SCHEMA = [
+    "CREATE TABLE run (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE fires (pk INTEGER PRIMARY KEY, id TEXT, type TEXT, "
+        "fuel_type TEXT, event_id TEXT, event_name TEXT, area REAL, "
+        "num_locations INTEGER, failed INTEGER, error_type TEXT, "
+        "error_message TEXT)",
+    "CREATE TABLE active_areas (pk INTEGER PRIMARY KEY, fire_pk INTEGER, "
+        "start TEXT, end TEXT, utc_offset TEXT, country TEXT, state TEXT, "
+        "county TEXT, ecoregion TEXT)",
+    "CREATE TABLE locations (pk INTEGER PRIMARY KEY, "
+        "active_area_pk INTEGER, fire_pk INTEGER, lat REAL, lng REAL, "
+        "area REAL, country TEXT, state TEXT, county TEXT, fccs_id TEXT, "
+        "consumption REAL, heat REAL)",
+    "CREATE TABLE emissions (location_pk INTEGER, fire_pk INTEGER, "
+        "species TEXT, total REAL)",
+    "CREATE TABLE plumerise (location_pk INTEGER, fire_pk INTEGER, "
+        "num_hours INTEGER, min_plume_bottom REAL, max_plume_top REAL, "
+        "mean_smolder_fraction REAL)"
+]
+
+# Indexes are created after the data are inserted, which is faster
+# than maintaining them during the inserts
+INDEXES = [
+    "CREATE INDEX fires_id_idx ON fires (id)",
+    "CREATE INDEX fires_area_idx ON fires (area)",
+    "CREATE INDEX fires_failed_idx ON fires (failed)",
+    "CREATE INDEX active_areas_fire_pk_idx ON active_areas (fire_pk)",
+    "CREATE INDEX locations_fire_pk_idx ON locations (fire_pk)",
+    "CREATE INDEX locations_active_area_pk_idx ON locations (active_area_pk)",
+    "CREATE INDEX locations_state_idx ON locations (state)",
+    "CREATE INDEX emissions_species_idx ON emissions (species)",
+    "CREATE INDEX emissions_location_pk_idx ON emissions (location_pk)",
+    "CREATE INDEX emissions_fire_pk_idx ON emissions (fire_pk)",
+    "CREATE INDEX plumerise_location_pk_idx ON plumerise (location_pk)"
+]
+
+RUN_KEYS = [
+    'run_id', 'today', 'bluesky_version', 'counts', 'processing',
+    'runtime', 'error', 'summary', 'dispersion_counts'
+]
+
+
+##
+## Functions for extracting location values
+##
+
+def _get_fccs_id(loc):
+    fuelbeds = [f for f in loc.get('fuelbeds') or []
+        if hasattr(f.get('pct', 0.0), 'real') and f.get('fccs_id')]
+    if fuelbeds:
+        return str(max(fuelbeds, key=lambda fb: fb.get('pct', 0.0))['fccs_id'])
+
+def _get_total(loc, key):
+    summary = (loc.get(key) or {}).get('summary')
+    if summary and summary.get('total') is not None:
+        return summary['total']
+
+    if loc.get('fuelbeds'):
+        totals = [(fb.get(key) or {}).get('total') for fb in loc['fuelbeds']]
+        # value is only returned if defined for all fuelbeds
+        if not any([t is None for t in totals]):
+            return sum([sum(_flatten_total(t)) for t in totals])
+
+def _flatten_total(val):
+    # 'heat' > 'total' is a list, while 'consumption' > 'total' is nested
+    # by category and subcategory
+    if isinstance(val, dict):
+        return [v for sub in val.values() for v in _flatten_total(sub)]
+    return val if isinstance(val, list) else [val]
+
+def _get_emissions_totals(loc):
+    summary = (loc.get('emissions') or {}).get('summary')
+    if summary:
+        return {s: v for s, v in summary.items() if s != 'total'}
+
+    totals = {}
+    for fb in loc.get('fuelbeds') or []:
+        for s, v in (fb.get('emissions') or {}).get('total', {}).items():
+            totals[s] = totals.get(s, 0.0) + sum(v)
+    return totals
+
+def _get_plumerise_summary(loc):
+    hours = [h for h in (loc.get('plumerise') or {}).values()
+        if h and h.get('heights')]
+    if hours:
+        smolder_fractions = [h['smolder_fraction'] for h in hours
+            if h.get('smolder_fraction') is not None]
+        return (
+            len(hours),
+            min([h['heights'][0] for h in hours]),
+            max([h['heights'][-1] for h in hours]),
+            (sum(smolder_fractions) / len(smolder_fractions)
+                if smolder_fractions else None)
+        )
+
+
+##
+## Writer class
+##
+
+class SqliteDbWriter(object):
+
+    def __init__(self, dest_dir, **kwargs):
+        filename = (kwargs.get('filename') or
+            Config().get('extrafiles', 'sqlitedb', 'filename'))
+        self._pathname = os.path.join(dest_dir, filename)
+
+    def write(self, fires_manager):
+        # start from scratch if re-run
+        if os.path.exists(self._pathname):
+            os.remove(self._pathname)
+
+        conn = sqlite3.connect(self._pathname)
+        try:
+            with conn:
+                for stmt in SCHEMA:
+                    conn.execute(stmt)
+                self._write_run(conn, fires_manager)
+                for fire in fires_manager.fires:
+                    self._write_fire(conn, fire, False)
+                for fire in fires_manager.failed_fires or []:
+                    self._write_fire(conn, fire, True)
+                for stmt in INDEXES:
+                    conn.execute(stmt)
+        finally:
+            conn.close()
+
+        return {"filename": os.path.basename(self._pathname)}
+
+    def _write_run(self, conn, fires_manager):
+        values = {
+            'run_id': fires_manager.run_id,
+            'today': fires_manager.today,
+            'bluesky_version': __version__,
+            'counts': fires_manager.counts,
+            # only set if dispersion was run before extrafiles
+            'dispersion_counts': (getattr(fires_manager, 'dispersion', None)
+                or {}).get('counts')
+        }
+        for k in RUN_KEYS:
+            v = values.get(k) if k in values else getattr(fires_manager, k)
+            if v is not None:
+                conn.execute("INSERT INTO run VALUES (?, ?)",
+                    (k, json.dumps(v, cls=FireEncoder)))
+
+    def _write_fire(self, conn, fire, failed):
+        error = fire.get('error') or {}
+        fire_pk = conn.execute("INSERT INTO fires (id, type, fuel_type, "
+            "event_id, event_name, failed, error_type, error_message) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+                fire.id, fire.get('type'), fire.get('fuel_type'),
+                (fire.get('event_of') or {}).get('id'),
+                (fire.get('event_of') or {}).get('name'),
+                int(failed), error.get('type'), error.get('message')
+            )).lastrowid
+
+        area = 0.0
+        num_locations = 0
+        # Failed fires often have invalid activity data, which raises
+        # exceptions when accessing active areas or locations; don't let
+        # one bad fire spoil the rest of the db
+        try:
+            active_areas = fire.active_areas
+        except Exception as e:
+            self._record_error(conn, fire, fire_pk, e)
+            active_areas = []
+
+        for aa in active_areas:
+            try:
+                aa_pk = conn.execute("INSERT INTO active_areas (fire_pk, "
+                    "start, end, utc_offset, country, state, county, "
+                    "ecoregion) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+                        fire_pk, _str(aa.get('start')), _str(aa.get('end')),
+                        _str(aa.get('utc_offset')), aa.get('country'),
+                        aa.get('state'), aa.get('county'), aa.get('ecoregion')
+                    )).lastrowid
+                locations = aa.locations
+            except Exception as e:
+                self._record_error(conn, fire, fire_pk, e)
+                continue
+
+            for loc in locations:
+                try:
+                    self._write_location(conn, fire_pk, aa_pk, loc)
+                except Exception as e:
+                    # don't let one bad location spoil the rest of the db
+                    logging.warning("Failed to write fire %s location to "
+                        "sqlite db: %s", fire.id, e)
+                    continue
+                area += loc.get('area') or 0.0
+                num_locations += 1
+
+        conn.execute("UPDATE fires SET area = ?, num_locations = ? "
+            "WHERE pk = ?", (area, num_locations, fire_pk))
+
+    def _record_error(self, conn, fire, fire_pk, e):
+        """Records error on the fire's row, unless the fire already has
+        an error (e.g. the one that caused it to fail)
+        """
+        logging.warning("Failed to write fire %s activity to sqlite db: %s",
+            fire.id, e)
+        conn.execute("UPDATE fires SET error_type = ?, error_message = ? "
+            "WHERE pk = ? AND error_type IS NULL",
+            (e.__class__.__name__, str(e), fire_pk))
+
+    def _write_location(self, conn, fire_pk, aa_pk, loc):
+        latlng = locationutils.LatLng(loc)
+        loc_pk = conn.execute("INSERT INTO locations (active_area_pk, "
+            "fire_pk, lat, lng, area, country, state, county, fccs_id, "
+            "consumption, heat) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                aa_pk, fire_pk, latlng.latitude, latlng.longitude,
+                loc.get('area'), loc.get('country'), loc.get('state'),
+                loc.get('county'), _get_fccs_id(loc),
+                _get_total(loc, 'consumption'), _get_total(loc, 'heat')
+            )).lastrowid
+
+        conn.executemany("INSERT INTO emissions VALUES (?, ?, ?, ?)",
+            [(loc_pk, fire_pk, s, _sum(v))
+                for s, v in _get_emissions_totals(loc).items()])
+
+        plumerise = _get_plumerise_summary(loc)
+        if plumerise:
+            conn.execute("INSERT INTO plumerise VALUES (?, ?, ?, ?, ?, ?)",
+                (loc_pk, fire_pk) + plumerise)
+
+def _str(val):
+    return str(val) if val is not None else None
+
+def _sum(val):
+    return sum(val) if isinstance(val, list) else val
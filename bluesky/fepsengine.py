@@ -0,0 +1,271 @@
+"""bluesky.fepsengine
+
+In-process implementations of the FEPS models run by the feps_emissions,
+feps_weather, and feps_timeprofile executables, which are used by the
+ubc-bsf-feps emissions and timeprofile models.
+
+The executables read a few input values from files, do some arithmetic,
+and write their results to files. Running them for each location means
+a fork/exec and file I/O per location, which dominates their run time.
+The functions here compute the same outputs for all locations at once,
+with NumPy, each taking arrays of inputs with one row per location.
+
+The models, and their constants, are those of the FEPS code built into
+the executables (revised 2008-03-28 STI). Results match the executables'
+output to the precision written to their output files. The executables
+are still used if the in-process engine is turned off in the config.
+"""
+
+__author__ = "Joel Dubowy"
+
+import numpy
+
+__all__ = [
+    'emissions',
+    'diurnal_weather',
+    'time_profile'
+]
+
+##
+## Emissions
+##
+
+EMISSIONS_PHASES = ['flaming', 'smoldering', 'residual', 'total']
+EMISSIONS_SPECIES = ['CO2', 'CO', 'CH4', 'PM25', 'PM10', 'NOx', 'SO2',
+    'NH3', 'VOC']
+
+# Tons emitted per ton consumed, by species; residual EFs are the same
+# as smoldering
+FLAMING_EFS = [1.6497, 0.0718, 0.00382, 0.00728, 0.0085904, 0.00242,
+    0.00098, 0.0012064, 0.017342]
+SMOLDERING_EFS = [1.39308, 0.21012, 0.009868, 0.016632, 0.01962576,
+    0.000908, 0.00098, 0.00341056, 0.0490268]
+EMISSIONS_FACTORS = numpy.array([FLAMING_EFS, SMOLDERING_EFS, SMOLDERING_EFS])
+
+def emissions(consumption, species=None):
+    """Computes emissions, like feps_emissions
+
+    Args:
+     - consumption -- (locations x 3) array of flaming, smoldering, and
+        residual consumption, in tons
+
+    Kwargs:
+     - species -- subset of EMISSIONS_SPECIES to compute emissions for;
+        defaults to all
+
+    Returns (locations x phases x species) array of emissions, in tons,
+    with phases and species in the order of EMISSIONS_PHASES and
+    `species` (or EMISSIONS_SPECIES).
+    """
+    efs = EMISSIONS_FACTORS
+    if species is not None:
+        efs = efs[:, [EMISSIONS_SPECIES.index(s) for s in species]]
+    consumption = numpy.asarray(consumption, dtype=float).reshape(-1, 3)
+    by_phase = consumption[:, :, numpy.newaxis] * efs
+    return numpy.concatenate(
+        [by_phase, by_phase.sum(axis=1, keepdims=True)], axis=1)
+
+
+##
+## Diurnal weather
+##
+
+NUM_DIURNAL_HOURS = 24
+NIGHT_TEMP_DECAY = -3.0
+MPH_TO_MPS = 0.447
+XPORT_WIND_MIN = 5.0 # m/s
+
+# Night time stability class is based on wind at flame height, in mph
+STABILITY_CLASSES = 'ABCDEF'
+DIF_TEMP_GRADS = [-0.009, -0.008, -0.006, 0.0, 0.015, 0.025]
+DAY_STABILITY_CLASS = 1 # 'B'
+NIGHT_WIND_THRESHOLDS = [
+    (6.71080888, 5), # 'F'
+    (11.1846815, 4) # 'E'
+]
+WINDY_NIGHT_STABILITY_CLASS = 3 # 'D'
+
+def _column(values):
+    return numpy.asarray(values, dtype=float).reshape(-1, 1)
+
+def diurnal_weather(sunset_hour, midday_hour, predawn_hour, min_humid,
+        max_humid, min_temp, max_temp, min_wind, max_wind, min_wind_aloft,
+        max_wind_aloft):
+    """Computes hourly weather over a day, like feps_weather
+
+    Each arg is an array with one value per location. Hours are whole
+    hours, as read by feps_weather; winds are in mph.
+
+    Returns dict of (locations x 24) arrays - 'temp', 'humid',
+    'wind_flame', 'modified_wind' (transport wind, in m/s),
+    'stability' (Pasquill stability class), and 'dif_temp_grad'
+    """
+    sunset, midday, predawn = [numpy.trunc(_column(v))
+        for v in (sunset_hour, midday_hour, predawn_hour)]
+    hours = numpy.arange(NUM_DIURNAL_HOURS, dtype=float)
+
+    # Fraction of the way from min to max temperature, which follows a
+    # sine curve from predawn past midday until sunset, and then decays
+    # exponentially through the night
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        day_curve = numpy.sin(numpy.pi / 2 * (hours - predawn)
+            / (midday - predawn))
+        sunset_curve = numpy.sin(numpy.pi / 2 * (sunset - predawn)
+            / (midday - predawn))
+        hours_since_sunset = numpy.where(hours < predawn,
+            hours + NUM_DIURNAL_HOURS, hours) - sunset
+        night_curve = sunset_curve * numpy.exp(NIGHT_TEMP_DECAY
+            * hours_since_sunset / (NUM_DIURNAL_HOURS - (sunset - predawn)))
+    fract = numpy.where((hours >= predawn) & (hours <= sunset),
+        day_curve, night_curve)
+
+    temp = _column(min_temp) * (1.0 - fract) + _column(max_temp) * fract
+    humid = _column(max_humid) * (1.0 - fract) + _column(min_humid) * fract
+
+    is_day = (hours > predawn) & (hours <= sunset)
+    wind_flame = numpy.where(is_day, _column(max_wind), _column(min_wind))
+    wind_aloft = numpy.where(is_day, _column(max_wind_aloft),
+        _column(min_wind_aloft))
+
+    # transport wind builds up during the day, and falls off by half
+    # each hour at night, but no faster than the wind aloft
+    modified_wind = numpy.empty(wind_aloft.shape)
+    prev = _column(min_wind_aloft)[:, 0]
+    for h in range(NUM_DIURNAL_HOURS):
+        prev = numpy.maximum(XPORT_WIND_MIN, MPH_TO_MPS
+            * numpy.maximum(2.0 * prev, wind_aloft[:, h]))
+        modified_wind[:, h] = prev
+
+    stability = numpy.full(wind_flame.shape, WINDY_NIGHT_STABILITY_CLASS)
+    for threshold, stability_class in reversed(NIGHT_WIND_THRESHOLDS):
+        stability[wind_flame < threshold] = stability_class
+    stability[is_day] = DAY_STABILITY_CLASS
+
+    return {
+        'temp': temp,
+        'humid': humid,
+        'wind_flame': wind_flame,
+        'modified_wind': modified_wind,
+        'stability': numpy.array(list(STABILITY_CLASSES))[stability],
+        'dif_temp_grad': numpy.array(DIF_TEMP_GRADS)[stability]
+    }
+
+
+##
+## Time profile
+##
+
+MAX_HOURS = 768 # feps_timeprofile computes 32 days of emissions
+
+# Rate constants for the flaming, short term smoldering, and long term
+# (residual) smoldering phases
+dBd = 20.0
+Bsts = 12.0
+Tflm1 = 4.0 / 3.0
+Tflm2 = 8.0
+Tfldfsn = 0.5
+Tsts1 = 8.0 / 3.0
+Tsts2 = 8.0
+Tstdfsn = 0.5
+Krdr = 12.0
+Mdbm = 130.0
+Klti = 1.0
+MIN_PER_HOUR = 60.0
+ONE_E_FOLDING = 1.0 - numpy.exp(-1.0)
+
+WIND_BENCHMARK = 3.0
+HUMI_BENCHMARK = 60.0
+HUMIDITY_LAG = 4 # hours
+INITIAL_HUMIDITY = 100.0
+
+def _decay_factors(cons_flm, cons_sts, moist_duff):
+    """Returns fraction of each phase's emissions rate carried over from
+    one hour to the next
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        flm_minutes = Tflm1 * Tflm2 * (cons_flm / dBd) ** (Tfldfsn / 2.0)
+        sts_minutes = Tsts1 * Tsts2 * (cons_sts / Bsts) ** Tstdfsn
+        lts_hours = (numpy.exp(-Klti * moist_duff / Mdbm) * Krdr
+            / ONE_E_FOLDING)
+        return (numpy.exp(-1.0 / (flm_minutes / MIN_PER_HOUR)),
+            numpy.exp(-1.0 / (sts_minutes / MIN_PER_HOUR)),
+            numpy.exp(-1.0 / lts_hours))
+
+def time_profile(consumption, growth, humid, wind_flame, normalize=True,
+        num_hours=NUM_DIURNAL_HOURS):
+    """Computes hourly area and emissions fractions, like feps_timeprofile
+
+    Args:
+     - consumption -- (locations x 5) array of flaming, smoldering,
+        residual, and duff consumption, in tons per acre, and duff
+        moisture
+     - growth -- (locations x hours) array of cumulative fire size, for
+        each hour starting with hour 0 of the first day; since every hour
+        is specified, no interpolation is needed
+     - humid -- (locations x 24) array of diurnal humidity
+     - wind_flame -- (locations x 24) array of diurnal wind at flame
+        height, in mph
+
+    Kwargs:
+     - normalize -- whether or not to normalize smoldering and residual
+        fractions to sum to 1
+     - num_hours -- number of hours of fractions to return
+
+    Returns dict of (locations x num_hours) arrays - 'area_fraction',
+    'flaming', 'smoldering', and 'residual'
+    """
+    consumption = numpy.asarray(consumption, dtype=float).reshape(-1, 5)
+    growth = numpy.asarray(growth, dtype=float)
+    humid = numpy.asarray(humid, dtype=float)
+    wind_flame = numpy.asarray(wind_flame, dtype=float)
+    num_locations, num_growth_hours = growth.shape
+
+    k_flm, k_sts, k_lts = _decay_factors(consumption[:, 0],
+        consumption[:, 1], consumption[:, 4])
+
+    # feps_timeprofile starts at the beginning of the day on which growth
+    # starts, or at the beginning of the previous day if growth starts
+    # in the first few hours, so that lagged humidity is defined
+    first = numpy.argmax(growth > 0, axis=1)
+    start = (first // NUM_DIURNAL_HOURS) * NUM_DIURNAL_HOURS
+    start = numpy.where(first <= 3, start - NUM_DIURNAL_HOURS, start)
+    total = growth[:, -1]
+
+    fractions = numpy.zeros((4, num_locations, num_hours))
+    sums = numpy.zeros((3, num_locations))
+    flm = numpy.zeros(num_locations)
+    sts = numpy.zeros(num_locations)
+    lts = numpy.zeros(num_locations)
+    prev_size = numpy.zeros(num_locations)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for i in range(int(start.min()), MAX_HOURS):
+            size = numpy.where(i < first, 0.0,
+                growth[:, min(i, num_growth_hours - 1)])
+            area_fraction = (size - prev_size) / total
+            prev_size = size
+
+            lagged_humid = numpy.where(i - HUMIDITY_LAG >= start,
+                humid[:, (i - HUMIDITY_LAG) % NUM_DIURNAL_HOURS],
+                INITIAL_HUMIDITY)
+            wind = wind_flame[:, i % NUM_DIURNAL_HOURS]
+            smoldering_rate = ((100.0 - lagged_humid)
+                * numpy.sqrt(wind / WIND_BENCHMARK) / HUMI_BENCHMARK
+                * area_fraction)
+
+            flm = k_flm * flm + (1.0 - k_flm) * area_fraction
+            sts = k_sts * sts + (1.0 - k_sts) * smoldering_rate
+            lts = k_lts * lts + (1.0 - k_lts) * smoldering_rate
+
+            if i >= 0:
+                sums += (flm, sts, lts)
+                if i < num_hours:
+                    fractions[:, :, i] = (area_fraction, flm, sts, lts)
+
+        if normalize:
+            normalized = sums[1] > 0
+            fractions[2][normalized] /= sums[1][normalized, numpy.newaxis]
+            fractions[3][normalized] /= sums[2][normalized, numpy.newaxis]
+
+    return dict(zip(['area_fraction', 'flaming', 'smoldering', 'residual'],
+        fractions))
@@ -78,6 +78,9 @@ class FireActivityFilter(FiresActionBase):
 
     INVALID_FILTER_MSG = "Invalid filter"
     MISSING_FILTER_CONFIG_MSG = "Specify config for each filter"
+    # filters whose options are all optional, which may be enabled with
+    # an empty config section
+    OPTIONAL_CONFIG_FILTERS = ('dispersion_window',)
     def _get_filter_func(self, filter_field):
         """Filters by specified field
 
@@ -90,7 +93,8 @@ class FireActivityFilter(FiresActionBase):
             self._fail_or_skip(self.MISSING_FILTER_CONFIG_MSG)
 
         kwargs = self._filter_config.get(filter_field)
-        if not kwargs:
+        if not kwargs and not (kwargs == {}
+                and filter_field in self.OPTIONAL_CONFIG_FILTERS):
             self._fail_or_skip(self.MISSING_FILTER_CONFIG_MSG)
 
         kwargs.update(filter_field=filter_field)
@@ -321,3 +325,36 @@ class FireActivityFilter(FiresActionBase):
             return (s and aa_e <= s) or (e and aa_s >= e)
 
         return _filter
+
+    SPECIFY_DISPERSION_START_AND_NUM_HOURS_MSG = ("Specify dispersion 'start'"
+        " and 'num_hours' to filter by dispersion window")
+    INVALID_BUFFER_HOURS_MSG = ("Invalid value for dispersion_window filter"
+        " config option 'buffer_hours'")
+
+    def _get_dispersion_window_filter(self, **kwargs):
+        """Returns function that checks if fire activity window lies
+        entirely outside of the dispersion window, defined by 'dispersion' >
+        'start' and 'num_hours' and extended by 'buffer_hours' on each side,
+        so that fires not dispersed aren't run through localmet, timeprofile,
+        plumerise, etc.
+        """
+        start = Config().get('dispersion', 'start')
+        num_hours = Config().get('dispersion', 'num_hours')
+        if not start or not num_hours:
+            raise self.FilterError(self.SPECIFY_DISPERSION_START_AND_NUM_HOURS_MSG)
+
+        try:
+            buffer_hours = datetime.timedelta(
+                hours=float(kwargs.get('buffer_hours') or 0))
+        except (TypeError, ValueError):
+            raise self.FilterError(self.INVALID_BUFFER_HOURS_MSG)
+
+        try:
+            start = to_datetime(start)
+        except Exception:
+            raise self.FilterError(
+                self.INVALID_TIME_START_OR_END_VAL.format('start'))
+
+        # dispersion start is UTC
+        return self._get_time_filter(start=start - buffer_hours,
+            end=start + datetime.timedelta(hours=num_hours) + buffer_hours)
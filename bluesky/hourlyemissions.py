@@ -0,0 +1,231 @@
+"""bluesky.hourlyemissions
+
+Hourly emissions, per location, computed once and shared by the modules
+and writers that need them.
+
+Dispersion, the emissions csv and SmokeReady writers, and (through
+dispersion) VSMOKE all need each location's hourly emissions, computed
+by multiplying the location's time profile fractions by its emissions
+totals, summed over fuelbeds, per phase and species. Rather than each
+doing so in nested loops, HourlyEmissions keeps each location's time
+profile as an (hours x phases) array and its emissions totals as a
+(phases x species) array, and computes the location's (hours x phases x
+species) hourly emissions with a single broadcast multiplication.
+Consumers look up a location's index and get the hours, phases and
+species they need.
+
+Each location's array covers only the hours of its own time profile,
+rather than the union of all locations' hours, and hourly emissions
+aren't stored, only computed for the hours requested, so that memory is
+proportional to the size of the time profiles.
+
+A fire's locations are added the first time one of them is looked up,
+so that each consumer does so in its own per-fire error handling, and
+so that invalid fires and locations are skipped, for the consumer to
+handle as it would without hourly emissions.
+
+If max_fires is specified, only the locations of the most recently
+added max_fires fires are kept, so that memory stays bounded when fires
+are streamed through (e.g. paged in from the sqlite fires store). The
+locations of a fire that was dropped are added again, with new indices,
+if one of them is looked up again.
+
+Hours are the timestamp keys of the locations' time profiles, which are
+in local time. A location's emissions are zero in hours for which its
+time profile isn't defined.
+
+HourlyEmissions are cached on the FiresManager; see
+FiresManager.hourly_emissions.
+"""
+
+__author__ = "Joel Dubowy"
+
+import logging
+from collections import OrderedDict
+
+import numpy
+
+from bluesky.hourlyseries import HourlySeries
+
+__all__ = [
+    'HourlyEmissions'
+]
+
+PHASES = ['flaming', 'smoldering', 'residual']
+
+class HourlyEmissions(object):
+
+    def __init__(self, fires=None, max_fires=None):
+        self.species = []
+        self._species_idx = {}
+        self._hour_idx = {}
+        self._max_fires = max_fires
+        # location index, or None, keyed by fire private id and index of
+        # location in fire.locations
+        self._location_idx = {}
+        # (index in fire.locations, location index) of added locations,
+        # keyed by fire private id, in the order the fires were added
+        self._fires = OrderedDict()
+        self._num_locations = 0
+        # keyed by location index; see _add_location
+        self._hour_ids = {}
+        self._rows = {}
+        self._fractions = {}
+        self._totals = {}
+
+        for fire in (fires or []):
+            self.add_fire(fire)
+
+    @property
+    def hours(self):
+        """Sorted list of all hours of the locations added, including
+        those of fires since dropped
+        """
+        return sorted(self._hour_idx)
+
+    def add_fire(self, fire):
+        """Adds the fire's locations, skipping those without the time
+        profile and emissions needed
+
+        Raises the exception raised by fire.locations, if the fire is
+        invalid.
+        """
+        if fire._private_id in self._fires:
+            return
+
+        location_idxs = []
+        for i, loc in enumerate(fire.locations):
+            try:
+                added = self._add_location(self._num_locations, loc)
+            except Exception as e:
+                logging.debug("Not computing hourly emissions of fire %s "
+                    "location %s: %s", fire.id, i, e)
+                added = False
+            if added:
+                self._location_idx[(fire._private_id, i)] = self._num_locations
+                location_idxs.append((i, self._num_locations))
+                self._num_locations += 1
+        self._fires[fire._private_id] = location_idxs
+        logging.debug("Added %s locations of fire %s to hourly emissions",
+            len(location_idxs), fire.id)
+
+        while self._max_fires and len(self._fires) > self._max_fires:
+            self._drop_fire(*self._fires.popitem(last=False))
+
+    def _drop_fire(self, private_id, location_idxs):
+        for i, l_idx in location_idxs:
+            self._location_idx.pop((private_id, i))
+            for d in (self._hour_ids, self._rows, self._fractions, self._totals):
+                d.pop(l_idx)
+
+    def _add_location(self, location_idx, loc):
+        """Adds location's hour ids, sorted, the rows of its time profile
+        fractions in that order, and its emissions totals, returning False
+        if it doesn't have the time profile and emissions needed
+        """
+        timeprofile = loc.get('timeprofile')
+        if not timeprofile or not loc.get('fuelbeds') or any(
+                [not fb.get('emissions') for fb in loc['fuelbeds']]):
+            return False
+
+        # computed before recording hours and species, in case it fails
+        if isinstance(timeprofile, HourlySeries):
+            fractions = numpy.stack([timeprofile.fields[p]
+                if p in timeprofile.fields else numpy.zeros(len(timeprofile))
+                for p in PHASES], axis=1).astype(float)
+        else:
+            fractions = numpy.array([[(tp or {}).get(p) or 0.0 for p in PHASES]
+                for tp in timeprofile.values()], dtype=float).reshape(-1, len(PHASES))
+
+        totals = {}
+        for fb in loc['fuelbeds']:
+            for p_idx, p in enumerate(PHASES):
+                for s, v in fb['emissions'].get(p, {}).items():
+                    totals[(p_idx, s)] = totals.get((p_idx, s), 0.0) + sum(v)
+
+        hour_ids = numpy.array([self._hour_idx.setdefault(ts,
+            len(self._hour_idx)) for ts in timeprofile], dtype=numpy.int64)
+        for p_idx, s in totals:
+            if s not in self._species_idx:
+                self._species_idx[s] = len(self.species)
+                self.species.append(s)
+
+        loc_totals = numpy.zeros((len(PHASES), len(self.species)))
+        for (p_idx, s), v in totals.items():
+            loc_totals[p_idx, self._species_idx[s]] = v
+
+        order = numpy.argsort(hour_ids, kind='stable')
+        self._hour_ids[location_idx] = hour_ids[order]
+        self._rows[location_idx] = order
+        self._fractions[location_idx] = fractions
+        self._totals[location_idx] = loc_totals
+        return True
+
+    def get_location_idx(self, fire, loc_idx):
+        """Returns index of the fire's loc_idx'th location (in the order of
+        fire.locations), or None if it doesn't have time profile or
+        emissions data
+
+        Adds the fire's locations if they haven't been added yet.
+        """
+        self.add_fire(fire)
+        return self._location_idx.get((fire._private_id, loc_idx))
+
+    def _get_rows(self, location_idx, hours):
+        """Returns (indices in hours, rows of location's fractions) of the
+        hours defined for the location
+        """
+        hour_ids = self._hour_ids[location_idx]
+        idxs, ids = [], []
+        for i, h in enumerate(hours):
+            h_id = self._hour_idx.get(h)
+            if h_id is not None:
+                idxs.append(i)
+                ids.append(h_id)
+        if not ids or not len(hour_ids):
+            return [], []
+
+        ids = numpy.array(ids)
+        pos = numpy.minimum(numpy.searchsorted(hour_ids, ids),
+            len(hour_ids) - 1)
+        found = hour_ids[pos] == ids
+        return (numpy.array(idxs)[found],
+            self._rows[location_idx][pos[found]])
+
+    def _get_species_idxs(self, location_idx, species):
+        """Returns (index in species, index in location's totals) of the
+        species defined for the location
+        """
+        num_species = self._totals[location_idx].shape[1]
+        s_idxs = [(i, self._species_idx.get(s)) for i, s in enumerate(species)]
+        return [(i, s) for i, s in s_idxs
+            if s is not None and s < num_species]
+
+    def get(self, location_idx, hours, species, phases=PHASES):
+        """Returns (hours x phases x species) array of the location's
+        emissions, with zeros for hours and species not defined
+        """
+        r = numpy.zeros((len(hours), len(phases), len(species)))
+        h_idxs, rows = self._get_rows(location_idx, hours)
+        totals = self._totals[location_idx]
+        s_idxs = self._get_species_idxs(location_idx, species)
+        if len(h_idxs) and s_idxs:
+            p_idxs = [PHASES.index(p) for p in phases]
+            fractions = self._fractions[location_idx][
+                numpy.ix_(rows, p_idxs)]
+            totals = totals[numpy.ix_(p_idxs, [s for i, s in s_idxs])]
+            r[numpy.ix_(h_idxs, range(len(phases)), [i for i, s in s_idxs])] = (
+                fractions[:, :, numpy.newaxis] * totals[numpy.newaxis, :, :])
+        return r
+
+    def get_totals(self, location_idx, species, phases=PHASES):
+        """Returns (phases x species) array of the location's emissions
+        totals, with zeros for species not defined
+        """
+        totals = self._totals[location_idx]
+        r = numpy.zeros((len(phases), len(species)))
+        s_idxs = self._get_species_idxs(location_idx, species)
+        if s_idxs:
+            r[:, [i for i, s in s_idxs]] = totals[numpy.ix_(
+                [PHASES.index(p) for p in phases], [s for i, s in s_idxs])]
+        return r
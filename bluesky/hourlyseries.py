@@ -0,0 +1,118 @@
+"""bluesky.hourlyseries
+
+Compact representation of hourly time series, such as time profiles.
+
+Time series have historically been stored as dicts keyed by ISO hour
+strings, e.g.
+
+    {
+        "2015-08-04T17:00:00": {
+            "area_fraction": 0.04, "flaming": 0.04, ...
+        },
+        "2015-08-04T18:00:00": {...},
+        ...
+    }
+
+HourlySeries instead stores the first hour and an array of values per
+field, so that an hour's index is computed from its datetime with
+arithmetic rather than by formatting or parsing strings. For backwards
+compatibility, it implements the mapping interface of the dict form,
+which is only built when needed, e.g. when fires are written to JSON
+(see FireEncoder).
+"""
+
+__author__ = "Joel Dubowy"
+
+import datetime
+from collections.abc import Mapping
+
+import numpy
+
+__all__ = [
+    'HourlySeries'
+]
+
+ONE_HOUR = datetime.timedelta(hours=1)
+
+class HourlySeries(Mapping):
+
+    def __init__(self, start, fields):
+        """Constructor
+
+        Args:
+         - start -- datetime.datetime of first hour
+         - fields -- dict of per hour values, keyed by field name; each
+            field's values may be scalars or (equal length) lists
+        """
+        self.start = start
+        self.fields = {k: numpy.asarray(v) for k, v in fields.items()}
+        lengths = set(len(v) for v in self.fields.values())
+        if len(lengths) > 1:
+            raise ValueError("HourlySeries fields must have same length")
+        self.num_hours = lengths.pop() if lengths else 0
+        self._keys = None
+
+    def get_index(self, dt):
+        """Returns index of hour dt, a datetime or ISO string, or None if
+        it's not in the series
+        """
+        if isinstance(dt, str):
+            try:
+                dt = datetime.datetime.fromisoformat(dt)
+            except ValueError:
+                return None
+        if self.start.tzinfo is None:
+            # like the dict form's keys, which don't include utc offsets
+            dt = dt.replace(tzinfo=None)
+        try:
+            i, r = divmod(dt - self.start, ONE_HOUR)
+        except TypeError:
+            # e.g. comparing naive and aware datetimes
+            return None
+        if r or not 0 <= i < self.num_hours:
+            return None
+        return i
+
+    def slice(self, start, end):
+        """Returns HourlySeries of the hours from start (inclusive) to
+        end (exclusive)
+        """
+        if self.start.tzinfo is None:
+            start = start.replace(tzinfo=None)
+            end = end.replace(tzinfo=None)
+        i0, i1 = [min(max(-((self.start - dt) // ONE_HOUR), 0), self.num_hours)
+            for dt in (start, end)]
+        i1 = max(i0, i1)
+        return HourlySeries(self.start + i0 * ONE_HOUR,
+            {k: v[i0:i1] for k, v in self.fields.items()})
+
+    def get_hour(self, i):
+        """Returns dict of hour i's values"""
+        return {k: v[i].tolist() for k, v in self.fields.items()}
+
+    def keys(self):
+        if self._keys is None:
+            self._keys = [(self.start + i * ONE_HOUR).isoformat()
+                for i in range(self.num_hours)]
+        return self._keys
+
+    def to_dict(self):
+        return {k: self.get_hour(i) for i, k in enumerate(self.keys())}
+
+    ## Mapping interface
+
+    def __getitem__(self, key):
+        i = self.get_index(key)
+        if i is None:
+            raise KeyError(key)
+        return self.get_hour(i)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return self.num_hours
+
+    def __repr__(self):
+        return "HourlySeries({!r}, {!r})".format(self.start,
+            {k: v.tolist() for k, v in self.fields.items()})
@@ -2,6 +2,7 @@
 
 __author__ = "Joel Dubowy"
 
+import gzip
 import logging
 import io
 import os
@@ -10,14 +11,15 @@ import shutil
 import subprocess
 import sys
 import tarfile
+import threading
 import time
 
 from pyairfire.io import *
 
 from bluesky.config import Config
 from bluesky.exceptions import (
-    BlueSkyConfigurationError, BlueSkyUnavailableResourceError,
-    BlueSkySubprocessError
+    BlueSkyConfigurationError, BlueSkyImportError,
+    BlueSkyUnavailableResourceError, BlueSkySubprocessError
 )
 
 __all__ = [
@@ -26,8 +28,12 @@ __all__ = [
     "create_sym_link",
     "wait_for_availability",
     "capture_stdout",
+    "capture_thread_stdout",
     "SubprocessExecutor",
-    "create_tarball"
+    "create_tarball",
+    "get_compression",
+    "open_file",
+    "decompress"
 ]
 
 def create_dir_or_handle_existing(dir_to_create, handle_existing):
@@ -170,6 +176,10 @@ class capture_stdout(object):
     """
 
     def __enter__(self):
+        # restored on exit, rather than resetting to sys.__stdout__, so
+        # that stdout replaced by an enclosing capture, e.g. with
+        # capture_thread_stdout, is left in place
+        self._previous = sys.stdout
         sys.stdout = io.StringIO()
         # returning sys.stdout isn't necessary, since user could
         # just use a reference to sys.stdout directly, but it's for
@@ -177,7 +187,68 @@ class capture_stdout(object):
         return sys.stdout
 
     def __exit__(self, e_type, value, tb):
-        sys.stdout = sys.__stdout__
+        sys.stdout = self._previous
+
+
+class _ThreadStdout(object):
+    """Stand-in for sys.stdout that writes to the current thread's buffer,
+    if it has one, and otherwise to the stdout it replaced
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self._local = threading.local()
+
+    # Note: not named 'buffer', which would shadow stdout's binary buffer
+    @property
+    def capture_buffer(self):
+        return getattr(self._local, 'capture_buffer', None)
+
+    @capture_buffer.setter
+    def capture_buffer(self, capture_buffer):
+        self._local.capture_buffer = capture_buffer
+
+    def __getattr__(self, name):
+        return getattr(self.capture_buffer or self.stdout, name)
+
+class capture_thread_stdout(object):
+    """Context manager that redirects the current thread's stdout to a
+    stringIO buffer, leaving other threads' output alone
+
+    Unlike capture_stdout, sys.stdout isn't swapped in and out by each
+    capture. It's replaced with a stand-in that dispatches writes by
+    thread when the first capture, in any thread, starts, and restored
+    when the last one ends. That way concurrent captures don't clobber
+    each other, and output from other threads still goes to stdout.
+    """
+
+    _lock = threading.Lock()
+    _thread_stdout = None
+    _num_captures = 0
+
+    def __enter__(self):
+        cls = capture_thread_stdout
+        with cls._lock:
+            if not cls._num_captures:
+                cls._thread_stdout = _ThreadStdout(sys.stdout)
+                sys.stdout = cls._thread_stdout
+            cls._num_captures += 1
+            self._thread_stdout = cls._thread_stdout
+        self._previous = self._thread_stdout.capture_buffer
+        self._thread_stdout.capture_buffer = io.StringIO()
+        return self._thread_stdout.capture_buffer
+
+    def __exit__(self, e_type, value, tb):
+        self._thread_stdout.capture_buffer = self._previous
+        cls = capture_thread_stdout
+        with cls._lock:
+            cls._num_captures -= 1
+            if not cls._num_captures:
+                # leave stdout alone if it's since been replaced by
+                # something other than the stand-in
+                if sys.stdout is cls._thread_stdout:
+                    sys.stdout = cls._thread_stdout.stdout
+                cls._thread_stdout = None
 
 
 class SubprocessExecutor(object):
@@ -298,3 +369,85 @@ def create_tarball(output_dir, tarball_pathname=None):
     with tarfile.open(tarball_pathname, "w:gz") as tar:
         tar.add(output_dir, arcname=os.path.basename(output_dir))
     return tarball_pathname
+
+
+##
+## Compressed files
+##
+
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.zst': 'zstd',
+    '.zstd': 'zstd'
+}
+
+COMPRESSION_MAGIC_BYTES = {
+    b'\x1f\x8b': 'gzip',
+    b'\x28\xb5\x2f\xfd': 'zstd'
+}
+
+def _get_compression_from_magic_bytes(data):
+    for magic, compression in COMPRESSION_MAGIC_BYTES.items():
+        if data.startswith(magic):
+            return compression
+
+def get_compression(filename, mode='r'):
+    """Returns 'gzip', 'zstd', or None
+
+    Existing files being read are identified by their magic bytes, so
+    that compressed files are handled regardless of their names. Otherwise,
+    the compression is determined by the file's extension.
+    """
+    if 'r' in mode and os.path.isfile(filename):
+        with open(filename, 'rb') as f:
+            return _get_compression_from_magic_bytes(f.read(4))
+
+    ext = os.path.splitext(filename)[1].lower()
+    return COMPRESSION_EXTENSIONS.get(ext)
+
+def _import_zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        raise BlueSkyImportError("Package 'zstandard' required "
+            "for reading and writing zstd compressed files")
+
+def open_file(filename, mode='r', encoding=None):
+    """Opens plain, gzip, or zstd compressed file, as appropriate
+
+    Returns file object that streams (de)compressed data, so that large
+    files don't need to be decompressed in full, either on disk or in
+    memory. zstd compression uses all available cores.
+    """
+    compression = get_compression(filename, mode)
+    if compression and 'b' not in mode and 't' not in mode:
+        mode += 't'
+
+    if compression == 'gzip':
+        logging.debug("Opening gzip file %s", filename)
+        return gzip.open(filename, mode, encoding=encoding)
+
+    elif compression == 'zstd':
+        logging.debug("Opening zstd file %s", filename)
+        zstandard = _import_zstandard()
+        cctx = (zstandard.ZstdCompressor(threads=-1)
+            if 'r' not in mode else None)
+        return zstandard.open(filename, mode, cctx=cctx, encoding=encoding)
+
+    return open(filename, mode, encoding=encoding)
+
+def decompress(data):
+    """Decompresses gzip or zstd compressed bytes, passing through
+    uncompressed data as is
+    """
+    compression = _get_compression_from_magic_bytes(data)
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    elif compression == 'zstd':
+        zstandard = _import_zstandard()
+        # Note: ZstdDecompressor.decompress fails on data written in
+        #   streaming mode, which doesn't record the decompressed size
+        return b''.join(zstandard.ZstdDecompressor().read_to_iter(data))
+    return data
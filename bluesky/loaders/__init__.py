@@ -23,11 +23,12 @@ import logging
 import os
 import urllib
 import shutil
+import tempfile
 import traceback
 
 from pyairfire.io import CSV2JSON
 
-from bluesky import datetimeutils
+from bluesky import datetimeutils, io
 from bluesky.datetimeutils import parse_datetime, parse_utc_offset
 from bluesky.exceptions import (
     BlueSkyConfigurationError, BlueSkyUnavailableResourceError
@@ -152,7 +153,7 @@ class BaseLoader(object):
     def _save_copy(self, data):
         if self._saved_copy_filename:
             try:
-                with open(self._saved_copy_filename, 'w') as f:
+                with io.open_file(self._saved_copy_filename, 'w') as f:
                     f.write(json.dumps(data))
             except Exception as e:
                 logging.warning("Failed to write loaded data to %s - %s",
@@ -177,9 +178,15 @@ class BaseFileLoader(BaseLoader, metaclass=abc.ABCMeta):
                 "load {} does not exist".format(self._filename))
 
     def _save_copy(self, data):
-        # initially try to just copy file; if fail, then use super
-        # to write to file
+        # initially try to just copy file, if compression of the copy
+        # would match; otherwise, or if copy fails, use super to write
+        # to file
         if self._saved_copy_filename:
+            if (io.get_compression(self._filename)
+                    != io.get_compression(self._saved_copy_filename, 'w')):
+                super()._save_copy(data)
+                return
+
             try:
                 shutil.copyfile(self._filename, self._saved_copy_filename)
             except Exception as e:
@@ -194,7 +201,7 @@ class BaseJsonFileLoader(BaseFileLoader):
     """
 
     def _load(self):
-        with open(self._filename, 'r') as f:
+        with io.open_file(self._filename, 'r') as f:
             return json.loads(f.read())
 
 
@@ -203,8 +210,18 @@ class BaseCsvFileLoader(BaseFileLoader):
     """
 
     def _load(self):
-        csv_loader = CSV2JSON(input_file=self._filename)
-        return csv_loader._load()
+        if not io.get_compression(self._filename):
+            csv_loader = CSV2JSON(input_file=self._filename)
+            return csv_loader._load()
+
+        # CSV2JSON only reads plain files, so stream the decompressed
+        # data to a temp file
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv') as tmp:
+            with io.open_file(self._filename, 'r') as f:
+                shutil.copyfileobj(f, tmp)
+            tmp.flush()
+            csv_loader = CSV2JSON(input_file=tmp.name)
+            return csv_loader._load()
 
 
 ##
@@ -16,7 +16,64 @@ INVALID_LOCATION_MSGS = {
     for k in REQUIRED_LOCATION_FIELDS
 }
 
-class Location(dict):
+class FireData(dict):
+    """Base class for fires and the activity collections, active areas,
+    and locations in them, which report changes made to them, via
+    _changed, so that changes to a fire kept in a sqlite store are saved
+    even if made after it's been paged out (see bluesky.models.store)
+
+    Activity collections and active areas refer back to their fire, and
+    locations to their active area.  When a fire is kept in a sqlite
+    store, it refers to the store.  These references to the fire and
+    store are neither pickled nor copied.
+    """
+
+    _fire = None
+
+    def _changed(self):
+        if self._fire is not None:
+            self._fire._changed()
+
+    def __setitem__(self, key, val):
+        super().__setitem__(key, val)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def pop(self, *args):
+        val = super().pop(*args)
+        self._changed()
+        return val
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def setdefault(self, key, default=None):
+        val = super().setdefault(key, default)
+        self._changed()
+        return val
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_fire', None)
+        state.pop('_store', None)
+        return state
+
+class Location(FireData):
+
+    _active_area = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -58,7 +115,11 @@ class Location(dict):
             self._active_area and attr not in self.LOCATION_ONLY_FIELDS
             and attr in self._active_area)
 
-class ActiveArea(dict):
+    def _changed(self):
+        if self._active_area is not None:
+            self._active_area._changed()
+
+class ActiveArea(FireData):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -77,6 +138,10 @@ class ActiveArea(dict):
     MISSING_LOCATION_INFO_MSG = ("Each active area must contain "
         "'specified_points' or 'perimeter'")
 
+    # Set by bluesky.models.validation.validate_fires, if active area
+    # passes validation at load time
+    _validated = False
+
     def __getitem__(self, attr):
         if attr == 'locations':
             return self.locations
@@ -89,12 +154,18 @@ class ActiveArea(dict):
         This method validates data and casts areas to float every time it
         is called, in case fire activity data is made invalid mid-run
         (which should only be possibly if a user imports the bluesky package
-        instead of running 'bsp')
+        instead of running 'bsp'), unless the active area was already
+        validated at load time (see bluesky.models.validation)
 
         Note that perimeter 'area' does not need to be defined, since
         this method will be called before fuelbeds, which fills in perimeter
         area if not already defined.
         """
+        if self._validated:
+            # already validated, and areas cast to float, at load time
+            return ([self['perimeter']] if not self.get('specified_points')
+                else self['specified_points'])
+
         if self.get('specified_points'):
             return self._validate_locations('specified_points')
 
@@ -153,7 +224,7 @@ class ActiveArea(dict):
         else:
             raise ValueError(self.MISSING_LOCATION_INFO_FOR_ACTIVE_AREA)
 
-class ActivityCollection(dict):
+class ActivityCollection(FireData):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
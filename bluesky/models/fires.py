@@ -8,24 +8,32 @@ import itertools
 import io
 import json
 import logging
+import math
+import os
 import sys
 import traceback
 import uuid
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import requests
 from pyairfire import process
 
 from bluesky import datautils, datetimeutils, __version__
+from bluesky import io as bluesky_io
 from bluesky.config import Config
 from bluesky.exceptions import (
-    BlueSkyImportError, BlueSkyModuleError
+    BlueSkyConfigurationError, BlueSkyImportError, BlueSkyModuleError
 )
 from bluesky.filtermerge.filter import FireActivityFilter
 from bluesky.filtermerge.merge import FiresMerger
+from bluesky.hourlyemissions import HourlyEmissions
+from bluesky.hourlyseries import HourlySeries
 from bluesky.statuslogging import StatusLogger
 
-from .activity import ActiveArea, ActivityCollection
+from . import validation
+from .activity import ActiveArea, ActivityCollection, FireData
+from .store import SqliteFiresStore
 
 __all__ = [
     'Fire',
@@ -38,11 +46,14 @@ __all__ = [
 ##
 
 
-class Fire(dict):
+class Fire(FireData):
 
     DEFAULT_TYPE = 'wildfire'
     DEFAULT_FUEL_TYPE = 'natural'
 
+    # weak reference to the sqlite store the fire was paged in from, if any
+    _store = None
+
     def __init__(self, *args, **kwargs):
         super(Fire, self).__init__(*args, **kwargs)
 
@@ -150,6 +161,11 @@ class Fire(dict):
             # else, assume zero offset
             return dt
 
+    def _changed(self):
+        store = self._store and self._store()
+        if store is not None:
+            store._changed(self)
+
    ## Validation
 
     VALID_TYPES = {
@@ -199,6 +215,8 @@ class FireEncoder(json.JSONEncoder):
     def default(self, obj):
         if hasattr(obj, 'tolist'):
             return obj.tolist()
+        elif isinstance(obj, HourlySeries):
+            return obj.to_dict()
         elif isinstance(obj, datetime.date):
             return obj.isoformat()
 
@@ -213,6 +231,7 @@ class FiresManager(object):
 
     def __init__(self):
         self._meta = {}
+        self._hourly_emissions = None
         # configuration no longer initialized here
         self.modules = []
         self.fires = [] # this intitializes self._fires and self._num_fires
@@ -226,29 +245,63 @@ class FiresManager(object):
     ##
 
     def add_fires(self, fires):
-        for fire in fires:
-            # cast to Fire, in case it isn't already
-            # TODO: should add_fire do the casting?
-            self.add_fire(Fire(fire))
+        # cast to Fire, in case they aren't already
+        # TODO: should add_fire do the casting?
+        fires = (Fire(fire) for fire in fires)
+        if isinstance(self._fires, SqliteFiresStore):
+            # inserted in bulk, in a single transaction
+            self._num_fires += self._fires.add_fires(fires)
+            self._hourly_emissions = None
+        else:
+            for fire in fires:
+                self.add_fire(fire)
 
     def add_fire(self, fire):
-        self._fires = self._fires or OrderedDict()
-        if fire.id not in self._fires:
-            self._fires[fire.id] = []
-        self._fires[fire.id].append(fire)
+        if self._fires is None:
+            self._fires = self._new_fires_store()
+        if isinstance(self._fires, SqliteFiresStore):
+            self._fires.add_fires([fire])
+        else:
+            if fire.id not in self._fires:
+                self._fires[fire.id] = []
+            self._fires[fire.id].append(fire)
         self._num_fires += 1
+        self._hourly_emissions = None
 
 
     def remove_fire(self, fire):
         # TODO: raise exception if fire doesn't exist ?
         if fire.id in self._fires:
-            _n = len(self._fires[fire.id])
-            self._fires[fire.id] = [f for f in self._fires[fire.id]
+            fires_with_id = self._fires[fire.id]
+            remaining = [f for f in fires_with_id
                 if f._private_id != fire._private_id]
-            self._num_fires -= (_n - len(self._fires[fire.id]))
-            if len(self._fires[fire.id]) == 0:
+            self._num_fires -= (len(fires_with_id) - len(remaining))
+            if remaining:
+                self._fires[fire.id] = remaining
+            else:
                 # that was last fire with that id
                 self._fires.pop(fire.id)
+            self._hourly_emissions = None
+
+    ## Fires store
+
+    def _new_fires_store(self):
+        """Returns new, empty mapping of fire id to list of fires
+
+        By default, fires are kept in memory.  For runs with more fire data
+        than fits in memory, they can be kept in a sqlite database on local
+        disk and paged in as the modules iterate through them.
+        """
+        store_config = Config().get('fires_store')
+        store_type = (store_config.get('type') or 'memory').lower()
+        if store_type == 'memory':
+            return OrderedDict()
+        elif store_type == 'sqlite':
+            return SqliteFiresStore(dir=store_config.get('dir'),
+                batch_size=store_config.get('batch_size'))
+        else:
+            raise BlueSkyConfigurationError(
+                "Invalid fires store type: '{}'".format(store_type))
 
     ##
     ## Merging Fires
@@ -264,18 +317,22 @@ class FiresManager(object):
 
     # TODO: Remove this method and use bluesky.io.Stream in code below instead
     # (would have a fair amoubnt of unit test updates)
+    def _fill_in_file_name(self, file_name):
+        file_name = datetimeutils.fill_in_datetime_strings(
+            file_name, today=self.today)
+        return file_name.replace('{run_id}', self.run_id)
+
     def _stream(self, file_name, flag): #, do_strip_newlines):
         if file_name:
-            file_name = datetimeutils.fill_in_datetime_strings(
-                file_name, today=self.today)
-            file_name = file_name.replace('{run_id}', self.run_id)
+            file_name = self._fill_in_file_name(file_name)
             if  file_name.startswith('http'):
                 logging.debug("Loading input over http: %s", file_name)
                 r = requests.get(file_name)
-                return io.StringIO(r.text)
+                return io.StringIO(
+                    bluesky_io.decompress(r.content).decode('utf-8'))
             else:
                 logging.debug("Loading local file: %s", file_name)
-                return open(file_name, flag)
+                return bluesky_io.open_file(file_name, flag)
         else:
             if flag == 'r':
                 return sys.stdin
@@ -297,6 +354,26 @@ class FiresManager(object):
 
     @property
     def fires(self):
+        """Returns the fires, as a list, or, if fires are kept in a sqlite
+        store, as a sequence that pages them into memory as it's iterated
+        through
+
+        Note that, with the sqlite store, changes made to a fire, or to
+        its activity collections, active areas, or locations, after the
+        iteration that yielded it, are reported to the store, which holds
+        the fire until it's written back.  Code that gathers data from
+        all fires in one pass, and then updates them after doing some
+        computation on the gathered data, should nonetheless avoid
+        holding on to the fires, since that keeps them all in memory.
+        Nor should it modify fuelbeds or other nested data held from the
+        first pass, since those changes aren't reported, and are lost if
+        the fire is no longer in memory.  Instead, it should key its
+        results by fire._private_id (and, e.g., location index) and apply
+        them with apply_by_fire, which makes a second pass through the
+        fires.
+        """
+        if isinstance(self._fires, SqliteFiresStore):
+            return self._fires.paged_fires()
         return [fire_obj for fire_list in self._fires.values()
             for fire_obj in fire_list]
 
@@ -315,10 +392,17 @@ class FiresManager(object):
 
     @fires.setter
     def fires(self, fires_list):
+        # fires_list may be the existing store's fires, so they're
+        # streamed into the new store before the existing one is closed
+        old_fires = getattr(self, '_fires', None)
         self._num_fires = 0
-        self._fires = OrderedDict()
-        for fire in fires_list:
-            self.add_fire(Fire(fire))
+        self._fires = self._new_fires_store()
+        self._hourly_emissions = None
+        try:
+            self.add_fires(fires_list)
+        finally:
+            if isinstance(old_fires, SqliteFiresStore):
+                old_fires.close()
 
     ##
     ## Special Meta Attributes
@@ -414,6 +498,25 @@ class FiresManager(object):
             return sorted(end_times)[-1]
         # TODO: else try to determine from "met", if defined (?)
 
+    @property
+    def hourly_emissions(self):
+        """Hourly emissions of all locations, computed from each fire's
+        time profiles and emissions the first time one of its locations is
+        looked up, and reused until fires are added or removed, or a module
+        that may modify emissions or time profiles is run
+
+        With the sqlite fires store, only the locations of the last batch
+        of fires looked up are kept, so that memory stays bounded as fires
+        are paged through.
+
+        See bluesky.hourlyemissions.HourlyEmissions
+        """
+        if self._hourly_emissions is None:
+            self._hourly_emissions = HourlyEmissions(
+                max_fires=(self._fires.batch_size
+                    if isinstance(self._fires, SqliteFiresStore) else None))
+        return self._hourly_emissions
+
     @property
     def counts(self):
         counts = {
@@ -453,9 +556,20 @@ class FiresManager(object):
     ## Running Modules
     ##
 
+    # modules that don't modify fires' emissions or time profiles, and
+    # so don't invalidate hourly emissions computed before they're run
+    HOURLY_EMISSIONS_PRESERVING_MODULES = set([
+        'bluesky.modules.{}'.format(m) for m in ('archive', 'dispersion',
+            'export', 'extrafiles', 'findmetdata', 'localmet', 'plumerise',
+            'trajectories', 'visualization')
+    ])
+
     def processed(self, module_name, version, **data):
         # TODO: determine module from call stack rather than require name
         # to be passed in.  Also get version from module's __version__
+        if module_name not in self.HOURLY_EMISSIONS_PRESERVING_MODULES:
+            self._hourly_emissions = None
+
         v = {
             'module': module_name,
             'version': version,
@@ -498,6 +612,16 @@ class FiresManager(object):
         logging.summary("Modules to be run: %s", ', '.join(self._module_names))
 
         with process.RunTimeRecorder(self.runtime):
+            # validate once, up front, so that modules don't need to
+            # recheck input data (The load module validates any
+            # fires that it loads)
+            if Config().get('validate_fires'):
+                try:
+                    self.validate_fires()
+                except Exception as e:
+                    failed = True
+                    self._record_error('validation', e)
+
             for i in range(len(self._modules)):
                 # if one of the modules already failed, then the only thing
                 # we'll run from here on is the export module
@@ -527,15 +651,7 @@ class FiresManager(object):
                     # and then raise BlueSkyModuleError, below, so that the calling
                     # code can decide what to do (which, in the case of bsp and
                     # bsp-web, is to dump the data as is)
-                    logging.error(str(e))
-                    tb = traceback.format_exc()
-                    logging.debug(tb)
-                    self.error = {
-                        "module": self._module_names[i],
-                        "message": str(e),
-                        "traceback": str(tb)
-                    }
-                    self.log_status('Failure', self._module_names[i], 'Die')
+                    self._record_error(self._module_names[i], e)
 
         if failed:
             self.log_status('Failure', 'Main', 'Die')
@@ -544,6 +660,31 @@ class FiresManager(object):
 
         self.log_status('Good', 'Main', 'Finish')
 
+    def _record_error(self, module_name, e):
+        logging.error(str(e))
+        tb = traceback.format_exc()
+        logging.debug(tb)
+        self.error = {
+            "module": module_name,
+            "message": str(e),
+            "traceback": str(tb)
+        }
+        self.log_status('Failure', module_name, 'Die')
+
+    ## Validating Fires
+
+    def validate_fires(self):
+        """Validates all fires in one pass, handling invalid fires with
+        fire_failure_handler - i.e. moving them to failed_fires if
+        skip_failed_fires is set, and otherwise raising an exception
+        """
+        errors = validation.validate_fires(self.fires)
+        if errors:
+            for fire in self.fires:
+                if fire._private_id in errors:
+                    with self.fire_failure_handler(fire):
+                        raise ValueError('; '.join(errors[fire._private_id]))
+
     ## Filtering Fires
 
     def filter_fires(self):
@@ -615,6 +756,24 @@ class FiresManager(object):
 
         return klass
 
+    def apply_by_fire(self, results, func):
+        """Applies results computed from data gathered in an earlier pass
+        through the fires, making a second pass so that, with the sqlite
+        store, fires are paged in and saved in batches (see 'fires', above)
+
+        Args:
+         - results -- dict of results keyed by fire._private_id
+         - func -- called as func(fire, result) for each fire with a
+            result, within the fire's failure handler; it can raise the
+            result, if it's an exception, to fail the fire
+        """
+        if not results:
+            return
+        for fire in self.fires:
+            if fire._private_id in results:
+                with self.fire_failure_handler(fire):
+                    func(fire, results[fire._private_id])
+
     @property
     def skip_failed_fires(self):
         return not not Config().get('skip_failed_fires')
@@ -631,7 +790,10 @@ class FiresManager(object):
         # wipe out existing fires, if any, if append_fires==False
         new_fires = (input_dict.pop('fires', [])
             or input_dict.pop('fire_information', []))
-        self.fires = self.fires + new_fires if append_fires else new_fires
+        if append_fires:
+            self.add_fires(new_fires)
+        else:
+            self.fires = new_fires
 
         # pop config, but don't set until after today has been set
         if 'config' in input_dict:
@@ -657,9 +819,15 @@ class FiresManager(object):
         """
         if input_stream and input_file:
             raise RuntimeError("Don't specify both input_stream and input_file")
-        if not input_stream:
+        if input_stream:
+            data = json.loads(''.join([d for d in input_stream]))
+        else:
             input_stream = self._stream(input_file, 'r')
-        data = json.loads(''.join([d for d in input_stream]))
+            try:
+                data = json.loads(''.join([d for d in input_stream]))
+            finally:
+                if input_file:
+                    input_stream.close()
         return self.load(data, append_fires=append_fires)
 
     ## Dumping data
@@ -683,8 +851,146 @@ class FiresManager(object):
     def dumps(self, output_stream=None, output_file=None, indent=None):
         if output_stream and output_file:
             raise RuntimeError("Don't specify both output_stream and output_file")
-        if not output_stream:
+        if output_stream:
+            self._dumps(output_stream, indent)
+        else:
             output_stream = self._stream(output_file, 'w')
-        fire_json = json.dumps(self.dump(), sort_keys=True, cls=FireEncoder,
-            indent=indent)
-        output_stream.write(fire_json)
+            try:
+                self._dumps(output_stream, indent)
+            finally:
+                # close files, so that compressed output is completely
+                # written, but leave stdout open
+                if output_file:
+                    output_stream.close()
+
+    def _dumps(self, output_stream, indent):
+        if isinstance(self._fires, SqliteFiresStore):
+            self._dumps_paged(output_stream, indent)
+        else:
+            fire_json = json.dumps(self.dump(), sort_keys=True,
+                cls=FireEncoder, indent=indent)
+            output_stream.write(fire_json)
+
+    def _dumps_paged(self, output_stream, indent):
+        """Writes the fires one at a time, so that they don't all need to
+        be loaded into memory at once.
+
+        'fires' is written first, followed by the rest of the output data.
+        """
+        output_stream.write('{"fires": [')
+        for i, fire in enumerate(self.fires):
+            if i > 0:
+                output_stream.write(', ')
+            output_stream.write(json.dumps(fire, sort_keys=True,
+                cls=FireEncoder, indent=indent))
+        output_stream.write('], ')
+
+        data = self.dump()
+        data.pop('fires')
+        # strip leading '{', since it was written above
+        output_stream.write(json.dumps(data, sort_keys=True,
+            cls=FireEncoder, indent=indent).lstrip()[1:])
+
+    ## Sharded output
+
+    SHARDS_META_FILENAME = 'meta.json'
+    SHARD_FLUSH_SIZE = 1000
+
+    def dumps_shards(self, output_dir, fires_per_shard=None, tile_size=None):
+        """Writes fires to NDJSON shards (one fire per line), and the rest
+        of the output data to a small header file, so that downstream
+        consumers can process the shards independently and in parallel.
+
+        Fires are split either by count or by spatial tile, where tile_size
+        is in degrees.  Each fire is assigned to the tile containing its
+        first location.
+        """
+        if bool(fires_per_shard) == bool(tile_size):
+            raise ValueError("Specify either fires_per_shard or tile_size")
+
+        output_dir = self._fill_in_file_name(output_dir)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        shards = OrderedDict()
+        buffers = {}
+        def flush(shard_name):
+            with bluesky_io.open_file(
+                    os.path.join(output_dir, shard_name), 'a') as f:
+                f.writelines(buffers.pop(shard_name))
+
+        for i, fire in enumerate(self.fires):
+            if fires_per_shard:
+                shard_name = 'fires-{:05d}.ndjson'.format(
+                    i // fires_per_shard)
+            else:
+                shard_name = self._get_tile_shard_name(fire, tile_size)
+
+            if shard_name not in shards:
+                # in case output dir is being reused
+                if os.path.exists(os.path.join(output_dir, shard_name)):
+                    os.remove(os.path.join(output_dir, shard_name))
+                shards[shard_name] = 0
+            shards[shard_name] += 1
+
+            # buffer lines rather than keep a file open per shard, since
+            # there could be more tiles than allowed open files
+            buffers.setdefault(shard_name, []).append(json.dumps(fire,
+                sort_keys=True, cls=FireEncoder) + '\n')
+            if len(buffers[shard_name]) >= self.SHARD_FLUSH_SIZE:
+                flush(shard_name)
+
+        for shard_name in list(buffers):
+            flush(shard_name)
+
+        data = self.dump()
+        data.pop('fires')
+        data['shards'] = [{"file": k, "num_fires": v}
+            for k, v in shards.items()]
+        with open(os.path.join(output_dir, self.SHARDS_META_FILENAME), 'w') as f:
+            f.write(json.dumps(data, sort_keys=True, cls=FireEncoder))
+
+    def _get_tile_shard_name(self, fire, tile_size):
+        # imported here, since locationutils has heavy dependencies
+        from bluesky.locationutils import LatLng
+        try:
+            latlng = LatLng(fire.locations[0])
+            # tiles are named by their south west corners
+            lat = round(math.floor(latlng.latitude / tile_size) * tile_size, 6)
+            lng = round(math.floor(latlng.longitude / tile_size) * tile_size, 6)
+            return 'fires-{:g}_{:g}.ndjson'.format(lat, lng)
+        except Exception as e:
+            logging.warning("Failed to determine tile of fire %s - %s",
+                fire.id, e)
+            return 'fires-unknown-tile.ndjson'
+
+    def loads_shards(self, input_dir, append_fires=False, num_processes=None):
+        """Loads sharded output written by dumps_shards, parsing the
+        shards in parallel.
+        """
+        input_dir = self._fill_in_file_name(input_dir)
+        with open(os.path.join(input_dir, self.SHARDS_META_FILENAME)) as f:
+            data = json.loads(f.read())
+        shard_files = [os.path.join(input_dir, s['file'])
+            for s in data.pop('shards', [])]
+
+        self.load(data, append_fires=append_fires)
+        with ProcessPoolExecutor(max_workers=num_processes) as executor:
+            for fires in executor.map(_load_shard, shard_files):
+                self.add_fires(fires)
+
+    def is_shards_dir(self, input_dir):
+        """Returns whether input_dir, with run id and date wildcards
+        filled in as by loads_shards, contains sharded output
+        """
+        input_dir = self._fill_in_file_name(input_dir)
+        return os.path.isfile(
+            os.path.join(input_dir, self.SHARDS_META_FILENAME))
+
+
+def _load_shard(filename):
+    """Parses fires in an NDJSON shard; defined at module level so that it
+    can be run by worker processes.
+    """
+    with bluesky_io.open_file(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
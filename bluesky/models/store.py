@@ -0,0 +1,365 @@
+"""bluesky.models.store
+
+Backends for storing the fires managed by FiresManager.
+
+By default, FiresManager keeps its fires in an OrderedDict, keyed by fire
+id, with each value being a list of the fires with that id.  For runs
+with more fire data than fits in memory, SqliteFiresStore provides the
+same mapping interface, but keeps the fires pickled in an embedded
+sqlite database on local disk, paging them into memory in batches as
+they're iterated over.
+
+Each batch is written back to the database when the iteration moves on
+to the next batch.  Changes made to a fire after that are saved as well,
+since the fire reports them to the store, which holds on to it until
+it's written back again.  See FiresManager.fires and
+FiresManager.apply_by_fire.
+"""
+
+__author__ = "Joel Dubowy"
+
+import itertools
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import weakref
+from collections import Counter, OrderedDict
+
+from .activity import FireData
+
+__all__ = [
+    'SqliteFiresStore'
+]
+
+
+class SqliteFiresStore(object):
+    """Mapping of fire id to list of fires, kept in a sqlite database
+
+    Fires are modified in place by the bluesky modules. So, when iterating
+    through the fires (see PagedFires, below), each batch of fires is
+    loaded into memory, and written back to the database in a single
+    transaction once the batch has been consumed.
+
+    Fires in memory are tracked, as long as they're referenced, so that
+    there's only ever one copy of each fire being modified - e.g. lookups
+    by id in FiresManager's failure handler return the same objects that
+    the modules are modifying.  Fires looked up outside of an iteration,
+    by id or index, and fires changed outside of an iteration, e.g. by
+    a module holding on to a fire's locations from an earlier pass, are
+    held in memory and written back in batches as well.
+
+    Changes to a fire, its activity collections, active areas, and
+    locations are reported to the store (see bluesky.models.activity).
+    Changes made directly to other nested data, such as a fuelbed, held
+    from an earlier iteration, aren't, and are only saved if the fire is
+    still in memory when it's next written back.
+    """
+
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self, dir=None, batch_size=None):
+        self._batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+
+        if dir and not os.path.exists(dir):
+            os.makedirs(dir)
+        fd, self._filename = tempfile.mkstemp(prefix='bsp-fires-',
+            suffix='.sqlite', dir=dir)
+        os.close(fd)
+        logging.debug("Storing fires in %s", self._filename)
+
+        self._conn = sqlite3.connect(self._filename)
+        # The database is a scratch file that's deleted at the end of the
+        # run, so there's no need for durability
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE fires ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "id TEXT NOT NULL, "
+            "private_id TEXT NOT NULL, "
+            "data BLOB NOT NULL)")
+        self._conn.execute("CREATE INDEX fires_id_idx ON fires (id)")
+        self._conn.execute(
+            "CREATE UNIQUE INDEX fires_private_id_idx ON fires (private_id)")
+        self._conn.commit()
+
+        # fires in memory, keyed by private id
+        self._live = weakref.WeakValueDictionary()
+        # number of active iterations each fire is paged in by, keyed by
+        # private id
+        self._paging = Counter()
+        # fires looked up or changed outside of an iteration, keyed by
+        # private id, held until they're written back
+        self._held = OrderedDict()
+
+        self._ref = weakref.ref(self)
+        self._finalizer = weakref.finalize(self, self._cleanup,
+            self._conn, self._filename)
+
+    @staticmethod
+    def _cleanup(conn, filename):
+        conn.close()
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def close(self):
+        self._finalizer()
+
+    ##
+    ## Mapping interface used by FiresManager
+    ##
+
+    def __contains__(self, fire_id):
+        return self._conn.execute("SELECT 1 FROM fires WHERE id = ? LIMIT 1",
+            (fire_id,)).fetchone() is not None
+
+    def __getitem__(self, fire_id):
+        fires = self.get(fire_id)
+        if fires is None:
+            raise KeyError(fire_id)
+        return fires
+
+    def get(self, fire_id, default=None):
+        rows = self._conn.execute("SELECT private_id, data FROM fires "
+            "WHERE id = ? ORDER BY seq", (fire_id,)).fetchall()
+        if not rows:
+            return default
+        return [self._hold(self._load(p_id, data)) for p_id, data in rows]
+
+    def __setitem__(self, fire_id, fires):
+        """Replaces the fires with the given id.
+
+        Fires that remain are updated in place, retaining their original
+        order, and new ones are appended.
+        """
+        private_ids = set([f._private_id for f in fires])
+        existing = set([r[0] for r in self._conn.execute(
+            "SELECT private_id FROM fires WHERE id = ?", (fire_id,))])
+        with self._conn:
+            for p_id in existing - private_ids:
+                self._delete(p_id)
+            for fire in fires:
+                if fire._private_id in existing:
+                    self._update(fire)
+                else:
+                    self._insert(fire)
+
+    def add_fires(self, fires):
+        """Appends fires, in a single transaction, returning the number
+        added
+
+        fires can be any iterable, including a generator, so that fires
+        can be streamed into the store without all being in memory at once.
+        """
+        with self._conn:
+            return self._conn.executemany(
+                "INSERT INTO fires (id, private_id, data) VALUES (?, ?, ?)",
+                ((fire.id, fire._private_id, self._dumps(fire))
+                    for fire in fires)).rowcount
+
+    def pop(self, fire_id, *args):
+        fires = self.get(fire_id)
+        if fires is None:
+            if args:
+                return args[0]
+            raise KeyError(fire_id)
+        with self._conn:
+            self._conn.execute("DELETE FROM fires WHERE id = ?", (fire_id,))
+        for fire in fires:
+            self._forget(fire._private_id)
+        return fires
+
+    def keys(self):
+        return [r[0] for r in self._conn.execute(
+            "SELECT id FROM fires GROUP BY id ORDER BY MIN(seq)")]
+
+    def values(self):
+        """Returns lists of fires grouped by id, as OrderedDict.values would
+
+        Note that this loads all fires into memory. Use 'paged_fires' to
+        iterate through fires without doing so.
+        """
+        return [self.get(fire_id) for fire_id in self.keys()]
+
+    def __len__(self):
+        return self._conn.execute(
+            "SELECT COUNT(DISTINCT id) FROM fires").fetchone()[0]
+
+    ##
+    ## Paging
+    ##
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @property
+    def num_fires(self):
+        return self._conn.execute("SELECT COUNT(*) FROM fires").fetchone()[0]
+
+    def paged_fires(self):
+        return PagedFires(self)
+
+    def _get_range(self, offset, limit):
+        """Returns up to 'limit' fires, starting at 'offset', in the order
+        of iteration, loading only those fires
+        """
+        rows = self._conn.execute("SELECT private_id, data FROM fires "
+            "ORDER BY seq LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+        return [self._hold(self._load(p_id, data)) for p_id, data in rows]
+
+    def _iter_batches(self):
+        self._write_back_held()
+        last_seq = 0
+        while True:
+            rows = self._conn.execute("SELECT seq, private_id, data "
+                "FROM fires WHERE seq > ? ORDER BY seq LIMIT ?",
+                (last_seq, self._batch_size)).fetchall()
+            if not rows:
+                break
+
+            last_seq = rows[-1][0]
+            batch = [self._load(p_id, data) for seq, p_id, data in rows]
+            self._paging.update([fire._private_id for fire in batch])
+            try:
+                yield batch
+            finally:
+                # write back whatever the modules changed, in a single
+                # transaction, even if iteration was aborted
+                self._paging.subtract([fire._private_id for fire in batch])
+                self._paging = +self._paging
+                self._update_many(batch)
+
+    def _changed(self, fire):
+        """Called when a fire in memory, or data in it, is changed
+
+        Fires changed while being paged through are written back at the
+        end of the batch.  Others are held until written back.
+        """
+        if self._finalizer.alive:
+            self._hold(fire)
+
+    ##
+    ## Helpers
+    ##
+
+    def _insert(self, fire):
+        self._conn.execute(
+            "INSERT INTO fires (id, private_id, data) VALUES (?, ?, ?)",
+            (fire.id, fire._private_id, self._dumps(fire)))
+
+    def _update(self, fire):
+        # Note: fires removed from the store mid iteration won't match
+        #   any row, and so won't be written back
+        self._conn.execute("UPDATE fires SET data = ? WHERE private_id = ?",
+            (self._dumps(fire), fire._private_id))
+
+    def _update_many(self, fires):
+        with self._conn:
+            for fire in fires:
+                self._update(fire)
+
+    def _delete(self, private_id):
+        self._conn.execute("DELETE FROM fires WHERE private_id = ?",
+            (private_id,))
+        self._forget(private_id)
+
+    def _load(self, private_id, data):
+        """Returns the fire, reusing the object in memory, if there is
+        one, so that there's only one copy of each fire being modified
+        """
+        fire = self._live.get(private_id)
+        if fire is None:
+            fire = pickle.loads(data)
+            # so that changes to the fire, its activity collections and
+            # active areas, and their locations are reported to the store,
+            # and so that the fire stays in memory as long as any of them do
+            fire._store = self._ref
+            for ac in fire.get('activity', []):
+                if isinstance(ac, FireData):
+                    ac._fire = fire
+                for aa in ac.get('active_areas', []):
+                    if isinstance(aa, FireData):
+                        aa._fire = fire
+            self._live[private_id] = fire
+        return fire
+
+    def _hold(self, fire):
+        """Holds a fire looked up, or changed, outside of an iteration,
+        so that it's written back
+        """
+        if fire._private_id not in self._paging:
+            if len(self._held) >= self._batch_size:
+                self._write_back_held()
+            self._held[fire._private_id] = fire
+        return fire
+
+    def _write_back_held(self):
+        if self._held:
+            fires = list(self._held.values())
+            self._held.clear()
+            self._update_many(fires)
+
+    def _forget(self, private_id):
+        self._live.pop(private_id, None)
+        self._held.pop(private_id, None)
+
+    def _dumps(self, fire):
+        return pickle.dumps(fire, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class PagedFires(object):
+    """Sequence-like view of the fires in a SqliteFiresStore
+
+    Supports what the modules do with FiresManager.fires - iterating,
+    checking length and truthiness, indexing, and comparing - without
+    loading all fires into memory at once.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __iter__(self):
+        for batch in self._store._iter_batches():
+            for fire in batch:
+                yield fire
+
+    def __len__(self):
+        return self._store.num_fires
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, idx):
+        """Returns the fire at idx, or list of fires if idx is a slice,
+        querying for just those fires
+        """
+        num_fires = len(self)
+        if isinstance(idx, slice):
+            idxs = range(*idx.indices(num_fires))
+            if not idxs:
+                return []
+            start = min(idxs)
+            fires = self._store._get_range(start, max(idxs) - start + 1)
+            return [fires[i - start] for i in idxs]
+
+        if idx < 0:
+            idx += num_fires
+        if not 0 <= idx < num_fires:
+            raise IndexError("fire index out of range")
+        return self._store._get_range(idx, 1)[0]
+
+    def __add__(self, other):
+        # returns an iterator, rather than a list, so that the fires
+        # aren't all loaded into memory at once
+        return itertools.chain(self, other)
+
+    def __eq__(self, other):
+        # compares one fire at a time
+        try:
+            if len(self) != len(other):
+                return False
+        except TypeError:
+            return NotImplemented
+        return all(a == b for a, b in zip(self, other))
@@ -0,0 +1,277 @@
+"""bluesky.models.validation
+
+Validates fire input data once, up front, over all fires, rather than
+having each module recheck it for every location.
+
+The fire schema, below, is compiled once into a single validation
+function. Numeric specified point values (lat, lng, area) are cast to
+float with numpy, a fire at a time, and range checked together, over all
+fires.
+
+As in ActiveArea.locations, required values that are falsy - e.g. lat or
+lng of 0 - are treated as missing.
+"""
+
+__author__ = "Joel Dubowy"
+
+import logging
+
+import numpy
+
+from bluesky import datetimeutils
+
+from .activity import ActiveArea, INVALID_LOCATION_MSGS
+
+__all__ = [
+    'validate_fires'
+]
+
+MISSING_ACTIVITY_MSG = "Each fire must have 'activity' defined"
+MISSING_ACTIVE_AREAS_MSG = "Each activity collection must have 'active_areas' defined"
+INVALID_DATETIME_MSG = "Invalid active area '{}': {}"
+START_AFTER_END_MSG = "Active area 'start' must be before 'end'"
+INVALID_UTC_OFFSET_MSG = "Invalid active area 'utc_offset': {}"
+INVALID_NUMBER_MSG = "Invalid specified point '{}': {}"
+OUT_OF_RANGE_MSG = "Specified point '{}' out of range: {}"
+INVALID_PERIMETER_AREA_MSG = "Invalid perimeter 'area': {}"
+
+
+##
+## Schema
+##
+## Each node may specify:
+##  - 'required' -- error message if value is missing or empty
+##  - 'check' -- function, returning list of error messages, called on value
+##  - 'fields' -- dict of child field name to child node
+##  - 'items' -- node applied to each element of list value
+##  - 'one_of' -- list of field names, at least one of which must be defined,
+##      along with error message
+##
+
+def _check_datetime(key):
+    def f(val):
+        try:
+            datetimeutils.parse_datetime(val, key)
+            return []
+        except Exception:
+            return [INVALID_DATETIME_MSG.format(key, val)]
+    return f
+
+def _check_utc_offset(val):
+    try:
+        datetimeutils.parse_utc_offset(val)
+        return []
+    except Exception:
+        return [INVALID_UTC_OFFSET_MSG.format(val)]
+
+def _check_start_before_end(aa):
+    if aa.get('start') and aa.get('end'):
+        try:
+            if (datetimeutils.parse_datetime(aa['start'], 'start')
+                    >= datetimeutils.parse_datetime(aa['end'], 'end')):
+                return [START_AFTER_END_MSG]
+        except Exception:
+            # invalid datetimes are caught by _check_datetime
+            pass
+    return []
+
+SPECIFIED_POINT_NUMERIC_FIELDS = ('lat', 'lng', 'area')
+
+OUT_OF_RANGE = {
+    'lat': lambda a: (a < -90) | (a > 90),
+    'lng': lambda a: (a < -180) | (a > 180),
+    'area': lambda a: a <= 0
+}
+
+FIRE_SCHEMA = {
+    'fields': {
+        'activity': {
+            'required': MISSING_ACTIVITY_MSG,
+            'items': {
+                'fields': {
+                    'active_areas': {
+                        'required': MISSING_ACTIVE_AREAS_MSG,
+                        'items': {
+                            'one_of': (['specified_points', 'perimeter'],
+                                ActiveArea.MISSING_LOCATION_INFO_MSG),
+                            'check': _check_start_before_end,
+                            'fields': {
+                                'start': {'check': _check_datetime('start')},
+                                'end': {'check': _check_datetime('end')},
+                                'utc_offset': {'check': _check_utc_offset},
+                                # specified point lat, lng, and area are
+                                # checked separately, with numpy
+                                'specified_points': {
+                                    'items': {
+                                        'fields': {
+                                            k: {'required': INVALID_LOCATION_MSGS['specified_points']}
+                                            for k in SPECIFIED_POINT_NUMERIC_FIELDS
+                                        }
+                                    }
+                                },
+                                'perimeter': {
+                                    'fields': {
+                                        'polygon': {'required': INVALID_LOCATION_MSGS['perimeter']}
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+##
+## Compiling
+##
+
+def _is_empty(val):
+    # matches ActiveArea.locations' `not p.get(f)`, which rejects 0
+    return not val
+
+def _compile(node):
+    """Returns function that validates a value against the schema node,
+    appending error messages to the given list
+    """
+    steps = []
+
+    if 'one_of' in node:
+        keys, msg = node['one_of']
+        def one_of(val, errors):
+            if all([_is_empty(val.get(k)) for k in keys]):
+                errors.append(msg)
+        steps.append(one_of)
+
+    if 'check' in node:
+        check = node['check']
+        steps.append(lambda val, errors: errors.extend(check(val)))
+
+    for key, child in node.get('fields', {}).items():
+        steps.append(_compile_field(key, child))
+
+    if 'items' in node:
+        validate_item = _compile(node['items'])
+        def items(val, errors):
+            if not isinstance(val, list):
+                errors.append("Expected list: {}".format(val))
+                return
+            for item in val:
+                validate_item(item, errors)
+        steps.append(items)
+
+    def validate(val, errors):
+        for step in steps:
+            step(val, errors)
+    return validate
+
+def _compile_field(key, node):
+    validate_value = _compile(node)
+    required = node.get('required')
+    def validate(val, errors):
+        if not hasattr(val, 'get'):
+            errors.append("Expected object: {}".format(val))
+            return
+        v = val.get(key)
+        if _is_empty(v):
+            if required:
+                errors.append(required)
+        else:
+            validate_value(v, errors)
+    return validate
+
+_validate_fire = _compile(FIRE_SCHEMA)
+
+
+##
+## Validating
+##
+
+def validate_fires(fires):
+    """Validates all fires, returning dict of fire private id to list of
+    error messages, for fires with errors.
+
+    Active areas that pass validation are flagged so that
+    ActiveArea.locations doesn't recheck them.  Specified point and
+    perimeter string values are cast to float.
+    """
+    errors = {}
+    # numeric specified point values, and whether they're numbers at all,
+    # collected across all fires
+    fire_ids = []
+    values = {k: [] for k in SPECIFIED_POINT_NUMERIC_FIELDS}
+    not_numbers = {k: [] for k in SPECIFIED_POINT_NUMERIC_FIELDS}
+
+    for fire in fires:
+        fire_errors = []
+        _validate_fire(fire, fire_errors)
+
+        if not fire_errors:
+            points = [p for aa in fire.active_areas
+                for p in aa.get('specified_points') or []]
+            for k in SPECIFIED_POINT_NUMERIC_FIELDS:
+                raw = [p[k] for p in points]
+                cast, invalid = _to_floats(raw)
+                for i in numpy.flatnonzero(invalid):
+                    fire_errors.append(INVALID_NUMBER_MSG.format(k, raw[i]))
+                # cast values that aren't already floats, e.g. strings
+                not_floats = numpy.fromiter(
+                    (type(v) is not float for v in raw), bool, len(raw))
+                for i in numpy.flatnonzero(not_floats & ~invalid):
+                    points[i][k] = float(cast[i])
+                values[k].append(cast)
+                not_numbers[k].append(invalid)
+            fire_ids.extend([fire._private_id] * len(points))
+
+            for aa in fire.active_areas:
+                perimeter = aa.get('perimeter')
+                if perimeter and perimeter.get('area'):
+                    try:
+                        perimeter['area'] = float(perimeter['area'])
+                    except (TypeError, ValueError):
+                        fire_errors.append(INVALID_PERIMETER_AREA_MSG.format(
+                            perimeter['area']))
+                # flagged here, since fires failing the numeric checks,
+                # below, will be moved to failed_fires anyway
+                aa._validated = True
+
+        if fire_errors:
+            errors[fire._private_id] = fire_errors
+
+    if fire_ids:
+        fire_ids = numpy.array(fire_ids)
+        for k in SPECIFIED_POINT_NUMERIC_FIELDS:
+            a = numpy.concatenate(values[k])
+            # values that aren't numbers were recorded as errors, above
+            out_of_range = ~numpy.concatenate(not_numbers[k]) & (
+                OUT_OF_RANGE[k](a) | ~numpy.isfinite(a))
+            for i in numpy.flatnonzero(out_of_range):
+                errors.setdefault(fire_ids[i], []).append(
+                    OUT_OF_RANGE_MSG.format(k, a[i]))
+
+    logging.debug("%s fires failed validation", len(errors))
+    return errors
+
+def _to_floats(raw):
+    """Casts values to float array, returning it along with boolean array
+    flagging values that aren't numbers (set to nan in the first)
+    """
+    not_numbers = numpy.zeros(len(raw), dtype=bool)
+    try:
+        values = numpy.array(raw, dtype=float)
+        # lists of numbers would be cast to a 2-d array
+        if values.ndim == 1:
+            return values, not_numbers
+    except (TypeError, ValueError):
+        pass
+
+    # cast one by one, to find the values that aren't numbers
+    values = numpy.full(len(raw), numpy.nan)
+    for i, v in enumerate(raw):
+        try:
+            values[i] = float(v)
+        except (TypeError, ValueError):
+            not_numbers[i] = True
+    return values, not_numbers
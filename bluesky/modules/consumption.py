@@ -2,15 +2,20 @@
 
 __author__ = "Joel Dubowy"
 
+import copy
 import itertools
+import json
 import logging
+from collections import OrderedDict, defaultdict
 
 import consume
 
 from bluesky.config import Config
 from bluesky import datautils, datetimeutils
+from bluesky.consumetables import ConsumeTable
 from bluesky.consumeutils import (
-    _apply_settings, FuelLoadingsManager, CONSUME_VERSION_STR
+    _apply_settings, _get_settings, FuelLoadingsManager,
+    PerAcreConsumptionCache, CONSUME_VERSION_STR
 )
 from bluesky import exceptions
 from bluesky.locationutils import LatLng
@@ -33,8 +38,9 @@ def run(fires_manager):
     #   $ pip3 freeze |grep consume
     #  or
     #   $ pip3 show apps-consume4|grep "^Version:"
-    fires_manager.processed(__name__, __version__,
-        consume_version=CONSUME_VERSION_STR)
+    processed_kwargs = {
+        "consume_version": CONSUME_VERSION_STR
+    }
 
     # TODO: get msg_level and burn_type from fires_manager's config
     msg_level = 2  # 1 => fewest messages; 3 => most messages
@@ -42,30 +48,56 @@ def run(fires_manager):
     all_fuel_loadings = Config().get('consumption', 'fuel_loadings')
     fuel_loadings_manager = FuelLoadingsManager(all_fuel_loadings=all_fuel_loadings)
 
-    _validate_input(fires_manager)
+    cache = None
+    if (Config().get('consumption', 'cache_per_acre')
+            or Config().get('consumption', 'cache_dir')):
+        cache = PerAcreConsumptionCache(
+            cache_dir=Config().get('consumption', 'cache_dir'))
 
-    # TODO: can I safely instantiate one FuelConsumption object and
-    # use it across all fires, or at lesat accross all fuelbeds within
-    # a single fire?
-    for fire in fires_manager.fires:
-        with fires_manager.fire_failure_handler(fire):
-            _run_fire(fire, fuel_loadings_manager, msg_level)
+    table = None
+    if Config().get('consumption', 'table_file'):
+        table = ConsumeTable(Config().get('consumption', 'table_file'))
+
+    try:
+        _validate_input(fires_manager)
 
-    datautils.summarize_all_levels(fires_manager, 'consumption')
-    datautils.summarize_all_levels(fires_manager, 'heat')
+        if Config().get('consumption', 'batch_fuelbeds'):
+            _run_batched(fires_manager, fuel_loadings_manager, msg_level,
+                cache, table)
 
-def _run_fire(fire, fuel_loadings_manager, msg_level):
+        else:
+            for fire in fires_manager.fires:
+                with fires_manager.fire_failure_handler(fire):
+                    _run_fire(fire, fuel_loadings_manager, msg_level, cache,
+                        table)
+
+    finally:
+        if cache:
+            cache.close()
+            processed_kwargs.update(per_acre_cache=cache.stats)
+        if table:
+            processed_kwargs.update(table=table.stats)
+        fires_manager.processed(__name__, __version__, **processed_kwargs)
+
+    datautils.summarize_all_levels(fires_manager, 'consumption', 'heat')
+
+def _run_fire(fire, fuel_loadings_manager, msg_level, cache=None,
+        table=None):
     logging.debug("Consume consumption - fire {}".format(fire.id))
 
+    for fb, loc, season, burn_type in _get_fuelbeds(fire):
+        _run_fuelbed(fb, loc, fuel_loadings_manager, season,
+            burn_type, msg_level, cache, table)
+
+def _get_fuelbeds(fire):
+    """Generates (fuelbed, location, season, burn type) for each of the
+    fire's fuelbeds
+    """
     # TODO: set burn type to 'activity' if fire.fuel_type == 'piles' ?
     if fire.fuel_type == 'piles':
         raise ValueError("Consume can't be used for fuel type 'piles'")
     burn_type = fire.fuel_type
 
-    # TODO: can I run consume on all fuelbeds at once and get per-fuelbed
-    # results?  If it is simply a matter of parsing separated values from
-    # the results, make sure that running all at once produces any performance
-    # gain; if it doesn't,then it might not be worth the trouble
     for ac in fire['activity']:
         for aa in ac.active_areas:
             if not aa.get('start'):
@@ -75,11 +107,203 @@ def _run_fire(fire, fuel_loadings_manager, msg_level):
             season = datetimeutils.season_from_date(aa.get('start'))
             for loc in aa.locations:
                 for fb in loc['fuelbeds']:
+                    yield fb, loc, season, burn_type
+
+def _run_batched(fires_manager, fuel_loadings_manager, msg_level,
+        cache=None, table=None):
+    """Runs consume once for each group of fuelbeds, across all fires,
+    that share burn type, fuel loadings, and location settings (moisture,
+    slope, etc.), rather than once per fuelbed.
+
+    Fuelbeds are gathered in one pass through the fires, and the results
+    are set on them in a second pass, so that they're saved by the sqlite
+    fires store.  If consume fails for a group, its fuelbeds are run
+    individually in the second pass, so that only the fires with
+    problematic fuelbeds fail.
+    """
+    groups = defaultdict(list)
+    for fire in fires_manager.fires:
+        with fires_manager.fire_failure_handler(fire):
+            logging.debug("Consume consumption - fire {}".format(fire.id))
+            # gather the fire's fuelbeds before adding any to the groups,
+            # in case the fire fails
+            fire_groups = defaultdict(list)
+            for i, (fb, loc, season, burn_type) in enumerate(
+                    _get_fuelbeds(fire)):
+                if _set_from_table(table, fb, loc, season, burn_type,
+                        fuel_loadings_manager):
+                    continue
+
+                if cache:
+                    per_acre = cache.get(_get_cache_key(cache, fb, loc,
+                        season, burn_type, fuel_loadings_manager))
+                    if per_acre:
+                        _set_per_acre_values(fb, loc, per_acre)
+                        continue
+
+                fccs_file = fuel_loadings_manager.generate_custom_csv(
+                    fb['fccs_id'])
+                key = (burn_type, fccs_file,
+                    _get_settings_key(loc, burn_type))
+                fire_groups[key].append(((fire._private_id, i), fb, loc,
+                    season))
+            for key, rows in fire_groups.items():
+                groups[key].extend(rows)
+
+    # per acre values, or None if the fuelbed is to be run individually,
+    # keyed by fire private id and then by fuelbed index
+    results = defaultdict(dict)
+    for (burn_type, fccs_file, _), rows in groups.items():
+        logging.debug("Running consume on %s fuelbeds", len(rows))
+        try:
+            per_acre = _run_fuelbeds(rows, fuel_loadings_manager, fccs_file,
+                burn_type, cache)
+        except Exception as e:
+            logging.debug("Failed to run consume on %s fuelbeds (%s). "
+                "Running them individually", len(rows), e)
+            per_acre = [None] * len(rows)
+        for ((fire_id, i), _, _, _), v in zip(rows, per_acre):
+            results[fire_id][i] = v
+
+    def _apply(fire, fire_results):
+        for i, (fb, loc, season, burn_type) in enumerate(_get_fuelbeds(fire)):
+            if i in fire_results:
+                if fire_results[i] is not None:
+                    _set_per_acre_values(fb, loc, fire_results[i])
+                else:
                     _run_fuelbed(fb, loc, fuel_loadings_manager, season,
-                        burn_type, msg_level)
+                        burn_type, msg_level, cache)
+
+    fires_manager.apply_by_fire(results, _apply)
+
+def _get_settings_key(location, burn_type):
+    return json.dumps(_get_settings(location, burn_type), sort_keys=True,
+        default=str)
+
+def _run_fuelbeds(rows, fuel_loadings_manager, fccs_file, burn_type,
+        cache=None):
+    """Runs consume on multiple fuelbeds at once, returning the per acre
+    values for each row, to be set with _set_per_acre_values.
+
+    Args:
+     - rows -- list of (key, fuelbed, location, season) tuples, all
+        sharing the same location settings
+
+    If a cache is specified, consume is run only once for each set of
+    rows with the same cache key.
+    """
+    keys = [_get_cache_key(cache, fb, loc, season, burn_type,
+            fuel_loadings_manager) if cache else i
+        for i, (_, fb, loc, season) in enumerate(rows)]
+    unique_rows = OrderedDict()
+    for key, row in zip(keys, rows):
+        unique_rows.setdefault(key, row)
+    unique_keys = list(unique_rows.keys())
+    unique_rows = list(unique_rows.values())
+
+    fc = consume.FuelConsumption(fccs_file=fccs_file)
+
+    fc.burn_type = burn_type
+    fc.fuelbed_fccs_ids = [fb['fccs_id'] for _, fb, _, _ in unique_rows]
+    fc.season = [season for _, _, _, season in unique_rows]
+    # See note about area in _run_fuelbed
+    fc.fuelbed_area_acres = [1] * len(unique_rows)
+    fc.fuelbed_ecoregion = [loc['ecoregion'] for _, _, loc, _ in unique_rows]
+
+    # settings are the same for all rows
+    _apply_settings(fc, unique_rows[0][2], burn_type)
+    _results = fc.results()
+    if not _results:
+        raise RuntimeError("Failed to calculate consumption for "
+            "fuelbeds {}".format(fc.fuelbed_fccs_ids))
+
+    _results['consumption'].pop('debug', None)
+    fuel_loadings = {}
+    per_acre = {}
+    for i, (key, (_, fb, _, _)) in enumerate(zip(unique_keys, unique_rows)):
+        if fb['fccs_id'] not in fuel_loadings:
+            fuel_loadings[fb['fccs_id']] = fuel_loadings_manager.get_fuel_loadings(
+                fb['fccs_id'], fc.FCCS)
+        per_acre[key] = {
+            "fuel_loadings": fuel_loadings[fb['fccs_id']],
+            "consumption": _get_row(_results['consumption'], i,
+                len(unique_rows)),
+            "heat": _get_row(_results['heat release'], i, len(unique_rows)),
+            "scale": fc.output_units == 'tons_ac'
+        }
+        if cache:
+            cache.set(key, per_acre[key])
+
+    return [per_acre[key] for key in keys]
+
+def _get_cache_key(cache, fb, location, season, burn_type,
+        fuel_loadings_manager):
+    return cache.get_key(fb['fccs_id'],
+        fuel_loadings_manager.get_custom_fuel_loadings(fb['fccs_id']),
+        location['ecoregion'], season, burn_type,
+        _get_settings_key(location, burn_type))
+
+def _set_from_table(table, fb, location, season, burn_type,
+        fuel_loadings_manager):
+    """Sets fuelbed's values from per-acre values interpolated from the
+    consumption table, returning False if the table doesn't cover the
+    fuelbed's inputs
+    """
+    # tables are built with consume's built-in fuel loadings
+    if (not table or fuel_loadings_manager.get_custom_fuel_loadings(
+            fb['fccs_id'])):
+        return False
+
+    values = table.look_up(fb['fccs_id'], location, season, burn_type)
+    if not values:
+        return False
+
+    _set_per_acre_values(fb, location, {
+        "fuel_loadings": fuel_loadings_manager.get_fuel_loadings(
+            fb['fccs_id']),
+        "consumption": values['consumption'],
+        "heat": values['heat'],
+        "scale": True
+    })
+    return True
+
+def _set_per_acre_values(fb, location, per_acre):
+    """Sets fuelbed's fuel loadings, consumption, and heat from per-acre
+    values, multiplying by the fuelbed's area if consume output was per acre
+    """
+    fb['fuel_loadings'] = per_acre['fuel_loadings']
+    fb['consumption'] = copy.deepcopy(per_acre['consumption'])
+    fb['heat'] = copy.deepcopy(per_acre['heat'])
+    if per_acre['scale']:
+        area = (fb['pct'] / 100.0) * location['area']
+        datautils.multiply_nested_data(fb["consumption"], area)
+        datautils.multiply_nested_data(fb["heat"], area)
+
+def _get_row(data, i, num_rows):
+    """Extracts the i'th row from nested consume results, keeping each
+    value as a single element array, as when consume is run on one fuelbed
+    """
+    if isinstance(data, dict):
+        return {k: _get_row(v, i, num_rows) for k, v in data.items()}
+    if len(data) != num_rows:
+        raise ValueError("Expected {} consume result rows; got {}".format(
+            num_rows, len(data)))
+    return data[i:i + 1].copy()
 
 def _run_fuelbed(fb, location, fuel_loadings_manager, season,
-        burn_type, msg_level):
+        burn_type, msg_level, cache=None, table=None):
+    if _set_from_table(table, fb, location, season, burn_type,
+            fuel_loadings_manager):
+        return
+
+    if cache:
+        key = _get_cache_key(cache, fb, location, season, burn_type,
+            fuel_loadings_manager)
+        per_acre = cache.get(key)
+        if per_acre:
+            _set_per_acre_values(fb, location, per_acre)
+            return
+
     fuel_loadings_csv_filename = fuel_loadings_manager.generate_custom_csv(
         fb['fccs_id'])
 
@@ -111,6 +335,14 @@ def _run_fuelbed(fb, location, fuel_loadings_manager, season,
         fb['consumption'].pop('debug', None)
         fb['heat'] = _results['heat release']
 
+        if cache:
+            cache.set(key, {
+                "fuel_loadings": fb['fuel_loadings'],
+                "consumption": copy.deepcopy(fb['consumption']),
+                "heat": copy.deepcopy(fb['heat']),
+                "scale": fc.output_units == 'tons_ac'
+            })
+
         # multiply each consumption and heat value by area if
         # output_inits is 'tons_ac',
         # TODO: multiple by area even if user sets output_units to 'tons',
@@ -140,13 +372,19 @@ VALIDATION_ERROR_MSGS = {
 }
 
 def _validate_input(fires_manager):
-    ecoregion_lookup = None # instantiate only if necessary
+    # locations missing ecoregion are collected, by fire, and looked up
+    # together once all fires are validated
+    missing_ecoregion = {}
     for fire in fires_manager.fires:
         with fires_manager.fire_failure_handler(fire):
             active_areas = fire.active_areas
             if not active_areas:
                 raise ValueError(VALIDATION_ERROR_MSGS['NO_ACTIVITY'])
 
+            # (index in fire.locations, LatLng) of each location
+            # missing ecoregion
+            fire_missing_ecoregion = []
+            loc_idx = 0
             for aa in active_areas:
                 locations = aa.locations
                 if not locations:
@@ -160,37 +398,93 @@ def _validate_input(fires_manager):
                     if not loc.get('area'):
                         raise ValueError(VALIDATION_ERROR_MSGS["AREA_UNDEFINED"])
 
-
                     if not loc.get('ecoregion'):
-                        # import EcoregionLookup here so that, if fires do have
-                        # ecoregion defined, consumption can be run without mapscript
-                        # and other dependencies installed
-                        try:
-                            latlng = LatLng(loc)
-                            if not ecoregion_lookup:
-                                from bluesky.ecoregion.lookup import EcoregionLookup
-                                implemenation = Config().get('consumption',
-                                    'ecoregion_lookup_implemenation')
-                                ecoregion_lookup = EcoregionLookup(implemenation)
-                            loc['ecoregion'] = ecoregion_lookup.lookup(
-                                latlng.latitude, latlng.longitude)
-                            if not loc['ecoregion']:
-                                logging.warning("Failed to look up ecoregion for "
-                                    "{}, {}".format(latlng.latitude, latlng.longitude))
-                                _use_default_ecoregion(fires_manager, loc)
-
-                        except exceptions.MissingDependencyError as e:
-                            _use_default_ecoregion(fires_manager, loc, e)
+                        fire_missing_ecoregion.append((loc_idx, LatLng(loc)))
 
                     for fb in loc['fuelbeds'] :
                         if not fb.get('fccs_id') or not fb.get('pct'):
                             raise ValueError("Each fuelbed must define 'fccs_id' and 'pct'")
+                    loc_idx += 1
+
+            if fire_missing_ecoregion:
+                missing_ecoregion[fire._private_id] = fire_missing_ecoregion
+
+    if missing_ecoregion:
+        _look_up_ecoregions(fires_manager, missing_ecoregion)
+
+def _look_up_ecoregions(fires_manager, missing_ecoregion):
+    """Looks up ecoregions of all locations missing them at once, and then
+    sets them in a second pass through the fires, so that they're saved
+    by the sqlite fires store
+
+    Args:
+     - missing_ecoregion -- lists of (location index, LatLng), keyed by
+        fire private id
+    """
+    ecoregions = {}
+    lookup_error = None
+    try:
+        ecoregion_lookup = _get_ecoregion_lookup()
+    except Exception as e:
+        # raised, below, for each fire, as if looked up individually
+        lookup_error = e
+
+    if not lookup_error:
+        # invalid lat/lng only fail the fires they belong to; their
+        # locations are left out of the lookup, and they're failed, below
+        points = []
+        for locs in missing_ecoregion.values():
+            try:
+                for loc_idx, latlng in locs:
+                    ecoregion_lookup.validate_lat_lng(
+                        latlng.latitude, latlng.longitude)
+            except Exception:
+                continue
+            points.extend([(latlng.latitude, latlng.longitude)
+                for loc_idx, latlng in locs])
+        try:
+            ecoregions = dict(zip(points, ecoregion_lookup.lookup_many(points)))
+        except Exception as e:
+            lookup_error = e
+
+    def _apply(fire, locs):
+        locations = fire.locations
+        if not lookup_error:
+            for loc_idx, latlng in locs:
+                ecoregion_lookup.validate_lat_lng(
+                    latlng.latitude, latlng.longitude)
+
+        for loc_idx, latlng in locs:
+            loc = locations[loc_idx]
+            if isinstance(lookup_error, exceptions.MissingDependencyError):
+                _use_default_ecoregion(fires_manager, loc, lookup_error)
+                continue
+            elif lookup_error:
+                raise lookup_error
+
+            loc['ecoregion'] = ecoregions[
+                (latlng.latitude, latlng.longitude)]
+            if not loc['ecoregion']:
+                logging.warning("Failed to look up ecoregion for "
+                    "{}, {}".format(latlng.latitude, latlng.longitude))
+                _use_default_ecoregion(fires_manager, loc)
+
+    fires_manager.apply_by_fire(missing_ecoregion, _apply)
+
+def _get_ecoregion_lookup():
+    # import EcoregionLookup here so that, if fires do have
+    # ecoregion defined, consumption can be run without mapscript
+    # and other dependencies installed
+    from bluesky.ecoregion.lookup import EcoregionLookup
+    implemenation = Config().get('consumption',
+        'ecoregion_lookup_implemenation')
+    return EcoregionLookup(implemenation)
 
 def _use_default_ecoregion(fires_manager, loc, exc=None):
     default_ecoregion = Config().get('consumption', 'default_ecoregion')
     if default_ecoregion:
         logging.debug('Using default ecoregion %s', default_ecoregion)
-        loc['location']['ecoregion'] = default_ecoregion
+        loc['ecoregion'] = default_ecoregion
     else:
         logging.debug('No default ecoregion')
         if exc:
@@ -4,8 +4,11 @@ __author__ = "Joel Dubowy"
 
 import abc
 import copy
+from collections import defaultdict
+import functools
 import itertools
 import logging
+import math
 import sys
 import os
 
@@ -15,17 +18,20 @@ from emitcalc.calculator import EmissionsCalculator
 from eflookup import __version__ as eflookup_version
 from eflookup.fccs2ef.lookup import Fccs2Ef
 from eflookup.fepsef import FepsEFLookup
-from pyairfire import osutils
 
-from bluesky import datautils, datetimeutils
+from bluesky import (
+    datautils, datetimeutils, emissionsdetails, emissionsmatrix, fepsengine
+)
 from bluesky.config import Config
+from bluesky.consumetables import ConsumeTable
 from bluesky.exceptions import BlueSkyConfigurationError
-from bluesky.io import capture_stdout
+from bluesky.io import capture_thread_stdout
 from bluesky.emitters.ubcbsffeps import UbcBsfFEPSEmissions
+from bluesky.workerpool import feps_worker_pool
 
 from bluesky.consumeutils import (
     _apply_settings, FuelLoadingsManager, FuelConsumptionForEmissions,
-    CONSUME_FIELDS, CONSUME_VERSION_STR
+    StoredFuelConsumptionForEmissions, CONSUME_FIELDS, CONSUME_VERSION_STR
 )
 
 __all__ = [
@@ -45,7 +51,18 @@ def run(fires_manager):
      - emissions > species -- whitelist of species to compute emissions for
      - emissions > include_emissions_details -- whether or not to include
         emissions per fuel category per phase, as opposed to just per phase
+     - emissions > compact_emissions_details -- whether or not to store
+        emissions details as (species x phase) arrays, indexed by species
+        and phase lists in the summary; see bluesky.emissionsdetails
      - emissions > fuel_loadings --
+     - emissions > table_file -- table of per-acre emissions, built by
+        bsp-build-tables
+     - emissions > reuse_consumption -- whether or not consume emissions
+        should use the consumption and heat stored on each fuelbed, rather
+        than recompute them
+     - emissions > vectorized -- whether or not to compute FEPS and
+        Prichard / O'Neill emissions for all fuelbeds at once, with matrix
+        products, rather than per fuelbed
      - consumption > fuel_loadings -- considered if fuel loadings aren't
         specified in the emissions config
     """
@@ -53,45 +70,73 @@ def run(fires_manager):
 
     include_emissions_details = Config().get(
         'emissions', 'include_emissions_details')
-    fires_manager.processed(__name__, __version__, model=model,
+    details_index = None
+    processed_kwargs = dict(model=model,
         emitcalc_version=emitcalc_version, eflookup_version=eflookup_version,
         consume_version=CONSUME_VERSION_STR)
 
     try:
-        klass_name = ''.join([e.capitalize() for e in model.split('-')])
-        klass = getattr(sys.modules[__name__], klass_name)
-        e = klass(fires_manager.fire_failure_handler)
-    except AttributeError:
-        msg = "Invalid emissions model: '{}'.".format(model)
-        if model == 'urbanski':
-            msg += " The urbanski model has be replaced by prichard-oneill"
-        raise BlueSkyConfigurationError(msg)
-
-    e.run(fires_manager.fires)
-
-    # fix keys
+        try:
+            klass_name = ''.join([e.capitalize() for e in model.split('-')])
+            klass = getattr(sys.modules[__name__], klass_name)
+            e = klass(fires_manager.fire_failure_handler)
+        except AttributeError:
+            msg = "Invalid emissions model: '{}'.".format(model)
+            if model == 'urbanski':
+                msg += " The urbanski model has be replaced by prichard-oneill"
+            raise BlueSkyConfigurationError(msg)
+
+        details_index = e.details_index
+        try:
+            e.run(fires_manager.fires)
+        finally:
+            if e.table:
+                processed_kwargs.update(table=e.table.stats)
+            if e.calculators:
+                processed_kwargs.update(calculator_cache=e.calculators.stats)
+
+    finally:
+        fires_manager.processed(__name__, __version__, **processed_kwargs)
+
+    # fix keys; compact details' species names are fixed in the index,
+    # and compact details are padded to include all species in the index
+    if details_index:
+        details_index.rename_species(_fix_key)
+    all_compact_details = []
     for fire in fires_manager.fires:
         with fires_manager.fire_failure_handler(fire):
             for aa in fire.active_areas:
                 for loc in aa.locations:
                     for fb in loc['fuelbeds']:
                         _fix_keys(fb['emissions'])
-                        if include_emissions_details:
+                        if details_index:
+                            emissionsdetails.pad(fb['emissions_details'],
+                                len(details_index.species))
+                            all_compact_details.append(fb['emissions_details'])
+                        elif include_emissions_details:
                             _fix_keys(fb['emissions_details'])
 
     datautils.summarize_all_levels(fires_manager, 'emissions')
-    if include_emissions_details:
+    if details_index:
+        fires_manager.summarize(emissions_details=dict(details_index.to_dict(),
+            summary=emissionsdetails.summarize(all_compact_details)))
+    elif include_emissions_details:
         datautils.summarize_over_all_fires(fires_manager, 'emissions_details')
 
 
+def _fix_key(k):
+    # in case someone spcifies custom EF's with 'PM25'
+    if k == 'PM25':
+        return 'PM2.5'
+    # Total non-methane VOCs
+    if k == 'NMOC':
+        return 'VOC'
+    return k
+
 def _fix_keys(emissions):
-    for k in emissions:
-        # in case someone spcifies custom EF's with 'PM25'
-        if k == 'PM25':
-            emissions['PM2.5'] = emissions.pop('PM25')
-        elif k == 'NMOC':
-            # Total non-methane VOCs
-            emissions['VOC'] = emissions.pop('NMOC')
+    for k in list(emissions):
+        if _fix_key(k) != k:
+            emissions[_fix_key(k)] = emissions.pop(k)
         elif isinstance(emissions[k], dict):
             _fix_keys(emissions[k])
 
@@ -107,11 +152,75 @@ class EmissionsBase(object, metaclass=abc.ABCMeta):
         self.include_emissions_details = Config().get(
             'emissions', 'include_emissions_details')
         self.species = Config().get('emissions', 'species')
+        self.table = self._load_table()
+        # set by models using emitcalc; see EmissionsCalculatorBase
+        self.calculators = None
+        # shared by all fuelbeds' compact emissions details
+        self.details_index = (emissionsdetails.DetailsIndex()
+            if self.include_emissions_details and Config().get(
+                'emissions', 'compact_emissions_details')
+            else None)
 
     @abc.abstractmethod
     def run(self, fires):
         pass
 
+    def _load_table(self):
+        table_file = Config().get('emissions', 'table_file')
+        if not table_file:
+            return None
+
+        table = ConsumeTable(table_file)
+        model = Config().get('emissions', 'model').lower()
+        if table.metadata.get('emissions_model') != model:
+            logging.warning("Emissions table %s was not built for emissions "
+                "model %s. Not using it.", table_file, model)
+            return None
+        if self.include_emissions_details:
+            logging.warning("Emissions table can't be used when including "
+                "emissions details. Not using it.")
+            return None
+        return table
+
+    def _compact_details(self, fb):
+        if self.details_index:
+            fb['emissions_details'] = emissionsdetails.compact(
+                fb['emissions_details'], self.details_index)
+
+    def _set_from_table(self, fire, active_area, loc, fb):
+        """Sets fuelbed's emissions from per-acre emissions interpolated from
+        the emissions table, returning False if the table doesn't cover
+        the fuelbed's inputs
+
+        Table values are only used if the fuelbed's consumption matches
+        that in the table, i.e. if consumption was itself computed from
+        the table, so that emissions are consistent with consumption.
+        """
+        if not self.table or not fb.get('fccs_id'):
+            return False
+
+        values = self.table.look_up(fb['fccs_id'], loc,
+            datetimeutils.season_from_date(active_area.get('start')),
+            fire.fuel_type, is_rx=(fire.get('type') == 'rx'))
+        if not values or not values.get('emissions'):
+            return False
+
+        area = (fb['pct'] / 100.0) * loc['area']
+        try:
+            total_consumption = fb['consumption']['summary']['total']['total'][0]
+        except (KeyError, IndexError, TypeError):
+            return False
+        if not math.isclose(total_consumption, area *
+                values['consumption']['summary']['total']['total'][0],
+                rel_tol=1e-6):
+            return False
+
+        fb['emissions'] = {p: {s: [v * area for v in vals]
+                for s, vals in d.items()
+                if not self.species or s in self.species}
+            for p, d in values['emissions'].items()}
+        return True
+
 ##
 ## FEPS for Canadian Smartfire
 ##
@@ -124,67 +233,200 @@ class UbcBsfFeps(EmissionsBase):
         model = Config().get('emissions', 'model').lower()
         config = Config().get('emissions', model)
         self.emitter = UbcBsfFEPSEmissions(**config)
+        # feps species to compute emissions for; feps_emissions computes
+        # them all, so they're filtered after running it
+        self.feps_species = None
+        if self.species:
+            species = set(_fix_key(e) for e in self.species)
+            self.feps_species = [s for s in fepsengine.EMISSIONS_SPECIES
+                if _fix_key(s) in species]
 
     def run(self, fires):
         logging.info("Running emissions module UbcBsfFeps EFs")
 
+        # validate all fires up front, and then compute emissions for all
+        # locations at once, in process, or by running feps_emissions
+        # with a pool of workers
+        fire_locations = []
         for fire in fires:
             with self.fire_failure_handler(fire):
-                self._run_on_fire(fire)
-
-    def _get_fire_working_dir(self, fire, working_dir):
-        fire_working_dir = os.path.join(working_dir,
-            "feps-emissions-{}".format(fire.id))
-        if not os.path.exists(fire_working_dir):
-            os.makedirs(fire_working_dir)
-        return fire_working_dir
+                fire_locations.append((fire, self._get_locations(fire)))
+
+        all_locations = [loc for fire, locations in fire_locations
+            for loc in locations]
+        if Config().get('emissions', 'ubc-bsf-feps', 'in_process'):
+            results = iter(self.emitter.run_many(all_locations,
+                species=self.feps_species))
+
+        else:
+            tasks = [("feps-emissions-{}".format(fire.id),
+                    functools.partial(self.emitter.run, loc))
+                for fire, locations in fire_locations for loc in locations]
+            working_dir = Config().get('emissions', 'ubc-bsf-feps', 'working_dir')
+            with feps_worker_pool(working_dir=working_dir) as pool:
+                results = iter(pool.run(tasks))
+
+        fire_results = {fire._private_id: [next(results) for loc in locations]
+            for fire, locations in fire_locations}
+
+        # results are set in a second pass through the fires, since, with
+        # the sqlite fires store, locations held from the first pass
+        # aren't the ones saved
+        for fire in fires:
+            if fire._private_id not in fire_results:
+                continue
+            with self.fire_failure_handler(fire):
+                for loc, r in zip(self._get_locations(fire),
+                        fire_results[fire._private_id]):
+                    if isinstance(r, Exception):
+                        raise r
+                    if self.feps_species is not None:
+                        r = {p: {s: v for s, v in d.items()
+                            if s in self.feps_species} for p, d in r.items()}
+                    loc["fuelbeds"][0]["emissions"] = r
 
     #CONVERSION_FACTOR = 0.0005 # 1.0 ton / 2000.0 lbs
 
-    def _run_on_fire(self, fire):
-        working_dir = Config().get('emissions', 'ubc-bsf-feps', 'working_dir')
-        with osutils.create_working_dir(working_dir=working_dir) as wdir:
-            fire_working_dir = self._get_fire_working_dir(fire, wdir)
-            if 'activity' not in fire:
-                raise ValueError(
-                    "Missing activity data required for computing Canadian emissions")
-            for aa in fire.active_areas:
-                for loc in aa.locations:
-                    if "consumption" not in loc:
-                        raise ValueError(
-                            "Missing consumption data required for computing Canadian emissions")
-                    if 'fuelbeds' not in loc:
-                        raise ValueError(
-                            "Fuelbeds should be made in bsf load module before computing Canadian emissions")
-                    if len(loc["fuelbeds"]) != 1:
-                        raise ValueError(
-                            "Each fuelbed array should only have one entry when running Canadian emissions")
-                    loc["fuelbeds"][0]["emissions"] = self.emitter.run(loc, fire_working_dir)
+    def _get_locations(self, fire):
+        if 'activity' not in fire:
+            raise ValueError(
+                "Missing activity data required for computing Canadian emissions")
+        locations = []
+        for aa in fire.active_areas:
+            for loc in aa.locations:
+                if "consumption" not in loc:
+                    raise ValueError(
+                        "Missing consumption data required for computing Canadian emissions")
+                if 'fuelbeds' not in loc:
+                    raise ValueError(
+                        "Fuelbeds should be made in bsf load module before computing Canadian emissions")
+                if len(loc["fuelbeds"]) != 1:
+                    raise ValueError(
+                        "Each fuelbed array should only have one entry when running Canadian emissions")
+                locations.append(loc)
+        return locations
 
 
+##
+## Base class for models using emitcalc
+##
+
+class EmissionsCalculatorBase(EmissionsBase):
+    """Base class for models computing emissions with emitcalc's
+    EmissionsCalculator, either per fuelbed, or, if 'vectorized' is
+    set, for all fuelbeds in the run at once, with bluesky.emissionsmatrix
+    """
+
+    def __init__(self, fire_failure_handler):
+        super(EmissionsCalculatorBase, self).__init__(fire_failure_handler)
+        self.calculators = EmissionsCalculatorCache()
+        self.vectorized = Config().get('emissions', 'vectorized')
+        if self.vectorized and self.include_emissions_details:
+            logging.warning("Vectorized emissions calculations don't support "
+                "emissions details. Computing emissions per fuelbed.")
+            self.vectorized = False
+
+    @abc.abstractmethod
+    def _get_fuelbeds(self, fire):
+        """Validates fire, yielding (active area, location, fuelbed)"""
+        pass
+
+    @abc.abstractmethod
+    def _get_calculator(self, fire, fb):
+        """Returns calculator for fuelbed, along with factor by which to
+        multiply its output
+        """
+        pass
+
+    def _run(self, fires):
+        if self.vectorized:
+            self._run_vectorized(fires)
+        else:
+            for fire in fires:
+                with self.fire_failure_handler(fire):
+                    self._run_on_fire(fire)
+
+    def _run_on_fire(self, fire):
+        for aa, loc, fb in self._get_fuelbeds(fire):
+            if not self._set_from_table(fire, aa, loc, fb):
+                self._calculate_fuelbed(fire, fb)
+
+    def _calculate_fuelbed(self, fire, fb):
+        calculator, factor = self._get_calculator(fire, fb)
+        _calculate(calculator, fb, self.include_emissions_details)
+        if factor != 1.0:
+            datautils.multiply_nested_data(fb['emissions'], factor)
+            if self.include_emissions_details:
+                datautils.multiply_nested_data(fb['emissions_details'], factor)
+        if self.include_emissions_details:
+            self._compact_details(fb)
+
+    def _run_vectorized(self, fires):
+        # fuelbeds are grouped by calculator, after validating each fire;
+        # they're identified by fire private id and index in the fire's
+        # fuelbeds, since fuelbeds held from this pass through the fires
+        # aren't the ones saved by the sqlite fires store
+        groups = {}
+        for fire in fires:
+            with self.fire_failure_handler(fire):
+                fire_groups = []
+                for i, (aa, loc, fb) in enumerate(self._get_fuelbeds(fire)):
+                    if not self._set_from_table(fire, aa, loc, fb):
+                        calculator, factor = self._get_calculator(fire, fb)
+                        fire_groups.append((calculator, factor, i,
+                            fb['consumption']))
+                for calculator, factor, i, consumption in fire_groups:
+                    groups.setdefault(id(calculator), (calculator, factor, [])
+                        )[2].append(((fire._private_id, i), consumption))
+
+        # emissions, or None if not computed, by fire and fuelbed index
+        computed = defaultdict(dict)
+        for calculator, factor, rows in groups.values():
+            try:
+                results = emissionsmatrix.calculate(calculator,
+                    [consumption for key, consumption in rows], factor)
+            except Exception as e:
+                logging.warning("Vectorized emissions calculation failed: %s. "
+                    "Computing emissions per fuelbed.", e)
+                results = [None] * len(rows)
+            for ((fire_id, i), consumption), r in zip(rows, results):
+                computed[fire_id][i] = r
+
+        # emissions are set in a second pass through the fires; fuelbeds
+        # without emissions are computed individually, so that any errors
+        # are recorded on their fires
+        for fire in fires:
+            if fire._private_id not in computed:
+                continue
+            fire_computed = computed[fire._private_id]
+            with self.fire_failure_handler(fire):
+                for i, (aa, loc, fb) in enumerate(self._get_fuelbeds(fire)):
+                    if i not in fire_computed:
+                        continue
+                    if fire_computed[i] is not None:
+                        fb['emissions'] = fire_computed[i]
+                    else:
+                        self._calculate_fuelbed(fire, fb)
+
 ##
 ## FEPS
 ##
 
-class Feps(EmissionsBase):
+class Feps(EmissionsCalculatorBase):
 
     def __init__(self, fire_failure_handler):
         super(Feps, self).__init__(fire_failure_handler)
 
         # The same lookup object is used for both Rx and WF
-        self.calculator = EmissionsCalculator(FepsEFLookup(),
-            species=self.species)
+        self.calculator = self.calculators.get_feps_calculator(self.species)
 
     def run(self, fires):
         logging.info("Running emissions module FEPS EFs")
-
-        for fire in fires:
-            with self.fire_failure_handler(fire):
-                self._run_on_fire(fire)
+        self._run(fires)
 
     CONVERSION_FACTOR = 0.0005 # 1.0 ton / 2000.0 lbs
 
-    def _run_on_fire(self, fire):
+    def _get_fuelbeds(self, fire):
         if 'activity' not in fire:
             raise ValueError(
                 "Missing activity data required for computing emissions")
@@ -197,22 +439,22 @@ class Feps(EmissionsBase):
                     if 'consumption' not in fb:
                         raise ValueError(
                             "Missing consumption data required for computing emissions")
-                    _calculate(self.calculator, fb, self.include_emissions_details)
-                    # TODO: Figure out if we should indeed convert from lbs to tons;
-                    #   if so, uncomment the following
-                    # Note: According to BSF, FEPS emissions are in lbs/ton consumed.  Since
-                    # consumption is in tons, and since we want emissions in tons, we need
-                    # to divide each value by 2000.0
-                    # datautils.multiply_nested_data(fb['emissions'], self.CONVERSION_FACTOR)
-                    # if self.include_emissions_details:
-                    #     datautils.multiply_nested_data(fb['emissions_details'], self.CONVERSION_FACTOR)
+                    yield aa, loc, fb
+
+    def _get_calculator(self, fire, fb):
+        # TODO: Figure out if we should indeed convert from lbs to tons;
+        #   if so, return self.CONVERSION_FACTOR
+        # Note: According to BSF, FEPS emissions are in lbs/ton consumed.  Since
+        # consumption is in tons, and since we want emissions in tons, we need
+        # to divide each value by 2000.0
+        return self.calculator, 1.0
 
 ##
 ## Prichard / O'Neill
 ##
 
 
-class PrichardOneill(EmissionsBase):
+class PrichardOneill(EmissionsCalculatorBase):
 
     def __init__(self, fire_failure_handler):
         super(PrichardOneill, self).__init__(fire_failure_handler)
@@ -220,10 +462,8 @@ class PrichardOneill(EmissionsBase):
     def run(self, fires):
         logging.info("Running emissions module with Prichard / O'Neill EFs")
 
-        # Instantiate two lookup object, one Rx and one WF, to be reused
-        for fire in fires:
-            with self.fire_failure_handler(fire):
-                self._run_on_fire(fire)
+        # Calculators, one per fccs_id for each of Rx and WF, are reused
+        self._run(fires)
 
     # Consumption values are in tons, Prichard/ONeill EFS are in g/kg, and
     # we want emissions values in tons.  Since 1 g/kg == 2 lbs/ton, we need
@@ -231,7 +471,7 @@ class PrichardOneill(EmissionsBase):
     #   (2 lbs/ton) * (1 ton / 2000lbs) = 1/1000 = 0.001
     CONVERSION_FACTOR = 0.001
 
-    def _run_on_fire(self, fire):
+    def _get_fuelbeds(self, fire):
         if 'activity' not in fire:
             raise ValueError(
                 "Missing activity data required for computing emissions")
@@ -248,16 +488,14 @@ class PrichardOneill(EmissionsBase):
                     if 'fccs_id' not in fb:
                         raise ValueError(
                             "Missing FCCS Id required for computing emissions")
-                    fccs2ef = Fccs2Ef(fb["fccs_id"], is_rx=(fire["type"]=="rx"))
-                    calculator = EmissionsCalculator(fccs2ef, species=self.species)
-                    _calculate(calculator, fb, self.include_emissions_details)
-                    # Convert from lbs to tons
-                    # TODO: Update EFs to be tons/ton in a) eflookup package,
-                    #   b) just after instantiating look-up objects, above,
-                    #   or c) just before calling EmissionsCalculator, above
-                    datautils.multiply_nested_data(fb['emissions'], self.CONVERSION_FACTOR)
-                    if self.include_emissions_details:
-                        datautils.multiply_nested_data(fb['emissions_details'], self.CONVERSION_FACTOR)
+                    yield aa, loc, fb
+
+    def _get_calculator(self, fire, fb):
+        # TODO: Update EFs to be tons/ton in eflookup package, to avoid
+        #   converting from lbs to tons
+        return (self.calculators.get_prichard_oneill_calculator(
+            fb["fccs_id"], fire["type"] == "rx", self.species),
+            self.CONVERSION_FACTOR)
 
 ##
 ## CONSUME
@@ -275,6 +513,11 @@ class Consume(EmissionsBase):
         self.fuel_loadings_manager = FuelLoadingsManager(
             all_fuel_loadings=all_fuel_loadings)
 
+        # Use consumption and heat stored on each fuelbed, rather than
+        # having consume recompute them
+        self.fuel_consumption_class = (StoredFuelConsumptionForEmissions
+            if Config().get('emissions', 'reuse_consumption')
+            else FuelConsumptionForEmissions)
 
     def run(self, fires):
         logging.info("Running emissions module with CONSUME")
@@ -327,7 +570,7 @@ class Consume(EmissionsBase):
         # unlike with consume consumption results, emissions results reflect
         # how you set area and output_units
         area = (fb['pct'] / 100.0) * loc['area']
-        fc = FuelConsumptionForEmissions(fb["consumption"], fb['heat'],
+        fc = self.fuel_consumption_class(fb["consumption"], fb['heat'],
             area, burn_type, fb['fccs_id'], season, active_area,
             fccs_file=fuel_loadings_csv_filename)
 
@@ -339,9 +582,10 @@ class Consume(EmissionsBase):
 
         # Consume emissions prints out lines like
         #    Converting units: tons_ac -> tons
-        # which we want to capture and ignore
+        # which we want to capture and ignore; they're captured per thread,
+        # so that sys.stdout isn't swapped out from under other threads
         # TODO: should we log??
-        with capture_stdout() as stdout_buffer:
+        with capture_thread_stdout() as stdout_buffer:
             r = e.results()['emissions']
 
         fb['emissions'] = {f: {} for f in CONSUME_FIELDS}
@@ -369,6 +613,7 @@ class Consume(EmissionsBase):
                         for p in r['stratum'][k][c]:
                             fb['emissions_details']['summary'][c][p] = fb['emissions_details']['summary'][c].get(p, {})
                             fb['emissions_details']['summary'][c][p][upper_k] = r['stratum'][k][c][p]
+            self._compact_details(fb)
 
         # Note: We don't need to call
         #   datautils.multiply_nested_data(fb["emissions"], area)
@@ -380,6 +625,78 @@ class Consume(EmissionsBase):
         #   it lists per-category emissions, not per-sub-category
 
 
+##
+## Calculator cache
+##
+
+class CachedEFLookup(object):
+    """Wraps an EF lookup object, memoizing the EFs returned by `get`, so
+    that each EF is resolved from the lookup tables only once
+    """
+
+    def __init__(self, ef_lookup):
+        self._ef_lookup = ef_lookup
+        self._efs = {}
+
+    def get(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            return self._efs[key]
+        except KeyError:
+            ef = self._efs[key] = self._ef_lookup.get(*args, **kwargs)
+            return ef
+
+    def __getattr__(self, name):
+        return getattr(self._ef_lookup, name)
+
+_EF_LOOKUPS = {}
+_CALCULATORS = {}
+
+class EmissionsCalculatorCache(object):
+    """Returns emissions calculators, with memoized EF lookups, from a
+    process-wide cache keyed by EF set (FEPS, or Prichard / O'Neill
+    fccs_id and Rx vs. WF) and species filter
+
+    Setting up Fccs2Ef and EmissionsCalculator objects, and resolving
+    their EFs, is then done once per fccs_id and fire type, rather than
+    once per fuelbed. Hits and misses are counted per instance.
+    """
+
+    def __init__(self):
+        self._hits = 0
+        self._misses = 0
+
+    def get_feps_calculator(self, species=None):
+        return self._get(('feps',), species, FepsEFLookup)
+
+    def get_prichard_oneill_calculator(self, fccs_id, is_rx, species=None):
+        return self._get(('prichard-oneill', str(fccs_id), bool(is_rx)),
+            species, lambda: Fccs2Ef(fccs_id, is_rx=bool(is_rx)))
+
+    def _get(self, ef_key, species, create_ef_lookup):
+        key = ef_key + (tuple(species) if species else None,)
+        calculator = _CALCULATORS.get(key)
+        if calculator is not None:
+            self._hits += 1
+            return calculator
+
+        self._misses += 1
+        if ef_key not in _EF_LOOKUPS:
+            _EF_LOOKUPS[ef_key] = CachedEFLookup(create_ef_lookup())
+        calculator = _CALCULATORS[key] = EmissionsCalculator(
+            _EF_LOOKUPS[ef_key], species=species and list(species))
+        return calculator
+
+    @property
+    def stats(self):
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": float(self._hits) / total if total else None
+        }
+
+
 ##
 ## Helpers
 ##
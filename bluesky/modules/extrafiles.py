@@ -13,13 +13,14 @@ import os
 from bluesky.config import Config
 from bluesky.exceptions import BlueSkyConfigurationError
 from bluesky.extrafilewriters import (
-    emissionscsv, firescsvs, smokeready
+    emissionscsv, firescsvs, smokeready, sqlitedb
 )
 
 EXTRA_FILE_WRITERS = {
     'emissionscsv': emissionscsv.EmissionsCsvWriter,
     'firescsvs': firescsvs.FiresCsvsWriter,
-    'smokeready': smokeready.SmokeReadyWriter
+    'smokeready': smokeready.SmokeReadyWriter,
+    'sqlitedb': sqlitedb.SqliteDbWriter
 }
 
 def run(fires_manager):
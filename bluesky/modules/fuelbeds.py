@@ -2,15 +2,24 @@
 
 __author__ = "Joel Dubowy"
 
+import hashlib
+import json
 import logging
+import math
+import os
 import random
+import sqlite3
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import fccsmap
+import numpy
 from fccsmap.lookup import FccsLookUp
 from functools import reduce
+from shapely.geometry import box, mapping, shape
 
 from bluesky.config import Config
+from bluesky.exceptions import BlueSkyConfigurationError, BlueSkyImportError
 
 __all__ = [
     'run'
@@ -30,21 +39,43 @@ def run(fires_manager):
     Args:
      - fires_manager -- bluesky.models.fires.FiresManager object
     """
-    fires_manager.processed(__name__, __version__,
-        fccsmap_version=fccsmap.__version__)
+    processed_kwargs = {
+        "fccsmap_version": fccsmap.__version__
+    }
 
     logging.debug('Using FCCS version %s',
         Config().get('fuelbeds', 'fccs_version'))
 
-    for fire in fires_manager.fires:
-        with fires_manager.fire_failure_handler(fire):
-            for aa in fire.active_areas:
-                lookup = FCCS_LOOKUPS['AK'] if Config().get('fuelbeds', 'use_alaska') else FCCS_LOOKUPS[aa.get('state')]
-
-                # Note that aa.locations validates that each location object
-                # has either lat+lng+area or polygon
-                for loc in aa.locations:
-                    Estimator(lookup).estimate(loc)
+    cache = None
+    if (Config().get('fuelbeds', 'cache_lookups')
+            or Config().get('fuelbeds', 'cache_dir')):
+        cache = FuelbedLookupCache(
+            cache_dir=Config().get('fuelbeds', 'cache_dir'))
+
+    sampled = {}
+    if Config().get('fuelbeds', 'raster_point_lookups'):
+        sampled = _look_up_points(fires_manager, processed_kwargs)
+
+    try:
+        for fire in fires_manager.fires:
+            with fires_manager.fire_failure_handler(fire):
+                for i, aa in enumerate(fire.active_areas):
+                    lookup = _get_lookup(_get_lookup_key(aa), cache)
+
+                    # Note that aa.locations validates that each location object
+                    # has either lat+lng+area or polygon
+                    for j, loc in enumerate(aa.locations):
+                        fuelbed_info = sampled.pop((fire._private_id, i, j), None)
+                        if fuelbed_info:
+                            Estimator(lookup).set_fuelbeds(loc, fuelbed_info)
+                        else:
+                            Estimator(lookup).estimate(loc)
+
+    finally:
+        if cache:
+            cache.close()
+            processed_kwargs.update(lookup_cache=cache.stats)
+        fires_manager.processed(__name__, __version__, **processed_kwargs)
 
     # TODO: Add fuel loadings data to each fuelbed object (????)
     #  If we do so here, use bluesky.modules.consumption.FuelLoadingsManager
@@ -58,6 +89,16 @@ def run(fires_manager):
 
     fires_manager.summarize(fuelbeds=summarize(fires_manager.fires))
 
+def _get_lookup_key(aa):
+    return 'AK' if Config().get('fuelbeds', 'use_alaska') else aa.get('state')
+
+def _get_lookup(lookup_key, cache):
+    lookup = FCCS_LOOKUPS[lookup_key]
+    if (Config().get('fuelbeds', 'polygon_simplify')
+            or Config().get('fuelbeds', 'polygon_tile_cells')):
+        lookup = PolygonLookUp(lookup)
+    return CachedLookUp(cache, lookup_key, lookup) if cache else lookup
+
 def summarize(fires):
     if not fires:
         return []
@@ -77,6 +118,405 @@ def summarize(fires):
         for fccs_id, area in area_by_fccs_id.items()]
     return sorted(summary, key=lambda a: a["fccs_id"])
 
+##
+## Lookup cache
+##
+
+class FuelbedLookupCache(object):
+    """Memoizes fuelbed lookups, and optionally persists them on disk, so
+    that locations already looked up - e.g. fires reappearing at the same
+    coordinates day after day, or specified points repeated within a
+    run - don't require calls to FccsLookUp.look_up.
+
+    Keys are formed from the point's exact coordinates or a hash of the
+    perimeter's WKB, along with whether the AK lookup was used and a hash
+    of the fccsmap version and lookup config. Raw lookup results are
+    cached, before truncation, so truncation settings don't need to be
+    part of the key.
+
+    Points aren't snapped to a grid. The FCCS rasters are Albers
+    projected, so a lat/lng grid doesn't line up with their cells, and
+    snapping would be lossy - points near cell edges would be given the
+    fuelbeds of whichever point in their grid square was looked up first.
+    """
+
+    # fuelbeds config settings that don't affect the lookup itself
+    NON_LOOKUP_CONFIG_PREFIXES = ('truncation_', 'total_pct_threshold',
+        'cache_', 'use_alaska', 'raster_')
+
+    def __init__(self, cache_dir=None):
+        self._memo = {}
+        self._hits = 0
+        self._misses = 0
+
+        lookup_config = {k: v for k, v in Config().get('fuelbeds').items()
+            if not k.startswith(self.NON_LOOKUP_CONFIG_PREFIXES)}
+        self._config_hash = hashlib.sha1(json.dumps(
+            [fccsmap.__version__, lookup_config], sort_keys=True,
+            default=str).encode()).hexdigest()
+
+        self._conn = None
+        if cache_dir:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            self._conn = sqlite3.connect(
+                os.path.join(cache_dir, 'fuelbed-lookups.sqlite'))
+            self._conn.execute("CREATE TABLE IF NOT EXISTS lookups "
+                "(key TEXT PRIMARY KEY, fuelbed_info TEXT)")
+
+    def look_up(self, lookup_key, lookup, geo_data):
+        key = self._key(lookup_key, geo_data)
+        if key in self._memo:
+            self._hits += 1
+            return self._memo[key]
+
+        if self._conn:
+            row = self._conn.execute("SELECT fuelbed_info FROM lookups "
+                "WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._hits += 1
+                self._memo[key] = json.loads(row[0])
+                return self._memo[key]
+
+        self._misses += 1
+        fuelbed_info = lookup.look_up(geo_data)
+        self._memo[key] = fuelbed_info
+        if self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO lookups VALUES (?, ?)",
+                (key, json.dumps(fuelbed_info, default=float)))
+        return fuelbed_info
+
+    def _key(self, lookup_key, geo_data):
+        if geo_data['type'] == 'Point':
+            lng, lat = [float(c) for c in geo_data['coordinates']]
+            geo_key = 'point:{!r},{!r}'.format(lng, lat)
+        else:
+            geo_key = 'wkb:' + hashlib.sha1(shape(geo_data).wkb).hexdigest()
+
+        return '{}:{}:{}'.format(self._config_hash,
+            'AK' if lookup_key == 'AK' else '', geo_key)
+
+    @property
+    def stats(self):
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": float(self._hits) / total if total else None
+        }
+
+    def close(self):
+        if self._conn:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+class CachedLookUp(object):
+    """Drop-in replacement for FccsLookUp that checks the cache first
+    """
+
+    def __init__(self, cache, lookup_key, lookup):
+        self._cache = cache
+        self._lookup_key = lookup_key
+        self._lookup = lookup
+
+    def look_up(self, geo_data):
+        return self._cache.look_up(self._lookup_key, self._lookup, geo_data)
+
+
+##
+## Large polygon preprocessing
+##
+
+class PolygonLookUp(object):
+    """Drop-in replacement for FccsLookUp that simplifies polygons and
+    splits large ones into raster aligned tiles before looking them up.
+
+    Polygons are simplified, preserving topology, with tolerance of half
+    the raster cell size. Polygons spanning more than 'polygon_tile_cells'
+    raster cells in either dimension are split into tiles of that many
+    cells per side, aligned to the raster grid, which are looked up in
+    parallel. Per-fuelbed grid cell counts are then merged across tiles,
+    so that the combined result can be truncated as usual.
+
+    Points are passed straight through.
+    """
+
+    def __init__(self, lookup):
+        self._lookup = lookup
+        self._cell_size = Config().get('fuelbeds', 'polygon_raster_cell_size')
+        self._simplify = Config().get('fuelbeds', 'polygon_simplify')
+        tile_cells = Config().get('fuelbeds', 'polygon_tile_cells')
+        self._tile_size = tile_cells and tile_cells * self._cell_size
+        self._num_workers = Config().get('fuelbeds', 'polygon_tile_workers')
+
+    def look_up(self, geo_data):
+        if geo_data['type'] not in ('Polygon', 'MultiPolygon'):
+            return self._lookup.look_up(geo_data)
+
+        geom = shape(geo_data)
+        if self._simplify:
+            simplified = geom.simplify(self._cell_size / 2.0,
+                preserve_topology=True)
+            # don't let simplification eliminate small polygons
+            if not simplified.is_empty:
+                geom = simplified
+
+        tiles = self._get_tiles(geom)
+        logging.debug("Looking up fuelbeds for polygon in %s tile(s)",
+            len(tiles))
+        if len(tiles) == 1:
+            return self._lookup.look_up(mapping(tiles[0]))
+
+        with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+            fuelbed_infos = list(executor.map(
+                lambda t: self._lookup.look_up(mapping(t)), tiles))
+        return merge_fuelbed_infos(fuelbed_infos)
+
+    def _get_tiles(self, geom):
+        if not self._tile_size:
+            return [geom]
+
+        min_lng, min_lat, max_lng, max_lat = geom.bounds
+        if (max_lng - min_lng <= self._tile_size
+                and max_lat - min_lat <= self._tile_size):
+            return [geom]
+
+        tiles = []
+        for i in range(math.floor(min_lng / self._tile_size),
+                math.floor(max_lng / self._tile_size) + 1):
+            for j in range(math.floor(min_lat / self._tile_size),
+                    math.floor(max_lat / self._tile_size) + 1):
+                tile = geom.intersection(box(i * self._tile_size,
+                    j * self._tile_size, (i + 1) * self._tile_size,
+                    (j + 1) * self._tile_size))
+                # drop slivers along tile boundaries, which have no area
+                tile = _polygonal_part(tile)
+                if tile is not None:
+                    tiles.append(tile)
+        return tiles
+
+def _polygonal_part(geom):
+    if geom.is_empty:
+        return None
+    if geom.geom_type in ('Polygon', 'MultiPolygon'):
+        return geom
+    polygons = [g for g in getattr(geom, 'geoms', [])
+        if g.geom_type in ('Polygon', 'MultiPolygon')]
+    if polygons:
+        return reduce(lambda a, b: a.union(b), polygons)
+
+def merge_fuelbed_infos(fuelbed_infos):
+    """Merges fuelbed info looked up for the tiles of a polygon, summing
+    per-fuelbed grid cell counts and recomputing percentages
+
+    Tiles for which the lookup failed (e.g. tiles containing only ignored
+    fuelbeds) are skipped. Returns None if all failed.
+    """
+    fuelbed_infos = [fi for fi in fuelbed_infos if fi and fi.get('fuelbeds')]
+    if not fuelbed_infos:
+        return None
+
+    grid_cells = defaultdict(lambda: 0)
+    for fi in fuelbed_infos:
+        for fccs_id, d in fi['fuelbeds'].items():
+            grid_cells[fccs_id] += d['grid_cells']
+    total_grid_cells = sum(grid_cells.values())
+
+    merged = {
+        "fuelbeds": {
+            fccs_id: {
+                "grid_cells": n,
+                "percent": 100.0 * n / total_grid_cells
+            } for fccs_id, n in grid_cells.items()
+        },
+        "units": fuelbed_infos[0].get('units')
+    }
+    for k in ('grid_cells', 'area'):
+        if all([fi.get(k) is not None for fi in fuelbed_infos]):
+            merged[k] = sum([fi[k] for fi in fuelbed_infos])
+    return merged
+
+
+##
+## Direct raster point lookups
+##
+
+def _look_up_points(fires_manager, processed_kwargs):
+    """Gathers every specified point in the run and samples the FCCS
+    fuelbed grid for all of them at once, returning fuelbed info keyed by
+    fire private id and active area and location indices
+
+    Perimeters, and points the sampler leaves unresolved, are left out, to
+    be looked up individually.
+    """
+    if not Config().get('fuelbeds', 'no_sampling'):
+        raise BlueSkyConfigurationError("fuelbeds 'raster_point_lookups' "
+            "requires 'no_sampling', since surrounding cells aren't sampled")
+    if not Config().get('fuelbeds', 'fccs_fuelload_file', allow_missing=True):
+        raise BlueSkyConfigurationError("fuelbeds 'raster_point_lookups' "
+            "requires 'fccs_fuelload_file'")
+
+    loc_keys = []
+    points = []
+    for fire in fires_manager.fires:
+        with fires_manager.fire_failure_handler(fire):
+            for i, aa in enumerate(fire.active_areas):
+                for j, loc in enumerate(aa.locations):
+                    if not loc.get('polygon') and loc.get('lat') and loc.get('lng'):
+                        loc_keys.append((fire._private_id, i, j))
+                        points.append((float(loc['lng']), float(loc['lat'])))
+
+    sampler = RasterPointSampler.open(
+        Config().get('fuelbeds', 'fccs_fuelload_file', allow_missing=True),
+        Config().get('fuelbeds', 'fccs_fuelload_param', allow_missing=True),
+        Config().get('fuelbeds', 'ignored_fuelbeds'))
+    try:
+        fuelbed_infos = sampler.look_up(points)
+    finally:
+        sampler.close()
+
+    sampled = {k: fi for k, fi in zip(loc_keys, fuelbed_infos) if fi}
+    processed_kwargs.update(raster_point_lookups={
+        "points": len(points),
+        "sampled": len(sampled)
+    })
+    return sampled
+
+def _import_gdal():
+    try:
+        from osgeo import gdal, osr
+        return gdal, osr
+    except ImportError:
+        raise BlueSkyImportError("Package 'gdal' required "
+            "for fuelbeds 'raster_point_lookups'")
+
+class RasterPointSampler(object):
+    """Looks up fuelbeds for many points at once by reading the FCCS
+    fuelbed grid directly, rather than calling FccsLookUp.look_up, which
+    opens, reprojects, and reads the grid anew for each point.
+
+    The grid is opened once, and memory mapped where GDAL supports it, so
+    that only pages containing sampled cells are read. Points are projected
+    to the grid's CRS together, and cells are read in grid order.
+
+    Each point is given the fuelbed of the grid cell containing it, which
+    is what FccsLookUp returns for points with 'no_sampling' set. Points
+    off the grid, or in nodata or ignored cells - which FccsLookUp
+    resamples or fails to look up - are left unresolved, to be looked
+    up individually.
+    """
+
+    def __init__(self, grid, geo_transform, to_grid_crs, nodata=None,
+            ignored_fuelbeds=None):
+        """
+        Args:
+         - grid -- 2-d array of fuelbed ids
+         - geo_transform -- GDAL geo transform, mapping grid column and row
+            to x and y in the grid's CRS
+         - to_grid_crs -- function that projects arrays of lngs and lats
+            to arrays of x and y in the grid's CRS
+        Kwargs:
+         - nodata -- grid's nodata value
+         - ignored_fuelbeds -- fuelbed ids left unresolved
+        """
+        if geo_transform[2] or geo_transform[4]:
+            raise BlueSkyConfigurationError(
+                "Rotated FCCS fuelbed grids not supported")
+        self._grid = grid
+        self._geo_transform = geo_transform
+        self._to_grid_crs = to_grid_crs
+        self._nodata = nodata
+        self._ignored_fuelbeds = set(ignored_fuelbeds or [])
+        self._dataset = None
+
+    @classmethod
+    def open(cls, filename, param=None, ignored_fuelbeds=None):
+        gdal, osr = _import_gdal()
+        dataset = gdal.Open('NETCDF:"{}":{}'.format(filename, param)
+            if param else filename)
+        if not dataset:
+            raise BlueSkyConfigurationError(
+                "Failed to open FCCS fuelbed grid {}".format(filename))
+
+        band = dataset.GetRasterBand(1)
+        try:
+            grid = band.GetVirtualMemAutoArray(gdal.GF_Read)
+        except Exception:
+            grid = None
+        if grid is None:
+            # virtual memory isn't supported on all platforms
+            grid = band.ReadAsArray()
+
+        lat_lng_srs = osr.SpatialReference()
+        lat_lng_srs.ImportFromEPSG(4326)
+        if hasattr(lat_lng_srs, 'SetAxisMappingStrategy'):
+            # GDAL >= 3 otherwise expects lat,lng order for EPSG:4326
+            lat_lng_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(lat_lng_srs,
+            osr.SpatialReference(wkt=dataset.GetProjection()))
+        def to_grid_crs(lngs, lats):
+            xy = numpy.array(transform.TransformPoints(
+                numpy.column_stack([lngs, lats]).tolist())).reshape(-1, 3)
+            return xy[:, 0], xy[:, 1]
+
+        sampler = cls(grid, dataset.GetGeoTransform(), to_grid_crs,
+            nodata=band.GetNoDataValue(), ignored_fuelbeds=ignored_fuelbeds)
+        # the mapped grid is only valid while the dataset is open
+        sampler._dataset = dataset
+        return sampler
+
+    def close(self):
+        self._grid = None
+        self._dataset = None
+
+    def sample(self, points):
+        """Returns the fuelbed id, as a string, of the grid cell
+        containing each of the given (lng, lat) points, or None for points
+        off the grid or in nodata cells
+        """
+        fccs_ids = [None] * len(points)
+        if not points:
+            return fccs_ids
+
+        lngs, lats = numpy.array(points, dtype=float).T
+        x, y = self._to_grid_crs(lngs, lats)
+        x0, dx, _, y0, _, dy = self._geo_transform
+        cols = numpy.floor((numpy.asarray(x) - x0) / dx).astype(int)
+        rows = numpy.floor((numpy.asarray(y) - y0) / dy).astype(int)
+        idx = numpy.flatnonzero((rows >= 0) & (rows < self._grid.shape[0])
+            & (cols >= 0) & (cols < self._grid.shape[1]))
+
+        # read cells in grid order, so that each page is read only once
+        idx = idx[numpy.lexsort((cols[idx], rows[idx]))]
+        values = self._grid[rows[idx], cols[idx]]
+        for i, v in zip(idx.tolist(), values.tolist()):
+            # nodata may be nan, which doesn't equal itself
+            if v == v and v != self._nodata:
+                fccs_ids[i] = str(int(v))
+        return fccs_ids
+
+    def look_up(self, points):
+        """Returns fuelbed info for each of the given (lng, lat) points,
+        or None for points left to be looked up individually
+        """
+        # points in cells with the same fuelbed share the same info
+        fuelbed_infos = {}
+        def get_fuelbed_info(fccs_id):
+            if not fccs_id or fccs_id in self._ignored_fuelbeds:
+                return None
+            if fccs_id not in fuelbed_infos:
+                fuelbed_infos[fccs_id] = {
+                    "fuelbeds": {
+                        fccs_id: {"grid_cells": 1, "percent": 100.0}
+                    },
+                    "grid_cells": 1
+                }
+            return fuelbed_infos[fccs_id]
+
+        return [get_fuelbed_info(fccs_id) for fccs_id in self.sample(points)]
+
+
 # TODO: change 'get_*' functions to 'set_*' and chnge fire in place
 # rather than return values ???
 
@@ -96,6 +536,13 @@ class Estimator(object):
     def estimate(self, loc):
         """Estimates fuelbed composition based on lat/lng or polygon
         """
+        geo_data = self.get_geo_data(loc)
+        fuelbed_info = self.lookup.look_up(geo_data)
+        self.set_fuelbeds(loc, fuelbed_info)
+
+    def get_geo_data(self, loc):
+        """Returns geojson to look up, from location's lat/lng or polygon
+        """
         if not loc:
             raise ValueError("Insufficient data for looking up fuelbed information")
 
@@ -105,13 +552,6 @@ class Estimator(object):
                 "coordinates": [loc['polygon']]
             }
             logging.debug("Converted polygon to geojson: %s", geo_data)
-            fuelbed_info = self.lookup.look_up(geo_data)
-            # If loc['area'] is defined, then we want to keep it. We're dealing
-            # with a perimeter which may not be all burning.  If it isn't
-            # defined, then set loc['area'] to fuelbed_info['area']
-            if not loc.get('area') and fuelbed_info and fuelbed_info.get('area'):
-                # fuelbed_info['area'] is in m^2
-                loc['area'] = fuelbed_info['area'] * ACRES_PER_SQUARE_METER
 
         elif loc.get('lat') and loc.get('lng'):
             geo_data = {
@@ -122,11 +562,23 @@ class Estimator(object):
                 ]
             }
             logging.debug("Converted lat,lng to geojson: %s", geo_data)
-            fuelbed_info = self.lookup.look_up(geo_data)
 
         else:
             raise ValueError("Insufficient data for looking up fuelbed information")
 
+        return geo_data
+
+    def set_fuelbeds(self, loc, fuelbed_info):
+        """Sets location's fuelbeds from looked up fuelbed info
+        """
+        # If loc['area'] is defined, then we want to keep it. We're dealing
+        # with a perimeter which may not be all burning.  If it isn't
+        # defined, then set loc['area'] to fuelbed_info['area']
+        if (loc.get('polygon') and not loc.get('area')
+                and fuelbed_info and fuelbed_info.get('area')):
+            # fuelbed_info['area'] is in m^2
+            loc['area'] = fuelbed_info['area'] * ACRES_PER_SQUARE_METER
+
         if not fuelbed_info or not fuelbed_info.get('fuelbeds'):
             # TODO: option to ignore failures ?
             raise RuntimeError("Failed to lookup fuelbed information")
@@ -78,6 +78,9 @@ def run(fires_manager):
                 if not (Config().get('skip_failed_sources')
                         or Config().get('load', 'skip_failed_sources', allow_missing=True)):
                     raise
+
+        if Config().get('validate_fires'):
+            fires_manager.validate_fires()
     finally:
         fires_manager.processed(__name__, __version__,
             successfully_loaded_sources=successfully_loaded_sources)
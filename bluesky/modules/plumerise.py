@@ -7,16 +7,19 @@ __author__ = "Joel Dubowy"
 
 import copy
 import datetime
+import functools
 import logging
 import os
 import csv
 
 from plumerise import sev, feps, __version__ as plumerise_version
-from pyairfire import sun, osutils
+from pyairfire import sun
 
 from bluesky import datautils, datetimeutils, locationutils
 from bluesky.config import Config
 from bluesky.exceptions import BlueSkyConfigurationError
+from bluesky.hourlyseries import HourlySeries
+from bluesky.workerpool import feps_worker_pool
 
 __all__ = [
     'run'
@@ -33,11 +36,18 @@ def run(fires_manager):
     """
     compute_func = ComputeFunction(fires_manager)
 
-    with osutils.create_working_dir(
-            working_dir=compute_func.config.get('working_dir')) as working_dir:
-        for fire in fires_manager.fires:
-            with fires_manager.fire_failure_handler(fire):
-                compute_func(fire, working_dir=working_dir)
+    # Compute functions either compute plumerise for a fire directly, or
+    # return tasks that run external binaries, which are run for all
+    # fires with a pool of workers
+    fire_tasks = []
+    for fire in fires_manager.fires:
+        with fires_manager.fire_failure_handler(fire):
+            tasks = compute_func(fire)
+            if tasks:
+                fire_tasks.append((fire._private_id, tasks))
+
+    if fire_tasks:
+        _run_tasks(fires_manager, compute_func, fire_tasks)
 
     # Make sure to distribute the heat if it was loaded here.
     if compute_func.config.get("load_heat"):
@@ -50,6 +60,25 @@ def run(fires_manager):
     # TODO: set summary?
     # fires_manager.summarize(plumerise=...)
 
+def _run_tasks(fires_manager, compute_func, fire_tasks):
+    with feps_worker_pool(
+            working_dir=compute_func.config.get('working_dir')) as pool:
+        results = iter(pool.run([(group, func)
+            for fire_id, tasks in fire_tasks for group, func, apply in tasks]))
+
+    fire_results = {fire_id: [(apply, next(results))
+        for group, func, apply in tasks] for fire_id, tasks in fire_tasks}
+
+    def _apply(fire, results):
+        for apply, r in results:
+            if isinstance(r, Exception):
+                raise r
+            apply(fire, r)
+
+    # results are applied in a second pass through the fires, so that
+    # they're saved by the sqlite fires store
+    fires_manager.apply_by_fire(fire_results, _apply)
+
 INVALID_PLUMERISE_MODEL_MSG = "Invalid plumerise model: '{}'"
 NO_ACTIVITY_ERROR_MSG = "Missing activity data required for plumerise"
 MISSING_AREA_ERROR_MSG = "Missing fire activity area required for plumerise"
@@ -80,7 +109,10 @@ class ComputeFunction(object):
                 }
             }
 
-    def __call__(self, fire, working_dir=None):
+    def __call__(self, fire):
+        """Computes plumerise for fire, or returns list of
+        (group, func(working_dir), apply(fire, result)) tasks to do so
+        """
         if 'activity' not in fire:
             raise ValueError(NO_ACTIVITY_ERROR_MSG)
 
@@ -88,20 +120,13 @@ class ComputeFunction(object):
         # exception if any are missing area
         fire.locations
 
-        self._compute_func(fire, working_dir)
+        return self._compute_func(fire)
 
     ## compute function generators
 
     def _feps(self, config):
         pr = feps.FEPSPlumeRise(**config)
 
-        def _get_fire_working_dir(fire, working_dir):
-            fire_working_dir = os.path.join(working_dir,
-                "feps-plumerise-{}".format(fire.id))
-            if not os.path.exists(fire_working_dir):
-                os.makedirs(fire_working_dir)
-            return fire_working_dir
-
         def _loadHeat(plume_dir):
             plumeFile = os.path.join(plume_dir, "plume.txt")
 
@@ -117,11 +142,33 @@ class ComputeFunction(object):
 
             return heat
 
-        def _f(fire, working_dir):
-            # TODO: create and change to working directory here (per fire),
-            #   above (one working dir per all fires), or below (per activity
-            #   window)...or just let plumerise create temp workingdir (as
-            #   it's currently doing?
+        def _compute(timeprofile, loc, working_dir):
+            # the plumerise package expects the dict form of time profiles
+            if isinstance(timeprofile, HourlySeries):
+                timeprofile = timeprofile.to_dict()
+            plumerise_data = pr.compute(timeprofile,
+                loc['consumption']['summary'], loc,
+                working_dir=working_dir)
+            heat = config.get("load_heat") and _loadHeat(working_dir)
+            return plumerise_data, heat
+
+        def _apply(loc_idx, sun_hours, fire, result):
+            loc = fire.locations[loc_idx]
+            plumerise_data, heat = result
+            loc.update(sun_hours)
+            loc['plumerise'] = plumerise_data['hours']
+            if config.get("load_heat"):
+                loc["fuelbeds"][0]["heat"] = heat
+            # TODO: do anything with plumerise_data['heat'] ?
+            # SEE: Canadian additon to this system above
+
+        def _f(fire):
+            # Each location's feps_plumerise run is returned as a task, to
+            # be run in a working directory provided by the worker pool,
+            # which is either shared by all of the fire's locations, e.g.
+            # 'feps-plumerise-<fire id>', or a scratch directory
+            tasks = []
+            loc_idx = 0
             for aa in fire.active_areas:
                 start = aa.get('start')
                 if not start:
@@ -135,7 +182,10 @@ class ComputeFunction(object):
                     if not loc.get('consumption', {}).get('summary'):
                         raise ValueError(MISSING_CONSUMPTION_ERROR_MSG)
 
-                    # Fill in missing sunrise / sunset
+                    # Fill in missing sunrise / sunset, which are set on
+                    # the location along with the results, in the second
+                    # pass through the fires (see _run_tasks)
+                    sun_hours = {}
                     if any([loc.get(k) is None for k in
                             ('sunrise_hour', 'sunset_hour')]):
 
@@ -148,29 +198,31 @@ class ComputeFunction(object):
                         s = sun.Sun(lat=latlng.latitude, lng=latlng.longitude)
                         d = start.date()
                         # just set them both, even if one is already set
-                        loc["sunrise_hour"] = s.sunrise_hr(d, utc_offset)
-                        loc["sunset_hour"] = s.sunset_hr(d, utc_offset)
+                        sun_hours = {
+                            "sunrise_hour": s.sunrise_hr(d, utc_offset),
+                            "sunset_hour": s.sunset_hr(d, utc_offset)
+                        }
 
-                    fire_working_dir = _get_fire_working_dir(fire, working_dir)
-                    plumerise_data = pr.compute(aa['timeprofile'],
-                        loc['consumption']['summary'], loc,
-                        working_dir=fire_working_dir)
-                    loc['plumerise'] = plumerise_data['hours']
+                    if config.get("load_heat") and 'fuelbeds' not in loc:
+                        raise ValueError(
+                            "Fuelbeds should exist before loading heat in plumerise")
+
+                    compute_loc = copy.copy(loc)
+                    compute_loc.update(sun_hours)
+                    tasks.append(("feps-plumerise-{}".format(fire.id),
+                        functools.partial(_compute, aa['timeprofile'],
+                            compute_loc),
+                        functools.partial(_apply, loc_idx, sun_hours)))
+                    loc_idx += 1
 
-                    if config.get("load_heat"):
-                        if 'fuelbeds' not in loc:
-                            raise ValueError(
-                                "Fuelbeds should exist before loading heat in plumerise")
-                        loc["fuelbeds"][0]["heat"] = _loadHeat(fire_working_dir)
-                    # TODO: do anything with plumerise_data['heat'] ?
-                    # SEE: Canadian additon to this system above
+            return tasks
 
         return _f
 
     def _sev(self, config):
         pr = sev.SEVPlumeRise(**config)
 
-        def _f(fire, working_dir):
+        def _f(fire):
             fire_frp = fire.get('meta', {}).get('frp')
             for aa in fire.active_areas:
                 for loc in aa.locations:
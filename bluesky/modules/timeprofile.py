@@ -3,6 +3,7 @@
 __author__ = "Joel Dubowy"
 
 import copy
+import datetime
 import os
 from functools import reduce
 
@@ -16,10 +17,14 @@ from timeprofile.static import (
 from timeprofile.feps import FepsTimeProfiler, FireType
 
 from bluesky.config import Config
-from bluesky.datetimeutils import parse_datetimes, parse_datetime
+from bluesky.datetimeutils import (
+    parse_datetimes, parse_datetime, parse_utc_offset, to_datetime
+)
 from bluesky.exceptions import BlueSkyConfigurationError
+from bluesky.hourlyseries import HourlySeries
 
 from bluesky.timeprofilers import ubcbsffeps
+from bluesky.workerpool import feps_worker_pool
 
 __all__ = [
     'run'
@@ -36,10 +41,15 @@ def run(fires_manager):
 
     fires_manager.processed(__name__, __version__,
         timeprofile_version=timeprofile_version)
+    dispersion_window = (_get_dispersion_window()
+        if Config().get('timeprofile', 'prune_to_dispersion_window') else None)
+    feps_profilers = _run_ubc_bsf_feps(hourly_fractions, fires_manager.fires)
+    timeprofiles = {}
     for fire in fires_manager.fires:
         with fires_manager.fire_failure_handler(fire):
             try:
-                _run_fire(hourly_fractions, fire)
+                _run_fire(hourly_fractions, fire, feps_profilers, timeprofiles,
+                    dispersion_window)
             except InvalidHourlyFractionsError as e:
                 raise BlueSkyConfigurationError(
                     "Invalid timeprofile hourly fractions: '{}'".format(str(e)))
@@ -50,7 +60,18 @@ def run(fires_manager):
 NOT_24_HOURLY_FRACTIONS_W_MULTIPLE_ACTIVE_AREAS_MSG = ("Only 24-hour repeatable"
     " time profiles supported for fires with multiple activity windows")
 
-def _run_fire(hourly_fractions, fire):
+def _run_fire(hourly_fractions, fire, feps_profilers=None, timeprofiles=None,
+        dispersion_window=None):
+    """Sets the time profile of each of the fire's active areas
+
+    timeprofiles, if specified, memoizes time profiles that depend only
+    on the active area's local start and end (and ignition) times,
+    keyed by _get_timeprofile_key. Active areas with the same key share
+    the same timeprofile object, which consumers only read.
+
+    dispersion_window, if specified, is the (start, end) UTC datetimes
+    to which time profiles are pruned.
+    """
     active_areas =  fire.active_areas
     if (hourly_fractions and len(active_areas) > 1 and
             set([len(e) for p,e in hourly_fractions.items()]) != set([24])):
@@ -62,18 +83,128 @@ def _run_fire(hourly_fractions, fire):
         raise BlueSkyConfigurationError(NOT_24_HOURLY_FRACTIONS_W_MULTIPLE_ACTIVE_AREAS_MSG)
 
     _validate_fire(fire)
-    for a in active_areas:
-        profiler = _get_profiler(hourly_fractions, fire, a)
+    for i, a in enumerate(active_areas):
+        key = (_get_timeprofile_key(hourly_fractions, fire, a)
+            if timeprofiles is not None else None)
+        if key is not None and key in timeprofiles:
+            a['timeprofile'] = timeprofiles[key]
+        else:
+            profiler = _get_profiler(hourly_fractions, fire, a,
+                (feps_profilers or {}).get((fire._private_id, i)))
+            # ubc-bsf-feps fills in missing weather and location info
+            # on a copy of the active area's specified point, since it may
+            # be computed in an earlier pass through the fires (see
+            # _run_ubc_bsf_feps); it's set on the point here
+            if getattr(profiler, 'filled_location_info', None):
+                a['specified_points'][0].update(profiler.filled_location_info)
+            a['timeprofile'] = _get_timeprofile(profiler)
+            if key is not None:
+                timeprofiles[key] = a['timeprofile']
+
+        if dispersion_window:
+            a['timeprofile'] = _prune_timeprofile(a['timeprofile'], a,
+                dispersion_window)
+
+def _get_timeprofile(profiler):
+    # hourly fractions are kept as arrays, and only converted to the
+    # dict form, keyed by hour, when output
+    start_hour = profiler.start_hour
+    if isinstance(start_hour, str):
+        start_hour = parse_datetime(start_hour, k='start')
+    return HourlySeries(start_hour, profiler.hourly_fractions)
 
-        # convert timeprofile to dict with dt keys
-        a['timeprofile'] = {}
-        fields = list(profiler.hourly_fractions.keys())
-        for i in range(len(list(profiler.hourly_fractions.values())[0])): # each phase should have same len
-            hr = profiler.start_hour + (i * profiler.ONE_HOUR)
-            a['timeprofile'][hr.isoformat()] = {
-                p: profiler.hourly_fractions[p][i] for p in fields }
+MISSING_DISPERSION_WINDOW_MSG = ("Specify dispersion 'start' and 'num_hours'"
+    " to prune time profiles to the dispersion window")
 
-def _get_profiler(hourly_fractions, fire, active_area):
+def _get_dispersion_window():
+    start = Config().get('dispersion', 'start')
+    num_hours = Config().get('dispersion', 'num_hours')
+    if not start or not num_hours:
+        raise BlueSkyConfigurationError(MISSING_DISPERSION_WINDOW_MSG)
+    start = to_datetime(start)
+    return start, start + datetime.timedelta(hours=num_hours)
+
+def _prune_timeprofile(timeprofile, active_area, dispersion_window):
+    """Drops the hours outside of the dispersion window, which is UTC,
+    from the active area's time profile, which is keyed by local time.
+    Emissions in those hours would never be dispersed, so plumerise,
+    dispersion, etc. don't need to compute anything for them.
+    """
+    utc_offset = datetime.timedelta(hours=parse_utc_offset(
+        active_area.get('utc_offset') or 0))
+    start, end = dispersion_window
+    return timeprofile.slice(start + utc_offset, end + utc_offset)
+
+def _get_timeprofile_key(hourly_fractions, fire, active_area):
+    """Returns the inputs that determine the active area's time profile,
+    or None if it's computed by ubc-bsf-feps, which depends on
+    consumption, growth and weather
+
+    hourly_fractions are the same for all fires in the run, so aren't
+    included.
+    """
+    tw = parse_datetimes(active_area, 'start', 'end')
+    if _uses_feps_rx_profiler(hourly_fractions, fire):
+        return ('feps-rx', tw['start'], tw['end'],
+            active_area.get('ignition_start'), active_area.get('ignition_end'))
+
+    if Config().get("timeprofile", "model").lower() == "ubc-bsf-feps":
+        return None
+
+    return ('static', tw['start'], tw['end'])
+
+def _uses_feps_rx_profiler(hourly_fractions, fire):
+    return fire.type == 'rx' and not hourly_fractions
+
+def _run_ubc_bsf_feps(hourly_fractions, fires):
+    """Runs UbcBsfFEPSTimeProfiler for all active areas that use it, in
+    process or with a pool of workers, and returns the profilers, or the
+    exceptions raised instantiating them, keyed by fire private id and
+    index of active area
+
+    Active areas aren't keyed by id, since, with the sqlite fires store,
+    those seen when the fires are run aren't the objects seen here. For
+    the same reason, weather and location info filled in by the profilers
+    is set on the active areas when the fires are run (see _run_fire).
+    """
+    if Config().get("timeprofile", "model").lower() != "ubc-bsf-feps":
+        return {}
+
+    wfrt_config = Config().get('timeprofile', 'ubc-bsf-feps')
+    tasks = []
+    active_areas = []
+    keys = []
+    for fire in fires:
+        if _uses_feps_rx_profiler(hourly_fractions, fire):
+            continue
+        try:
+            _validate_fire(fire)
+        except Exception:
+            # the error will be raised, and handled, when the fire is run
+            continue
+        for i, a in enumerate(fire.active_areas):
+            tasks.append(("feps-timeprofile-{}".format(fire.id),
+                lambda wdir, a=a: ubcbsffeps.UbcBsfFEPSTimeProfiler(
+                    a, wdir, wfrt_config)))
+            active_areas.append(a)
+            keys.append((fire._private_id, i))
+
+    if not active_areas:
+        return {}
+
+    if wfrt_config.get('in_process'):
+        return dict(zip(keys,
+            ubcbsffeps.UbcBsfFEPSTimeProfiler.run_many(active_areas, wfrt_config)))
+
+    with feps_worker_pool(working_dir=wfrt_config.get('working_dir')) as pool:
+        return dict(zip(keys, pool.run(tasks)))
+
+def _get_profiler(hourly_fractions, fire, active_area, feps_profiler=None):
+    """Returns the active area's time profiler
+
+    feps_profiler, if specified, is the active area's profiler, or the
+    exception raised instantiating it, returned by _run_ubc_bsf_feps
+    """
     tw = parse_datetimes(active_area, 'start', 'end')
 
     # Use FepsTimeProfiler for Rx fires and StaticTimeProfiler for WF,
@@ -85,7 +216,7 @@ def _get_profiler(hourly_fractions, fire, active_area):
     #   hourly_fractions are specified (or the converse - i.e. alwys use
     #   FEPS for rx and add setting to turn on use of hourly_fractions,
     #   if specified, for Rx)
-    if fire.type == 'rx' and not hourly_fractions:
+    if _uses_feps_rx_profiler(hourly_fractions, fire):
         ig_start = active_area.get('ignition_start') and parse_datetime(
             active_area['ignition_start'], k='ignition_start')
         ig_end = active_area.get('ignition_end') and parse_datetime(
@@ -101,7 +232,12 @@ def _get_profiler(hourly_fractions, fire, active_area):
 
     else:
         model_name = Config().get("timeprofile", "model").lower()
-        if model_name == "ubc-bsf-feps":
+        if model_name == "ubc-bsf-feps" and feps_profiler is not None:
+            if isinstance(feps_profiler, Exception):
+                raise feps_profiler
+            return feps_profiler
+
+        elif model_name == "ubc-bsf-feps":
             wfrtConfig = Config().get('timeprofile', 'ubc-bsf-feps')
             with osutils.create_working_dir(working_dir=wfrtConfig.get('working_dir')) as wdir:
                 fire_working_dir = os.path.join(wdir, "feps-timeprofile-{}".format(fire.id))
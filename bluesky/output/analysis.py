@@ -3,6 +3,7 @@ import json
 from collections import defaultdict
 
 from bluesky import models, locationutils
+from bluesky.hourlyseries import HourlySeries
 from bluesky.modules import fuelbeds
 
 
@@ -10,6 +11,8 @@ class SummarizedFiresEncoder(json.JSONEncoder):
     def default(self, obj):
         if hasattr(obj, 'tolist'):
             return obj.tolist()
+        elif isinstance(obj, HourlySeries):
+            return obj.to_dict()
         elif isinstance(obj, datetime.date):
             return obj.isoformat()
         # elif isinstance(obj, pd.DataFrame):
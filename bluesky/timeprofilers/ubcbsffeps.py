@@ -1,5 +1,6 @@
 __author__      = "Tobias Schmidt"
 
+import copy
 import os
 import subprocess
 import logging
@@ -11,6 +12,8 @@ from math import degrees as deg, radians as rad
 
 from pyairfire import sun
 
+from bluesky import fepsengine
+
 # required executables
 FEPS_WEATHER_BINARY = "feps_weather"
 FEPS_TIMEPROFILE_BINARY = "feps_timeprofile"
@@ -36,17 +39,84 @@ class UbcBsfFEPSTimeProfiler(object):
     def config(self, key):
         return self._config[key]
 
-    def __init__(self, active_area, local_working_dir, config):
+    def __init__(self, active_area, local_working_dir, config,
+            hourly_fractions=None, filled_location_info=None):
         self._config = config
-        self._run(active_area, local_working_dir)
+        # Weather and location info missing from the active area's
+        # specified point is filled in with defaults on a copy of the
+        # point, rather than on the point itself, and recorded here, for
+        # the caller to set on the point (see bluesky.modules.timeprofile)
+        self.filled_location_info = filled_location_info or {}
+        if hourly_fractions is None:
+            self._run(active_area, local_working_dir)
+        else:
+            # computed in process, by run_many
+            self.hourly_fractions = hourly_fractions
+            self.start_hour = active_area["start"]
+            self.ONE_HOUR = timedelta(hours=1)
 
-    def _run(self, active_area, working_dir):
+    @classmethod
+    def run_many(cls, active_areas, config):
+        """Computes time profiles for list of active areas in process,
+        with bluesky.fepsengine, rather than running the feps binaries for
+        each one
+
+        Returns list of profilers, with exceptions in place of the
+        profilers of active areas that failed
+        """
+        results = [None] * len(active_areas)
+        valid = []
+        for i, active_area in enumerate(active_areas):
+            try:
+                cls._validate(active_area)
+                active_area, fire_location_info = cls._copy_active_area(
+                    active_area)
+                filled = cls._fill_fire_location_info(active_area,
+                    fire_location_info)
+                valid.append((i, active_area, fire_location_info,
+                    cls._get_consumption(active_area), filled))
+            except Exception as e:
+                results[i] = e
+
+        if valid:
+            weather = fepsengine.diurnal_weather(*[
+                [v[2][k] for v in valid] for k in cls.WEATHER_KEYS])
+            profiles = fepsengine.time_profile(
+                [v[3] for v in valid],
+                [cls._get_growth(v[1]) for v in valid],
+                weather['humid'], weather['wind_flame'],
+                normalize=bool(config.get("normalize")))
+            for j, (i, active_area, _, _, filled) in enumerate(valid):
+                hourly_fractions = {k: profiles[k][j].tolist()
+                    for k in ["area_fraction", "flaming", "residual", "smoldering"]}
+                results[i] = cls(active_area, None, config,
+                    hourly_fractions=hourly_fractions,
+                    filled_location_info=filled)
+
+        return results
+
+    @staticmethod
+    def _validate(active_area):
         if active_area["consumption"] is None:
             raise ValueError("Missing consumption data for Canadian timeprofiling")
         if len(active_area["specified_points"]) != 1:
             raise ValueError("There should be exactly one specified_point per activity object before running Canadian timeprofiling")
 
-        diurnalFile = self._get_diurnal_file(active_area, active_area["specified_points"][0],working_dir)
+    @staticmethod
+    def _copy_active_area(active_area):
+        """Returns shallow copies of the active area and of its specified
+        point, in which to fill in weather and location info
+        """
+        active_area = copy.copy(active_area)
+        fire_location_info = copy.copy(active_area["specified_points"][0])
+        active_area["specified_points"] = [fire_location_info]
+        return active_area, fire_location_info
+
+    def _run(self, active_area, working_dir):
+        self._validate(active_area)
+
+        active_area, fire_location_info = self._copy_active_area(active_area)
+        diurnalFile = self._get_diurnal_file(active_area, fire_location_info, working_dir)
 
         consumptionFile = os.path.join(working_dir, "cons.txt")
         growthFile = os.path.join(working_dir, "growth.txt")
@@ -78,36 +148,54 @@ class UbcBsfFEPSTimeProfiler(object):
         self.start_hour = active_area["start"]
         self.ONE_HOUR = timedelta(hours=1)
 
-    def writeConsumption(self, active_area, filename):
+    @staticmethod
+    def _get_consumption(active_area):
+        """Returns flaming, smoldering, residual, and duff consumption per
+        area, and average duff moisture, over all specified points
+        """
         cons = active_area["consumption"]["summary"]
-
-        # compute total area and average moisture_duff over all specified points
         area = sum([l['area'] for l in active_area['specified_points']])
         mduff = sum([
             l['moisture_duff'] for l in active_area['specified_points']
         ]) / len(active_area['specified_points'])
+        return [cons["flaming"] / area, cons["smoldering"] / area,
+            cons["residual"] / area, cons["duff"] / area, mduff]
+
+    def writeConsumption(self, active_area, filename):
+        cons_flm, cons_sts, cons_lts, cons_duff, mduff = self._get_consumption(
+            active_area)
 
         f = open(filename, 'w')
-        f.write("cons_flm={}\n".format(cons["flaming"] / area))
-        f.write("cons_sts={}\n".format(cons["smoldering"] / area))
-        f.write("cons_lts={}\n".format(cons["residual"] / area))
-        f.write("cons_duff={}\n".format(cons["duff"] / area))
+        f.write("cons_flm={}\n".format(cons_flm))
+        f.write("cons_sts={}\n".format(cons_sts))
+        f.write("cons_lts={}\n".format(cons_lts))
+        f.write("cons_duff={}\n".format(cons_duff))
         f.write("moist_duff={}\n".format(mduff))
         f.close()
 
+    @classmethod
+    def _get_growth(cls, active_area):
+        """Returns cumulative area for each hour of the day
+
+        NOTE: We are assuming that all fires are of the type WF.
+        This is based off of the standard being said by CWFIS and smartfire.
+        See the orginal framework's version of this method to see how it used to be done.
+        """
+        area = active_area["specified_points"][0]["area"]
+        growth = []
+        cumul_size = 0
+        for size_fract in cls.WRAP_TIME_PROFILE:
+            cumul_size += area * size_fract
+            growth.append(cumul_size)
+        return growth
+
     def writeGrowth(self, active_area, filename):
         f = open(filename, 'w')
         f.write("day, hour, size\n")
-        cumul_size = 0
         # Write area measurements using WRAP curve
-        # NOTE: We are assuming that all fires are of the type WF.
-        # This is based off of the standard being said by CWFIS and smartfire.
-        # See the orginal framework's version of this method to see how it used to be done.
-        for h, size_fract in enumerate(self.WRAP_TIME_PROFILE):
+        for h, cumul_size in enumerate(self._get_growth(active_area)):
             day = h // 24
             hour = h % 24
-            size = active_area["specified_points"][0]["area"] * size_fract
-            cumul_size += size
             f.write("%d, %d, %f\n" %(day, hour, cumul_size))
         f.close()
 
@@ -129,7 +217,8 @@ class UbcBsfFEPSTimeProfiler(object):
 
     # The next 2 methods were copied from AirFire with some modifications
     def _get_diurnal_file(self, active_area, fire_location_info, working_dir):
-        self._fill_fire_location_info(active_area, fire_location_info)
+        self.filled_location_info = self._fill_fire_location_info(
+            active_area, fire_location_info)
 
         weather_file = os.path.join(working_dir, "weather.txt")
         diurnal_file = os.path.join(working_dir, "diurnal.txt")
@@ -175,10 +264,20 @@ class UbcBsfFEPSTimeProfiler(object):
         # but note that in AirFire's BSP it is set to 100
         "moisture_duff": 40
     }
-    def _fill_fire_location_info(self, fire_loc, fire_location_info):
-        for k, v in list(self.FIRE_LOCATION_INFO_DEFAULTS.items()):
+    # feps_weather inputs, in the order of fepsengine.diurnal_weather's args
+    WEATHER_KEYS = ['sunset_hour', 'max_temp_hour', 'min_temp_hour',
+        'min_humid', 'max_humid', 'min_temp', 'max_temp', 'min_wind',
+        'max_wind', 'min_wind_aloft', 'max_wind_aloft']
+
+    @classmethod
+    def _fill_fire_location_info(cls, fire_loc, fire_location_info):
+        """Fills in missing weather and location info, returning the
+        values filled in
+        """
+        filled = {}
+        for k, v in list(cls.FIRE_LOCATION_INFO_DEFAULTS.items()):
             if fire_location_info.get(k) is None:
-                fire_location_info[k] = v
+                fire_location_info[k] = filled[k] = v
         if fire_location_info.get('sunset_hour') is None:
             dt = fire_loc['start']
             utc_offset = fire_loc['utc_offset']
@@ -191,3 +290,6 @@ class UbcBsfFEPSTimeProfiler(object):
                 # this calculation can fail near the North/South poles
                 fire_location_info['sunrise_hour'] = 6
                 fire_location_info['sunset_hour'] = 18
+            filled['sunrise_hour'] = fire_location_info['sunrise_hour']
+            filled['sunset_hour'] = fire_location_info['sunset_hour']
+        return filled
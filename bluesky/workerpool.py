@@ -0,0 +1,161 @@
+"""bluesky.workerpool
+
+Bounded pool of worker threads for running external binaries, such as
+the feps_* executables, for many locations concurrently.
+
+Each task is a function that's passed a working directory, in which it
+writes its input files, runs its binary, and reads its output files.
+Tasks have a group name, used in one of two ways:
+
+ - If the pool is given a working directory (e.g. if the user configured
+   one, in order to keep the binaries' input and output files), each
+   group gets its own subdirectory, e.g. 'feps-plumerise-<fire id>', and
+   tasks in the same group are run one after the other, in order, since
+   they share files.  Groups are run concurrently.
+ - Otherwise, each worker gets a scratch directory, on tmpfs if
+   available, which it reuses for all of its tasks, clearing it out
+   before each one.  All tasks are run concurrently.
+
+Results are returned in the order the tasks were given. A task that
+fails doesn't affect the others; its exception is returned in place of
+its result, so that callers can record failures per location.
+"""
+
+__author__ = "Joel Dubowy"
+
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pyairfire import osutils
+
+from bluesky.config import Config
+
+__all__ = [
+    'WorkerPool',
+    'feps_worker_pool'
+]
+
+TMPFS_DIR = '/dev/shm'
+
+def get_scratch_root(scratch_dir=None):
+    """Returns directory in which to create worker scratch directories,
+    preferring tmpfs, or None to use the system default temp directory
+    """
+    if scratch_dir:
+        return scratch_dir
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+        return TMPFS_DIR
+    return None
+
+
+class WorkerPool(object):
+
+    def __init__(self, num_workers=1, working_dir=None, scratch_dir=None):
+        self._num_workers = max(1, num_workers or 1)
+        self._working_dir = working_dir
+        self._scratch_root = get_scratch_root(scratch_dir)
+        self._local = threading.local()
+        self._scratch_dirs = []
+        self._lock = threading.Lock()
+
+    def run(self, tasks):
+        """Runs list of (group, func) tasks, calling func(working_dir),
+        and returns list of results, in task order, with exceptions in
+        place of the results of tasks that failed
+        """
+        results = [None] * len(tasks)
+
+        if self._working_dir:
+            groups = OrderedDict()
+            for i, (group, func) in enumerate(tasks):
+                groups.setdefault(group, []).append((i, func))
+            units = [(self._run_group, group, group_tasks)
+                for group, group_tasks in groups.items()]
+        else:
+            units = [(self._run_scratch, None, [(i, func)])
+                for i, (group, func) in enumerate(tasks)]
+
+        logging.debug("Running %s tasks with %s workers", len(tasks),
+            self._num_workers)
+        if self._num_workers == 1 or len(units) < 2:
+            for f, group, unit_tasks in units:
+                f(group, unit_tasks, results)
+        else:
+            with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+                # Note: each unit catches its tasks' exceptions
+                list(executor.map(lambda u: u[0](u[1], u[2], results), units))
+
+        return results
+
+    def _run_group(self, group, tasks, results):
+        working_dir = os.path.join(self._working_dir, group)
+        if not os.path.exists(working_dir):
+            os.makedirs(working_dir)
+        for i, func in tasks:
+            results[i] = self._call(func, working_dir)
+
+    def _run_scratch(self, group, tasks, results):
+        working_dir = self._get_scratch_dir()
+        for i, func in tasks:
+            # clear out previous task's files, so that they're not
+            # mistaken for this task's output
+            for f in os.listdir(working_dir):
+                p = os.path.join(working_dir, f)
+                if os.path.isdir(p):
+                    shutil.rmtree(p)
+                else:
+                    os.remove(p)
+            results[i] = self._call(func, working_dir)
+
+    def _get_scratch_dir(self):
+        scratch_dir = getattr(self._local, 'scratch_dir', None)
+        if not scratch_dir:
+            scratch_dir = tempfile.mkdtemp(prefix='bsp-worker-',
+                dir=self._scratch_root)
+            self._local.scratch_dir = scratch_dir
+            with self._lock:
+                self._scratch_dirs.append(scratch_dir)
+        return scratch_dir
+
+    def _call(self, func, working_dir):
+        try:
+            return func(working_dir)
+        except Exception as e:
+            return e
+
+    def close(self):
+        for scratch_dir in self._scratch_dirs:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        self._scratch_dirs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, e_type, value, tb):
+        self.close()
+
+
+@contextlib.contextmanager
+def feps_worker_pool(working_dir=None):
+    """Yields pool for running feps binaries, configured by 'feps_workers'
+
+    With one worker, or if working_dir is specified, each task group
+    gets its own subdirectory in working_dir, or in a temporary directory
+    that's removed afterwards. Otherwise, workers use scratch directories.
+    """
+    num_workers = Config().get('feps_workers', 'num_workers') or 1
+    if num_workers > 1 and not working_dir:
+        with WorkerPool(num_workers, scratch_dir=Config().get(
+                'feps_workers', 'scratch_dir')) as pool:
+            yield pool
+
+    else:
+        with osutils.create_working_dir(working_dir=working_dir) as wdir:
+            with WorkerPool(num_workers, working_dir=wdir) as pool:
+                yield pool
@@ -19,6 +19,7 @@ setup(
     scripts=[
         'bin/bsp',
         'bin/bsp-run-info',
+        'bin/bsp-build-tables',
         'bin/bsp-output-visualizer'
     ],
     classifiers=[
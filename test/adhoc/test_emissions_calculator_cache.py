@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""Benchmarks Prichard / O'Neill emissions on 10k fuelbed rows, comparing
+a new Fccs2Ef and EmissionsCalculator per fuelbed with calculators from
+EmissionsCalculatorCache, and checks that both produce the same emissions.
+
+The number of rows can be set with env var BSP_TEST_NUM_FUELBEDS
+(default 10000), and the number of distinct fccs ids with
+BSP_TEST_NUM_FCCS_IDS (default 50).
+"""
+
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+sys.path.insert(0, ROOT_DIR) # in case this script is run outside of py.test
+
+from emitcalc.calculator import EmissionsCalculator
+from eflookup.fccs2ef.lookup import Fccs2Ef
+
+from bluesky.modules import emissions
+
+NUM_FUELBEDS = int(os.environ.get('BSP_TEST_NUM_FUELBEDS') or 10000)
+NUM_FCCS_IDS = int(os.environ.get('BSP_TEST_NUM_FCCS_IDS') or 50)
+SPECIES = ['CH4', 'CO', 'CO2', 'NH3', 'NOx', 'PM10', 'PM2.5', 'SO2', 'VOC']
+
+CATEGORIES = {
+    'canopy': ['overstory', 'midstory', 'understory'],
+    'ground fuels': ['duff lower', 'duff upper'],
+    'litter-lichen-moss': ['litter'],
+    'nonwoody': ['primary live'],
+    'shrub': ['primary live'],
+    'woody fuels': ['1-hr fuels', '10-hr fuels', '100-hr fuels']
+}
+
+def _consumption(i):
+    v = 1.0 + (i % 17)
+    return {c: {sc: {'flaming': [v], 'smoldering': [v / 2],
+                'residual': [v / 4], 'total': [v * 1.75]}
+            for sc in subcategories}
+        for c, subcategories in CATEGORIES.items()}
+
+def _rows():
+    # fccs ids 1 through 50 cover most of the FCCS fuelbed numbering range
+    return [(str(1 + i % NUM_FCCS_IDS), i % 3 == 0, _consumption(i))
+        for i in range(NUM_FUELBEDS)]
+
+def _run_uncached(rows):
+    results = []
+    for fccs_id, is_rx, consumption in rows:
+        calculator = EmissionsCalculator(Fccs2Ef(fccs_id, is_rx=is_rx),
+            species=SPECIES)
+        results.append(calculator.calculate(consumption)['summary']['total'])
+    return results
+
+def _run_cached(rows):
+    calculators = emissions.EmissionsCalculatorCache()
+    results = []
+    for fccs_id, is_rx, consumption in rows:
+        calculator = calculators.get_prichard_oneill_calculator(
+            fccs_id, is_rx, SPECIES)
+        results.append(calculator.calculate(consumption)['summary']['total'])
+    return results, calculators.stats
+
+def test_cached_calculators_faster_and_equivalent():
+    rows = _rows()
+
+    t = time.time()
+    expected = _run_uncached(rows)
+    uncached_time = time.time() - t
+
+    t = time.time()
+    actual, stats = _run_cached(rows)
+    cached_time = time.time() - t
+
+    print("{} fuelbeds - uncached: {:.3f}s, cached: {:.3f}s ({:.1f}x), "
+        "stats: {}".format(NUM_FUELBEDS, uncached_time, cached_time,
+        uncached_time / cached_time, stats))
+
+    assert actual == expected
+    assert stats['misses'] == len(set((r[0], r[1]) for r in rows))
+    assert cached_time < uncached_time
+
+
+if __name__ == '__main__':
+    test_cached_calculators_faster_and_equivalent()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""Tests that a large run completes, within a memory cap, when fires are
+kept in the sqlite fires store.
+
+A synthetic run with 500k locations is built, iterated over as the modules
+would, adding data to each location, and then dumped. This is done in a
+subprocess so that its peak RSS can be measured in isolation.
+
+The cap, in MB, can be set with env var BSP_TEST_MAX_RSS_MB (default 1024),
+and the number of locations with BSP_TEST_NUM_LOCATIONS (default 500000).
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+sys.path.insert(0, ROOT_DIR) # in case this script is run outside of py.test
+
+MAX_RSS_MB = int(os.environ.get('BSP_TEST_MAX_RSS_MB') or 1024)
+NUM_LOCATIONS = int(os.environ.get('BSP_TEST_NUM_LOCATIONS') or 500000)
+LOCATIONS_PER_FIRE = 10
+
+SCRIPT = """
+import sys
+sys.path.insert(0, {root_dir!r})
+
+from bluesky.config import Config
+from bluesky.models.fires import Fire, FiresManager
+
+Config().set({{"fires_store": {{"type": "sqlite", "dir": {tmp_dir!r}}}}})
+
+fires_manager = FiresManager()
+fires_manager.add_fires(Fire({{
+        "id": str(i),
+        "activity": [{{
+            "active_areas": [{{
+                "start": "2019-08-01T00:00:00",
+                "end": "2019-08-02T00:00:00",
+                "utc_offset": "-07:00",
+                "specified_points": [
+                    {{"lat": 45.0 + j * 0.001, "lng": -120.0, "area": 100}}
+                    for j in range({locations_per_fire})
+                ]
+            }}]
+        }}]
+    }}) for i in range({num_fires}))
+
+# simulate modules adding data to each location
+for fire in fires_manager.fires:
+    with fires_manager.fire_failure_handler(fire):
+        for loc in fire.locations:
+            loc["fuelbeds"] = [{{
+                "fccs_id": "52", "pct": 100.0,
+                "emissions": {{"flaming": {{"PM2.5": [1.0] * 24}}}}
+            }}]
+
+with open({output_file!r}, 'w') as f:
+    fires_manager.dumps(output_stream=f)
+"""
+
+
+def test_peak_rss_under_cap():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        script = SCRIPT.format(root_dir=ROOT_DIR, tmp_dir=tmp_dir,
+            num_fires=NUM_LOCATIONS // LOCATIONS_PER_FIRE,
+            locations_per_fire=LOCATIONS_PER_FIRE,
+            output_file=os.path.join(tmp_dir, 'output.json'))
+        subprocess.check_call([sys.executable, '-c', script])
+
+    # ru_maxrss is in KB on linux
+    max_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    assert max_rss_mb < MAX_RSS_MB
+
+
+if __name__ == '__main__':
+    test_peak_rss_under_cap()
@@ -374,3 +374,58 @@ class TestDispersionBaseSetFireData(object):
             for k in f.keys():
                 assert f[k] == expected_fires[i][k], "{} don't match".format(k)
 
+
+    def test_hourly_emissions_with_invalid_fire(self, reset_config):
+        Config().set(True, "dispersion", "hysplit", "skip_invalid_fires")
+        fm = fires.FiresManager()
+        fm.fires = [
+            # missing area
+            fires.Fire({
+                "id": "a",
+                "activity": [{"active_areas": [{
+                    "start": "2015-08-04T17:00:00",
+                    "end": "2015-08-05T17:00:00",
+                    "utc_offset": "-07:00",
+                    "specified_points": [{"lat": 47.41, "lng": -121.41}]
+                }]}]
+            }),
+            fires.Fire({
+                "id": "b",
+                "activity": [{"active_areas": [{
+                    "start": "2015-08-04T17:00:00",
+                    "end": "2015-08-05T17:00:00",
+                    "utc_offset": "-07:00",
+                    "specified_points": [{
+                        "area": 120.0,
+                        "lat": 47.41,
+                        "lng": -121.41,
+                        "consumption": CONSUMPTION,
+                        "fuelbeds": [{
+                            "emissions": {
+                                "flaming": {"PM2.5": [10.0]},
+                                "residual": {"PM2.5": [20.0]},
+                                "smoldering": {"PM2.5": [30.0]}
+                            },
+                            "pct": 100.0
+                        }],
+                        "plumerise": {
+                            "2015-08-04T17:00:00": PLUMERISE_HOUR
+                        },
+                        "timeprofile": {
+                            "2015-08-04T17:00:00": {
+                                "area_fraction": 0.1, "flaming": 0.2,
+                                "residual": 0.1, "smoldering": 0.1
+                            }
+                        }
+                    }]
+                }]}]
+            })
+        ]
+
+        self.d._set_fire_data(fm.fires, hourly_emissions=fm.hourly_emissions)
+
+        assert len(self.d._fires) == 1
+        assert self.d._fires[0]['timeprofiled_emissions'] == {
+            "2015-08-04T17:00:00": {"CO": 0.0, "PM2.5": 7.0},
+            "2015-08-04T18:00:00": {"CO": 0.0, "PM2.5": 0.0}
+        }
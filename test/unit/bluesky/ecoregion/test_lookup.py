@@ -36,6 +36,14 @@ class BaseLookupEcoregionTest(object):
         # on land but outside of shapefile area
         assert None == self.ecoregion_lookup.lookup(19, -100)
 
+    def test_lookup_many(self):
+        assert self.ecoregion_lookup.lookup_many([(45, -118), (32, -88),
+            (66, -149), (28, -88), (45.00001, -118.00001)]) == [
+            'western', 'southern', 'boreal', None, 'western']
+
+        with raises(BlueSkyGeographyValueError) as e_info:
+            self.ecoregion_lookup.lookup_many([(45, -118), (99, -122)])
+
 class TestLookupEcoregionShapely(BaseLookupEcoregionTest):
 
     def setup(self):
@@ -0,0 +1,149 @@
+"""Unit tests for bluesky.extrafilewriters.sqlitedb"""
+
+__author__ = "Joel Dubowy"
+
+import json
+import os
+import sqlite3
+import tempfile
+
+from bluesky.config import Config
+from bluesky.models import activity
+from bluesky.models.fires import Fire, FiresManager
+from bluesky.extrafilewriters import sqlitedb
+
+
+FIRES = [
+    {
+        "id": "SF11C14225236095807750",
+        "type": "wildfire",
+        "event_of": {"id": "SF11E826544", "name": "Natural Fire"},
+        "activity": [{
+            "active_areas": [{
+                "start": "2015-08-04T17:00:00",
+                "end": "2015-08-05T17:00:00",
+                "utc_offset": "-07:00",
+                "state": "ID",
+                "specified_points": [
+                    {
+                        "lat": 47.0, "lng": -121.0, "area": 1000.0,
+                        "fuelbeds": [
+                            {"fccs_id": "52", "pct": 60.0},
+                            {"fccs_id": "9", "pct": 40.0}
+                        ],
+                        "emissions": {
+                            "summary": {"PM2.5": 10.0, "CO": 20.0,
+                                "total": 30.0}
+                        },
+                        "plumerise": {
+                            "2015-08-04T17:00:00": {
+                                "heights": [100, 200, 300],
+                                "smolder_fraction": 0.1
+                            },
+                            "2015-08-04T18:00:00": {
+                                "heights": [200, 400, 600],
+                                "smolder_fraction": 0.3
+                            }
+                        }
+                    },
+                    {
+                        "lat": 47.1, "lng": -121.1, "area": 500.0,
+                        "fuelbeds": [{
+                            "fccs_id": "52", "pct": 100.0,
+                            "emissions": {"total": {"PM2.5": [3.0, 2.0]}}
+                        }]
+                    }
+                ]
+            }]
+        }]
+    },
+    {
+        "id": "SF11C14225236095807751",
+        "type": "rx",
+        "activity": [{
+            "active_areas": [{
+                "start": "2015-08-04T17:00:00",
+                "end": "2015-08-05T17:00:00",
+                "utc_offset": "-06:00",
+                "state": "MT",
+                "specified_points": [
+                    {"lat": 46.0, "lng": -111.0, "area": 200.0}
+                ]
+            }]
+        }]
+    }
+]
+
+
+class TestSqliteDbWriter(object):
+
+    def test_write(self, reset_config):
+        fires_manager = FiresManager()
+        fires_manager.fires = [Fire(f) for f in FIRES]
+
+        with tempfile.TemporaryDirectory() as dest_dir:
+            writer = sqlitedb.SqliteDbWriter(dest_dir)
+            r = writer.write(fires_manager)
+            assert r == {"filename": "bluesky.sqlite"}
+
+            conn = sqlite3.connect(os.path.join(dest_dir, r['filename']))
+            try:
+                run = dict(conn.execute("SELECT key, value FROM run"))
+                assert json.loads(run['run_id']) == fires_manager.run_id
+                assert json.loads(run['counts'])['fires'] == 2
+
+                assert conn.execute("SELECT id, event_id, area, num_locations "
+                    "FROM fires WHERE area > 1000").fetchall() == [
+                    ("SF11C14225236095807750", "SF11E826544", 1500.0, 2)]
+
+                assert conn.execute("SELECT l.state, SUM(e.total) "
+                    "FROM emissions e JOIN locations l "
+                    "ON l.pk = e.location_pk WHERE e.species = 'PM2.5' "
+                    "GROUP BY l.state").fetchall() == [("ID", 15.0)]
+
+                assert conn.execute("SELECT fccs_id FROM locations "
+                    "ORDER BY pk").fetchall() == [("52",), ("52",), (None,)]
+
+                assert conn.execute("SELECT num_hours, min_plume_bottom, "
+                    "max_plume_top, mean_smolder_fraction "
+                    "FROM plumerise").fetchall() == [(2, 100, 600, 0.2)]
+            finally:
+                conn.close()
+
+    def test_write_failed_fires_and_dispersion_counts(self, reset_config):
+        fires_manager = FiresManager()
+        fires_manager.fires = [Fire(FIRES[1])]
+        fires_manager.dispersion = {"counts": {"fires": 1, "locations": 1}}
+        fires_manager.failed_fires = [
+            # invalid location data, with an error already recorded
+            Fire({"id": "f1", "error": {"type": "ValueError",
+                    "message": "oops"},
+                "activity": [{"active_areas": [{
+                    "start": "2015-08-04T17:00:00",
+                    "specified_points": [{"lat": 47.0, "lng": -121.0}]
+                }]}]}),
+            # invalid location data, without an error
+            Fire({"id": "f2", "activity": [{"active_areas": [{
+                "specified_points": [{"lat": 47.0}]}]}]})
+        ]
+
+        with tempfile.TemporaryDirectory() as dest_dir:
+            r = sqlitedb.SqliteDbWriter(dest_dir).write(fires_manager)
+            conn = sqlite3.connect(os.path.join(dest_dir, r['filename']))
+            try:
+                run = dict(conn.execute("SELECT key, value FROM run"))
+                assert json.loads(run['dispersion_counts']) == {
+                    "fires": 1, "locations": 1}
+
+                assert conn.execute("SELECT id, failed, num_locations, "
+                    "error_type, error_message FROM fires "
+                    "ORDER BY pk").fetchall() == [
+                    ("SF11C14225236095807751", 0, 1, None, None),
+                    ("f1", 1, 0, "ValueError", "oops"),
+                    ("f2", 1, 0, "ValueError",
+                        activity.INVALID_LOCATION_MSGS['specified_points'])
+                ]
+                assert conn.execute("SELECT COUNT(*) FROM active_areas "
+                    ).fetchone()[0] == 3
+            finally:
+                conn.close()
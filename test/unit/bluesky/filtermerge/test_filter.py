@@ -873,3 +873,47 @@ class TestFiresManagerFilterFiresByTime(object):
         assert self.fm.num_fires == 0
         assert self.fm.num_locations == 0
         assert expected == sorted(self.fm.fires, key=lambda e: int(e.id))
+
+
+class TestFiresManagerFilterFiresByDispersionWindow(object):
+
+    setup = TestFiresManagerFilterFiresByTime.setup
+
+    def test_invalid_config(self, reset_config):
+        Config().set(False, 'filter', 'skip_failures')
+        Config().set({"buffer_hours": 0}, 'filter', 'dispersion_window')
+        with raises(fires.FireActivityFilter.FilterError) as e_info:
+            self.fm.filter_fires()
+        assert e_info.value.args[0] == fires.FireActivityFilter.SPECIFY_DISPERSION_START_AND_NUM_HOURS_MSG
+
+        Config().set("2019-01-03T00:00:00", 'dispersion', 'start')
+        Config().set(24, 'dispersion', 'num_hours')
+        Config().set({"buffer_hours": "sdf"}, 'filter', 'dispersion_window')
+        with raises(fires.FireActivityFilter.FilterError) as e_info:
+            self.fm.filter_fires()
+        assert e_info.value.args[0] == fires.FireActivityFilter.INVALID_BUFFER_HOURS_MSG
+        assert self.init_fires == sorted(self.fm.fires, key=lambda e: int(e.id))
+
+    def test_remove_all_but_middle_aas(self, reset_config):
+        Config().set("2019-01-03T00:00:00", 'dispersion', 'start')
+        Config().set(24, 'dispersion', 'num_hours')
+        Config().set({"buffer_hours": 0}, 'filter', 'dispersion_window')
+        self.fm.filter_fires()
+        assert self.fm.num_fires == 2
+        assert self.fm.num_locations == 3
+
+    def test_no_buffer_hours(self, reset_config):
+        Config().set("2019-01-03T00:00:00", 'dispersion', 'start')
+        Config().set(24, 'dispersion', 'num_hours')
+        Config().set({}, 'filter', 'dispersion_window')
+        self.fm.filter_fires()
+        assert self.fm.num_fires == 2
+        assert self.fm.num_locations == 3
+
+    def test_buffer_hours(self, reset_config):
+        Config().set("2019-01-04T00:00:00", 'dispersion', 'start')
+        Config().set(24, 'dispersion', 'num_hours')
+        Config().set({"buffer_hours": 24}, 'filter', 'dispersion_window')
+        self.fm.filter_fires()
+        assert self.fm.num_fires == 2
+        assert self.fm.num_locations == 5
@@ -7,6 +7,8 @@ import datetime
 import json
 import sys
 import io
+import os
+import tempfile
 import uuid
 
 import freezegun
@@ -929,3 +931,86 @@ class TestFiresManagerSettingToday(object):
 
         fires_manager.today = "2017-10-05"
         assert fires_manager.today == datetime.datetime(2017,10,5)
+
+
+class TestFiresManagerShards(object):
+
+    def _fire(self, fire_id, lat, lng):
+        return fires.Fire({
+            'id': fire_id,
+            'activity': [{
+                'active_areas': [{
+                    'specified_points': [{'lat': lat, 'lng': lng, 'area': 10}]
+                }]
+            }]
+        })
+
+    def _fires_manager(self):
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [
+            self._fire('a', 45.5, -120.5),
+            self._fire('b', 45.2, -119.5),
+            self._fire('c', 46.1, -120.1)
+        ]
+        fires_manager.foo = {"bar": "baz"}
+        return fires_manager
+
+    def test_invalid_args(self, reset_config):
+        fires_manager = self._fires_manager()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with raises(ValueError) as e_info:
+                fires_manager.dumps_shards(tmp_dir)
+            with raises(ValueError) as e_info:
+                fires_manager.dumps_shards(tmp_dir, fires_per_shard=2,
+                    tile_size=1)
+
+    def test_by_count(self, reset_config):
+        fires_manager = self._fires_manager()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fires_manager.dumps_shards(tmp_dir, fires_per_shard=2)
+            assert sorted(os.listdir(tmp_dir)) == [
+                'fires-00000.ndjson', 'fires-00001.ndjson', 'meta.json']
+            with open(os.path.join(tmp_dir, 'fires-00000.ndjson')) as f:
+                assert [json.loads(l)['id'] for l in f] == ['a', 'b']
+
+            new_fires_manager = fires.FiresManager()
+            assert new_fires_manager.is_shards_dir(tmp_dir)
+            assert not new_fires_manager.is_shards_dir(
+                os.path.join(tmp_dir, 'meta.json'))
+            new_fires_manager.loads_shards(tmp_dir, num_processes=2)
+            assert [f.id for f in new_fires_manager.fires] == ['a', 'b', 'c']
+            assert new_fires_manager.fires == fires_manager.fires
+            assert new_fires_manager.foo == {"bar": "baz"}
+            assert new_fires_manager.run_id == fires_manager.run_id
+
+    def test_wildcards_filled_in(self, reset_config):
+        fires_manager = self._fires_manager()
+        fires_manager.run_id = 'abc'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fires_manager.dumps_shards(os.path.join(tmp_dir, '{run_id}'),
+                fires_per_shard=2)
+            assert os.listdir(tmp_dir) == ['abc']
+
+            new_fires_manager = fires.FiresManager()
+            new_fires_manager.run_id = 'abc'
+            assert new_fires_manager.is_shards_dir(
+                os.path.join(tmp_dir, '{run_id}'))
+            new_fires_manager.loads_shards(os.path.join(tmp_dir, '{run_id}'))
+            assert [f.id for f in new_fires_manager.fires] == ['a', 'b', 'c']
+
+    def test_by_tile(self, reset_config):
+        fires_manager = self._fires_manager()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fires_manager.dumps_shards(tmp_dir, tile_size=1)
+            with open(os.path.join(tmp_dir, 'meta.json')) as f:
+                meta = json.loads(f.read())
+            assert meta['shards'] == [
+                {'file': 'fires-45_-121.ndjson', 'num_fires': 1},
+                {'file': 'fires-45_-120.ndjson', 'num_fires': 1},
+                {'file': 'fires-46_-121.ndjson', 'num_fires': 1}
+            ]
+            assert 'fires' not in meta
+
+            new_fires_manager = fires.FiresManager()
+            new_fires_manager.loads_shards(tmp_dir)
+            assert [f.id for f in new_fires_manager.fires] == ['a', 'b', 'c']
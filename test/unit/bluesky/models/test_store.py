@@ -0,0 +1,251 @@
+"""Unit tests for bluesky.models.store"""
+
+__author__ = "Joel Dubowy"
+
+import copy
+import gc
+import io
+import json
+import os
+
+from py.test import raises
+
+from bluesky.config import Config
+from bluesky.models import fires
+from bluesky.models.store import SqliteFiresStore
+
+
+class TestSqliteFiresStore(object):
+
+    def setup_method(self):
+        self.store = SqliteFiresStore(batch_size=2)
+
+    def teardown_method(self):
+        self.store.close()
+
+    def test_set_get_and_pop(self):
+        f1 = fires.Fire({'id': '1', 'name': 'n1'})
+        f2 = fires.Fire({'id': '2', 'name': 'n2'})
+        f3 = fires.Fire({'id': '1', 'name': 'n3'})
+        self.store['1'] = [f1]
+        self.store['2'] = [f2]
+        self.store['1'] = self.store['1'] + [f3]
+
+        assert len(self.store) == 2
+        assert self.store.num_fires == 3
+        assert self.store.keys() == ['1', '2']
+        assert '1' in self.store
+        assert '3' not in self.store
+        assert self.store['1'] == [f1, f3]
+        assert self.store.get('3') is None
+        with raises(KeyError) as e_info:
+            self.store['3']
+
+        assert self.store.pop('1') == [f1, f3]
+        assert self.store.pop('1', None) is None
+        assert self.store.keys() == ['2']
+        assert self.store.num_fires == 1
+
+    def test_add_fires(self):
+        f1 = fires.Fire({'id': '1', 'name': 'n1'})
+        f2 = fires.Fire({'id': '2', 'name': 'n2'})
+        f3 = fires.Fire({'id': '1', 'name': 'n3'})
+        assert self.store.add_fires(f for f in [f1, f2]) == 2
+        assert self.store.add_fires([f3]) == 1
+        assert self.store.add_fires([]) == 0
+
+        assert self.store.keys() == ['1', '2']
+        assert self.store.num_fires == 3
+        assert self.store['1'] == [f1, f3]
+        assert list(self.store.paged_fires()) == [f1, f2, f3]
+
+    def test_iteration_writes_back_changes(self):
+        for i in range(5):
+            self.store[str(i)] = [fires.Fire({'id': str(i)})]
+
+        for fire in self.store.paged_fires():
+            fire['foo'] = int(fire.id) * 2
+            # lookups by id return the objects being modified
+            assert self.store[fire.id][0] is fire
+
+        assert [f['foo'] for f in self.store.paged_fires()] == [0, 2, 4, 6, 8]
+
+    def test_paged_fires_indexing_and_comparing(self):
+        fires_list = [fires.Fire({'id': str(i)}) for i in range(5)]
+        self.store.add_fires(fires_list)
+        paged_fires = self.store.paged_fires()
+
+        assert paged_fires[0] == fires_list[0]
+        assert paged_fires[3] == fires_list[3]
+        assert paged_fires[-1] == fires_list[4]
+        assert paged_fires[1:4] == fires_list[1:4]
+        assert paged_fires[::2] == fires_list[::2]
+        assert paged_fires[::-2] == fires_list[::-2]
+        assert paged_fires[7:] == []
+        with raises(IndexError) as e_info:
+            paged_fires[5]
+        with raises(IndexError) as e_info:
+            paged_fires[-6]
+
+        assert paged_fires == fires_list
+        assert paged_fires == self.store.paged_fires()
+        assert paged_fires != fires_list[:4]
+        assert paged_fires != fires_list[:4] + [fires.Fire({'id': '5'})]
+        assert list(paged_fires + fires_list[:1]) == fires_list + fires_list[:1]
+
+    def test_close_removes_file(self):
+        filename = self.store._filename
+        assert os.path.exists(filename)
+        self.store.close()
+        assert not os.path.exists(filename)
+
+
+class TestFiresManagerWithSqliteStore(object):
+
+    def setup_method(self):
+        Config().reset()
+        Config().set('sqlite', 'fires_store', 'type')
+        Config().set(2, 'fires_store', 'batch_size')
+
+    def teardown_method(self):
+        Config().reset()
+
+    def test_fire_failure_handler(self):
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [
+            fires.Fire({'id': '1', 'name': 'n1'}),
+            fires.Fire({'id': '2', 'name': 'n2'}),
+            fires.Fire({'id': '3', 'name': 'n3'})
+        ]
+        assert isinstance(fires_manager._fires, SqliteFiresStore)
+        Config().set(True, "skip_failed_fires")
+        for fire in fires_manager.fires:
+            with fires_manager.fire_failure_handler(fire):
+                if fire.id == '2':
+                    raise RuntimeError("oops")
+                fire['processed'] = True
+
+        assert fires_manager.num_fires == 2
+        assert [f.id for f in fires_manager.fires] == ['1', '3']
+        assert all([f['processed'] for f in fires_manager.fires])
+        assert len(fires_manager.failed_fires) == 1
+        assert fires_manager.failed_fires[0].id == '2'
+
+    def test_add_fires(self):
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [{'id': '1'}, {'id': '2'}]
+        fires_manager.add_fires({'id': str(i)} for i in range(3, 6))
+        fires_manager.add_fire(fires.Fire({'id': '1'}))
+        assert fires_manager.num_fires == 6
+        assert [f.id for f in fires_manager.fires] == [
+            '1', '2', '3', '4', '5', '1']
+        assert all([isinstance(f, fires.Fire) for f in fires_manager.fires])
+
+    def test_set_fires_from_own_fires(self):
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [{'id': str(i)} for i in range(5)]
+        old_store = fires_manager._fires
+
+        fires_manager.fires = (f for f in fires_manager.fires
+            if int(f.id) % 2 == 0)
+        assert fires_manager._fires is not old_store
+        assert not os.path.exists(old_store._filename)
+        assert fires_manager.num_fires == 3
+        assert [f.id for f in fires_manager.fires] == ['0', '2', '4']
+
+    def test_apply_by_fire(self):
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [fires.Fire({'id': str(i)}) for i in range(5)]
+        Config().set(True, "skip_failed_fires")
+
+        results = {f._private_id: int(f.id) * 2 for f in fires_manager.fires}
+        results[fires_manager.fires[3]._private_id] = RuntimeError("oops")
+        def _apply(fire, r):
+            if isinstance(r, Exception):
+                raise r
+            fire['foo'] = r
+        fires_manager.apply_by_fire(results, _apply)
+
+        assert [(f.id, f['foo']) for f in fires_manager.fires] == [
+            ('0', 0), ('1', 2), ('2', 4), ('4', 8)]
+        assert [f.id for f in fires_manager.failed_fires] == ['3']
+
+    def test_changes_to_held_fires_are_saved(self):
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [{
+            'id': str(i),
+            'activity': [{'active_areas': [{
+                'specified_points': [{'lat': 45.0, 'lng': -120.0, 'area': 10}]
+            }]}]
+        } for i in range(5)]
+
+        held_fires = list(fires_manager.fires)
+        # held only through their locations
+        held_locations = [f.locations[0] for f in fires_manager.fires]
+        held_fires[0]['foo'] = 'bar'
+        for i, loc in enumerate(held_locations):
+            loc['baz'] = i
+        # not held at all
+        fires_manager.fires[2]['qux'] = 'quux'
+        del held_fires
+        gc.collect()
+
+        fires_list = list(fires_manager.fires)
+        assert fires_list[0]['foo'] == 'bar'
+        assert fires_list[2]['qux'] == 'quux'
+        assert [f.locations[0]['baz'] for f in fires_list] == [0, 1, 2, 3, 4]
+        assert [l['baz'] for l in held_locations] == [0, 1, 2, 3, 4]
+
+        output = io.StringIO()
+        fires_manager.dumps(output_stream=output)
+        actual = json.loads(output.getvalue())['fires']
+        assert actual[0]['foo'] == 'bar'
+        assert [f['activity'][0]['active_areas'][0]['specified_points'][0]['baz']
+            for f in actual] == [0, 1, 2, 3, 4]
+
+        # the references back to the fire and store aren't copied
+        aa = fires_list[0]['activity'][0]['active_areas'][0]
+        assert aa._fire is fires_list[0]
+        assert copy.deepcopy(aa)._fire is None
+        assert fires_list[0]._store() is fires_manager._fires
+        assert copy.deepcopy(fires_list[0])._store is None
+
+    def test_changes_to_fires_no_longer_held_are_saved(self):
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [{
+            'id': str(i),
+            'activity': [{'active_areas': [{
+                'specified_points': [{'lat': 45.0, 'lng': -120.0, 'area': 10}]
+            }]}]
+        } for i in range(5)]
+
+        # changed after their batches were written back, and then
+        # dropped, before the fires are next paged in
+        locations = [f.locations[0] for f in fires_manager.fires]
+        for i, loc in enumerate(locations):
+            loc['baz'] = i
+        del locations
+        active_areas = [f.active_areas[0] for f in fires_manager.fires]
+        for i, aa in enumerate(active_areas):
+            aa['qux'] = i * 2
+        del active_areas
+        gc.collect()
+
+        fires_list = list(fires_manager.fires)
+        assert [f.locations[0]['baz'] for f in fires_list] == [0, 1, 2, 3, 4]
+        assert [f.active_areas[0]['qux'] for f in fires_list] == [0, 2, 4, 6, 8]
+
+    def test_dumps(self):
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [
+            fires.Fire({'id': '1', 'name': 'n1'}),
+            fires.Fire({'id': '2', 'name': 'n2'})
+        ]
+        fires_manager.foo = {"bar": "baz"}
+        output = io.StringIO()
+        fires_manager.dumps(output_stream=output)
+
+        actual = json.loads(output.getvalue())
+        assert [f['id'] for f in actual['fires']] == ['1', '2']
+        assert actual['foo'] == {"bar": "baz"}
+        assert actual['counts']['fires'] == 2
@@ -0,0 +1,124 @@
+"""Unit tests for bluesky.models.validation"""
+
+__author__ = "Joel Dubowy"
+
+import copy
+
+from py.test import raises
+
+from bluesky.config import Config
+from bluesky.models import fires, validation
+
+
+VALID_FIRE = {
+    "id": "a",
+    "activity": [{
+        "active_areas": [
+            {
+                "start": "2019-08-01T00:00:00",
+                "end": "2019-08-02T00:00:00",
+                "utc_offset": "-07:00",
+                "specified_points": [
+                    {"lat": 45.0, "lng": -120.0, "area": 100},
+                    {"lat": "45.1", "lng": "-120.1", "area": "50.5"}
+                ]
+            },
+            {
+                "perimeter": {
+                    "polygon": [[-120.0, 45.0], [-120.1, 45.0],
+                        [-120.1, 45.1], [-120.0, 45.0]],
+                    "area": "200"
+                }
+            }
+        ]
+    }]
+}
+
+def _fire(fire_id, **aa_updates):
+    f = copy.deepcopy(VALID_FIRE)
+    f['id'] = fire_id
+    f['activity'][0]['active_areas'][0].update(aa_updates)
+    return fires.Fire(f)
+
+
+class TestValidateFires(object):
+
+    def test_valid(self):
+        fire = _fire('a')
+        assert validation.validate_fires([fire]) == {}
+
+        # values cast to float, and active areas flagged as validated
+        aa = fire.active_areas[0]
+        assert aa['specified_points'][1] == {
+            "lat": 45.1, "lng": -120.1, "area": 50.5}
+        assert fire.active_areas[1]['perimeter']['area'] == 200.0
+        assert all([aa._validated for aa in fire.active_areas])
+        assert len(fire.active_areas[0].locations) == 2
+        assert fire.active_areas[1].locations == [
+            fire.active_areas[1]['perimeter']]
+
+    def test_invalid(self):
+        no_activity = fires.Fire({"id": "b"})
+        no_locations = _fire('c', specified_points=[])
+        missing_area = _fire('d', specified_points=[{"lat": 45, "lng": -120}])
+        bad_lat = _fire('e',
+            specified_points=[{"lat": "sdf", "lng": -120, "area": 1}])
+        lat_out_of_range = _fire('f',
+            specified_points=[{"lat": 95, "lng": -120, "area": 1}])
+        negative_area = _fire('g',
+            specified_points=[{"lat": 45, "lng": -120, "area": -1}])
+        end_before_start = _fire('h', end="2019-07-31T00:00:00")
+        # as in ActiveArea.locations, lat or lng of 0 is treated as missing
+        zero_lat = _fire('i',
+            specified_points=[{"lat": 0, "lng": -120, "area": 1}])
+        zero_lng = _fire('j',
+            specified_points=[{"lat": 45, "lng": 0.0, "area": 1}])
+        list_lng = _fire('k',
+            specified_points=[{"lat": 45, "lng": [-120, -121], "area": 1}])
+        nan_area = _fire('l',
+            specified_points=[{"lat": 45, "lng": -120, "area": "nan"}])
+
+        all_fires = [_fire('a'), no_activity, no_locations, missing_area,
+            bad_lat, lat_out_of_range, negative_area, end_before_start,
+            zero_lat, zero_lng, list_lng, nan_area]
+        errors = validation.validate_fires(all_fires)
+        assert {f.id: errors.get(f._private_id) for f in all_fires} == {
+            'a': None,
+            'b': [validation.MISSING_ACTIVITY_MSG],
+            'c': [fires.ActiveArea.MISSING_LOCATION_INFO_MSG],
+            'd': ["Each active area specified point must define 'lat', 'lng', 'area'"],
+            'e': ["Invalid specified point 'lat': sdf"],
+            'f': ["Specified point 'lat' out of range: 95.0"],
+            'g': ["Specified point 'area' out of range: -1.0"],
+            'h': [validation.START_AFTER_END_MSG],
+            'i': ["Each active area specified point must define 'lat', 'lng', 'area'"],
+            'j': ["Each active area specified point must define 'lat', 'lng', 'area'"],
+            'k': ["Invalid specified point 'lng': [-120, -121]"],
+            'l': ["Specified point 'area' out of range: nan"]
+        }
+        # the same locations are rejected by ActiveArea.locations
+        for f in (zero_lat, zero_lng):
+            with raises(ValueError):
+                fires.Fire(copy.deepcopy(f)).active_areas[0].locations
+
+
+class TestFiresManagerValidateFires(object):
+
+    def test_skip_failed_fires(self, reset_config):
+        Config().set(True, 'skip_failed_fires')
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [_fire('a'), fires.Fire({"id": "b"})]
+        fires_manager.validate_fires()
+        assert [f.id for f in fires_manager.fires] == ['a']
+        assert [f.id for f in fires_manager.failed_fires] == ['b']
+        assert fires_manager.failed_fires[0]['error']['message'] == (
+            validation.MISSING_ACTIVITY_MSG)
+
+    def test_dont_skip_failed_fires(self, reset_config):
+        Config().set(False, 'skip_failed_fires')
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [_fire('a'), fires.Fire({"id": "b"})]
+        with raises(ValueError) as e_info:
+            fires_manager.validate_fires()
+        assert e_info.value.args[0] == validation.MISSING_ACTIVITY_MSG
+        assert fires_manager.num_fires == 2
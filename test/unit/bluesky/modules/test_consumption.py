@@ -3,14 +3,17 @@
 __author__ = "Joel Dubowy"
 
 import copy
+import tempfile
 from unittest import mock
 
 from numpy import array
 from numpy.testing import assert_approx_equal
 from py.test import raises
 
+from bluesky import consumeutils
+from bluesky.config import Config
 from bluesky.consumeutils import FuelLoadingsManager
-from bluesky.models.fires import Fire
+from bluesky.models.fires import Fire, FiresManager
 from bluesky.modules import consumption
 
 
@@ -147,3 +150,266 @@ class TestConsumptionRunFire(object):
         }
 
         check_consumption(fb['consumption'], expected_consumption)
+
+
+class MockFuelConsumption(object):
+    """Computes fake per-fuelbed values from fccs id, ecoregion, and
+    moisture, returning them in consume's results format
+    """
+
+    instances = []
+
+    def __init__(self, fccs_file=None):
+        self.FCCS = mock.Mock()
+        self.output_units = 'tons_ac'
+        self.instances.append(self)
+
+    def results(self):
+        vals = [float(f) * self.fuel_moisture_1000hr_pct
+            + (1 if e == 'western' else 2)
+            for f, e in zip(self.fuelbed_fccs_ids, self.fuelbed_ecoregion)]
+        return {
+            'consumption': {
+                'summary': {
+                    'total': {
+                        'flaming': [v * 0.5 for v in vals],
+                        'total': vals
+                    }
+                },
+                'debug': {}
+            },
+            'heat release': {
+                'flaming': [v * 10 for v in vals],
+                'total': [v * 20 for v in vals]
+            }
+        }
+
+class BaseTestConsumptionRun(object):
+
+    FIRES = [
+        {
+            "id": "a",
+            "type": "wildfire",
+            "activity": [{
+                "active_areas": [{
+                    "start": "2018-06-27T00:00:00",
+                    "end": "2018-06-28T00:00:00",
+                    "moisture_1khr": 30,
+                    "specified_points": [
+                        {
+                            "area": 100, "lat": 45.0, "lng": -120.0,
+                            "ecoregion": "western",
+                            "fuelbeds": [
+                                {"fccs_id": "52", "pct": 60.0},
+                                {"fccs_id": "9", "pct": 40.0}
+                            ]
+                        },
+                        {
+                            "area": 50, "lat": 45.1, "lng": -120.1,
+                            "ecoregion": "southern",
+                            "fuelbeds": [{"fccs_id": "52", "pct": 100.0}]
+                        }
+                    ]
+                }]
+            }]
+        },
+        {
+            "id": "b",
+            "type": "wildfire",
+            "activity": [{
+                "active_areas": [{
+                    "start": "2018-01-27T00:00:00",
+                    "end": "2018-01-28T00:00:00",
+                    "moisture_1khr": 20,
+                    "specified_points": [
+                        {
+                            "area": 10, "lat": 46.0, "lng": -121.0,
+                            "ecoregion": "western",
+                            "fuelbeds": [{"fccs_id": "9", "pct": 100.0}]
+                        }
+                    ]
+                }]
+            }]
+        }
+    ]
+
+    def _run(self, monkeypatch, batch_fuelbeds, cache=None):
+        MockFuelConsumption.instances = []
+        monkeypatch.setattr(consumption.consume, 'FuelConsumption',
+            MockFuelConsumption)
+        fuel_loadings_manager = mock.Mock()
+        fuel_loadings_manager.generate_custom_csv.return_value = ""
+        fuel_loadings_manager.get_fuel_loadings.side_effect = (
+            lambda fccs_id, fccsdb_obj: {"fccs_id": fccs_id})
+        fuel_loadings_manager.get_custom_fuel_loadings.return_value = None
+
+        fires_manager = FiresManager()
+        fires_manager.fires = [Fire(copy.deepcopy(f)) for f in self.FIRES]
+        if batch_fuelbeds:
+            consumption._run_batched(fires_manager, fuel_loadings_manager, 1,
+                cache)
+        else:
+            for fire in fires_manager.fires:
+                consumption._run_fire(fire, fuel_loadings_manager, 1, cache)
+        return fires_manager
+
+class TestConsumptionRunBatched(BaseTestConsumptionRun):
+
+    def test_matches_per_fuelbed_runs(self, monkeypatch, reset_config):
+        fires_manager = self._run(monkeypatch, False)
+        assert len(MockFuelConsumption.instances) == 4
+
+        batched_fires_manager = self._run(monkeypatch, True)
+        # one run per set of location settings
+        assert len(MockFuelConsumption.instances) == 2
+        assert batched_fires_manager.fires == fires_manager.fires
+
+        fb = batched_fires_manager.fires[0]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][1]
+        assert fb['fuel_loadings'] == {"fccs_id": "9"}
+        assert fb['consumption'] == {
+            'summary': {'total': {'flaming': [5420.0], 'total': [10840.0]}}}
+        assert fb['heat'] == {'flaming': [108400.0], 'total': [216800.0]}
+
+    def test_sqlite_store(self, monkeypatch, reset_config):
+        expected = self._run(monkeypatch, False)
+
+        Config().set('sqlite', 'fires_store', 'type')
+        Config().set(1, 'fires_store', 'batch_size')
+        fires_manager = self._run(monkeypatch, True)
+        assert len(MockFuelConsumption.instances) == 2
+        assert list(fires_manager.fires) == expected.fires
+
+class TestConsumptionPerAcreCache(BaseTestConsumptionRun):
+
+    def setup(self):
+        consumeutils._PER_ACRE_MEMO.clear()
+
+    def teardown(self):
+        consumeutils._PER_ACRE_MEMO.clear()
+
+    def test_per_fuelbed(self, monkeypatch, reset_config):
+        expected = self._run(monkeypatch, False)
+
+        cache = consumeutils.PerAcreConsumptionCache()
+        fires_manager = self._run(monkeypatch, False, cache)
+        # fccs_id '52' in western and southern ecoregions, and '9' with
+        # different moisture are each unique
+        assert len(MockFuelConsumption.instances) == 4
+        assert fires_manager.fires == expected.fires
+
+        # all values are memoized process-wide
+        cache = consumeutils.PerAcreConsumptionCache()
+        fires_manager = self._run(monkeypatch, False, cache)
+        assert len(MockFuelConsumption.instances) == 0
+        assert fires_manager.fires == expected.fires
+        assert cache.stats == {"hits": 4, "misses": 0, "hit_rate": 1.0}
+
+    def test_batched(self, monkeypatch, reset_config):
+        expected = self._run(monkeypatch, False)
+
+        # repeat fire 'a' location with different area
+        fire = copy.deepcopy(self.FIRES[0])
+        fire['id'] = 'c'
+        fire['activity'][0]['active_areas'][0]['specified_points'][1]['area'] = 5
+        self.FIRES = self.FIRES + [fire]
+
+        cache = consumeutils.PerAcreConsumptionCache()
+        fires_manager = self._run(monkeypatch, True, cache)
+        assert len(MockFuelConsumption.instances) == 2
+        assert fires_manager.fires[:2] == expected.fires
+        loc = fires_manager.fires[2]['activity'][0]['active_areas'][0]['specified_points'][1]
+        expected_loc = expected.fires[0]['activity'][0]['active_areas'][0]['specified_points'][1]
+        assert loc['fuelbeds'][0]['heat']['total'][0] == (
+            expected_loc['fuelbeds'][0]['heat']['total'][0] / 10)
+
+    def test_disk(self, monkeypatch, reset_config):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            expected = self._run(monkeypatch, False)
+            cache = consumeutils.PerAcreConsumptionCache(cache_dir=cache_dir)
+            self._run(monkeypatch, False, cache)
+            cache.close()
+
+            consumeutils._PER_ACRE_MEMO.clear()
+            cache = consumeutils.PerAcreConsumptionCache(cache_dir=cache_dir)
+            fires_manager = self._run(monkeypatch, False, cache)
+            cache.close()
+            assert len(MockFuelConsumption.instances) == 0
+            assert fires_manager.fires == expected.fires
+
+class TestValidateInputEcoregionLookup(BaseTestConsumptionRun):
+
+    def _validate(self, monkeypatch, ecoregions, fires_store='memory',
+            validate_lat_lng=None):
+        Config().set(fires_store, 'fires_store', 'type')
+        Config().set(1, 'fires_store', 'batch_size')
+        ecoregion_lookup = mock.Mock()
+        ecoregion_lookup.lookup_many.side_effect = (
+            lambda points: [ecoregions.get(p) for p in points])
+        ecoregion_lookup.validate_lat_lng.side_effect = validate_lat_lng
+        monkeypatch.setattr(consumption, '_get_ecoregion_lookup',
+            lambda: ecoregion_lookup)
+
+        fires_manager = FiresManager()
+        fires = [Fire(copy.deepcopy(f)) for f in self.FIRES]
+        for f in fires:
+            for aa in f.active_areas:
+                for loc in aa.locations:
+                    loc.pop('ecoregion')
+        fires_manager.fires = fires
+        consumption._validate_input(fires_manager)
+        return fires_manager, ecoregion_lookup
+
+    def test_one_lookup_for_all_fires(self, monkeypatch, reset_config):
+        fires_manager, ecoregion_lookup = self._validate(monkeypatch, {
+            (45.0, -120.0): 'western', (45.1, -120.1): 'southern',
+            (46.0, -121.0): 'boreal'
+        })
+        ecoregion_lookup.lookup_many.assert_called_once_with(
+            [(45.0, -120.0), (45.1, -120.1), (46.0, -121.0)])
+        assert [loc['ecoregion'] for f in fires_manager.fires
+            for aa in f.active_areas for loc in aa.locations] == [
+            'western', 'southern', 'boreal']
+
+    def test_sqlite_store(self, monkeypatch, reset_config):
+        fires_manager, ecoregion_lookup = self._validate(monkeypatch, {
+            (45.0, -120.0): 'western', (45.1, -120.1): 'southern',
+            (46.0, -121.0): 'boreal'
+        }, fires_store='sqlite')
+        ecoregion_lookup.lookup_many.assert_called_once_with(
+            [(45.0, -120.0), (45.1, -120.1), (46.0, -121.0)])
+        assert [loc['ecoregion'] for f in fires_manager.fires
+            for aa in f.active_areas for loc in aa.locations] == [
+            'western', 'southern', 'boreal']
+
+    def test_invalid_lat_lng(self, monkeypatch, reset_config):
+        Config().set(True, 'skip_failed_fires')
+        def validate_lat_lng(lat, lng):
+            if lat > 45.5:
+                raise ValueError("invalid lat")
+        fires_manager, ecoregion_lookup = self._validate(monkeypatch, {
+            (45.0, -120.0): 'western', (45.1, -120.1): 'southern'
+        }, fires_store='sqlite', validate_lat_lng=validate_lat_lng)
+        ecoregion_lookup.lookup_many.assert_called_once_with(
+            [(45.0, -120.0), (45.1, -120.1)])
+        assert [loc['ecoregion'] for f in fires_manager.fires
+            for aa in f.active_areas for loc in aa.locations] == [
+            'western', 'southern']
+        assert [f.id for f in fires_manager.failed_fires] == ['b']
+        assert fires_manager.failed_fires[0]['error']['message'] == "invalid lat"
+
+    def test_default_ecoregion(self, monkeypatch, reset_config):
+        Config().set('southern', 'consumption', 'default_ecoregion')
+        fires_manager, ecoregion_lookup = self._validate(monkeypatch, {
+            (45.0, -120.0): 'western'
+        })
+        assert [loc['ecoregion'] for f in fires_manager.fires
+            for aa in f.active_areas for loc in aa.locations] == [
+            'western', 'southern', 'southern']
+
+    def test_no_default_ecoregion(self, monkeypatch, reset_config):
+        Config().set(True, 'skip_failed_fires')
+        fires_manager, ecoregion_lookup = self._validate(monkeypatch, {
+            (45.0, -120.0): 'western', (45.1, -120.1): 'southern'
+        })
+        assert [f.id for f in fires_manager.fires] == ['a']
+        assert [f.id for f in fires_manager.failed_fires] == ['b']
@@ -3,17 +3,18 @@
 __author__ = "Joel Dubowy"
 
 import copy
-#from unittest import mock
+from unittest import mock
 
 from numpy import array
-from numpy.testing import assert_approx_equal
+from numpy.testing import assert_allclose, assert_approx_equal
 from py.test import raises
 
 import afconfig
 
 from bluesky.config import Config
-from bluesky.models.fires import Fire
-from bluesky.modules import emissions
+from bluesky.consumeutils import FuelLoadingsManager
+from bluesky.models.fires import Fire, FiresManager
+from bluesky.modules import consumption, emissions
 
 FIRES = [
     Fire({
@@ -267,6 +268,37 @@ class TestFepsEmissions(BaseEmissionsTest):
         self._check_emissions(self.EXPECTED_FIRE1_EMISSIONS,
             self.fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['emissions'])
 
+    def test_wo_details_vectorized(self, reset_config):
+        Config().set("feps", 'emissions', "model")
+        Config().set(False, 'emissions', "include_emissions_details")
+        Config().set(True, 'emissions', "vectorized")
+
+        emissions.Feps(fire_failure_manager).run(self.fires)
+
+        assert self.fires[0]['error'] == (
+            'Missing fuelbed data required for computing emissions')
+
+        self._check_emissions(self.EXPECTED_FIRE1_EMISSIONS,
+            self.fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['emissions'])
+
+    def test_wo_details_vectorized_sqlite_store(self, reset_config):
+        Config().set("feps", 'emissions', "model")
+        Config().set(False, 'emissions', "include_emissions_details")
+        Config().set(True, 'emissions', "vectorized")
+        Config().set(True, 'skip_failed_fires')
+        Config().set('sqlite', 'fires_store', 'type')
+        Config().set(1, 'fires_store', 'batch_size')
+        fires_manager = FiresManager()
+        fires_manager.fires = self.fires
+
+        emissions.Feps(fires_manager.fire_failure_handler).run(
+            fires_manager.fires)
+
+        fires = list(fires_manager.fires)
+        assert len(fires) == 1
+        self._check_emissions(self.EXPECTED_FIRE1_EMISSIONS,
+            fires[0]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['emissions'])
+
     def test_with_details(self, reset_config):
         Config().set("feps", 'emissions', "model")
         Config().set(True, 'emissions', "include_emissions_details")
@@ -368,6 +400,19 @@ class TestPrichardOneillEmissions(BaseEmissionsTest):
         self._check_emissions(self.EXPECTED_FIRE1_EMISSIONS,
             self.fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['emissions'])
 
+    def test_wo_details_PM_only_vectorized(self, reset_config):
+        Config().set("prichard-oneill", 'emissions', "model")
+        Config().set(False, 'emissions', "include_emissions_details")
+        Config().set(self.SPECIES, 'emissions', "species")
+        Config().set(True, 'emissions', "vectorized")
+        emissions.PrichardOneill(fire_failure_manager).run(self.fires)
+
+        assert self.fires[0]['error'] == (
+            'Missing fuelbed data required for computing emissions')
+
+        self._check_emissions(self.EXPECTED_FIRE1_EMISSIONS,
+            self.fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['emissions'])
+
     def test_with_details_PM_only(self, reset_config):
         Config().set("prichard-oneill", 'emissions', "model")
         Config().set(True, 'emissions', "include_emissions_details")
@@ -491,3 +536,148 @@ class TestConsumeEmissions(BaseEmissionsTest):
         assert 'emissions_details' in self.fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]
         self._check_emissions(self.EXPECTED_FIRE1_EMISSIONS_PM_ONLY,
             self.fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['emissions'])
+
+class TestConsumeEmissionsReuseConsumption(object):
+    """Runs consume emissions on the consumption computed by the
+    consumption module, both recomputing it and reusing it
+    """
+
+    # custom fuelbed with piles, based on 52
+    FUEL_LOADINGS = {
+        "9052": {
+            "based_on_fccs_id": "52",
+            "pile_clean_loading": 10.0,
+            "pile_dirty_loading": 5.0,
+            "pile_vdirty_loading": 2.5
+        }
+    }
+
+    def _fire(self):
+        fire = copy.deepcopy(FIRES[1])
+        aa = fire['activity'][0]['active_areas'][0]
+        aa['pile_blackened_pct'] = 20
+        aa['specified_points'][0]['fuelbeds'] = [
+            {"fccs_id": "52", "pct": 60.0},
+            {"fccs_id": "9052", "pct": 30.0},
+            {"fccs_id": "9", "pct": 10.0}
+        ]
+        return fire
+
+    def _run(self, fire, reuse_consumption, include_emissions_details):
+        Config().set(reuse_consumption, 'emissions', "reuse_consumption")
+        Config().set(include_emissions_details,
+            'emissions', "include_emissions_details")
+        fire = copy.deepcopy(fire)
+        emissions.Consume(fire_failure_manager).run([fire])
+        assert 'error' not in fire
+        return fire['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds']
+
+    def test_matches_recomputed(self, reset_config):
+        Config().set("consume", 'emissions', "model")
+        Config().set(self.FUEL_LOADINGS, 'consumption', "fuel_loadings")
+        fire = self._fire()
+        consumption._run_fire(fire,
+            FuelLoadingsManager(all_fuel_loadings=self.FUEL_LOADINGS), 1)
+        fuelbeds = fire['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds']
+        assert fuelbeds[1]['consumption']['woody fuels']['piles']['total'][0] > 0
+
+        for include_emissions_details in (False, True):
+            recomputed = self._run(fire, False, include_emissions_details)
+            reused = self._run(fire, True, include_emissions_details)
+            for fb_r, fb in zip(recomputed, reused):
+                keys = ['emissions'] + (['emissions_details']
+                    if include_emissions_details else [])
+                for k in keys:
+                    _assert_nested_allclose(fb_r[k], fb[k])
+
+def _assert_nested_allclose(expected, actual):
+    if isinstance(expected, dict):
+        assert set(expected) == set(actual)
+        for k in expected:
+            _assert_nested_allclose(expected[k], actual[k])
+    else:
+        assert_allclose(expected, actual, rtol=1e-9)
+
+class TestUbcBsfFepsEmissions(object):
+
+    def _run(self, fires_store):
+        Config().set("ubc-bsf-feps", 'emissions', "model")
+        Config().set(True, 'emissions', "ubc-bsf-feps", "in_process")
+        Config().set(fires_store, 'fires_store', 'type')
+        Config().set(1, 'fires_store', 'batch_size')
+        fires_manager = FiresManager()
+        fires_manager.fires = [Fire({
+            'id': fire_id,
+            'activity': [{'active_areas': [{
+                'start': "2018-06-27T00:00:00",
+                'end': "2018-06-28T00:00:00",
+                'utc_offset': "-07:00",
+                'specified_points': [{
+                    'lat': 45.632,
+                    'lng': -120.362,
+                    'area': 50.4,
+                    'consumption': {'summary': consumption},
+                    'fuelbeds': [{'fccs_id': "52", 'pct': 100.0}]
+                }]
+            }]}]
+        }) for fire_id, consumption in (
+            ('a', {'flaming': 100.0, 'smoldering': 50.0, 'residual': 10.0}),
+            ('b', {'flaming': 20.0, 'smoldering': 80.0, 'residual': 30.0}))]
+
+        emissions.UbcBsfFeps(fires_manager.fire_failure_handler).run(
+            fires_manager.fires)
+        return [f['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0].get('emissions')
+            for f in fires_manager.fires]
+
+    def test_sqlite_store(self, reset_config):
+        expected = self._run('memory')
+        assert all(expected)
+        assert self._run('sqlite') == expected
+
+class TestEmissionsCalculatorCache(object):
+
+    def setup(self):
+        self.ef_lookups = []
+        def create_ef_lookup(fccs_id, is_rx):
+            ef_lookup = mock.Mock()
+            ef_lookup.get.side_effect = lambda **kwargs: 1.5
+            self.ef_lookups.append((fccs_id, is_rx, ef_lookup))
+            return ef_lookup
+        self.create_ef_lookup = create_ef_lookup
+
+    def test_get_prichard_oneill_calculator(self, monkeypatch):
+        monkeypatch.setattr(emissions, '_EF_LOOKUPS', {})
+        monkeypatch.setattr(emissions, '_CALCULATORS', {})
+        monkeypatch.setattr(emissions, 'Fccs2Ef', self.create_ef_lookup)
+        monkeypatch.setattr(emissions, 'EmissionsCalculator', mock.Mock)
+
+        calculators = emissions.EmissionsCalculatorCache()
+        c1 = calculators.get_prichard_oneill_calculator('52', False, ['CO'])
+        c2 = calculators.get_prichard_oneill_calculator(52, False, ['CO'])
+        c3 = calculators.get_prichard_oneill_calculator('52', True, ['CO'])
+        c4 = calculators.get_prichard_oneill_calculator('52', False, None)
+        assert c1 is c2
+        assert c1 is not c3 and c1 is not c4
+        assert calculators.stats == {
+            "hits": 1, "misses": 3, "hit_rate": 0.25}
+
+        # EFs are looked up once per EF set, regardless of species filter
+        assert [(f, r) for f, r, _ in self.ef_lookups] == [
+            ('52', False), ('52', True)]
+
+        # shared process-wide, while stats are per instance
+        calculators = emissions.EmissionsCalculatorCache()
+        assert calculators.get_prichard_oneill_calculator(
+            '52', True, ['CO']) is c3
+        assert calculators.stats == {
+            "hits": 1, "misses": 0, "hit_rate": 1.0}
+
+    def test_cached_ef_lookup(self):
+        ef_lookup = self.create_ef_lookup('52', False)
+        cached = emissions.CachedEFLookup(ef_lookup)
+        assert cached.get(phase='flaming', species='CO') == 1.5
+        assert cached.get(species='CO', phase='flaming') == 1.5
+        assert cached.get(phase='smoldering', species='CO') == 1.5
+        assert ef_lookup.get.call_count == 2
+        # other attributes are passed through
+        assert cached.species is ef_lookup.species
@@ -3,12 +3,17 @@
 __author__ = "Joel Dubowy"
 
 import copy
+import os
+from collections import defaultdict
 from unittest import mock
+import tempfile
 
-from py.test import raises
+import numpy
+from py.test import importorskip, raises
 
 from bluesky.config import Config
-from bluesky.models.fires import Fire
+from bluesky.exceptions import BlueSkyConfigurationError
+from bluesky.models.fires import Fire, FiresManager
 from bluesky.modules import fuelbeds
 
 
@@ -566,3 +571,339 @@ class TestEstimatorPercentageAdjustment(object):
             {'fccs_id': 323, 'pct': 40.0}
         ]
         assert expected == actual
+
+
+class TestFuelbedLookupCache(object):
+
+    def setup(self):
+        self.calls = []
+        def look_up(geo_data):
+            self.calls.append(geo_data)
+            return copy.deepcopy(FUELBED_INFO_60_40)
+        self.lookup = mock.Mock()
+        self.lookup.look_up = look_up
+
+    def _point(self, lat, lng):
+        return {"type": "Point", "coordinates": [lng, lat]}
+
+    def test_memo(self, reset_config):
+        cache = fuelbeds.FuelbedLookupCache()
+        lookup = fuelbeds.CachedLookUp(cache, 'WA', self.lookup)
+        assert lookup.look_up(self._point(47.5, -120.5)) == FUELBED_INFO_60_40
+        assert lookup.look_up(self._point(47.5, -120.5)) == FUELBED_INFO_60_40
+        assert lookup.look_up(self._point(47.51, -120.5)) == FUELBED_INFO_60_40
+        assert len(self.calls) == 2
+        assert cache.stats == {"hits": 1, "misses": 2, "hit_rate": 1.0 / 3}
+
+        # AK lookup results are keyed separately
+        fuelbeds.CachedLookUp(cache, 'AK', self.lookup).look_up(
+            self._point(47.5, -120.5))
+        assert len(self.calls) == 3
+
+    def test_exact_coordinates(self, reset_config):
+        cache = fuelbeds.FuelbedLookupCache()
+        lookup = fuelbeds.CachedLookUp(cache, 'WA', self.lookup)
+        lookup.look_up(self._point(47.51, -120.51))
+        lookup.look_up(self._point(47.51000001, -120.51))
+        lookup.look_up({"type": "Point", "coordinates": [-120.51, 47.51]})
+        lookup.look_up({"type": "Point", "coordinates": ["-120.51", "47.51"]})
+        assert len(self.calls) == 2
+        assert cache.stats['hits'] == 2
+
+    def test_disk(self, reset_config):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = fuelbeds.FuelbedLookupCache(cache_dir=cache_dir)
+            fuelbeds.CachedLookUp(cache, 'WA', self.lookup).look_up(
+                self._point(47.5, -120.5))
+            cache.close()
+
+            cache = fuelbeds.FuelbedLookupCache(cache_dir=cache_dir)
+            lookup = fuelbeds.CachedLookUp(cache, 'WA', self.lookup)
+            assert lookup.look_up(self._point(47.5, -120.5)) == FUELBED_INFO_60_40
+            assert len(self.calls) == 1
+            assert cache.stats['hits'] == 1
+            cache.close()
+
+            # changing lookup config invalidates cached results
+            Config().set(True, 'fuelbeds', 'no_sampling')
+            cache = fuelbeds.FuelbedLookupCache(cache_dir=cache_dir)
+            fuelbeds.CachedLookUp(cache, 'WA', self.lookup).look_up(
+                self._point(47.5, -120.5))
+            assert len(self.calls) == 2
+            cache.close()
+
+    def test_run_records_stats(self, monkeypatch, reset_config):
+        monkeypatch.setattr(fuelbeds, 'FCCS_LOOKUPS',
+            defaultdict(lambda: self.lookup))
+        Config().set(True, 'fuelbeds', 'cache_lookups')
+        fires_manager = FiresManager()
+        fires_manager.fires = [Fire({
+            "id": "a",
+            "activity": [{
+                "active_areas": [{
+                    "state": "WA",
+                    "specified_points": [
+                        {"lat": 47.5, "lng": -120.5, "area": 10},
+                        {"lat": 47.5, "lng": -120.5, "area": 20}
+                    ]
+                }]
+            }]
+        })]
+        fuelbeds.run(fires_manager)
+        assert len(self.calls) == 1
+        assert fires_manager.processing[-1]['lookup_cache'] == {
+            "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+class TestMergeFuelbedInfos(object):
+
+    def test_none(self):
+        assert fuelbeds.merge_fuelbed_infos([]) is None
+        assert fuelbeds.merge_fuelbed_infos([None, {"fuelbeds": {}}]) is None
+
+    def test_merge(self):
+        merged = fuelbeds.merge_fuelbed_infos([
+            FUELBED_INFO_60_40, None, FUELBED_INFO_24_12_48_12_4])
+        assert set(merged['fuelbeds']) == {'46', '47', '48', '49', '50'}
+        assert merged['fuelbeds']['46']['grid_cells'] == 12
+        assert merged['fuelbeds']['47']['grid_cells'] == 7
+        total = sum([d['grid_cells'] for d in merged['fuelbeds'].values()])
+        assert merged['fuelbeds']['46']['percent'] == 100.0 * 12 / total
+        assert sum([d['percent'] for d in merged['fuelbeds'].values()]) == 100.0
+        assert merged['units'] == 'm^2'
+        assert merged['area'] == (FUELBED_INFO_60_40['area']
+            + FUELBED_INFO_24_12_48_12_4['area'])
+
+
+class TestPolygonLookUp(object):
+
+    def setup(self):
+        self.calls = []
+        def look_up(geo_data):
+            self.calls.append(geo_data)
+            return copy.deepcopy(FUELBED_INFO_60_40)
+        self.lookup = mock.Mock()
+        self.lookup.look_up = look_up
+
+    def test_point(self, reset_config):
+        Config().set(1, 'fuelbeds', 'polygon_tile_cells')
+        geo_data = {"type": "Point", "coordinates": [-120.5, 47.5]}
+        fuelbeds.PolygonLookUp(self.lookup).look_up(geo_data)
+        assert self.calls == [geo_data]
+
+    def test_simplify(self, reset_config):
+        Config().set(True, 'fuelbeds', 'polygon_simplify')
+        Config().set(0.01, 'fuelbeds', 'polygon_raster_cell_size')
+        # the vertex at (-120.05, 47.001) is within tolerance of the edge
+        fuelbeds.PolygonLookUp(self.lookup).look_up({
+            "type": "Polygon",
+            "coordinates": [[[-120.1, 47.0], [-120.05, 47.001],
+                [-120.0, 47.0], [-120.0, 47.1], [-120.1, 47.1],
+                [-120.1, 47.0]]]
+        })
+        assert len(self.calls) == 1
+        assert len(self.calls[0]['coordinates'][0]) == 5
+
+    def test_tiles(self, reset_config):
+        Config().set(0.01, 'fuelbeds', 'polygon_raster_cell_size')
+        Config().set(5, 'fuelbeds', 'polygon_tile_cells')
+        r = fuelbeds.PolygonLookUp(self.lookup).look_up({
+            "type": "Polygon",
+            "coordinates": [[[-120.1, 47.0], [-120.0, 47.0],
+                [-120.0, 47.1], [-120.1, 47.1], [-120.1, 47.0]]]
+        })
+        # 0.1 x 0.1 degree polygon split into 0.05 degree tiles
+        assert len(self.calls) == 4
+        assert r['fuelbeds']['46'] == {"grid_cells": 24, "percent": 60.0}
+        assert r['area'] == 4 * FUELBED_INFO_60_40['area']
+
+
+class TestRasterPointSampler(object):
+
+    # 4 x 4 grid of 0.25 degree cells, with upper left corner at
+    # 48.0, -121.0; -1 is nodata and '0' is ignored
+    GRID = numpy.array([
+        [52, 52, 9, 9],
+        [52, 0, 9, -1],
+        [46, 46, 47, 47],
+        [46, 46, 47, 47]
+    ])
+    GEO_TRANSFORM = (-121.0, 0.25, 0, 48.0, 0, -0.25)
+
+    FIRES = [
+        {
+            "id": "a",
+            "activity": [{
+                "active_areas": [
+                    {
+                        "specified_points": [
+                            {"lat": 47.9, "lng": -120.9, "area": 10},
+                            {"lat": 47.6, "lng": -120.6, "area": 10},
+                            {"lat": 47.1, "lng": -120.1, "area": 10}
+                        ]
+                    },
+                    {
+                        "perimeter": {
+                            "polygon": [[-120.9, 47.1], [-120.6, 47.1],
+                                [-120.6, 47.4], [-120.9, 47.1]],
+                            "area": 10
+                        }
+                    }
+                ]
+            }]
+        },
+        {
+            "id": "b",
+            "activity": [{
+                "active_areas": [{
+                    "specified_points": [
+                        {"lat": 47.6, "lng": -120.1, "area": 10},
+                        {"lat": 49.0, "lng": -120.9, "area": 10},
+                        {"lat": 47.4, "lng": -120.4, "area": 10}
+                    ]
+                }]
+            }]
+        }
+    ]
+
+    def setup(self):
+        self.calls = []
+        def look_up(geo_data):
+            # reference per-location lookup, giving points the fuelbed of
+            # the cell containing them, and 60/40 otherwise, as if
+            # resampling surrounding cells
+            self.calls.append(geo_data)
+            if geo_data['type'] == 'Point':
+                lng, lat = geo_data['coordinates']
+                row, col = int((48.0 - lat) // 0.25), int((lng + 121.0) // 0.25)
+                if 0 <= row < 4 and 0 <= col < 4 and self.GRID[row][col] > 0:
+                    fccs_id = str(self.GRID[row][col])
+                    return {
+                        "fuelbeds": {
+                            fccs_id: {"grid_cells": 1, "percent": 100.0}
+                        },
+                        "grid_cells": 1
+                    }
+            return copy.deepcopy(FUELBED_INFO_60_40)
+        self.lookup = mock.Mock()
+        self.lookup.look_up = look_up
+
+    def _sampler(self):
+        return fuelbeds.RasterPointSampler(self.GRID, self.GEO_TRANSFORM,
+            lambda lngs, lats: (lngs, lats), nodata=-1,
+            ignored_fuelbeds=['0'])
+
+    def _run(self, monkeypatch, raster_point_lookups):
+        monkeypatch.setattr(fuelbeds, 'FCCS_LOOKUPS',
+            defaultdict(lambda: self.lookup))
+        monkeypatch.setattr(fuelbeds.RasterPointSampler, 'open',
+            lambda *args: self._sampler())
+        Config().set(raster_point_lookups, 'fuelbeds', 'raster_point_lookups')
+        Config().set(True, 'fuelbeds', 'no_sampling')
+        Config().set('/path/to/fccs.nc', 'fuelbeds', 'fccs_fuelload_file')
+        self.calls = []
+        fires_manager = FiresManager()
+        fires_manager.fires = copy.deepcopy(self.FIRES)
+        fuelbeds.run(fires_manager)
+        return fires_manager
+
+    def test_sample(self):
+        assert self._sampler().sample([]) == []
+        assert self._sampler().sample([(-120.9, 47.9), (-120.1, 47.9),
+            (-120.4, 47.4), (-120.1, 47.6), (-121.1, 47.9), (-120.9, 49.0),
+            (-120.6, 47.6)]) == ['52', '9', '47', None, None, None, '0']
+
+    def test_look_up(self):
+        fuelbed_infos = self._sampler().look_up([(-120.9, 47.9),
+            (-120.1, 47.6), (-120.6, 47.6), (-120.6, 47.9)])
+        assert fuelbed_infos == [
+            {"fuelbeds": {"52": {"grid_cells": 1, "percent": 100.0}},
+                "grid_cells": 1},
+            None,
+            None,
+            {"fuelbeds": {"52": {"grid_cells": 1, "percent": 100.0}},
+                "grid_cells": 1}
+        ]
+
+    def test_requires_no_sampling(self, monkeypatch, reset_config):
+        Config().set(True, 'fuelbeds', 'raster_point_lookups')
+        Config().set('/path/to/fccs.nc', 'fuelbeds', 'fccs_fuelload_file')
+        with raises(BlueSkyConfigurationError):
+            fuelbeds.run(FiresManager())
+
+    def test_run_matches_per_location_lookups(self, monkeypatch, reset_config):
+        expected = self._run(monkeypatch, False)
+        assert len(self.calls) == 7
+
+        fires_manager = self._run(monkeypatch, True)
+        # the perimeter, the point in an ignored cell, the point in a
+        # nodata cell, and the point off the grid are looked up individually
+        assert [c['type'] for c in self.calls] == [
+            'Point', 'Polygon', 'Point', 'Point']
+        assert fires_manager.processing[-1]['raster_point_lookups'] == {
+            "points": 6, "sampled": 3}
+        assert fires_manager.fires == expected.fires
+        assert fires_manager.fires[0]['activity'][0]['active_areas'][0][
+            'specified_points'][0]['fuelbeds'] == [
+            {"fccs_id": "52", "pct": 100.0}]
+
+    def test_matches_fccsmap(self, monkeypatch, reset_config):
+        """Compares results with those of fccsmap's per-location lookups,
+        for a small grid in CONUS Albers
+        """
+        gdal = importorskip('osgeo.gdal')
+        osr = importorskip('osgeo.osr')
+        lookup_module = importorskip('fccsmap.lookup')
+
+        albers = osr.SpatialReference()
+        albers.ImportFromEPSG(5070)
+        lat_lng = osr.SpatialReference()
+        lat_lng.ImportFromEPSG(4326)
+        for srs in (albers, lat_lng):
+            if hasattr(srs, 'SetAxisMappingStrategy'):
+                srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        to_lat_lng = osr.CoordinateTransformation(albers, lat_lng)
+
+        x0, y0, cell_size, n = -2000000.0, 3000000.0, 1000.0, 20
+        grid = numpy.random.RandomState(0).choice([9, 46, 47, 52], (n, n))
+        points = []
+        for row in range(n):
+            for col in range(n):
+                # points well inside each cell, so that both
+                # implementations agree on which cell contains them
+                lng, lat = to_lat_lng.TransformPoint(
+                    x0 + (col + 0.3 + 0.4 * ((row * n + col) % 2)) * cell_size,
+                    y0 - (row + 0.5) * cell_size)[:2]
+                points.append({"lat": lat, "lng": lng, "area": 10})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'fccs.nc')
+            dataset = gdal.GetDriverByName('netCDF').Create(
+                filename, n, n, 1, gdal.GDT_Int32)
+            dataset.SetGeoTransform((x0, cell_size, 0, y0, 0, -cell_size))
+            dataset.SetProjection(albers.ExportToWkt())
+            dataset.GetRasterBand(1).WriteArray(grid)
+            dataset = None
+
+            Config().set(True, 'fuelbeds', 'no_sampling')
+            Config().set(filename, 'fuelbeds', 'fccs_fuelload_file')
+            Config().set('Band1', 'fuelbeds', 'fccs_fuelload_param')
+            Config().set(1, 'fuelbeds', 'fccs_fuelload_grid_resolution')
+            monkeypatch.setattr(fuelbeds, 'FCCS_LOOKUPS', defaultdict(
+                lambda: lookup_module.FccsLookUp(**Config().get('fuelbeds'))))
+            results = []
+            for raster_point_lookups in (False, True):
+                Config().set(raster_point_lookups,
+                    'fuelbeds', 'raster_point_lookups')
+                fires_manager = FiresManager()
+                fires_manager.fires = [Fire({"id": "a", "activity": [{
+                    "active_areas": [{
+                        "specified_points": copy.deepcopy(points)
+                    }]
+                }]})]
+                fuelbeds.run(fires_manager)
+                results.append(fires_manager.fires)
+
+        assert fires_manager.processing[-1]['raster_point_lookups'] == {
+            "points": n * n, "sampled": n * n}
+        assert results[1] == results[0]
@@ -2,6 +2,7 @@
 
 __author__ = "Joel Dubowy"
 
+import copy
 import datetime
 import os
 import tempfile
@@ -280,6 +281,8 @@ class TestPlumeRiseRunFeps(object):
         assert _PR_ARGS == ()
         assert _PR_KWARGS == defaults._DEFAULTS['plumerise']['feps']
         loc1 = FIRE_MISSING_LOCALMET['activity'][0]['active_areas'][0]['specified_points'][0]
+        # computed with a copy of the location, made before results are set
+        loc1 = {k: v for k, v in loc1.items() if k != 'plumerise'}
         assert _PR_COMPUTE_CALL_ARGS == [
             ({"foo": 1},{"smoldering": 123}, loc1)
         ]
@@ -318,6 +321,33 @@ class TestPlumeRiseRunFeps(object):
         ]
         # TOOD: assert plumerise return value
 
+    def test_sqlite_store(self, reset_config, monkeypatch):
+        monkeypatch_plumerise_class(monkeypatch)
+        monkeypatch_tempfile_mkdtemp(monkeypatch)
+        Config().set('feps', 'plumerise', 'model')
+        Config().set('sqlite', 'fires_store', 'type')
+        Config().set(1, 'fires_store', 'batch_size')
+
+        fires = []
+        for fire_id, num_points in (('a', 2), ('b', 1)):
+            fire = copy.deepcopy(FIRE_MISSING_LOCALMET)
+            fire['id'] = fire_id
+            points = fire['activity'][0]['active_areas'][0]['specified_points']
+            points.extend(copy.deepcopy(points * (num_points - 1)))
+            fires.append(fire)
+        fm = FiresManager()
+        fm.load({"fires": fires})
+        plumerise.run(fm)
+
+        locs = [loc for f in fm.fires for loc in f.locations]
+        assert [loc['plumerise'] for loc in locs] == [
+            "compute return value"] * 3
+        # filled in sunrise and sunset hours are saved, too
+        assert [(loc['sunrise_hour'], loc['sunset_hour']) for loc in locs] == [
+            (a[2]['sunrise_hour'], a[2]['sunset_hour'])
+            for a in _PR_COMPUTE_CALL_ARGS]
+        assert all([loc['sunrise_hour'] is not None for loc in locs])
+
 class TestPlumeRiseRunSev(object):
 
     def setup(self):
@@ -0,0 +1,136 @@
+"""Tests running consumption, emissions, and timeprofile with the sqlite
+fires store, which pages fires in and out of memory, comparing the results
+with those of the in-memory store
+"""
+
+__author__ = "Joel Dubowy"
+
+import copy
+from unittest import mock
+
+from bluesky.config import Config
+from bluesky.models.fires import FiresManager
+from bluesky.modules import consumption, emissions, timeprofile
+
+
+FIRES = [
+    {
+        "id": "a",
+        "type": "wildfire",
+        "activity": [{
+            "active_areas": [{
+                "start": "2018-06-27T00:00:00",
+                "end": "2018-06-28T00:00:00",
+                "utc_offset": "-07:00",
+                "moisture_1khr": 30,
+                "specified_points": [
+                    {
+                        "area": 100, "lat": 45.0, "lng": -120.0,
+                        "ecoregion": "western",
+                        "fuelbeds": [{"fccs_id": "52", "pct": 100.0}]
+                    },
+                    {
+                        "area": 50, "lat": 45.1, "lng": -120.1,
+                        "ecoregion": "southern",
+                        "fuelbeds": [{"fccs_id": "9", "pct": 100.0}]
+                    }
+                ]
+            }]
+        }]
+    },
+    {
+        "id": "b",
+        "type": "wildfire",
+        "activity": [{
+            "active_areas": [{
+                "start": "2018-01-27T00:00:00",
+                "end": "2018-01-28T00:00:00",
+                "utc_offset": "-08:00",
+                "moisture_1khr": 20,
+                "specified_points": [
+                    {
+                        "area": 10, "lat": 46.0, "lng": -121.0,
+                        "ecoregion": "western",
+                        "fuelbeds": [{"fccs_id": "9", "pct": 100.0}]
+                    }
+                ]
+            }]
+        }]
+    }
+]
+
+class MockFuelConsumption(object):
+    """Computes fake per-phase values from fccs id, ecoregion, and
+    moisture, returning them in consume's results format
+    """
+
+    def __init__(self, fccs_file=None):
+        self.FCCS = mock.Mock()
+        self.output_units = 'tons_ac'
+
+    def results(self):
+        vals = [float(f) * self.fuel_moisture_1000hr_pct
+            + (1 if e == 'western' else 2)
+            for f, e in zip(self.fuelbed_fccs_ids, self.fuelbed_ecoregion)]
+        phases = {
+            'flaming': [v * 0.5 for v in vals],
+            'smoldering': [v * 0.3 for v in vals],
+            'residual': [v * 0.2 for v in vals],
+            'total': vals
+        }
+        return {
+            'consumption': {
+                'canopy': {'overstory': copy.deepcopy(phases)},
+                'summary': {'total': copy.deepcopy(phases)},
+                'debug': {}
+            },
+            'heat release': {
+                'flaming': [v * 10 for v in vals],
+                'total': [v * 20 for v in vals]
+            }
+        }
+
+class TestConsumptionEmissionsTimeprofile(object):
+
+    def _run(self, monkeypatch, fires_store):
+        monkeypatch.setattr(consumption.consume, 'FuelConsumption',
+            MockFuelConsumption)
+        fuel_loadings_manager = mock.Mock()
+        fuel_loadings_manager.generate_custom_csv.return_value = ""
+        fuel_loadings_manager.get_fuel_loadings.side_effect = (
+            lambda fccs_id, fccsdb_obj: {"fccs_id": fccs_id})
+        fuel_loadings_manager.get_custom_fuel_loadings.return_value = None
+        monkeypatch.setattr(consumption, 'FuelLoadingsManager',
+            lambda **kwargs: fuel_loadings_manager)
+
+        Config().set(fires_store, 'fires_store', 'type')
+        Config().set(1, 'fires_store', 'batch_size')
+        Config().set('ubc-bsf-feps', 'emissions', 'model')
+        Config().set(True, 'emissions', 'ubc-bsf-feps', 'in_process')
+
+        fires_manager = FiresManager()
+        fires_manager.fires = copy.deepcopy(FIRES)
+        consumption.run(fires_manager)
+        emissions.run(fires_manager)
+        timeprofile.run(fires_manager)
+        return fires_manager
+
+    def test_matches_memory_store(self, monkeypatch, reset_config):
+        fires_manager = self._run(monkeypatch, 'memory')
+        sqlite_fires_manager = self._run(monkeypatch, 'sqlite')
+
+        fires = list(fires_manager.fires)
+        sqlite_fires = list(sqlite_fires_manager.fires)
+        assert [f.id for f in sqlite_fires] == ['a', 'b']
+        for fire in sqlite_fires:
+            for aa in fire.active_areas:
+                assert aa['timeprofile']
+                for loc in aa.locations:
+                    assert loc['consumption']['summary']
+                    assert loc['emissions']['summary']['total'] > 0
+                    fb = loc['fuelbeds'][0]
+                    assert fb['consumption']['canopy']
+                    assert fb['emissions']['flaming']
+        assert sqlite_fires == fires
+        assert not sqlite_fires_manager.failed_fires
+        assert sqlite_fires_manager.summary == fires_manager.summary
@@ -2,8 +2,11 @@
 
 __author__ = "Joel Dubowy"
 
+import datetime
+
 from py.test import raises
 
+from bluesky.config import Config
 from bluesky.exceptions import BlueSkyConfigurationError
 from bluesky.models import fires
 from bluesky.modules import timeprofile
@@ -153,4 +156,133 @@ class TestTimeprofilingRunFire(object):
         }
         timeprofile._run_fire(None, fire)
         actual = fire['activity'][0]['active_areas'][0]['timeprofile']
-        assert actual == expected
\ No newline at end of file
+        assert actual == expected
+
+    def test_memoized(self, reset_config, monkeypatch):
+        num_profilers = []
+        StaticTimeProfiler = timeprofile.StaticTimeProfiler
+        def _profiler(*args, **kwargs):
+            num_profilers.append(1)
+            return StaticTimeProfiler(*args, **kwargs)
+        monkeypatch.setattr(timeprofile, 'StaticTimeProfiler', _profiler)
+
+        fire_1, fire_2, fire_3 = [fires.Fire({
+            "activity": [
+                {
+                    "active_areas": [
+                        {
+                            "start": start,
+                            "end": "2015-01-20T02:00:00",
+                        }
+                    ]
+                }
+            ]
+        }) for start in ("2015-01-20T00:00:00", "2015-01-20T00:00:00",
+            "2015-01-20T01:00:00")]
+        timeprofiles = {}
+        for fire in (fire_1, fire_2, fire_3):
+            timeprofile._run_fire(None, fire, timeprofiles=timeprofiles)
+
+        assert len(num_profilers) == 2
+        tp_1, tp_2, tp_3 = [f['activity'][0]['active_areas'][0]['timeprofile']
+            for f in (fire_1, fire_2, fire_3)]
+        assert tp_1 is tp_2
+        assert list(tp_1) == ["2015-01-20T00:00:00", "2015-01-20T01:00:00"]
+        assert list(tp_3) == ["2015-01-20T01:00:00"]
+
+    def test_prune_to_dispersion_window(self, reset_config):
+        fire = fires.Fire({
+            "activity": [
+                {
+                    "active_areas": [
+                        {
+                            "start": "2015-01-20T00:00:00",
+                            "end": "2015-01-21T00:00:00",
+                            "utc_offset": "-07:00"
+                        }
+                    ]
+                }
+            ]
+        })
+        dispersion_window = (datetime.datetime(2015, 1, 20, 12),
+            datetime.datetime(2015, 1, 20, 15))
+        timeprofile._run_fire(None, fire, dispersion_window=dispersion_window)
+        actual = fire['activity'][0]['active_areas'][0]['timeprofile']
+        assert list(actual) == ["2015-01-20T05:00:00", "2015-01-20T06:00:00",
+            "2015-01-20T07:00:00"]
+
+
+class TestTimeprofilingRunUbcBsfFeps(object):
+
+    class MockProfiler(object):
+        def __init__(self, active_area):
+            self.start_hour = active_area['start']
+            self.hourly_fractions = {p: [1.0] for p in
+                ('area_fraction', 'flaming', 'smoldering', 'residual')}
+
+    def test_sqlite_store(self, reset_config, monkeypatch):
+        Config().set('ubc-bsf-feps', 'timeprofile', 'model')
+        Config().set(True, 'timeprofile', 'ubc-bsf-feps', 'in_process')
+        Config().set('sqlite', 'fires_store', 'type')
+        Config().set(1, 'fires_store', 'batch_size')
+        monkeypatch.setattr(timeprofile.ubcbsffeps.UbcBsfFEPSTimeProfiler,
+            'run_many', lambda active_areas, config: [
+                self.MockProfiler(a) for a in active_areas])
+
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [fires.Fire({
+            "id": fire_id,
+            "activity": [
+                {
+                    "active_areas": [
+                        {
+                            "start": start,
+                            "end": "2015-01-21T00:00:00",
+                        }
+                    ]
+                }
+            ]
+        }) for fire_id, start in (("a", "2015-01-20T00:00:00"),
+            ("b", "2015-01-20T01:00:00"))]
+        timeprofile.run(fires_manager)
+
+        assert [list(f['activity'][0]['active_areas'][0]['timeprofile'])
+            for f in fires_manager.fires] == [
+            ["2015-01-20T00:00:00"], ["2015-01-20T01:00:00"]]
+
+    def test_sqlite_store_fills_in_location_info(self, reset_config):
+        Config().set('ubc-bsf-feps', 'timeprofile', 'model')
+        Config().set(True, 'timeprofile', 'ubc-bsf-feps', 'in_process')
+        Config().set(1, 'fires_store', 'batch_size')
+
+        fires_managers = []
+        for store_type in ('memory', 'sqlite'):
+            Config().set(store_type, 'fires_store', 'type')
+            fires_manager = fires.FiresManager()
+            fires_manager.fires = [fires.Fire({
+                "id": fire_id,
+                "activity": [{
+                    "active_areas": [{
+                        "start": datetime.datetime(2015, 1, 20),
+                        "end": datetime.datetime(2015, 1, 21),
+                        "utc_offset": -7,
+                        "consumption": {"summary": {"flaming": 100.0,
+                            "smoldering": 50.0, "residual": 25.0, "duff": 10.0}},
+                        "specified_points": [{"lat": 45.0, "lng": -120.0,
+                            "area": 10.0, "moisture_duff": moisture_duff}]
+                    }]
+                }]
+            }) for fire_id, moisture_duff in (("a", None), ("b", 80))]
+            timeprofile.run(fires_manager)
+            fires_managers.append(fires_manager)
+
+        fires_list = list(fires_managers[1].fires)
+        assert fires_list == fires_managers[0].fires
+        points = [f['activity'][0]['active_areas'][0]['specified_points'][0]
+            for f in fires_list]
+        assert [p['moisture_duff'] for p in points] == [40, 80]
+        assert [p['max_temp'] for p in points] == [30, 30]
+        assert all([p['sunrise_hour'] is not None
+            and p['sunset_hour'] is not None for p in points])
+        assert all([f['activity'][0]['active_areas'][0]['timeprofile']
+            for f in fires_list])
@@ -0,0 +1,100 @@
+"""Unit tests for bluesky.consumetables"""
+
+__author__ = "Joel Dubowy"
+
+import os
+import tempfile
+
+from numpy.testing import assert_approx_equal
+
+from bluesky import consumetables
+from bluesky.modules import consumption
+
+
+def _run_fuelbeds(rows, fuel_loadings_manager, fccs_file, burn_type,
+        cache=None):
+    """Fake consume, linear in moistures, so that interpolation is exact
+    """
+    for _, fb, loc, season in rows:
+        if fb['fccs_id'] == '999':
+            raise RuntimeError("Failed")
+        v = (float(fb['fccs_id']) + loc['fuel_moisture_1000hr_pct']
+            + 2 * loc['fuel_moisture_duff_pct']
+            + (100 if season == 'summer' else 0))
+        fb['consumption'] = {
+            'summary': {'total': {'flaming': [v], 'total': [2 * v]}}
+        }
+        fb['heat'] = {'flaming': [3 * v], 'total': [4 * v]}
+
+class TestConsumeTable(object):
+
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'tables.npz')
+
+    def teardown(self):
+        self.tmp_dir.cleanup()
+
+    def _build(self, monkeypatch):
+        monkeypatch.setattr(consumption, '_run_fuelbeds', _run_fuelbeds)
+        return consumetables.build_table(self.filename,
+            fccs_ids=['1', '52', '999'], ecoregions=['western'],
+            seasons=['spring', 'summer'], burn_types=['natural'],
+            grid=[[10, 20, 40], [50, 100]])
+
+    def test_build(self, monkeypatch, reset_config):
+        metadata = self._build(monkeypatch)
+        assert metadata['emissions_model'] is None
+        # interpolation is exact for linear model
+        assert metadata['error_bounds']['consumption']['max'] < 1e-6
+        assert metadata['error_bounds']['heat']['num_samples'] == 2 * 2 * 2
+
+        table = consumetables.ConsumeTable(self.filename)
+        assert table.metadata['error_bounds'] == metadata['error_bounds']
+
+    def test_look_up(self, monkeypatch, reset_config):
+        self._build(monkeypatch)
+        table = consumetables.ConsumeTable(self.filename)
+        loc = {'ecoregion': 'western', 'moisture_1khr': 15,
+            'moisture_duff': 75}
+
+        values = table.look_up('52', loc, 'summer', 'natural')
+        v = 52 + 15 + 2 * 75 + 100
+        assert set(values) == {'consumption', 'heat'}
+        assert_approx_equal(
+            values['consumption']['summary']['total']['flaming'][0], v)
+        assert_approx_equal(
+            values['consumption']['summary']['total']['total'][0], 2 * v)
+        assert_approx_equal(values['heat']['total'][0], 4 * v)
+
+        # not in table
+        assert table.look_up('53', loc, 'summer', 'natural') is None
+        assert table.look_up('52', loc, 'fall', 'natural') is None
+        assert table.look_up('52', loc, 'summer', 'activity') is None
+        # consume failed
+        assert table.look_up('999', loc, 'summer', 'natural') is None
+        # outside of grid
+        assert table.look_up('52', dict(loc, moisture_duff=101),
+            'summer', 'natural') is None
+        # different settings than those used to build the table
+        assert table.look_up('52', dict(loc, moisture_litter=30),
+            'summer', 'natural') is None
+        assert table.stats == {"hits": 1, "misses": 6}
+
+    def test_consumption_table_mode(self, monkeypatch, reset_config):
+        self._build(monkeypatch)
+        table = consumetables.ConsumeTable(self.filename)
+        fuel_loadings_manager = consumption.FuelLoadingsManager()
+        monkeypatch.setattr(fuel_loadings_manager, 'get_fuel_loadings',
+            lambda fccs_id: {"fccs_id": fccs_id})
+        loc = {'ecoregion': 'western', 'moisture_1khr': 20,
+            'moisture_duff': 100, 'area': 10}
+        fb = {"fccs_id": "1", "pct": 50.0}
+
+        consumption._run_fuelbed(fb, loc, fuel_loadings_manager, 'spring',
+            'natural', 1, table=table)
+        v = 1 + 20 + 2 * 100
+        assert fb['fuel_loadings'] == {"fccs_id": "1"}
+        assert_approx_equal(fb['consumption']['summary']['total']['total'][0],
+            2 * v * 5)
+        assert_approx_equal(fb['heat']['flaming'][0], 3 * v * 5)
@@ -0,0 +1,126 @@
+"""Unit tests for bluesky.consumeutils"""
+
+__author__ = "Joel Dubowy"
+
+from unittest import mock
+
+from py.test import raises
+
+from bluesky import consumeutils
+from bluesky.exceptions import BlueSkyConfigurationError
+
+
+class MockLoadingsData(object):
+    """Mimics the pandas.DataFrame of fuel loadings read by consume
+    """
+
+    def __init__(self, rows):
+        self.columns = list(rows[0].keys())
+        self._rows = rows
+
+    def to_dict(self, orient):
+        assert orient == 'records'
+        return [dict(r) for r in self._rows]
+
+DEFAULT_LOADINGS_DATA = MockLoadingsData([
+    {"fccs_id": "1", "lit_depth": 1.0, "litter_loading": 2.0, "cover_type": 3},
+    {"fccs_id": "52", "lit_depth": 4.0, "litter_loading": 5.0, "cover_type": 6}
+])
+
+CUSTOM_LOADINGS = {
+    "101": {"based_on_fccs_id": "52", "litter_depth": 7.0},
+    "102": {"based_on_fccs_id": "1", "Litter_Loading": 8.0}
+}
+
+class TestFuelLoadingsManager(object):
+
+    def setup(self):
+        consumeutils._DEFAULT_FUEL_LOADINGS = None
+        consumeutils._CUSTOM_CSV_FILES.clear()
+
+    def teardown(self):
+        consumeutils._DEFAULT_FUEL_LOADINGS = None
+        consumeutils._CUSTOM_CSV_FILES.clear()
+
+    def _mock_fccsdb(self, monkeypatch):
+        fccsdb = mock.Mock(return_value=mock.Mock(
+            loadings_data_=DEFAULT_LOADINGS_DATA))
+        monkeypatch.setattr(consumeutils.consume.fccs_db, 'FCCSDB', fccsdb)
+        return fccsdb
+
+    def test_default(self, monkeypatch):
+        fccsdb = self._mock_fccsdb(monkeypatch)
+        flm = consumeutils.FuelLoadingsManager()
+        assert flm.get_fuel_loadings(52) == {
+            "litter_depth": 4.0, "litter_loading": 5.0, "cover_type": 6}
+        assert flm.get_fuel_loadings('1')['litter_depth'] == 1.0
+        assert flm.get_fuel_loadings('2') is None
+        assert flm.generate_custom_csv('52') == ""
+
+        # the index is built once per process
+        consumeutils.FuelLoadingsManager().get_fuel_loadings('1')
+        assert fccsdb.call_count == 1
+
+    def test_custom_csv(self, monkeypatch):
+        self._mock_fccsdb(monkeypatch)
+        monkeypatch.setattr(consumeutils.FuelLoadingsManager,
+            'FCCS_LOADINGS_CSV_HEADER', "fuelbed_number,lit,dep\n")
+        monkeypatch.setattr(consumeutils.FuelLoadingsManager,
+            'FCCS_LOADINGS_CSV_ROW_TEMPLATE',
+            "{fuelbed_number},{litter_loading},{litter_depth}\n")
+
+        flm = consumeutils.FuelLoadingsManager(CUSTOM_LOADINGS)
+        filename = flm.generate_custom_csv('101')
+        # all custom fuelbeds are written to one file, shared across
+        # managers with the same custom loadings
+        assert flm.generate_custom_csv('102') == filename
+        assert consumeutils.FuelLoadingsManager(
+            CUSTOM_LOADINGS).generate_custom_csv('101') == filename
+        with open(filename) as f:
+            assert f.read() == ("fuelbed_number,lit,dep\n"
+                "101,5.0,7.0\n"
+                "102,8.0,1.0\n")
+
+    def test_custom_csv_missing_field(self, monkeypatch):
+        self._mock_fccsdb(monkeypatch)
+        flm = consumeutils.FuelLoadingsManager({"101": {"litter_depth": 7.0}})
+        with raises(BlueSkyConfigurationError):
+            flm.generate_custom_csv('101')
+
+    def test_custom_from_fccsdb_obj(self, monkeypatch):
+        self._mock_fccsdb(monkeypatch)
+        flm = consumeutils.FuelLoadingsManager(CUSTOM_LOADINGS)
+        fccsdb_obj = mock.Mock(loadings_data_=MockLoadingsData([
+            {"fccs_id": "101", "lit_depth": 7.0, "litter_loading": 5.0},
+            {"fccs_id": "102", "lit_depth": 1.0, "litter_loading": 8.0}
+        ]))
+        assert flm.get_fuel_loadings('102', fccsdb_obj) == {
+            "litter_depth": 1.0, "litter_loading": 8.0}
+        # built-in fuelbeds are looked up in the default index
+        assert flm.get_fuel_loadings('52', fccsdb_obj)['litter_depth'] == 4.0
+
+
+class TestGetConsData(object):
+
+    def test_cons_data(self):
+        consumption = {
+            'summary': {'total': {'flaming': [20.0], 'smoldering': [10.0],
+                'residual': [4.0], 'total': [34.0]}},
+            'canopy': {'overstory': {'flaming': [20.0], 'smoldering': [10.0],
+                'residual': [4.0], 'total': [34.0]}}
+        }
+        cons_data = consumeutils.get_cons_data(consumption, 2.0)
+        num_subcategories = sum([len(v) for v in
+            consumeutils.CONSUME_FUEL_CATEGORIES.values()])
+        assert cons_data.shape == (num_subcategories, 4, 1)
+        # 'summary' > 'total' is first, followed by 'canopy' subcategories
+        assert cons_data[0].tolist() == [[10.0], [5.0], [2.0], [17.0]]
+        assert cons_data[7].tolist() == [[10.0], [5.0], [2.0], [17.0]]
+        # missing values default to 0
+        assert cons_data[8].tolist() == [[0.0], [0.0], [0.0], [0.0]]
+
+    def test_heat_data(self):
+        heat = {'flaming': [200.0], 'smoldering': [100.0],
+            'residual': [40.0], 'total': [340.0]}
+        heat_data = consumeutils.get_heat_data(heat, 4.0)
+        assert heat_data.tolist() == [[[50.0], [25.0], [10.0], [85.0]]]
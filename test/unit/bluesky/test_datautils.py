@@ -6,8 +6,9 @@ __author__ = "Joel Dubowy"
 from py.test import raises
 
 from bluesky import datautils
+from bluesky.config import Config
 from bluesky.models import activity
-from bluesky.models.fires import Fire
+from bluesky.models.fires import Fire, FiresManager
 
 # TODO: moke Fire class
 
@@ -455,4 +456,139 @@ class TestSummarizeAllLevels(object):
         assert fm.summary == expected_summary
 
     def test_multi(self):
-        pass
+        fm = MockFiresManager([
+            {
+                "id": "SF11C14225236095807750",
+                "activity": [{
+                    "active_areas": [{
+                        "start": "2014-05-25T17:00:00",
+                        "end": "2014-05-26T17:00:00",
+                        'specified_points': [
+                            {
+                                'area': 34, 'lat': 45.0, 'lng': -120.0,
+                                "fuelbeds": [
+                                    {
+                                        "consumption": {
+                                            "canopy": {
+                                                "overstory": {
+                                                    "flaming": [10], "smoldering": [5],
+                                                    "residual": [1], "total": [16]
+                                                }
+                                            },
+                                            "summary": {"total": {"total": [16]}}
+                                        },
+                                        "heat": {
+                                            "flaming": [100], "smoldering": [50],
+                                            "residual": [10], "total": [160]
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'area': 12, 'lat': 45.1, 'lng': -120.1,
+                                "fuelbeds": [
+                                    {
+                                        "consumption": {
+                                            "canopy": {
+                                                "overstory": {
+                                                    "flaming": [2], "smoldering": [1],
+                                                    "residual": [0], "total": [3]
+                                                }
+                                            },
+                                            "ground fuels": {
+                                                "duff upper": {
+                                                    "flaming": [0], "smoldering": [4],
+                                                    "residual": [6], "total": [10]
+                                                }
+                                            }
+                                        },
+                                        "heat": {
+                                            "flaming": [20], "smoldering": [10],
+                                            "residual": [0], "total": [30]
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    }]
+                }]
+            }
+        ])
+        datautils.summarize_all_levels(fm, 'consumption', 'heat')
+
+        locations = fm.fires[0].locations
+        assert locations[0]['consumption'] == {'summary': {
+            'flaming': 10.0, 'smoldering': 5.0, 'residual': 1.0, 'total': 16.0}}
+        assert locations[1]['heat'] == {'summary': {
+            'flaming': 20.0, 'smoldering': 10.0, 'residual': 0.0, 'total': 30.0}}
+        expected_consumption = {'summary': {
+            'flaming': 12.0, 'smoldering': 10.0, 'residual': 7.0, 'total': 29.0}}
+        expected_heat = {'summary': {
+            'flaming': 120.0, 'smoldering': 60.0, 'residual': 10.0, 'total': 190.0}}
+        for obj in (fm.fires[0], fm.fires[0]['activity'][0],
+                fm.fires[0]['activity'][0]['active_areas'][0]):
+            assert obj['consumption'] == expected_consumption
+            assert obj['heat'] == expected_heat
+
+        assert fm.summary == {
+            "consumption": {
+                "canopy": {
+                    "overstory": {
+                        "flaming": [12.0], "smoldering": [6.0],
+                        "residual": [1.0], "total": [19.0]
+                    }
+                },
+                "ground fuels": {
+                    "duff upper": {
+                        "flaming": [0.0], "smoldering": [4.0],
+                        "residual": [6.0], "total": [10.0]
+                    }
+                },
+                "summary": expected_consumption['summary']
+            },
+            "heat": {
+                "flaming": [120.0], "smoldering": [60.0], "residual": [10.0],
+                "summary": expected_heat['summary']
+            }
+        }
+
+    def test_sqlite_store(self, reset_config):
+        Config().set('sqlite', 'fires_store', 'type')
+        Config().set(1, 'fires_store', 'batch_size')
+        fm = FiresManager()
+        fm.fires = [{
+            "id": fire_id,
+            "activity": [{
+                "active_areas": [{
+                    "start": "2014-05-25T17:00:00",
+                    "end": "2014-05-26T17:00:00",
+                    'specified_points': [{
+                        'area': 34, 'lat': 45.0, 'lng': -120.0,
+                        "fuelbeds": [{"emissions": e}]
+                    }]
+                }]
+            }]
+        } for fire_id, e in (
+            ("a", {"flaming": {"PM2.5": [10]}, "smoldering": {"PM2.5": [7]}}),
+            ("b", {"flaming": {"PM2.5": [42]}, "residual": {"CO": [123]}})
+        )]
+        datautils.summarize_all_levels(fm, 'emissions')
+
+        expected = [
+            {'PM2.5': 17.0, 'total': 17.0},
+            {'PM2.5': 42.0, 'CO': 123.0, 'total': 165.0}
+        ]
+        fires = list(fm.fires)
+        for fire, summary in zip(fires, expected):
+            aa = fire['activity'][0]['active_areas'][0]
+            for obj in (fire, fire['activity'][0], aa,
+                    aa['specified_points'][0]):
+                assert obj['emissions'] == {'summary': summary}
+        assert fm.summary == {
+            "emissions": {
+                "flaming": {"PM2.5": [52.0]},
+                "smoldering": {"PM2.5": [7.0]},
+                "residual": {"CO": [123.0]},
+                'summary': {'PM2.5': 59.0, "CO": 123.0, 'total': 182.0}
+            }
+        }
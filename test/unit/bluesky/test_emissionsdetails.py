@@ -0,0 +1,86 @@
+"""Unit tests for bluesky.emissionsdetails"""
+
+__author__ = "Joel Dubowy"
+
+import json
+
+from numpy import array
+
+from bluesky import emissionsdetails
+
+
+DETAILS_1 = {
+    "summary": {
+        "total": {
+            "flaming": {"CO": [1.0], "PM2.5": [0.5]},
+            "smoldering": {"CO": [2.0], "PM2.5": [1.5]},
+            "residual": {"CO": [0.0], "PM2.5": [0.0]},
+            "total": {"CO": [3.0], "PM2.5": [2.0]}
+        }
+    },
+    "canopy": {
+        "overstory": {
+            "flaming": {"CO": [1.0], "PM2.5": [0.5]},
+            "smoldering": {"CO": [2.0], "PM2.5": [1.5]},
+            "residual": {"CO": [0.0], "PM2.5": [0.0]},
+            "total": {"CO": [3.0], "PM2.5": [2.0]}
+        }
+    }
+}
+
+# consume's values are arrays
+DETAILS_2 = {
+    "summary": {
+        "total": {
+            "flaming": {"CO": array([4.0]), "NOX": array([0.1])},
+            "smoldering": {"CO": array([1.0]), "NOX": array([0.2])},
+            "residual": {"CO": array([1.0]), "NOX": array([0.0])},
+            "total": {"CO": array([6.0]), "NOX": array([0.3])}
+        }
+    }
+}
+
+
+class TestCompact(object):
+
+    def test_compact_and_expand(self):
+        index = emissionsdetails.DetailsIndex()
+        c1 = emissionsdetails.compact(DETAILS_1, index)
+        assert index.species == ["CO", "PM2.5"]
+        assert c1 == {
+            "summary": {"total": [[1.0, 2.0, 0.0, 3.0], [0.5, 1.5, 0.0, 2.0]]},
+            "canopy": {"overstory": [[1.0, 2.0, 0.0, 3.0], [0.5, 1.5, 0.0, 2.0]]}
+        }
+        assert emissionsdetails.expand(c1, index) == DETAILS_1
+
+        # species index is shared
+        c2 = emissionsdetails.compact(DETAILS_2, index)
+        assert index.species == ["CO", "PM2.5", "NOX"]
+        assert c2 == {"summary": {"total": [[4.0, 1.0, 1.0, 6.0],
+            [0.0, 0.0, 0.0, 0.0], [0.1, 0.2, 0.0, 0.3]]}}
+
+        assert len(json.dumps(c1)) < len(json.dumps(DETAILS_1)) / 2
+
+    def test_pad_and_summarize(self):
+        index = emissionsdetails.DetailsIndex()
+        c1 = emissionsdetails.compact(DETAILS_1, index)
+        c2 = emissionsdetails.compact(DETAILS_2, index)
+        emissionsdetails.pad(c1, len(index.species))
+        emissionsdetails.pad(c2, len(index.species))
+        assert c1["summary"]["total"][2] == [0.0, 0.0, 0.0, 0.0]
+
+        assert emissionsdetails.summarize([c1, c2]) == {
+            "summary": {"total": [[5.0, 3.0, 1.0, 9.0], [0.5, 1.5, 0.0, 2.0],
+                [0.1, 0.2, 0.0, 0.3]]},
+            "canopy": {"overstory": [[1.0, 2.0, 0.0, 3.0],
+                [0.5, 1.5, 0.0, 2.0], [0.0, 0.0, 0.0, 0.0]]}
+        }
+
+    def test_rename_species(self):
+        index = emissionsdetails.DetailsIndex()
+        emissionsdetails.compact(DETAILS_2, index)
+        index.rename_species(lambda s: 'NOx' if s == 'NOX' else s)
+        assert index.species == ["CO", "NOx"]
+        assert index.get_species_idx("NOx") == 1
+        assert index.to_dict() == {"species": ["CO", "NOx"],
+            "phases": ["flaming", "smoldering", "residual", "total"]}
@@ -0,0 +1,101 @@
+"""Unit tests for bluesky.emissionsmatrix"""
+
+__author__ = "Joel Dubowy"
+
+from numpy.testing import assert_approx_equal
+
+from bluesky import emissionsmatrix
+
+
+class LinearCalculator(object):
+    """Computes emissions as consumption times EFs, which vary by category,
+    subcategory, phase, and species, skipping species without EFs, like
+    emitcalc's EmissionsCalculator
+    """
+
+    EFS = {
+        ('canopy', 'overstory'): {'CO': 2.0, 'PM2.5': 0.5},
+        ('woody fuels', '1-hr fuels'): {'CO': 3.0},
+        ('ground fuels', 'duff lower'): {'CO': 4.0, 'PM2.5': 1.5, 'CH4': 0.1}
+    }
+    PHASE_MULTIPLIERS = {'flaming': 1.0, 'smoldering': 2.0, 'residual': 3.0}
+
+    def __init__(self):
+        self.num_calls = 0
+
+    def calculate(self, consumption):
+        self.num_calls += 1
+        total = {}
+        for c, sub_categories in consumption.items():
+            if c == 'summary':
+                continue
+            for sc, phases in sub_categories.items():
+                for p, m in self.PHASE_MULTIPLIERS.items():
+                    t = total.setdefault(p, {})
+                    for s, ef in self.EFS[(c, sc)].items():
+                        v = [ef * m * c for c in phases[p]]
+                        t[s] = [a + b for a, b in zip(t.get(s, [0.0] * len(v)), v)]
+        return {'summary': {'total': total}}
+
+def _consumption(overstory, one_hr=None, duff=None):
+    c = {
+        'canopy': {'overstory': _phases(overstory)},
+        'summary': {'total': _phases(overstory + (one_hr or 0) + (duff or 0))}
+    }
+    if one_hr is not None:
+        c['woody fuels'] = {'1-hr fuels': _phases(one_hr)}
+    if duff is not None:
+        c['ground fuels'] = {'duff lower': _phases(duff)}
+    return c
+
+def _phases(v):
+    return {'flaming': [v], 'smoldering': [v / 2], 'residual': [v / 4],
+        'total': [v * 1.75]}
+
+
+class TestCalculate(object):
+
+    def _check(self, expected, actual):
+        assert set(expected) == set(actual)
+        for p in expected:
+            assert set(expected[p]) == set(actual[p])
+            for s in expected[p]:
+                assert len(actual[p][s]) == 1
+                assert_approx_equal(expected[p][s][0], actual[p][s][0])
+
+    def test_matches_calculator(self):
+        calculator = LinearCalculator()
+        consumptions = [
+            _consumption(10.0),
+            _consumption(5.0, one_hr=2.0),
+            _consumption(1.0, one_hr=0.0, duff=20.0),
+            _consumption(0.0, duff=3.5)
+        ]
+        expected = [calculator.calculate(c)['summary']['total']
+            for c in consumptions]
+
+        actual = emissionsmatrix.calculate(calculator, consumptions, 0.001)
+        for e, a in zip(expected, actual):
+            self._check({p: {s: [v[0] * 0.001] for s, v in d.items()}
+                for p, d in e.items()}, a)
+
+        # CH4 is only produced for fuelbeds with duff
+        assert 'CH4' not in actual[0]['flaming']
+        assert 'CH4' in actual[3]['flaming']
+
+    def test_efs_derived_once(self):
+        calculator = LinearCalculator()
+        emissionsmatrix.calculate(calculator, [_consumption(10.0)])
+        num_calls = calculator.num_calls
+        emissionsmatrix.calculate(calculator,
+            [_consumption(float(i)) for i in range(100)])
+        assert calculator.num_calls == num_calls
+
+    def test_non_single_valued(self):
+        calculator = LinearCalculator()
+        consumption = _consumption(10.0)
+        consumption['canopy']['overstory']['flaming'] = [1.0, 2.0]
+        actual = emissionsmatrix.calculate(calculator,
+            [_consumption(10.0), consumption])
+        assert actual[0] is not None
+        assert actual[1] is None
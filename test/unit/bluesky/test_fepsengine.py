@@ -0,0 +1,176 @@
+"""Unit tests for bluesky.fepsengine"""
+
+__author__ = "Joel Dubowy"
+
+import csv
+import os
+import random
+import subprocess
+
+import numpy
+import pytest
+
+from bluesky import fepsengine
+
+BIN_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'bin')
+
+def _binary(name):
+    return os.path.abspath(os.path.join(BIN_DIR, name))
+
+def _has_binary(name):
+    return os.access(_binary(name), os.X_OK)
+
+def _read_csv(filename):
+    with open(filename) as f:
+        return list(csv.DictReader(f, skipinitialspace=True))
+
+
+class TestEmissions(object):
+
+    def test_unit_consumption(self):
+        e = fepsengine.emissions([[1.0, 0.0, 0.0], [0.0, 1.0, 2.0]])
+        assert e.shape == (2, 4, 9)
+        numpy.testing.assert_allclose(e[0][0], fepsengine.FLAMING_EFS)
+        numpy.testing.assert_allclose(e[0][3], fepsengine.FLAMING_EFS)
+        numpy.testing.assert_allclose(e[1][1], fepsengine.SMOLDERING_EFS)
+        numpy.testing.assert_allclose(e[1][2],
+            2 * numpy.array(fepsengine.SMOLDERING_EFS))
+        numpy.testing.assert_allclose(e[1][3],
+            3 * numpy.array(fepsengine.SMOLDERING_EFS))
+
+    def test_species(self):
+        e = fepsengine.emissions([[1.0, 2.0, 0.0]], species=['PM25', 'CO'])
+        assert e.shape == (1, 4, 2)
+        numpy.testing.assert_allclose(e[0][3], [0.00728 + 2 * 0.016632,
+            0.0718 + 2 * 0.21012])
+
+    @pytest.mark.skipif(not _has_binary('feps_emissions'),
+        reason="feps_emissions binary not available")
+    def test_matches_binary(self, tmpdir):
+        cons_file = str(tmpdir.join('cons.txt'))
+        out_file = str(tmpdir.join('out.txt'))
+        with open(cons_file, 'w') as f:
+            f.write("cons_flm=2.000000\ncons_sts=3.000000\ncons_lts=5.000000\n"
+                "cons_duff=1.000000\nmoist_duff=40.000000\n")
+        subprocess.check_output([_binary('feps_emissions'), '-c', cons_file,
+            '-a', '10', '-o', out_file])
+
+        e = fepsengine.emissions([[20.0, 30.0, 50.0]])[0]
+        for phase, row in zip(fepsengine.EMISSIONS_PHASES, _read_csv(out_file)):
+            expected = [float(row[s]) for s in fepsengine.EMISSIONS_SPECIES]
+            numpy.testing.assert_allclose(e[fepsengine.EMISSIONS_PHASES.index(phase)],
+                expected, atol=1e-6)
+
+
+WEATHER_KEYS = ['sunsetTime', 'middayTime', 'predawnTime', 'minHumid',
+    'maxHumid', 'minTemp', 'maxTemp', 'minWindAtFlame', 'maxWindAtFlame',
+    'minWindAloft', 'maxWindAloft']
+
+def _random_weather_inputs(n):
+    random.seed(2)
+    inputs = []
+    for i in range(n):
+        inputs.append([random.randint(15, 22), random.randint(11, 15),
+            random.randint(2, 7), round(random.uniform(5, 40), 6),
+            round(random.uniform(40, 90), 6), round(random.uniform(-5, 10), 6),
+            round(random.uniform(10, 35), 6), round(random.uniform(0, 20), 6),
+            round(random.uniform(0, 20), 6), round(random.uniform(0, 20), 6),
+            round(random.uniform(0, 20), 6)])
+    return inputs
+
+def _run_feps_weather(tmpdir, inputs):
+    weather_file = str(tmpdir.join('weather.txt'))
+    diurnal_file = str(tmpdir.join('diurnal.txt'))
+    with open(weather_file, 'w') as f:
+        for k, v in zip(WEATHER_KEYS, inputs):
+            f.write(("%s=%d\n" if k.endswith('Time') else "%s=%f\n") % (k, v))
+    subprocess.check_output([_binary('feps_weather'), '-w', weather_file,
+        '-o', diurnal_file])
+    return diurnal_file
+
+
+class TestDiurnalWeather(object):
+
+    def test_defaults(self):
+        w = fepsengine.diurnal_weather([18], [14], [4], [40], [80], [13],
+            [30], [6], [6], [6], [6])
+        assert set(w) == set(['temp', 'humid', 'wind_flame',
+            'modified_wind', 'stability', 'dif_temp_grad'])
+        assert all([v.shape == (1, 24) for v in w.values()])
+
+        numpy.testing.assert_allclose(w['temp'][0][[0, 5, 14, 19]],
+            [15.273403, 15.659386, 30.0, 23.188687], atol=1e-6)
+        numpy.testing.assert_allclose(w['humid'][0][[0, 5, 14, 19]],
+            [74.650816, 73.742621, 40.0, 56.026619], atol=1e-6)
+        numpy.testing.assert_allclose(w['modified_wind'][0][[0, 5]],
+            [5.364, 5.0])
+        assert w['stability'][0][[0, 5, 18, 19]].tolist() == ['F', 'B', 'B', 'F']
+        assert w['dif_temp_grad'][0][[0, 5]].tolist() == [0.025, -0.008]
+
+    @pytest.mark.skipif(not _has_binary('feps_weather'),
+        reason="feps_weather binary not available")
+    def test_matches_binary(self, tmpdir):
+        inputs = _random_weather_inputs(10)
+        w = fepsengine.diurnal_weather(*zip(*inputs))
+        for i, loc_inputs in enumerate(inputs):
+            rows = _read_csv(_run_feps_weather(tmpdir, loc_inputs))
+            for k in ('temp', 'humid', 'wind_flame', 'modified_wind',
+                    'dif_temp_grad'):
+                numpy.testing.assert_allclose(w[k][i],
+                    [float(r[k]) for r in rows], atol=1e-5)
+            assert w['stability'][i].tolist() == [r['stability'] for r in rows]
+
+
+class TestTimeProfile(object):
+
+    def _inputs(self, n):
+        weather = fepsengine.diurnal_weather(*zip(*_random_weather_inputs(n)))
+        random.seed(3)
+        consumption = [[random.uniform(0.01, 40) for j in range(4)]
+            + [random.uniform(10, 250)] for i in range(n)]
+        growth = [numpy.cumsum([random.uniform(0, 10) for h in range(24)])
+            for i in range(n)]
+        return consumption, growth, weather
+
+    def test_sums(self):
+        consumption, growth, weather = self._inputs(5)
+        p = fepsengine.time_profile(consumption, growth, weather['humid'],
+            weather['wind_flame'], num_hours=fepsengine.MAX_HOURS)
+        for k in ('area_fraction', 'flaming', 'smoldering', 'residual'):
+            assert p[k].shape == (5, fepsengine.MAX_HOURS)
+            numpy.testing.assert_allclose(p[k].sum(axis=1), 1.0)
+
+    @pytest.mark.skipif(not (_has_binary('feps_weather')
+            and _has_binary('feps_timeprofile')),
+        reason="feps_weather and feps_timeprofile binaries not available")
+    def test_matches_binary(self, tmpdir):
+        consumption, growth, weather = self._inputs(10)
+        # include growth that doesn't start until the second hour
+        growth[1][0] = 0.0
+        weather_inputs = _random_weather_inputs(10)
+        for normalize in (True, False):
+            p = fepsengine.time_profile(consumption, growth,
+                weather['humid'], weather['wind_flame'], normalize=normalize)
+            for i in range(10):
+                diurnal_file = _run_feps_weather(tmpdir, weather_inputs[i])
+                cons_file = str(tmpdir.join('cons.txt'))
+                growth_file = str(tmpdir.join('growth.txt'))
+                profile_file = str(tmpdir.join('profile.txt'))
+                with open(cons_file, 'w') as f:
+                    for k, v in zip(['cons_flm', 'cons_sts', 'cons_lts',
+                            'cons_duff', 'moist_duff'], consumption[i]):
+                        f.write("{}={}\n".format(k, v))
+                with open(growth_file, 'w') as f:
+                    f.write("day, hour, size\n")
+                    for h, size in enumerate(growth[i]):
+                        f.write("0, {}, {}\n".format(h, float(size)))
+                subprocess.check_output([_binary('feps_timeprofile'),
+                    '-c', cons_file, '-w', diurnal_file, '-g', growth_file,
+                    '-i', '1', '-n' if normalize else '-d', '-o', profile_file])
+
+                rows = _read_csv(profile_file)[:24]
+                for k, col in (('area_fraction', 'area_fract'),
+                        ('flaming', 'flame'), ('smoldering', 'smolder'),
+                        ('residual', 'residual')):
+                    numpy.testing.assert_allclose(p[k][i],
+                        [float(r[col]) for r in rows], atol=1e-5)
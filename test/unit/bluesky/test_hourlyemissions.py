@@ -0,0 +1,157 @@
+"""Unit tests for bluesky.hourlyemissions"""
+
+__author__ = "Joel Dubowy"
+
+import numpy
+from py.test import raises
+
+from bluesky.config import Config
+from bluesky.hourlyemissions import HourlyEmissions
+from bluesky.models.fires import Fire, FiresManager
+
+
+def _fire(timeprofile, fuelbeds_emissions):
+    return Fire({
+        "activity": [{
+            "active_areas": [{
+                "specified_points": [{
+                    "lat": 47.0, "lng": -121.0, "area": 10,
+                    "timeprofile": timeprofile,
+                    "fuelbeds": [{"emissions": e} for e in fuelbeds_emissions]
+                }]
+            }]
+        }]
+    })
+
+FIRE_1 = _fire({
+        "2015-08-04T17:00:00": {"area_fraction": 0.5, "flaming": 0.5,
+            "smoldering": 0.25, "residual": 0.0},
+        "2015-08-04T18:00:00": {"area_fraction": 0.5, "flaming": 0.5,
+            "smoldering": 0.75, "residual": 1.0}
+    }, [
+        {"flaming": {"CO": [4.0], "PM2.5": [2.0]},
+         "smoldering": {"CO": [8.0], "PM2.5": [4.0]},
+         "residual": {"CO": [2.0], "PM2.5": [1.0]}},
+        {"flaming": {"CO": [2.0]},
+         "smoldering": {"CO": [4.0]},
+         "residual": {"CO": [0.0]}}
+    ])
+
+FIRE_2 = _fire({
+        "2015-08-04T18:00:00": {"area_fraction": 1.0, "flaming": 1.0,
+            "smoldering": 1.0, "residual": 1.0}
+    }, [
+        {"flaming": {"NOx": [1.0]},
+         "smoldering": {"NOx": [2.0]},
+         "residual": {"NOx": [3.0]}}
+    ])
+
+# no emissions
+FIRE_3 = _fire({
+        "2015-08-04T16:00:00": {"area_fraction": 1.0, "flaming": 1.0,
+            "smoldering": 1.0, "residual": 1.0}
+    }, [{}])
+
+
+class TestHourlyEmissions(object):
+
+    def test_get(self):
+        he = HourlyEmissions([FIRE_1, FIRE_3, FIRE_2])
+        assert he.hours == ["2015-08-04T17:00:00", "2015-08-04T18:00:00"]
+        assert set(he.species) == set(["CO", "PM2.5", "NOx"])
+
+        assert he.get_location_idx(FIRE_1, 0) == 0
+        assert he.get_location_idx(FIRE_2, 0) == 1
+        assert he.get_location_idx(FIRE_3, 0) is None
+        assert he.get_location_idx(FIRE_1, 1) is None
+
+        hours = ["2015-08-04T16:00:00", "2015-08-04T17:00:00",
+            "2015-08-04T18:00:00"]
+        e = he.get(0, hours, ["CO", "PM2.5", "SO2"])
+        assert e.shape == (3, 3, 3)
+        numpy.testing.assert_allclose(e[0], numpy.zeros((3, 3)))
+        numpy.testing.assert_allclose(e[1],
+            [[3.0, 1.0, 0.0], [3.0, 1.0, 0.0], [0.0, 0.0, 0.0]])
+        numpy.testing.assert_allclose(e[2],
+            [[3.0, 1.0, 0.0], [9.0, 3.0, 0.0], [2.0, 1.0, 0.0]])
+
+        e = he.get(1, hours, ["NOx"], phases=["residual", "flaming"])
+        numpy.testing.assert_allclose(e[:, :, 0],
+            [[0.0, 0.0], [0.0, 0.0], [3.0, 1.0]])
+
+    def test_get_totals(self):
+        he = HourlyEmissions([FIRE_1, FIRE_2])
+        numpy.testing.assert_allclose(he.get_totals(0, ["CO", "NOx"]),
+            [[6.0, 0.0], [12.0, 0.0], [2.0, 0.0]])
+        numpy.testing.assert_allclose(
+            he.get_totals(1, ["NOx"], phases=["smoldering"]), [[2.0]])
+
+    def test_max_fires(self):
+        he = HourlyEmissions([FIRE_1, FIRE_2], max_fires=1)
+        assert list(he._totals) == [1]
+        assert he.get_location_idx(FIRE_2, 0) == 1
+
+        # FIRE_1 was dropped, and is added again
+        assert he.get_location_idx(FIRE_1, 0) == 2
+        assert list(he._totals) == [2]
+        numpy.testing.assert_allclose(he.get_totals(2, ["CO"]),
+            [[6.0], [12.0], [2.0]])
+        assert he.get_location_idx(FIRE_2, 0) == 3
+        assert list(he._totals) == [3]
+        assert list(he._location_idx) == [(FIRE_2._private_id, 0)]
+
+
+class TestFiresManagerHourlyEmissions(object):
+
+    def test_cached_and_reset(self, reset_config):
+        fm = FiresManager()
+        fm.fires = [FIRE_1]
+        he = fm.hourly_emissions
+        assert fm.hourly_emissions is he
+
+        # modules that don't modify emissions or time profiles keep it
+        fm.processed('bluesky.modules.plumerise', '1.0')
+        assert fm.hourly_emissions is he
+
+        fm.processed('bluesky.modules.emissions', '1.0')
+        assert fm.hourly_emissions is not he
+        he = fm.hourly_emissions
+
+        fm.add_fire(FIRE_2)
+        assert fm.hourly_emissions is not he
+        assert fm.hourly_emissions.get_location_idx(FIRE_2, 0) == 0
+
+    def test_bounded_with_sqlite_store(self, reset_config):
+        Config().set('sqlite', 'fires_store', 'type')
+        Config().set(1, 'fires_store', 'batch_size')
+        fm = FiresManager()
+        fm.fires = [FIRE_1, FIRE_2]
+        for fire in fm.fires:
+            assert fm.hourly_emissions.get_location_idx(fire, 0) is not None
+            assert len(fm.hourly_emissions._totals) == 1
+
+    def test_added_when_looked_up(self, reset_config):
+        fm = FiresManager()
+        fm.fires = [FIRE_1, FIRE_2]
+        he = fm.hourly_emissions
+        assert he.hours == []
+
+        assert he.get_location_idx(FIRE_2, 0) == 0
+        assert he.hours == ["2015-08-04T18:00:00"]
+        assert he.get_location_idx(FIRE_1, 0) == 1
+        assert he.get_location_idx(FIRE_2, 0) == 0
+        numpy.testing.assert_allclose(he.get(1, ["2015-08-04T18:00:00"],
+            ["CO"])[0, :, 0], [3.0, 9.0, 2.0])
+
+    def test_invalid_fire_and_location(self, reset_config):
+        fire = _fire({"2015-08-04T18:00:00": {"flaming": 1.0}},
+            [{"flaming": {"CO": 1.0}}])
+        he = HourlyEmissions()
+        # sum of a scalar fails
+        assert he.get_location_idx(fire, 0) is None
+
+        fire = Fire({"activity": [{"active_areas": [{
+            "specified_points": [{"lat": 47.0, "lng": -121.0}]}]}]})
+        with raises(ValueError):
+            he.get_location_idx(fire, 0)
+        assert he.hours == []
@@ -0,0 +1,96 @@
+"""Unit tests for bluesky.hourlyseries"""
+
+__author__ = "Joel Dubowy"
+
+import datetime
+import json
+
+from py.test import raises
+
+from bluesky.hourlyemissions import HourlyEmissions
+from bluesky.models.fires import Fire, FireEncoder
+from bluesky.hourlyseries import HourlySeries
+
+
+START = datetime.datetime(2015, 1, 20, 23)
+
+SERIES = HourlySeries(START, {
+    "area_fraction": [0.25, 0.75],
+    "flaming": [0.5, 0.5],
+    "smoldering": [0.1, 0.9],
+    "residual": [0.0, 1.0]
+})
+
+DICT_FORM = {
+    "2015-01-20T23:00:00": {"area_fraction": 0.25, "flaming": 0.5,
+        "smoldering": 0.1, "residual": 0.0},
+    "2015-01-21T00:00:00": {"area_fraction": 0.75, "flaming": 0.5,
+        "smoldering": 0.9, "residual": 1.0}
+}
+
+
+class TestHourlySeries(object):
+
+    def test_invalid(self):
+        with raises(ValueError):
+            HourlySeries(START, {"flaming": [0.5, 0.5], "smoldering": [1.0]})
+
+    def test_get_index(self):
+        assert SERIES.get_index(START) == 0
+        assert SERIES.get_index(START + datetime.timedelta(hours=1)) == 1
+        assert SERIES.get_index("2015-01-21T00:00:00") == 1
+        assert SERIES.get_index(START + datetime.timedelta(hours=2)) is None
+        assert SERIES.get_index(START - datetime.timedelta(hours=1)) is None
+        assert SERIES.get_index(START + datetime.timedelta(minutes=30)) is None
+        assert SERIES.get_index("sdf") is None
+
+    def test_mapping(self):
+        assert len(SERIES) == 2
+        assert list(SERIES) == ["2015-01-20T23:00:00", "2015-01-21T00:00:00"]
+        assert SERIES["2015-01-21T00:00:00"] == DICT_FORM["2015-01-21T00:00:00"]
+        assert SERIES.get("2015-01-21T01:00:00") is None
+        assert "2015-01-20T23:00:00" in SERIES
+        with raises(KeyError):
+            SERIES["2015-01-21T01:00:00"]
+        assert SERIES == DICT_FORM
+        assert SERIES.to_dict() == DICT_FORM
+
+    def test_slice(self):
+        one_hour = datetime.timedelta(hours=1)
+        s = SERIES.slice(START + one_hour, START + 5 * one_hour)
+        assert s.start == START + one_hour
+        assert s == {"2015-01-21T00:00:00": DICT_FORM["2015-01-21T00:00:00"]}
+        # partial hours are included
+        assert SERIES.slice(START - 3 * one_hour,
+            START + datetime.timedelta(minutes=30)) == {
+                "2015-01-20T23:00:00": DICT_FORM["2015-01-20T23:00:00"]}
+        assert SERIES.slice(START - 3 * one_hour, START + 3 * one_hour) == DICT_FORM
+        assert len(SERIES.slice(START + 2 * one_hour, START + 3 * one_hour)) == 0
+        assert len(SERIES.slice(START + one_hour, START)) == 0
+
+    def test_json(self):
+        fire = Fire({"id": "a", "timeprofile": SERIES})
+        assert json.loads(json.dumps(fire, cls=FireEncoder)) == {
+            "id": "a", "type": "wildfire", "fuel_type": "natural",
+            "timeprofile": DICT_FORM
+        }
+
+    def test_hourly_emissions(self):
+        emissions = [{"flaming": {"CO": [4.0]}, "smoldering": {"CO": [10.0]},
+            "residual": {"CO": [2.0]}}]
+        fires = [Fire({
+            "activity": [{
+                "active_areas": [{
+                    "specified_points": [{
+                        "lat": 47.0, "lng": -121.0, "area": 10,
+                        "timeprofile": tp,
+                        "fuelbeds": [{"emissions": e} for e in emissions]
+                    }]
+                }]
+            }]
+        }) for tp in (SERIES, DICT_FORM)]
+        he = HourlyEmissions(fires)
+        assert he.hours == list(DICT_FORM)
+        hours = list(DICT_FORM)
+        assert he.get(0, hours, ["CO"]).tolist() == he.get(
+            1, hours, ["CO"]).tolist()
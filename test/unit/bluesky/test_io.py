@@ -2,8 +2,12 @@
 
 __author__ = "Joel Dubowy"
 
+import gzip
 import logging
+import os
 import sys
+import tempfile
+import threading
 import time
 from collections import defaultdict
 
@@ -262,6 +266,7 @@ class TestWaitForAvailabilityBackoff(TestWaitForAvailabilityBase):
 class TestCaptureStdout(object):
 
     def test(self):
+        stdout = sys.stdout
         with io.capture_stdout() as stdout_buffer:
             assert sys.stdout == stdout_buffer
             assert "" == stdout_buffer.read()
@@ -273,7 +278,64 @@ class TestCaptureStdout(object):
             assert "sdf\n322342" == stdout_buffer.read()
             assert sys.stdout == stdout_buffer
         assert sys.stdout != stdout_buffer
-        assert sys.stdout == sys.__stdout__
+        assert sys.stdout == stdout
+
+
+class TestCaptureThreadStdout(object):
+
+    def test(self):
+        stdout = sys.stdout
+        with io.capture_thread_stdout() as stdout_buffer:
+            print("sdf")
+            sys.stdout.write("322342")
+            stdout_buffer.seek(0)
+            assert "sdf\n322342" == stdout_buffer.read()
+        print("not captured")
+        stdout_buffer.seek(0)
+        assert "sdf\n322342" == stdout_buffer.read()
+        assert sys.stdout is stdout
+
+    def test_nested(self):
+        stdout = sys.stdout
+        with io.capture_thread_stdout() as outer_buffer:
+            print("outer")
+            with io.capture_thread_stdout() as inner_buffer:
+                print("inner")
+            print("outer again")
+            assert sys.stdout is not stdout
+        assert sys.stdout is stdout
+        assert outer_buffer.getvalue() == "outer\nouter again\n"
+        assert inner_buffer.getvalue() == "inner\n"
+
+    def test_capture_stdout_within(self):
+        stdout = sys.stdout
+        with io.capture_thread_stdout() as thread_buffer:
+            with io.capture_stdout() as stdout_buffer:
+                print("sdf")
+            # capture_stdout restores the stand-in, rather than
+            # sys.__stdout__, so the thread's capture continues
+            print("322342")
+        assert sys.stdout is stdout
+        assert stdout_buffer.getvalue() == "sdf\n"
+        assert thread_buffer.getvalue() == "322342\n"
+
+    def test_threads(self):
+        buffers = {}
+        barrier = threading.Barrier(4)
+        def f(i):
+            with io.capture_thread_stdout() as stdout_buffer:
+                barrier.wait()
+                for j in range(100):
+                    print(i)
+                buffers[i] = stdout_buffer.getvalue()
+
+        threads = [threading.Thread(target=f, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert buffers == {i: "{}\n".format(i) * 100 for i in range(4)}
+        assert not isinstance(sys.stdout, io._ThreadStdout)
 
 
 class TestSubprocessExecutor(object):
@@ -441,3 +503,40 @@ class TestSubprocessExecutor(object):
         assert self.msgs == [
             ((10, '%s: %s', 'echo', 'hello'), {})
         ]
+
+
+##
+## io.open_file, etc.
+##
+
+class TestCompressedFiles(object):
+
+    DATA = '{"fires": []}\n' * 1000
+
+    def test_open_file_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name, compression in [('a.json', None),
+                    ('b.json.gz', 'gzip'), ('c.json.zst', 'zstd')]:
+                filename = os.path.join(tmp_dir, name)
+                assert io.get_compression(filename, 'w') == compression
+                with io.open_file(filename, 'w') as f:
+                    f.write(self.DATA)
+                assert io.get_compression(filename) == compression
+                with io.open_file(filename) as f:
+                    assert f.read() == self.DATA
+                if compression:
+                    assert os.path.getsize(filename) < len(self.DATA)
+
+    def test_compression_detected_by_magic_bytes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'fires.json')
+            with gzip.open(filename, 'wt') as f:
+                f.write(self.DATA)
+            assert io.get_compression(filename) == 'gzip'
+            with io.open_file(filename) as f:
+                assert f.read() == self.DATA
+
+    def test_decompress(self):
+        data = self.DATA.encode()
+        assert io.decompress(data) == data
+        assert io.decompress(gzip.compress(data)) == data
@@ -0,0 +1,100 @@
+"""Unit tests for bluesky.workerpool"""
+
+__author__ = "Joel Dubowy"
+
+import os
+import threading
+import time
+
+from bluesky.config import Config
+from bluesky.workerpool import WorkerPool, feps_worker_pool
+
+
+def _task(value, delay=0.0):
+    def _f(working_dir):
+        # make sure previous task's files were cleared out
+        assert os.listdir(working_dir) == []
+        time.sleep(delay)
+        with open(os.path.join(working_dir, 'out.txt'), 'w') as f:
+            f.write(str(value))
+        with open(os.path.join(working_dir, 'out.txt')) as f:
+            return (int(f.read()), working_dir)
+    return _f
+
+def _failing_task(working_dir):
+    raise ValueError("task failed")
+
+
+class TestWorkerPoolScratchDirs(object):
+
+    def test_ordered_results_and_failures(self, tmpdir):
+        tasks = [('a', _task(i, delay=0.01 * (5 - i))) for i in range(5)]
+        tasks.insert(2, ('a', _failing_task))
+        with WorkerPool(3, scratch_dir=str(tmpdir)) as pool:
+            results = pool.run(tasks)
+            working_dirs = set(r[1] for r in results if isinstance(r, tuple))
+
+        assert [r[0] for r in results[:2]] == [0, 1]
+        assert isinstance(results[2], ValueError)
+        assert [r[0] for r in results[3:]] == [2, 3, 4]
+
+        # working dirs are reused, one per worker, and removed on close
+        assert 1 <= len(working_dirs) <= 3
+        assert all([d.startswith(str(tmpdir)) for d in working_dirs])
+        assert not any([os.path.exists(d) for d in working_dirs])
+
+    def test_one_worker(self, tmpdir):
+        with WorkerPool(1, scratch_dir=str(tmpdir)) as pool:
+            results = pool.run([('a', _task(i)) for i in range(3)])
+
+        assert [r[0] for r in results] == [0, 1, 2]
+        assert len(set(r[1] for r in results)) == 1
+
+
+class TestWorkerPoolWorkingDir(object):
+
+    def test_groups(self, tmpdir):
+        running = {}
+        lock = threading.Lock()
+
+        def _grouped_task(group, value):
+            def _f(working_dir):
+                # tasks in same group must not run concurrently
+                with lock:
+                    assert not running.get(group)
+                    running[group] = True
+                time.sleep(0.01)
+                with lock:
+                    running[group] = False
+                return (value, working_dir)
+            return _f
+
+        tasks = [(g, _grouped_task(g, i))
+            for i, g in enumerate(['f1', 'f2', 'f1', 'f2', 'f3'])]
+        tasks.append(('f3', _failing_task))
+        with WorkerPool(3, working_dir=str(tmpdir)) as pool:
+            results = pool.run(tasks)
+
+        assert [r[0] for r in results[:5]] == [0, 1, 2, 3, 4]
+        assert [r[1] for r in results[:5]] == [
+            os.path.join(str(tmpdir), g) for g in ['f1', 'f2', 'f1', 'f2', 'f3']]
+        assert isinstance(results[5], ValueError)
+
+        # working dirs aren't removed
+        assert sorted(os.listdir(str(tmpdir))) == ['f1', 'f2', 'f3']
+
+
+class TestFepsWorkerPool(object):
+
+    def test_default(self, reset_config, tmpdir):
+        with feps_worker_pool(working_dir=str(tmpdir)) as pool:
+            results = pool.run([('f1', _task(1))])
+        assert results == [(1, os.path.join(str(tmpdir), 'f1'))]
+
+    def test_multiple_workers(self, reset_config, tmpdir):
+        Config().set(4, 'feps_workers', 'num_workers')
+        Config().set(str(tmpdir), 'feps_workers', 'scratch_dir')
+        with feps_worker_pool() as pool:
+            results = pool.run([('f1', _task(1)), ('f1', _task(2))])
+        assert [r[0] for r in results] == [1, 2]
+        assert all([r[1].startswith(str(tmpdir)) for r in results])